@@ -12,6 +12,7 @@ from app.subcommands.build_subcommand import BuildSubcommand
 from app.subcommands.deploy_subcommand import DeploySubcommand
 from app.subcommands.master_subcommand import MasterSubcommand
 from app.subcommands.shutdown_subcommand import ShutdownSubcommand
+from app.subcommands.simulate_subcommand import SimulateSubcommand
 from app.subcommands.slave_subcommand import SlaveSubcommand
 from app.subcommands.stop_subcommand import StopSubcommand
 from app.util import app_info, autoversioning, log, util
@@ -113,6 +114,11 @@ def _parse_args(args):
     build_parser.add_argument(
         '-j', '--job-name',
         help='the name of the job to run')
+    build_parser.add_argument(
+        '-p', '--priority',
+        type=int,
+        default=argparse.SUPPRESS,
+        help='the priority of the build; builds with a higher priority are allocated slaves first (default: 0)')
     build_parser.add_argument(
         '-f', '--remote-file',
         default=None,
@@ -147,7 +153,54 @@ def _parse_args(args):
 
     shutdown_parser.set_defaults(subcommand_class=ShutdownSubcommand)
 
-    for subparser in (master_parser, slave_parser, build_parser, stop_parser, deploy_parser, shutdown_parser):
+    simulate_parser = subparsers.add_parser(
+        'simulate',
+        help=('Replay the builds recorded in the event logs of a cluster on a simulated cluster to compare '
+              'scheduling policies offline.'),
+        formatter_class=ClusterRunnerHelpFormatter
+    )
+    simulate_parser.add_argument(
+        '-f', '--eventlog-file',
+        action='append',
+        dest='eventlog_files',
+        required=True,
+        help='An event log file of the master or of one of its slaves. Specify once for each file.'
+    )
+    simulate_parser.add_argument(
+        '-s', '--num-slaves',
+        type=int,
+        required=True,
+        help='The number of slaves in the simulated cluster'
+    )
+    simulate_parser.add_argument(
+        '-e', '--num-executors',
+        type=int,
+        default=1,
+        help='The number of executors of each simulated slave, defaults to 1'
+    )
+    simulate_parser.add_argument(
+        '-p', '--policy',
+        action='append',
+        dest='policies',
+        help=('A scheduling policy to simulate, as a comma separated list of master settings, e.g., '
+              '"atom_grouping_strategy=bin_packing,subjob_dispatch_depth=2". Specify once for each policy. The '
+              'current settings are always simulated as well.')
+    )
+    simulate_parser.add_argument(
+        '--max-executors',
+        type=int,
+        help='The max_executors of the jobs of the simulated builds, defaults to the number of executors in the cluster'
+    )
+    simulate_parser.add_argument(
+        '--teardown-time',
+        type=float,
+        default=0.0,
+        help='The number of seconds a slave takes to tear down a build, defaults to 0'
+    )
+    simulate_parser.set_defaults(subcommand_class=SimulateSubcommand)
+
+    for subparser in (master_parser, slave_parser, build_parser, stop_parser, deploy_parser, shutdown_parser,
+                      simulate_parser):
         subparser.add_argument(
             '-v', '--verbose',
             action='store_const', const='DEBUG', dest='log_level', help='set the log level to "debug"')
@@ -226,6 +279,7 @@ def _initialize_configuration(app_subcommand, config_filename):
         'master': MasterConfigLoader(),
         'slave': SlaveConfigLoader(),
         'build': MasterConfigLoader(),
+        'simulate': MasterConfigLoader(),
         'deploy': DeployConfigLoader(),
         'stop': StopConfigLoader(),
     }
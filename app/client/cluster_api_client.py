@@ -309,7 +309,7 @@ class ClusterSlaveAPIClient(ClusterAPIClient):
         :return: Whether slave is idle
         """
         response_data = self.get_slave_status()
-        return response_data['slave']['current_build_id'] is None
+        return len(response_data['slave']['current_build_ids']) == 0
 
     def get_slave_status(self):
         """
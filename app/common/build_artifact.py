@@ -1,4 +1,3 @@
-import json
 import os
 import re
 
@@ -6,8 +5,8 @@ from typing import Optional
 
 from app.common.console_output import ConsoleOutput
 from app.common.console_output_segment import ConsoleOutputSegment
+from app.common.timing_data_store import TimingDataStore
 from app.util.conf.configuration import Configuration
-import app.util.fs
 from app.util.log import get_logger
 
 
@@ -18,6 +17,7 @@ class BuildArtifact(object):
     EXIT_CODE_FILE = 'clusterrunner_exit_code'
     OUTPUT_FILE = 'clusterrunner_console_output'
     TIMING_FILE = 'clusterrunner_time'
+    RESOURCE_USAGE_FILE = 'clusterrunner_resource_usage'
     ARTIFACT_TARFILE_NAME = 'results.tar.gz'
     ARTIFACT_ZIPFILE_NAME = 'results.zip'
 
@@ -33,12 +33,12 @@ class BuildArtifact(object):
 
     def write_timing_data(self, timing_file_path, timing_data):
         """
-        Persist timing data to a file.
+        Record the atom times of this build in the timing data store.
 
-        If there is no timing data, write the timing file regardless of whether there were any invalid executions.
-        If there is timing data, only write the timing file if there were no failures.
+        If the job has no timing data yet, record it regardless of whether there were any invalid executions.
+        If the job has timing data, only record it if there were no failures.
 
-        :param timing_file_path: where the timing data should be written
+        :param timing_file_path: the job's timing file path, which identifies the job in the timing data store
         :type timing_file_path: str
         :param timing_data: the key-value pairs of the atom-time in seconds the atom took to run
         :type timing_data: dict[str, float]
@@ -47,19 +47,19 @@ class BuildArtifact(object):
             self._logger.error('Failed to find timing data')
             return
 
-        app.util.fs.create_dir(os.path.dirname(timing_file_path))
+        timing_data_store = TimingDataStore()
 
-        # If file doesn't exist, then write timing data no matter what
-        if not os.path.isfile(timing_file_path):
-            self._write_timing_data_to_file(timing_file_path, timing_data)
-            self._logger.debug('Created new timing file in {}', timing_file_path)
+        # If the job has no timing data, then record timing data no matter what
+        if not timing_data_store.has_timing_data(timing_file_path):
+            timing_data_store.record_atom_times(timing_file_path, timing_data)
+            self._logger.debug('Recorded new timing data for {}', timing_file_path)
             return
 
-        # If file exists, update the timing data only if there were no failures this build
+        # If the job has timing data, update the timing data only if there were no failures this build
         # @TODO: in the future we should always update the timing data, but only for passed atom keys.
         if len(self._get_failed_artifact_directories()) == 0:
-            self._update_timing_file(timing_file_path, timing_data)
-            self._logger.debug('Overwrote existing timing file in {}', timing_file_path)
+            timing_data_store.record_atom_times(timing_file_path, timing_data)
+            self._logger.debug('Updated existing timing data for {}', timing_file_path)
             return
 
         self._logger.debug('Did not write/overwrite timing data during build')
@@ -123,27 +123,6 @@ class BuildArtifact(object):
             with open(os.path.join(self.build_artifact_dir, 'failures.txt'), 'w') as f:
                 f.write("\n".join(failed_atom_directories))
 
-    def _write_timing_data_to_file(self, timing_file_path, timing_data):
-        """
-        :type timing_file_path: str
-        :type timing_data: dict[str, float]
-        """
-        app.util.fs.write_file(json.dumps(timing_data), timing_file_path)
-
-    def _update_timing_file(self, timing_file_path, new_timing_data):
-        """
-        Update the timing data for the atoms specified in new_timing_data. This means that new results
-        does not replace the entire timing data file, but rather only replaces the timing data for
-        individual atom keys.
-        :param timing_file_path: str
-        :param new_timing_data: dict[str, float]
-        """
-        with open(timing_file_path) as timing_file:
-            timing_data = json.load(timing_file)
-
-        timing_data.update(new_timing_data)
-        self._write_timing_data_to_file(timing_file_path, timing_data)
-
     @classmethod
     def get_console_output(
             cls,
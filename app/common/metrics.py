@@ -1,6 +1,6 @@
 from enum import Enum
 
-from typing import Callable, Iterator, List
+from typing import Callable, Dict, Iterator, List
 
 from prometheus_client import Counter, Histogram, REGISTRY
 from prometheus_client.core import GaugeMetricFamily
@@ -21,6 +21,11 @@ serialized_build_time_seconds = Histogram(  # pylint: disable=no-value-for-param
     'serialized_build_time_seconds',
     'Total amount of time that would have been consumed by builds if all work was done serially')
 
+slave_allocations = Counter(
+    'slave_allocations',
+    'Total number of slaves allocated to builds, by how much build setup work the slave had already done',
+    ['warmth'])
+
 internal_errors = Counter(
     'internal_errors',
     'Total number of internal errors',
@@ -85,3 +90,44 @@ class SlavesCollector:
         if not cls._slaves_collector_is_registered:
             REGISTRY.register(SlavesCollector(get_slaves))
             cls._slaves_collector_is_registered = True
+
+
+class ClusterDemandCollector:
+    """
+    Prometheus collector for the demand for executors on the master (see ClusterMaster.cluster_demand()), so that
+    external autoscalers can scale the slaves of the cluster from the /metrics endpoint. collect() is called once each
+    time prometheus scrapes the /metrics endpoint, so the demand is only computed once per scrape.
+    """
+
+    # The name, cluster demand key and description of each gauge
+    _GAUGES = [
+        ('cluster_queued_builds', 'queued_builds', 'Number of builds that have not started building yet'),
+        ('cluster_queued_work_seconds', 'queued_work_seconds',
+         'Estimated serial runtime of the unstarted subjobs of the builds waiting for slaves'),
+        ('cluster_executors_needed', 'executors_needed',
+         'Number of additional executors the builds waiting for slaves need to finish within the target latency'),
+        ('cluster_idle_executors', 'idle_executors', 'Number of idle executors on connected slaves'),
+    ]
+
+    _cluster_demand_collector_is_registered = False
+
+    def __init__(self, get_cluster_demand: Callable[[], Dict[str, float]]):
+        self._get_cluster_demand = get_cluster_demand
+
+    def describe(self) -> Iterator[GaugeMetricFamily]:
+        """
+        Describe the gauges without computing the demand, which the registry would otherwise do on registration.
+        """
+        for name, _, description in self._GAUGES:
+            yield GaugeMetricFamily(name, description)
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        demand = self._get_cluster_demand()
+        for name, demand_key, description in self._GAUGES:
+            yield GaugeMetricFamily(name, description, value=demand[demand_key])
+
+    @classmethod
+    def register_cluster_demand_metrics_collector(cls, get_cluster_demand: Callable[[], Dict[str, float]]):
+        if not cls._cluster_demand_collector_is_registered:
+            REGISTRY.register(ClusterDemandCollector(get_cluster_demand))
+            cls._cluster_demand_collector_is_registered = True
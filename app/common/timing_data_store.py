@@ -0,0 +1,315 @@
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+from threading import Lock
+
+from app.util.conf.configuration import Configuration
+import app.util.fs
+from app.util.log import get_logger
+
+
+class TimingDataStore(object):
+    """
+    A SQLite-backed history of how long each atom of a job has taken to run. For every (job, atom) pair the store keeps
+    rolling statistics: an exponentially weighted moving average (used as the atom's expected time), the median and
+    95th percentile of the most recent samples, and the total number of samples recorded.
+
+    Jobs are identified by the path of their legacy JSON timing file (ProjectType.timing_file_path()). The first time a
+    job is accessed, any existing JSON timing file for it is imported so that no timing history is lost on upgrade.
+
+    Rows are keyed by (job, atom), so reads only touch the atoms in the current build and writes only touch the atoms
+    that were just executed, instead of rewriting the whole timing history of the job after every build.
+
+    The store also remembers which atoms of a job failed the last time they were run, so that builds in fail-fast mode
+    can run those atoms first.
+    """
+    EWMA_WEIGHT = 0.3  # the weight of a new sample in the moving average
+    MAX_RECENT_SAMPLES = 20  # the number of samples the percentiles are computed over
+    _MAX_QUERY_PARAMETERS = 500  # stay well below SQLite's limit on the number of host parameters in a query
+    # A single connection to each database file, shared by all threads so that each transaction does not have to
+    # connect to the database and no connection is left open by a thread that has exited. The lock ensures that only
+    # one transaction at a time uses a connection. Each connection is stored along with the identity of the file it
+    # was opened on, so that the database is recreated if its file is deleted or replaced.
+    _connections_by_database_file = {}
+    _connection_lock = Lock()
+
+    def __init__(self, database_file=None):
+        """
+        :param database_file: the path to the SQLite database; defaults to the 'timing_database_file' setting
+        :type database_file: str | None
+        """
+        self._logger = get_logger(__name__)
+        self._database_file = database_file or Configuration['timing_database_file']
+
+    def get_expected_times(self, job, atom_commands):
+        """
+        Look up the expected times of the specified atoms. Atoms without timing history are omitted from the result.
+
+        :param job: the job's timing file path
+        :type job: str
+        :param atom_commands: the command strings of the atoms to look up
+        :type atom_commands: list[str]
+        :return: a map of atom command string to expected time in seconds
+        :rtype: dict[str, float]
+        """
+        expected_times = {}
+        with self._transaction() as connection:
+            self._migrate_timing_file(connection, job)
+            for chunk in _chunks(list(set(atom_commands)), self._MAX_QUERY_PARAMETERS):
+                rows = connection.execute(
+                    'SELECT atom, ewma FROM atom_timing WHERE job = ? AND atom IN ({})'.format(_placeholders(chunk)),
+                    [job] + chunk,
+                )
+                expected_times.update(rows)
+        return expected_times
+
+    def get_atom_statistics(self, job, atom_commands):
+        """
+        Look up the rolling statistics of the specified atoms.
+
+        :param job: the job's timing file path
+        :type job: str
+        :param atom_commands: the command strings of the atoms to look up
+        :type atom_commands: list[str]
+        :return: a map of atom command string to a dict with the 'ewma', 'p50', 'p95' and 'sample_count' of the atom
+        :rtype: dict[str, dict[str, float]]
+        """
+        statistics = {}
+        with self._transaction() as connection:
+            self._migrate_timing_file(connection, job)
+            for chunk in _chunks(list(set(atom_commands)), self._MAX_QUERY_PARAMETERS):
+                rows = connection.execute(
+                    'SELECT atom, ewma, p50, p95, sample_count FROM atom_timing '
+                    'WHERE job = ? AND atom IN ({})'.format(_placeholders(chunk)),
+                    [job] + chunk,
+                )
+                for atom, ewma, p50, p95, sample_count in rows:
+                    statistics[atom] = {'ewma': ewma, 'p50': p50, 'p95': p95, 'sample_count': sample_count}
+        return statistics
+
+    def has_timing_data(self, job):
+        """
+        :param job: the job's timing file path
+        :type job: str
+        :rtype: bool
+        """
+        with self._transaction() as connection:
+            self._migrate_timing_file(connection, job)
+            row = connection.execute('SELECT 1 FROM atom_timing WHERE job = ? LIMIT 1', (job,)).fetchone()
+        return row is not None
+
+    def record_atom_times(self, job, atom_times):
+        """
+        Add a new sample for each of the specified atoms and update their rolling statistics.
+
+        :param job: the job's timing file path
+        :type job: str
+        :param atom_times: a map of atom command string to the time in seconds the atom took to run
+        :type atom_times: dict[str, float]
+        """
+        with self._transaction() as connection:
+            self._migrate_timing_file(connection, job)
+            existing_samples = {}
+            for chunk in _chunks(list(atom_times), self._MAX_QUERY_PARAMETERS):
+                rows = connection.execute(
+                    'SELECT atom, ewma, sample_count, recent_samples FROM atom_timing '
+                    'WHERE job = ? AND atom IN ({})'.format(_placeholders(chunk)),
+                    [job] + chunk,
+                )
+                for atom, ewma, sample_count, recent_samples in rows:
+                    existing_samples[atom] = (ewma, sample_count, json.loads(recent_samples))
+
+            updated_rows = []
+            for atom, atom_time in atom_times.items():
+                if atom in existing_samples:
+                    ewma, sample_count, recent_samples = existing_samples[atom]
+                    ewma += self.EWMA_WEIGHT * (atom_time - ewma)
+                else:
+                    ewma, sample_count, recent_samples = atom_time, 0, []
+                recent_samples = (recent_samples + [atom_time])[-self.MAX_RECENT_SAMPLES:]
+                updated_rows.append(self._row(job, atom, ewma, sample_count + 1, recent_samples))
+
+            connection.executemany('INSERT OR REPLACE INTO atom_timing VALUES (?, ?, ?, ?, ?, ?, ?)', updated_rows)
+
+    def get_failing_atoms(self, job, atom_commands):
+        """
+        Look up which of the specified atoms failed the last time they were run.
+
+        :param job: the job's timing file path
+        :type job: str
+        :param atom_commands: the command strings of the atoms to look up
+        :type atom_commands: list[str]
+        :return: the command strings of the atoms whose most recent execution failed
+        :rtype: set[str]
+        """
+        failing_atoms = set()
+        with self._transaction() as connection:
+            for chunk in _chunks(list(set(atom_commands)), self._MAX_QUERY_PARAMETERS):
+                rows = connection.execute(
+                    'SELECT atom FROM atom_failure WHERE job = ? AND atom IN ({})'.format(_placeholders(chunk)),
+                    [job] + chunk,
+                )
+                failing_atoms.update(atom for atom, in rows)
+        return failing_atoms
+
+    def record_atom_results(self, job, failed_atom_commands, passed_atom_commands):
+        """
+        Record the outcome of the most recent execution of the specified atoms.
+
+        :param job: the job's timing file path
+        :type job: str
+        :param failed_atom_commands: the command strings of the atoms that failed
+        :type failed_atom_commands: list[str]
+        :param passed_atom_commands: the command strings of the atoms that passed
+        :type passed_atom_commands: list[str]
+        """
+        with self._transaction() as connection:
+            connection.executemany('INSERT OR IGNORE INTO atom_failure VALUES (?, ?)',
+                                   [(job, atom) for atom in failed_atom_commands])
+            connection.executemany('DELETE FROM atom_failure WHERE job = ? AND atom = ?',
+                                   [(job, atom) for atom in passed_atom_commands])
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Run the body of the with-statement in a single transaction, creating the database if it does not exist yet.
+        Transactions are serialized, so the store can be used from any thread.
+
+        :rtype: sqlite3.Connection
+        """
+        with self._connection_lock:
+            connection = self._connection()
+            with connection:  # commits on success, rolls back on error
+                yield connection
+
+    def _connection(self):
+        """
+        Get the connection to the database, (re)connecting if there is none yet or if the database file has been
+        deleted or replaced since the connection was opened. Must be called while holding the connection lock.
+
+        :rtype: sqlite3.Connection
+        """
+        connection, database_file_id = self._connections_by_database_file.get(self._database_file, (None, None))
+        if connection is not None and database_file_id == self._database_file_id():
+            return connection
+
+        if connection is not None:
+            self._logger.warning('Timing database {} was deleted or replaced; recreating it.', self._database_file)
+            connection.close()
+        app.util.fs.create_dir(os.path.dirname(self._database_file))
+        connection = sqlite3.connect(self._database_file, timeout=30, check_same_thread=False)
+        self._create_schema(connection)
+        self._connections_by_database_file[self._database_file] = connection, self._database_file_id()
+        return connection
+
+    def _database_file_id(self):
+        """
+        :return: the identity of the database file, or None if it does not exist
+        :rtype: tuple[int, int] | None
+        """
+        try:
+            stat_result = os.stat(self._database_file)
+        except FileNotFoundError:
+            return None
+        return stat_result.st_dev, stat_result.st_ino
+
+    def _create_schema(self, connection):
+        """
+        Create the tables of the database, unless they already exist.
+
+        :type connection: sqlite3.Connection
+        """
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS atom_timing ('
+                '  job TEXT NOT NULL,'
+                '  atom TEXT NOT NULL,'
+                '  ewma REAL NOT NULL,'
+                '  p50 REAL NOT NULL,'
+                '  p95 REAL NOT NULL,'
+                '  sample_count INTEGER NOT NULL,'
+                '  recent_samples TEXT NOT NULL,'
+                '  PRIMARY KEY (job, atom))'
+            )
+            connection.execute('CREATE TABLE IF NOT EXISTS migrated_timing_file (job TEXT PRIMARY KEY)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS atom_failure ('
+                '  job TEXT NOT NULL,'
+                '  atom TEXT NOT NULL,'
+                '  PRIMARY KEY (job, atom))'
+            )
+
+    def _migrate_timing_file(self, connection, job):
+        """
+        Import the legacy JSON timing file of a job the first time the job is accessed. The timing file itself is
+        left in place.
+
+        :type connection: sqlite3.Connection
+        :param job: the job's timing file path
+        :type job: str
+        """
+        if connection.execute('SELECT 1 FROM migrated_timing_file WHERE job = ?', (job,)).fetchone():
+            return
+
+        # Several connections (e.g., of other processes using the same database) can get here for the same job at once.
+        # Claiming the job with a write starts the write transaction, so only the first connection imports the timing
+        # file and the others find the job claimed once that transaction commits.
+        if connection.execute('INSERT OR IGNORE INTO migrated_timing_file VALUES (?)', (job,)).rowcount == 0:
+            return
+
+        if os.path.isfile(job):
+            try:
+                with open(job, 'r') as timing_file:
+                    atom_times = json.load(timing_file)
+            except ValueError:
+                self._logger.warning('Failed to migrate timing data from file that exists {}', job)
+            else:
+                connection.executemany(
+                    'INSERT OR IGNORE INTO atom_timing VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [self._row(job, atom, atom_time, 1, [atom_time]) for atom, atom_time in atom_times.items()],
+                )
+                self._logger.info('Migrated timing data for {} atoms from {}.', len(atom_times), job)
+
+    def _row(self, job, atom, ewma, sample_count, recent_samples):
+        """
+        :type job: str
+        :type atom: str
+        :type ewma: float
+        :type sample_count: int
+        :type recent_samples: list[float]
+        :rtype: tuple
+        """
+        sorted_samples = sorted(recent_samples)
+        return (job, atom, ewma, _percentile(sorted_samples, 50), _percentile(sorted_samples, 95), sample_count,
+                json.dumps(recent_samples))
+
+
+def _percentile(sorted_samples, percent):
+    """
+    :param sorted_samples: a non-empty, sorted list of samples
+    :type sorted_samples: list[float]
+    :type percent: int
+    :return: the nearest-rank percentile of the samples
+    :rtype: float
+    """
+    rank = max(1, -(-percent * len(sorted_samples) // 100))  # ceil(percent / 100 * n)
+    return sorted_samples[rank - 1]
+
+
+def _placeholders(values):
+    """
+    :type values: list
+    :rtype: str
+    """
+    return ', '.join('?' * len(values))
+
+
+def _chunks(values, chunk_size):
+    """
+    :type values: list
+    :type chunk_size: int
+    :rtype: collections.Iterable[list]
+    """
+    for start in range(0, len(values), chunk_size):
+        yield values[start:start + chunk_size]
@@ -16,7 +16,10 @@ class Atom(object):
             exit_code=None,
             state=None,
             atom_id=None,
-            subjob_id=None
+            subjob_id=None,
+            result_cache_key=None,
+            resource_usage=None,
+            is_result_cached=False
     ):
         """
         :type command_string: str
@@ -26,6 +29,14 @@ class Atom(object):
         :type state: `:class:AtomState` | None
         :type atom_id: int | None
         :type subjob_id: int | None
+        :param result_cache_key: the key the atom's result is cached under, if result caching is enabled
+        :type result_cache_key: str | None
+        :param resource_usage: the resources the atom's command used (CPU time, max RSS, block I/O and context
+            switches), if they were measured by the slave
+        :type resource_usage: dict[str, int | float] | None
+        :param is_result_cached: whether the atom's result was restored from the atom result cache instead of running
+            the atom
+        :type is_result_cached: bool
         """
         self.command_string = command_string
         self.expected_time = expected_time
@@ -34,6 +45,9 @@ class Atom(object):
         self.state = state
         self.subjob_id = subjob_id
         self.id = atom_id
+        self.result_cache_key = result_cache_key
+        self.resource_usage = resource_usage
+        self.is_result_cached = is_result_cached
 
     def api_representation(self):
         return {
@@ -44,4 +58,5 @@ class Atom(object):
             'state': self.state,
             'id': self.id,
             'subjob_id': self.subjob_id,
+            'resource_usage': self.resource_usage,
         }
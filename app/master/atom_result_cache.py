@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+from app.util.conf.configuration import Configuration
+from app.util.log import get_logger
+
+
+class AtomResultCache(object):
+    """
+    A cache of the results of atoms that passed, stored on the master. Builds can skip running an atom whose result for
+    the same inputs is already in the cache and use the cached result instead.
+
+    A result is keyed by the source tree the atom ran against (see ProjectType.source_tree_hash()), the job's name,
+    setup_build commands and command, and the atom's command string. The cached result of an atom is a copy of its
+    artifact directory: its console output, exit code and time, and any other artifacts the atom wrote.
+
+    The modification time of a result directory is updated whenever the result is used, so that the least recently
+    used results can be evicted once the cache holds more than 'atom_result_cache_size' results.
+    """
+
+    def __init__(self, cache_directory=None):
+        """
+        :param cache_directory: the directory results are cached in; defaults to the 'atom_result_cache_directory'
+            setting
+        :type cache_directory: str | None
+        """
+        self._logger = get_logger(__name__)
+        self._cache_directory = cache_directory or Configuration['atom_result_cache_directory']
+
+    @staticmethod
+    def cache_key(source_tree_hash, job_config, atom_command):
+        """
+        :param source_tree_hash: identifies the contents of the project the atom runs against
+        :type source_tree_hash: str
+        :type job_config: app.master.job_config.JobConfig
+        :param atom_command: the command string of the atom
+        :type atom_command: str
+        :return: the key that the result of the atom is cached under
+        :rtype: str
+        """
+        key_components = [source_tree_hash, job_config.name, job_config.setup_build, job_config.command, atom_command]
+        return hashlib.sha256(json.dumps(key_components).encode('utf-8')).hexdigest()
+
+    def has_result(self, cache_key):
+        """
+        Check whether a result is cached under the key. A cached result is marked as used, which keeps it from being
+        evicted before the build that is about to restore it gets to it.
+
+        :type cache_key: str
+        :rtype: bool
+        """
+        try:
+            os.utime(self._result_directory(cache_key))
+        except OSError:  # the result is not cached (or was evicted just now)
+            return False
+        return True
+
+    def restore_result(self, cache_key, atom_artifact_directory):
+        """
+        Copy a cached result into the artifact directory of an atom. The artifact directory must not exist yet.
+
+        :type cache_key: str
+        :param atom_artifact_directory: the path to the artifact directory of the atom that the result is for
+        :type atom_artifact_directory: str
+        """
+        shutil.copytree(self._result_directory(cache_key), atom_artifact_directory)
+
+    def store_result(self, cache_key, atom_artifact_directory):
+        """
+        Cache the result of an atom, unless a result is already cached under the same key.
+
+        :type cache_key: str
+        :param atom_artifact_directory: the path to the artifact directory of the atom that passed
+        :type atom_artifact_directory: str
+        """
+        result_directory = self._result_directory(cache_key)
+        if os.path.isdir(result_directory):
+            return
+
+        # Copy to a temporary directory first so that a partially copied result is never visible to other builds.
+        temp_directory = '{}.{}.tmp'.format(result_directory, uuid.uuid4().hex)
+        shutil.copytree(atom_artifact_directory, temp_directory)
+        try:
+            os.rename(temp_directory, result_directory)
+        except OSError:
+            # Another build has cached the same result in the meantime.
+            shutil.rmtree(temp_directory, ignore_errors=True)
+
+    def evict_least_recently_used_results(self, max_results=None):
+        """
+        Delete the least recently used results until the cache holds no more than the given number of results.
+
+        :param max_results: the number of results to keep; defaults to the 'atom_result_cache_size' setting. 0 means
+            there is no limit.
+        :type max_results: int | None
+        """
+        max_results = Configuration['atom_result_cache_size'] if max_results is None else max_results
+        if max_results <= 0:
+            return
+
+        result_directories = []
+        for subdirectory in self._list_directory(self._cache_directory):
+            subdirectory_path = os.path.join(self._cache_directory, subdirectory)
+            result_directories.extend(os.path.join(subdirectory_path, result) for result
+                                      in self._list_directory(subdirectory_path) if not result.endswith('.tmp'))
+        if len(result_directories) <= max_results:
+            return
+
+        result_directories.sort(key=self._last_used_time)
+        evicted_directories = result_directories[:len(result_directories) - max_results]
+        self._logger.info('Evicting {} least recently used results from the atom result cache.',
+                          len(evicted_directories))
+        for result_directory in evicted_directories:
+            # Rename the result first so that it is never visible to other builds while it is partially deleted.
+            temp_directory = '{}.{}.tmp'.format(result_directory, uuid.uuid4().hex)
+            try:
+                os.rename(result_directory, temp_directory)
+            except OSError:
+                continue
+            shutil.rmtree(temp_directory, ignore_errors=True)
+
+    @staticmethod
+    def _last_used_time(result_directory):
+        """
+        :type result_directory: str
+        :rtype: float
+        """
+        try:
+            return os.path.getmtime(result_directory)
+        except OSError:  # evicted by another build in the meantime
+            return 0
+
+    @staticmethod
+    def _list_directory(directory):
+        """
+        :type directory: str
+        :return: the names of the entries of the directory, or an empty list if it does not exist
+        :rtype: list[str]
+        """
+        try:
+            return os.listdir(directory)
+        except FileNotFoundError:
+            return []
+
+    def _result_directory(self, cache_key):
+        """
+        :type cache_key: str
+        :rtype: str
+        """
+        # Spread the results over subdirectories so that no single directory holds too many entries.
+        return os.path.join(self._cache_directory, cache_key[:2], cache_key)
@@ -1,6 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from app.common.metrics import ErrorType, internal_errors
 from app.master.atom import Atom
+from app.master.atomizer_output_cache import AtomizerOutputCache
 from app.util import log
+from app.util.conf.configuration import Configuration
 from app.util.process_utils import get_environment_variable_setter_command
 
 
@@ -21,33 +25,79 @@ class Atomizer(object):
     def atomize_in_project(self, project_type):
         """
         Translate the atomizer dicts that this instance was initialized with into a list of actual atom commands. This
-        executes atomizer commands inside the given project in order to generate the atoms.
+        executes atomizer commands inside the given project in order to generate the atoms, unless the output of an
+        atomizer command for the same project version is in the atomizer output cache. Up to 'max_concurrent_atomizers'
+        atomizer commands are executed at the same time; the atoms are always returned in the order of the atomizers.
 
         :param project_type: The ProjectType instance in which to execute the atomizer commands
         :type project_type: ProjectType
         :return: The list of environment variable "export" atom commands
         :rtype: list[app.master.atom.Atom]
         """
+        project_version = None
+        if AtomizerOutputCache.is_enabled():
+            project_version = project_type.project_version()
+        atomizer_output_cache = AtomizerOutputCache.singleton()
+
+        atomizers = [(atomizer_var_name, atomizer_command)
+                     for atomizer_dict in self._atomizer_dicts
+                     for atomizer_var_name, atomizer_command in atomizer_dict.items()]
+
+        atom_values_by_atomizer_index = {}
+        if project_version is not None:
+            for atomizer_index, (_, atomizer_command) in enumerate(atomizers):
+                atom_values = atomizer_output_cache.get(project_type.project_id(), project_version, atomizer_command)
+                if atom_values is not None:
+                    self._logger.info('Using cached output of atomizer command "{}".', atomizer_command)
+                    atom_values_by_atomizer_index[atomizer_index] = atom_values
+
+        uncached_atomizer_indices = [atomizer_index for atomizer_index in range(len(atomizers))
+                                     if atomizer_index not in atom_values_by_atomizer_index]
+
+        def execute_atomizer(atomizer_index):
+            atomizer_var_name, atomizer_command = atomizers[atomizer_index]
+            return self._execute_atomizer_command(project_type, atomizer_var_name, atomizer_command)
+
+        max_workers = min(Configuration['max_concurrent_atomizers'], len(uncached_atomizer_indices))
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                executed_atom_values = list(executor.map(execute_atomizer, uncached_atomizer_indices))
+        else:
+            executed_atom_values = [execute_atomizer(atomizer_index) for atomizer_index in uncached_atomizer_indices]
+
+        for atomizer_index, atom_values in zip(uncached_atomizer_indices, executed_atom_values):
+            atom_values_by_atomizer_index[atomizer_index] = atom_values
+            if project_version is not None:
+                _, atomizer_command = atomizers[atomizer_index]
+                atomizer_output_cache.put(project_type.project_id(), project_version, atomizer_command, atom_values)
+
         atoms_list = []
-        for atomizer_dict in self._atomizer_dicts:
-            for atomizer_var_name, atomizer_command in atomizer_dict.items():
-                atomizer_output, exit_code = project_type.execute_command_in_project(atomizer_command)
-                if exit_code != 0:
-                    self._logger.error('Atomizer command "{}" for variable "{}" failed with exit code: {} and output:'
-                                       '\n{}', atomizer_command, atomizer_var_name, exit_code, atomizer_output)
-                    internal_errors.labels(ErrorType.AtomizerFailure).inc()  # pylint: disable=no-member
-                    raise AtomizerError('Atomizer command failed!')
-
-                new_atoms = []
-                for atom_value in atomizer_output.strip().splitlines():
-                    # For purposes of matching atom string values across builds, we must replace the generated/unique
-                    # project directory with its corresponding universal environment variable: '$PROJECT_DIR'.
-                    atom_value = atom_value.replace(project_type.project_directory, '$PROJECT_DIR')
-                    new_atoms.append(Atom(get_environment_variable_setter_command(atomizer_var_name, atom_value)))
-                atoms_list.extend(new_atoms)
+        for atomizer_index, (atomizer_var_name, _) in enumerate(atomizers):
+            atoms_list.extend(Atom(get_environment_variable_setter_command(atomizer_var_name, atom_value))
+                              for atom_value in atom_values_by_atomizer_index[atomizer_index])
 
         return atoms_list
 
+    def _execute_atomizer_command(self, project_type, atomizer_var_name, atomizer_command):
+        """
+        :type project_type: ProjectType
+        :type atomizer_var_name: str
+        :type atomizer_command: str
+        :return: the atom values output by the atomizer command
+        :rtype: list[str]
+        """
+        atomizer_output, exit_code = project_type.execute_command_in_project(atomizer_command)
+        if exit_code != 0:
+            self._logger.error('Atomizer command "{}" for variable "{}" failed with exit code: {} and output:'
+                               '\n{}', atomizer_command, atomizer_var_name, exit_code, atomizer_output)
+            internal_errors.labels(ErrorType.AtomizerFailure).inc()  # pylint: disable=no-member
+            raise AtomizerError('Atomizer command failed!')
+
+        # For purposes of matching atom string values across builds, we must replace the generated/unique project
+        # directory with its corresponding universal environment variable: '$PROJECT_DIR'.
+        return [atom_value.replace(project_type.project_directory, '$PROJECT_DIR')
+                for atom_value in atomizer_output.strip().splitlines()]
+
 
 class AtomizerError(Exception):
     """
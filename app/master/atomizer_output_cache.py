@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from threading import Lock
+
+from app.util.conf.configuration import Configuration
+from app.util.singleton import Singleton
+
+
+class AtomizerOutputCache(Singleton):
+    """
+    An in-memory cache of atomizer command output on the master, keyed by project, project version (e.g., a commit
+    hash) and atomizer command. When the cache is full, the least recently used output is evicted. The maximum number
+    of cached outputs is set by the 'atomizer_output_cache_size' setting; 0 disables the cache.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._atom_values_by_key = OrderedDict()
+        self._cache_lock = Lock()
+
+    @staticmethod
+    def is_enabled():
+        """
+        :rtype: bool
+        """
+        return Configuration['atomizer_output_cache_size'] > 0
+
+    def get(self, project_id, project_version, atomizer_command):
+        """
+        :type project_id: str
+        :type project_version: str
+        :type atomizer_command: str
+        :return: the atom values output by the atomizer command, or None if they are not cached
+        :rtype: list[str] | None
+        """
+        cache_key = (project_id, project_version, atomizer_command)
+        with self._cache_lock:
+            atom_values = self._atom_values_by_key.get(cache_key)
+            if atom_values is not None:
+                self._atom_values_by_key.move_to_end(cache_key)
+        return atom_values
+
+    def put(self, project_id, project_version, atomizer_command, atom_values):
+        """
+        :type project_id: str
+        :type project_version: str
+        :type atomizer_command: str
+        :param atom_values: the atom values output by the atomizer command
+        :type atom_values: list[str]
+        """
+        cache_key = (project_id, project_version, atomizer_command)
+        with self._cache_lock:
+            self._atom_values_by_key[cache_key] = list(atom_values)
+            self._atom_values_by_key.move_to_end(cache_key)
+            while len(self._atom_values_by_key) > Configuration['atomizer_output_cache_size']:
+                self._atom_values_by_key.popitem(last=False)
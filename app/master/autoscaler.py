@@ -0,0 +1,138 @@
+from importlib import import_module
+from subprocess import DEVNULL, Popen
+
+from app.master.slave import SlaveRegistry
+from app.util.conf.configuration import Configuration
+from app.util.exceptions import ItemNotFoundError
+from app.util.log import get_logger
+
+
+class Autoscaler(object):
+    """
+    The base class of autoscalers, which start and stop slaves to match the demand for executors. While the master is
+    running, it periodically calls scale() with the current demand (see ClusterMaster.cluster_demand()). The autoscaler
+    is selected with the 'autoscaler' setting; subclasses outside of ClusterRunner are selected by their dotted path.
+    """
+
+    def __init__(self, cluster_master):
+        """
+        :type cluster_master: app.master.cluster_master.ClusterMaster
+        """
+        self._logger = get_logger(__name__)
+        self._cluster_master = cluster_master
+
+    def scale(self, demand):
+        """
+        Start or stop slaves to meet the demand for executors.
+
+        :param demand: the current demand for executors, as returned by ClusterMaster.cluster_demand()
+        :type demand: dict[str, int | float]
+        """
+        raise NotImplementedError
+
+
+class LocalSlaveAutoscaler(Autoscaler):
+    """
+    An autoscaler that starts slave processes with one executor each on the master's host when the builds waiting for
+    slaves need more executors than are idle, and shuts down the slaves it started once no builds are queued. It is
+    meant for trying out an autoscaling feedback loop on one machine: the slaves share the host's ClusterRunner
+    directories, so do not use it for real builds. The slaves run on the ports after the master's port, up to the
+    'local_autoscaler_max_slaves' setting.
+    """
+
+    def __init__(self, cluster_master):
+        """
+        :type cluster_master: app.master.cluster_master.ClusterMaster
+        """
+        super().__init__(cluster_master)
+        self._slave_processes_by_port = {}  # type: Dict[int, Popen]
+
+    def scale(self, demand):
+        """
+        :type demand: dict[str, int | float]
+        """
+        self._forget_exited_slave_processes()
+        num_executors_starting = sum(1 for port in self._slave_processes_by_port if self._connected_slave(port) is None)
+        num_executors_missing = demand['executors_needed'] - demand['idle_executors'] - num_executors_starting
+        if num_executors_missing > 0:
+            self._start_slaves(num_executors_missing)
+        elif demand['queued_builds'] == 0 and demand['executors_needed'] == 0:
+            self._stop_idle_slaves()
+
+    def _start_slaves(self, num_slaves):
+        """
+        :param num_slaves: the number of slaves to start, if the 'local_autoscaler_max_slaves' setting allows it
+        :type num_slaves: int
+        """
+        master_port = int(Configuration['port'])
+        slave_ports = range(master_port + 1, master_port + 1 + Configuration['local_autoscaler_max_slaves'])
+        free_ports = [port for port in slave_ports if port not in self._slave_processes_by_port]
+        for port in free_ports[:num_slaves]:
+            self._logger.info('Starting a local slave on port {} to meet the demand for executors.', port)
+            slave_cmd = Configuration['main_executable_path'] + [
+                'slave',
+                '--port', str(port),
+                '--num-executors', '1',
+                '--master-url', '{}:{}'.format(Configuration['hostname'], master_port),
+            ]
+            # Don't use shell=True here so that the Popen instance is the slave process itself.
+            self._slave_processes_by_port[port] = Popen(slave_cmd, stdout=DEVNULL, stderr=DEVNULL)
+
+    def _stop_idle_slaves(self):
+        """
+        Put the started slaves that are not working on any builds in shutdown mode, which kills them.
+        """
+        for port in list(self._slave_processes_by_port):
+            slave = self._connected_slave(port)
+            if slave is not None and slave.current_build_id is None and not slave.is_shutdown():
+                self._logger.info('Stopping the local slave on port {} since no builds are queued.', port)
+                self._cluster_master.set_shutdown_mode_on_slaves([slave.id])
+
+    def _forget_exited_slave_processes(self):
+        for port, slave_process in list(self._slave_processes_by_port.items()):
+            if slave_process.poll() is not None:
+                del self._slave_processes_by_port[port]
+
+    def _connected_slave(self, port):
+        """
+        :type port: int
+        :return: the slave on the specified port if it has connected to the master, otherwise None
+        :rtype: app.master.slave.Slave | None
+        """
+        try:
+            return SlaveRegistry.singleton().get_slave(slave_url='{}:{}'.format(Configuration['hostname'], port))
+        except ItemNotFoundError:
+            return None
+
+
+# The autoscalers that can be selected by name via the 'autoscaler' setting
+_AUTOSCALERS_BY_NAME = {
+    'local': LocalSlaveAutoscaler,
+}
+
+
+def create_autoscaler(cluster_master):
+    """
+    Create the autoscaler selected by the 'autoscaler' setting: either the name of one of ClusterRunner's autoscalers,
+    or the dotted path of an Autoscaler subclass (e.g., "my_package.my_module.MyAutoscaler"). An autoscaler that cannot
+    be found disables autoscaling.
+
+    :type cluster_master: app.master.cluster_master.ClusterMaster
+    :return: the autoscaler, or None if autoscaling is disabled
+    :rtype: Autoscaler | None
+    """
+    autoscaler_name = Configuration['autoscaler']
+    if not autoscaler_name or autoscaler_name == 'none':
+        return None
+
+    autoscaler_class = _AUTOSCALERS_BY_NAME.get(autoscaler_name)
+    if autoscaler_class is None:
+        module_name, _, class_name = autoscaler_name.rpartition('.')
+        try:
+            autoscaler_class = getattr(import_module(module_name), class_name)
+        except (ImportError, AttributeError, ValueError):
+            get_logger(__name__).warning('Unknown autoscaler "{}"; autoscaling is disabled. Valid autoscalers are: {} '
+                                         'or the dotted path of an Autoscaler subclass.',
+                                         autoscaler_name, ', '.join(sorted(_AUTOSCALERS_BY_NAME)))
+            return None
+    return autoscaler_class(cluster_master)
@@ -0,0 +1,178 @@
+import heapq
+
+from app.master.atom_grouper import AtomGrouper
+from app.master.time_based_atom_grouper import TimeBasedAtomGrouper, _AtomTimingDataError
+
+
+class BinPackingAtomGrouper(TimeBasedAtomGrouper):
+    """
+    This class groups atoms into exactly one subjob per executor by treating the grouping as a multiprocessor
+    scheduling problem: given N executors and a list of atoms with historic times, find N groups of atoms such that
+    the longest group (the build's makespan) is as short as possible. Since every group is sized to keep its executor
+    busy for the whole build, no smaller subjobs are created to fill in gaps at the end of the build (unlike the
+    TimeBasedAtomGrouper): the build has exactly min(N, number of atoms) subjobs.
+
+    Two classic heuristics are run and the grouping with the shorter estimated makespan is kept:
+
+    - LPT (longest processing time first): atoms are visited in decreasing order of time and each one is assigned to
+      the currently least loaded group. The least loaded group is tracked with a heap, so this runs in O(n log n).
+      LPT is guaranteed to be within 4/3 of the optimal makespan.
+    - MULTIFIT: a binary search over a group capacity, where each step packs the atoms first-fit-decreasing into at
+      most N groups. The first group that has enough room for an atom is found with a max segment tree over the
+      remaining capacities, so each step runs in O(n log N). MULTIFIT is guaranteed to be within 13/11 of optimal.
+
+    Unlike the TimeBasedAtomGrouper, the atoms are never rescanned per group, so grouping cost stays low for builds
+    with tens of thousands of atoms.
+    """
+    MULTIFIT_ITERATIONS = 10
+
+    def groupings(self):
+        """
+        Group the atoms into subjobs using historic timing data.
+
+        :return: a list of lists of atoms
+        :rtype: list[list[app.master.atom.Atom]]
+        """
+        try:
+            self._set_expected_atom_times(self._atoms, self._atom_time_map, self._project_directory)
+        except _AtomTimingDataError:
+            grouper = AtomGrouper(self._atoms, self._max_executors)
+            return grouper.groupings()
+
+        atoms_by_decreasing_time = sorted(self._atoms, key=lambda atom: atom.expected_time, reverse=True)
+        num_groups = min(self._max_executors, len(atoms_by_decreasing_time))
+
+        lpt_groups = self._group_atoms_by_lpt(atoms_by_decreasing_time, num_groups)
+        multifit_groups = self._group_atoms_by_multifit(atoms_by_decreasing_time, num_groups)
+        if multifit_groups is not None and _max_group_time(multifit_groups) < _max_group_time(lpt_groups):
+            groups = multifit_groups
+        else:
+            groups = lpt_groups
+
+        # Dispatch the longest subjobs first so that they are not left over at the end of the build.
+        non_empty_groups = [group for group in groups if len(group) > 0]
+        return sorted(non_empty_groups, key=_group_time, reverse=True)
+
+    def _group_atoms_by_lpt(self, atoms_by_decreasing_time, num_groups):
+        """
+        :type atoms_by_decreasing_time: list[app.master.atom.Atom]
+        :type num_groups: int
+        :rtype: list[list[app.master.atom.Atom]]
+        """
+        groups = [[] for _ in range(num_groups)]
+        group_loads = [(0.0, group_index) for group_index in range(num_groups)]  # already a valid heap
+
+        for atom in atoms_by_decreasing_time:
+            load, group_index = heapq.heappop(group_loads)
+            groups[group_index].append(atom)
+            heapq.heappush(group_loads, (load + atom.expected_time, group_index))
+
+        return groups
+
+    def _group_atoms_by_multifit(self, atoms_by_decreasing_time, num_groups):
+        """
+        :type atoms_by_decreasing_time: list[app.master.atom.Atom]
+        :type num_groups: int
+        :return: the groups for the smallest capacity that was found to fit all atoms, or None if none was found
+        :rtype: list[list[app.master.atom.Atom]] | None
+        """
+        total_time = sum(atom.expected_time for atom in atoms_by_decreasing_time)
+        largest_atom_time = atoms_by_decreasing_time[0].expected_time
+        lower_bound = max(total_time / num_groups, largest_atom_time)
+        upper_bound = max(2 * total_time / num_groups, largest_atom_time)
+
+        best_groups = None
+        for _ in range(self.MULTIFIT_ITERATIONS):
+            capacity = (lower_bound + upper_bound) / 2
+            groups = self._first_fit_decreasing(atoms_by_decreasing_time, num_groups, capacity)
+            if groups is None:
+                lower_bound = capacity
+            else:
+                best_groups = groups
+                upper_bound = capacity
+
+        return best_groups
+
+    def _first_fit_decreasing(self, atoms_by_decreasing_time, num_groups, capacity):
+        """
+        Pack the atoms into at most num_groups groups of the given capacity, placing each atom into the first group
+        that still has room for it.
+
+        :type atoms_by_decreasing_time: list[app.master.atom.Atom]
+        :type num_groups: int
+        :type capacity: float
+        :return: the packed groups, or None if the atoms do not fit
+        :rtype: list[list[app.master.atom.Atom]] | None
+        """
+        groups = [[] for _ in range(num_groups)]
+        remaining_capacities = _MaxSegmentTree([capacity] * num_groups)
+
+        for atom in atoms_by_decreasing_time:
+            group_index = remaining_capacities.first_index_at_least(atom.expected_time)
+            if group_index is None:
+                return None
+            groups[group_index].append(atom)
+            remaining_capacities.update(group_index, remaining_capacities[group_index] - atom.expected_time)
+
+        return groups
+
+
+def _group_time(group):
+    """
+    :type group: list[app.master.atom.Atom]
+    :rtype: float
+    """
+    return sum(atom.expected_time for atom in group)
+
+
+def _max_group_time(groups):
+    """
+    :type groups: list[list[app.master.atom.Atom]]
+    :rtype: float
+    """
+    return max(_group_time(group) for group in groups)
+
+
+class _MaxSegmentTree(object):
+    """
+    A fixed-size array that can find the first index holding a value of at least some threshold in O(log n).
+    """
+    def __init__(self, values):
+        """
+        :type values: list[float]
+        """
+        self._size = 1
+        while self._size < len(values):
+            self._size *= 2
+        self._tree = [float('-inf')] * (2 * self._size)
+        self._tree[self._size:self._size + len(values)] = values
+        for node in range(self._size - 1, 0, -1):
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+
+    def __getitem__(self, index):
+        return self._tree[self._size + index]
+
+    def update(self, index, value):
+        """
+        :type index: int
+        :type value: float
+        """
+        node = self._size + index
+        self._tree[node] = value
+        node //= 2
+        while node >= 1:
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+
+    def first_index_at_least(self, threshold):
+        """
+        :type threshold: float
+        :return: the lowest index whose value is >= threshold, or None if there is no such index
+        :rtype: int | None
+        """
+        if self._tree[1] < threshold:
+            return None
+        node = 1
+        while node < self._size:
+            node = 2 * node if self._tree[2 * node] >= threshold else 2 * node + 1
+        return node - self._size
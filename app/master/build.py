@@ -1,6 +1,7 @@
 from collections import OrderedDict
 from enum import Enum
 from itertools import islice
+import json
 import os
 from queue import Queue, Empty
 import shutil
@@ -13,6 +14,8 @@ from typing import Dict, List
 
 from app.common.build_artifact import BuildArtifact
 from app.common.metrics import build_state_duration_seconds, ErrorType, internal_errors, serialized_build_time_seconds
+from app.common.timing_data_store import TimingDataStore
+from app.master.atom_result_cache import AtomResultCache
 from app.master.build_fsm import BuildFsm, BuildEvent, BuildState
 from app.master.build_request import BuildRequest
 from app.master.subjob import Subjob
@@ -68,6 +71,8 @@ class Build(object):
         self._unstarted_subjobs = None  # WIP(joey): Move subjob queues to BuildScheduler class.
         self._finished_subjobs = None
         self._failed_atoms = None
+        self._num_failed_atoms = 0  # the number of atoms that have failed so far, used by fail-fast mode
+        self._atoms_with_results = set()  # the (subjob id, atom id) of each atom whose result was reported on its own
         self._postbuild_tasks_are_finished = False  # WIP(joey): Remove and use build state.
         self._timing_file_path = None
 
@@ -108,6 +113,7 @@ class Build(object):
             'failed_atoms': failed_atoms_api_representation,
             'result': self._result(),
             'request_params': self.build_request.build_parameters(),
+            'priority': self.priority,
             # Convert self._state_timestamps to OrderedDict to make raw API response more readable. Sort the entries
             # by numerically increasing dict value, with None values sorting highest.
             'state_timestamps': OrderedDict(sorted(
@@ -136,7 +142,12 @@ class Build(object):
         if self._project_type is None:
             raise BuildProjectError('Build failed due to an invalid project type.')
 
-    def prepare(self):
+    def prepare(self, project_fetched_callback=None):
+        """
+        :param project_fetched_callback: called with this build once its project has been fetched on the master,
+            before the project is atomized
+        :type project_fetched_callback: (Build) -> None | None
+        """
         if not isinstance(self.build_request, BuildRequest):
             raise RuntimeError('Build {} has no associated request object.'.format(self._build_id))
 
@@ -146,7 +157,7 @@ class Build(object):
         if not self._preparation_coin.spend():
             raise RuntimeError('prepare() was called more than once on build {}.'.format(self._build_id))
 
-        self._state_machine.trigger(BuildEvent.START_PREPARE)
+        self._state_machine.trigger(BuildEvent.START_PREPARE, project_fetched_callback=project_fetched_callback)
 
     def build_id(self):
         """
@@ -161,6 +172,13 @@ class Build(object):
         """
         return self._build_request
 
+    @property
+    def priority(self):
+        """
+        :rtype: int
+        """
+        return self._build_request.priority
+
     def get_subjobs(self, offset: int=None, limit: int=None) -> List['Subjob']:
         """
         Returns a list of subjobs for this build
@@ -179,51 +197,214 @@ class Build(object):
             raise ItemNotFoundError('Invalid subjob id.')
         return subjob
 
-    def complete_subjob(self, subjob_id, payload=None):
+    def complete_subjob(self, subjob_id, payload=None, slave=None):
         """
-        Handle the subjob payload and mark the given subjob id for this build as complete.
+        Handle the subjob payload and mark the given subjob id for this build as complete. If the subjob was executed
+        speculatively on two slaves, only the first result received is used and any later result is ignored. Slaves
+        that report the result of each atom as soon as it finishes (see complete_atom()) complete the subjob without a
+        payload.
         :type subjob_id: int
         :type payload: dict
+        :param slave: the slave that reported the result; a result from a slave that is no longer executing the subjob
+            (e.g., a speculative duplicate that was dropped because the slave queued it) is ignored
+        :type slave: Slave | None
+        :return: whether the result was used, i.e., whether the results of the subjob's atoms should be recorded with
+            record_atom_results()
+        :rtype: bool
         """
         try:
-            self._handle_subjob_payload(subjob_id, payload)
+            subjob = self._all_subjobs_by_id.get(subjob_id)
+            if subjob is not None and subjob.is_completed():
+                self._logger.info('Ignoring duplicate result for subjob {} of build {}.', subjob_id, self._build_id)
+                return False
+            if subjob is not None and slave is not None and not subjob.is_executed_by(slave):
+                self._logger.info('Ignoring result for subjob {} of build {} from {}, which is not executing it.',
+                                  subjob_id, self._build_id, slave)
+                return False
+
+            if self._handle_subjob_payload(subjob_id, payload):
+                self._count_failed_atoms(subjob_id)
+                if Configuration['cache_atom_results']:
+                    self._cache_passed_atom_results(subjob_id)
             self._mark_subjob_complete(subjob_id)
+            return True
 
         except Exception:
             self._logger.exception('Error while completing subjob; marking build as failed.')
             self.mark_failed('Error occurred while completing subjob {}.'.format(subjob_id))
             raise
 
-    def _parse_payload_for_atom_exit_code(self, subjob_id):
+    def complete_atom(self, subjob_id, atom_id, payload, slave=None):
+        """
+        Handle the payload of a single atom that a slave reported as soon as the atom finished, ahead of the completion
+        of its subjob. This records the atom's exit code right away, so failures are known (and fail-fast builds are
+        canceled) without waiting for the rest of the subjob, and the results of a build are extracted as they arrive
+        instead of a subjob at a time. If the subjob was executed speculatively on two slaves, only the first result
+        received for each atom is used.
+        :type subjob_id: int
+        :type atom_id: int
+        :type payload: dict
+        :param slave: the slave that reported the result; a result from a slave that is no longer executing the subjob
+            is ignored
+        :type slave: Slave | None
+        """
+        subjob = self.subjob(subjob_id)
+        if not 0 <= atom_id < len(subjob.atoms):
+            raise ItemNotFoundError('Invalid atom id.')
+        if slave is not None and not subjob.is_executed_by(slave):
+            self._logger.info('Ignoring result for atom {} of subjob {} of build {} from {}, which is not executing it.',
+                              atom_id, subjob_id, self._build_id, slave)
+            return
+
+        with self._build_completion_lock:
+            is_duplicate = subjob.is_completed() or (subjob_id, atom_id) in self._atoms_with_results
+            self._atoms_with_results.add((subjob_id, atom_id))
+        if is_duplicate:
+            self._logger.info('Ignoring duplicate result for atom {} of subjob {} of build {}.',
+                              atom_id, subjob_id, self._build_id)
+            return
+
+        try:
+            self._write_and_extract_payload(payload, 'results_{}_{}.tar.gz'.format(subjob_id, atom_id),
+                                            'atom {} of subjob {}'.format(atom_id, subjob_id))
+            self._read_atom_results(subjob, atom_id)
+            self._count_failed_atoms(subjob_id, atom_ids=[atom_id])
+            if Configuration['cache_atom_results']:
+                self._cache_passed_atom_results(subjob_id, atom_ids=[atom_id])
+
+        except Exception:
+            self._logger.exception('Error while completing atom; marking build as failed.')
+            self.mark_failed('Error occurred while completing atom {} of subjob {}.'.format(atom_id, subjob_id))
+            raise
+
+    def _parse_payload_for_atom_results(self, subjob_id):
         subjob = self.subjob(subjob_id)
         for atom_id in range(len(subjob.atoms)):
-            artifact_dir = BuildArtifact.atom_artifact_directory(
-                self.build_id(),
-                subjob.subjob_id(),
-                atom_id,
-                result_root=Configuration['results_directory']
-            )
-            atom_exit_code_file_sys_path = os.path.join(artifact_dir, BuildArtifact.EXIT_CODE_FILE)
-            with open(atom_exit_code_file_sys_path, 'r') as atom_exit_code_file:
-                subjob.atoms[atom_id].exit_code = int(atom_exit_code_file.read())
+            self._read_atom_results(subjob, atom_id)
+
+    def _read_atom_results(self, subjob, atom_id):
+        """
+        Set the exit code and the resource usage of an atom from the files in its extracted artifact directory. The
+        resource usage file is optional since slaves cannot measure the resource usage of every command.
+
+        :type subjob: Subjob
+        :type atom_id: int
+        """
+        artifact_dir = BuildArtifact.atom_artifact_directory(
+            self.build_id(),
+            subjob.subjob_id(),
+            atom_id,
+            result_root=Configuration['results_directory']
+        )
+        atom_exit_code_file_sys_path = os.path.join(artifact_dir, BuildArtifact.EXIT_CODE_FILE)
+        with open(atom_exit_code_file_sys_path, 'r') as atom_exit_code_file:
+            subjob.atoms[atom_id].exit_code = int(atom_exit_code_file.read())
+
+        atom_resource_usage_file_sys_path = os.path.join(artifact_dir, BuildArtifact.RESOURCE_USAGE_FILE)
+        if os.path.isfile(atom_resource_usage_file_sys_path):
+            with open(atom_resource_usage_file_sys_path, 'r') as atom_resource_usage_file:
+                subjob.atoms[atom_id].resource_usage = json.load(atom_resource_usage_file)
 
     def _handle_subjob_payload(self, subjob_id, payload):
+        """
+        :type subjob_id: int
+        :type payload: dict
+        :return: whether there was a payload, in which case the exit codes of the subjob's atoms have been set
+        :rtype: bool
+        """
         if not payload:
-            self._logger.warning('No payload for subjob {} of build {}.', subjob_id, self._build_id)
-            return
+            # Slaves that report the result of each atom as it finishes complete the subjob without a payload. If the
+            # result of an atom never arrived, the build would silently be missing it, so the build fails instead.
+            # Atoms of a stopped build are expected to be missing results since their subjobs are killed.
+            atom_ids_without_results = self._atom_ids_without_results(subjob_id)
+            if atom_ids_without_results and not self.is_stopped:
+                self._logger.warning('No results for atoms {} of subjob {} of build {}.',
+                                     atom_ids_without_results, subjob_id, self._build_id)
+                self.mark_failed('The results of atoms {} of subjob {} were not received from the slave.'.format(
+                    atom_ids_without_results, subjob_id))
+            return False
 
         # Assertion: all payloads received from subjobs are uniquely named.
-        result_file_path = os.path.join(self._build_results_dir(), payload['filename'])
+        self._write_and_extract_payload(payload, payload['filename'], 'subjob {}'.format(subjob_id))
+        self._parse_payload_for_atom_results(subjob_id)
+        return True
 
+    def _write_and_extract_payload(self, payload, result_file_name, payload_description):
+        """
+        Write a result archive received from a slave to the build's results directory and extract it there.
+
+        :type payload: dict
+        :param result_file_name: the name to write the archive under; this must be unique within the build
+        :type result_file_name: str
+        :param payload_description: what the payload contains the results of, for logging
+        :type payload_description: str
+        """
+        result_file_path = os.path.join(self._build_results_dir(), result_file_name)
         try:
             app.util.fs.write_file(payload['body'], result_file_path)
             app.util.fs.extract_tar(result_file_path, delete=True)
-            self._parse_payload_for_atom_exit_code(subjob_id)
         except:
             internal_errors.labels(ErrorType.SubjobWriteFailure).inc()  # pylint: disable=no-member
-            self._logger.warning('Writing payload for subjob {} of build {} FAILED.', subjob_id, self._build_id)
+            self._logger.warning('Writing payload for {} of build {} FAILED.', payload_description, self._build_id)
             raise
 
+    def _atom_ids_without_results(self, subjob_id):
+        """
+        :type subjob_id: int
+        :return: the ids of the atoms of the subjob whose result has not been reported through complete_atom()
+        :rtype: list[int]
+        """
+        subjob = self.subjob(subjob_id)
+        with self._build_completion_lock:
+            return [atom_id for atom_id in range(len(subjob.atoms))
+                    if (subjob_id, atom_id) not in self._atoms_with_results]
+
+    def record_atom_results(self, subjob_id):
+        """
+        Remember which atoms of the completed subjob failed so that later fail-fast builds of this job can run them
+        first. Atoms whose results were not received are skipped. The results of atoms reported through complete_atom()
+        are recorded here too, so that the results of a subjob are written to the timing data store in a single
+        transaction instead of one per atom. This writes to the timing database, so it should not be called on the
+        thread that serves the API.
+
+        :type subjob_id: int
+        """
+        atoms = [atom for atom in self.subjob(subjob_id).atoms if atom.exit_code is not None]
+        if not atoms:
+            return
+        failed_atom_commands = [atom.command_string for atom in atoms if atom.exit_code != 0]
+        passed_atom_commands = [atom.command_string for atom in atoms if atom.exit_code == 0]
+        TimingDataStore().record_atom_results(self._timing_file_path, failed_atom_commands, passed_atom_commands)
+
+    def _count_failed_atoms(self, subjob_id, atom_ids=None):
+        """
+        Cancel this build if it is in fail-fast mode and the atoms of the subjob have made it reach its atom failure
+        threshold.
+
+        :type subjob_id: int
+        :param atom_ids: the atoms of the subjob whose results to count, or None for all of them
+        :type atom_ids: list[int] | None
+        """
+        subjob = self.subjob(subjob_id)
+        atoms = subjob.atoms if atom_ids is None else [subjob.atoms[atom_id] for atom_id in atom_ids]
+        num_newly_failed_atoms = sum(1 for atom in atoms if atom.exit_code != 0)
+
+        fail_fast_after = self._build_request.fail_fast_after
+        if fail_fast_after is None or num_newly_failed_atoms == 0:
+            return
+        with self._build_completion_lock:
+            self._num_failed_atoms += num_newly_failed_atoms
+            num_failed_atoms = self._num_failed_atoms
+            should_cancel = num_failed_atoms >= fail_fast_after and not self.is_stopped
+        if should_cancel:
+            self._logger.notice('Build {} reached its fail-fast threshold of {} atom failures.',
+                                self._build_id, fail_fast_after)
+            self._state_machine.trigger(
+                BuildEvent.CANCEL,
+                error_msg='Build was canceled after {} atom failures (fail_fast_after={}).'.format(
+                    num_failed_atoms, fail_fast_after),
+            )
+
     def _read_subjob_timings_from_results(self):
         """
         Collect timing data from all subjobs
@@ -235,6 +416,48 @@ class Build(object):
 
         return timings
 
+    def _cache_passed_atom_results(self, subjob_id, atom_ids=None):
+        """
+        Store the results of the subjob's passed atoms in the atom result cache so that later builds of the same source
+        tree can skip those atoms.
+
+        :type subjob_id: int
+        :param atom_ids: the atoms of the subjob whose results to cache if they passed, or None for all of them
+        :type atom_ids: list[int] | None
+        """
+        subjob = self.subjob(subjob_id)
+        atom_result_cache = AtomResultCache()
+        for atom_id, atom in enumerate(subjob.atoms):
+            if atom_ids is not None and atom_id not in atom_ids:
+                continue
+            if atom.exit_code == 0 and atom.result_cache_key is not None:
+                atom_artifact_directory = BuildArtifact.atom_artifact_directory(
+                    self.build_id(),
+                    subjob.subjob_id(),
+                    atom_id,
+                    result_root=Configuration['results_directory']
+                )
+                atom_result_cache.store_result(atom.result_cache_key, atom_artifact_directory)
+
+    def split_subjob(self, subjob):
+        """
+        Split an unstarted subjob in two and queue the newly created subjob for execution. This lets the scheduler
+        break up large subjobs near the end of the build so that the remaining work is spread over more executors.
+
+        :type subjob: Subjob
+        :return: the newly created subjob, or None if the subjob could not be split
+        :rtype: Subjob | None
+        """
+        with self._build_completion_lock:
+            new_subjob = subjob.split(new_subjob_id=len(self._all_subjobs_by_id))
+            if new_subjob is None:
+                return None
+            self._all_subjobs_by_id[new_subjob.subjob_id()] = new_subjob
+
+        self._logger.debug('Split {} atoms off of {} into new {}.', len(new_subjob.atoms), subjob, new_subjob)
+        self._unstarted_subjobs.put(new_subjob)
+        return new_subjob
+
     def _mark_subjob_complete(self, subjob_id):
         """
         :type subjob_id: int
@@ -294,24 +517,71 @@ class Build(object):
         self._logger.info('Fetching project for build {}.', self._build_id)
         self.project_type.fetch_project()
         self._logger.info('Successfully fetched project for build {}.', self._build_id)
+        project_fetched_callback = getattr(event, 'project_fetched_callback', None)
+        if project_fetched_callback is not None:
+            project_fetched_callback(self)
 
         job_config = self.project_type.job_config()
         if job_config is None:
             raise RuntimeError('Build failed while trying to parse clusterrunner.yaml.')
 
         subjobs = compute_subjobs_for_build(self._build_id, job_config, self.project_type)
+        self._timing_file_path = self._project_type.timing_file_path(job_config.name)
+        if self._build_request.fail_fast_after is not None:
+            subjobs = self._run_failing_atoms_first(subjobs)
 
-        self._unstarted_subjobs = Queue(maxsize=len(subjobs))  # WIP(joey): Move this into BuildScheduler?
-        self._finished_subjobs = Queue(maxsize=len(subjobs))  # WIP(joey): Remove this and just record finished count.
+        # These queues are unbounded since subjobs can be split into more subjobs while the build is running.
+        self._unstarted_subjobs = Queue()  # WIP(joey): Move this into BuildScheduler?
+        self._finished_subjobs = Queue()  # WIP(joey): Remove this and just record finished count.
 
         for subjob in subjobs:
             self._all_subjobs_by_id[subjob.subjob_id()] = subjob
-            self._unstarted_subjobs.put(subjob)
+            if subjob.is_completed():  # the subjob of atoms whose results were restored from the atom result cache
+                self._finished_subjobs.put(subjob)
+            else:
+                self._unstarted_subjobs.put(subjob)
 
-        self._timing_file_path = self._project_type.timing_file_path(job_config.name)
         app.util.fs.create_dir(self._build_results_dir())
         self._state_machine.trigger(BuildEvent.FINISH_PREPARE)
 
+        # If every atom had a cached result there is nothing left to run, so the build can finish right away.
+        if subjobs and self._all_subjobs_are_finished():
+            self._logger.info('All results of build {} were cached.', self._build_id)
+            self.finish()
+
+    def _run_failing_atoms_first(self, subjobs):
+        """
+        Move the atoms that failed the last time they were run into subjobs of their own and order these subjobs
+        first, so that a fail-fast build finds out about failures as early as possible. The previously failing atoms of
+        each subjob are split off into one new subjob, keeping the atom grouping close to the original one. The subjobs
+        with the most previously failing atoms come first; the relative order of all other subjobs is preserved.
+
+        :type subjobs: list[Subjob]
+        :rtype: list[Subjob]
+        """
+        atom_commands = [atom.command_string for subjob in subjobs for atom in subjob.atoms]
+        failing_atoms = TimingDataStore().get_failing_atoms(self._timing_file_path, atom_commands)
+        if not failing_atoms:
+            return subjobs
+
+        self._logger.info('Running {} previously failed atoms first for build {}.', len(failing_atoms), self._build_id)
+        failing_subjobs = []
+        other_subjobs = []
+        next_subjob_id = len(subjobs)
+        for subjob in subjobs:
+            subjob_failing_atoms = [atom for atom in subjob.atoms if atom.command_string in failing_atoms]
+            if not subjob_failing_atoms or subjob.is_completed():
+                other_subjobs.append(subjob)
+            elif len(subjob_failing_atoms) == len(subjob.atoms):
+                failing_subjobs.append(subjob)
+            else:
+                failing_subjobs.append(subjob.split_off_atoms(subjob_failing_atoms, new_subjob_id=next_subjob_id))
+                other_subjobs.append(subjob)
+                next_subjob_id += 1
+
+        failing_subjobs.sort(key=lambda failing_subjob: -len(failing_subjob.atoms))
+        return failing_subjobs + other_subjobs
+
     def _on_leave_state(self, event):
         start_time = self._state_machine.transition_timestamps.get(event.src)
         if start_time is not None:
@@ -333,6 +603,8 @@ class Build(object):
         :type event: BuildEvent
         """
         self._logger.notice('Canceling build {}.', self._build_id)
+        # A build is canceled with an error message when it is stopped early by fail-fast mode.
+        self._error_message = getattr(event, 'error_msg', self._error_message)
         # Set the kill_event to kill the subprocesses for the build
         self.project_type.kill_subprocesses()
 
@@ -421,7 +693,7 @@ class Build(object):
         return sum([len(subjob.atomic_commands()) for subjob in self._all_subjobs_by_id.values()])
 
     def _all_subjobs_are_finished(self):
-        return self._finished_subjobs and self._finished_subjobs.full()
+        return self._finished_subjobs and self._finished_subjobs.qsize() == len(self._all_subjobs_by_id)
 
     @property
     def is_finished(self):
@@ -452,6 +724,13 @@ class Build(object):
     def is_canceled(self):
         return self._status() is BuildState.CANCELED
 
+    @property
+    def is_queued(self):
+        """
+        Whether the build has not started building on any slave yet.
+        """
+        return self._status() in (BuildState.QUEUED, BuildState.PREPARING, BuildState.PREPARED)
+
     @property
     def is_stopped(self):
         return self._status() in (BuildState.ERROR, BuildState.CANCELED)
@@ -501,6 +780,8 @@ class Build(object):
             self._create_build_artifact(timing_data)
             serialized_build_time_seconds.observe(sum(timing_data.values()))
             self._delete_temporary_build_artifact_files()
+            if Configuration['cache_atom_results']:
+                AtomResultCache().evict_least_recently_used_results()
             self._postbuild_tasks_are_finished = True
             self._state_machine.trigger(BuildEvent.POSTBUILD_TASKS_COMPLETE)
 
@@ -23,6 +23,11 @@ class BuildRequest(object):
             - This field is optional if the "config" section is specified
         [OPTIONAL] "atoms_override": ['export VAR="overridden_atom_value_1";', ...],
         [OPTIONAL] "hash": "123456789123456789123456789"
+        [OPTIONAL] "priority": 10,
+            - Builds with a higher priority are allocated slaves first. Defaults to 0.
+        [OPTIONAL] "fail_fast_after": 3,
+            - Run the atoms that failed in the most recent builds of this job first, and cancel the build once this
+              many atoms have failed. Disabled by default.
         [OPTIONAL] "config": {
             "commands" : [...],
             "atomizers" : {...},
@@ -33,6 +38,8 @@ class BuildRequest(object):
         }
     }
     """
+    DEFAULT_PRIORITY = 0
+
     def __init__(self, build_parameters):
         """
         :param build_parameters: A dictionary of request parameters
@@ -42,6 +49,16 @@ class BuildRequest(object):
         build_type = self._build_parameters.get('type')
         self._build_type = build_type.lower() if build_type else None
 
+        # The priority is only used by the master for scheduling, so it is not passed on to the project type.
+        priority = self._build_parameters.pop('priority', None)
+        self._priority = self.DEFAULT_PRIORITY if priority is None else _parse_integer(priority)
+
+        # Fail-fast mode is also handled entirely by the master.
+        fail_fast_after = self._build_parameters.pop('fail_fast_after', None)
+        self._fail_fast_after = None if fail_fast_after is None else _parse_integer(fail_fast_after)
+        self._is_valid_fail_fast_after = (fail_fast_after is None
+                                          or self._fail_fast_after is not None and self._fail_fast_after > 0)
+
     def is_valid(self):
         """
         Validate the request arguments to make sure that they have provided enough information and are valid.
@@ -52,7 +69,8 @@ class BuildRequest(object):
         if self._build_type is None:
             return False
         missing_parameters = set(self.required_parameters()) - self._build_parameters.keys()
-        return self.is_valid_type() and not missing_parameters
+        return (self.is_valid_type() and self.is_valid_priority() and self.is_valid_fail_fast_after()
+                and not missing_parameters)
 
     def is_valid_type(self):
         """
@@ -63,6 +81,20 @@ class BuildRequest(object):
             return False
         return util.get_project_type_subclass(self._build_type) is not None
 
+    def is_valid_priority(self):
+        """
+        :return: whether the priority is an integer (or was not specified)
+        :rtype: bool
+        """
+        return self._priority is not None
+
+    def is_valid_fail_fast_after(self):
+        """
+        :return: whether the fail-fast threshold is a positive integer (or was not specified)
+        :rtype: bool
+        """
+        return self._is_valid_fail_fast_after
+
     def required_parameters(self):
         """
         :return: a list of the required parameters for this type of build
@@ -80,3 +112,37 @@ class BuildRequest(object):
         :rtype: dict
         """
         return self._build_parameters
+
+    @property
+    def priority(self):
+        """
+        :return: the build priority; builds with a higher priority are allocated slaves first
+        :rtype: int
+        """
+        return self._priority if self._priority is not None else self.DEFAULT_PRIORITY
+
+    @property
+    def fail_fast_after(self):
+        """
+        :return: the number of atom failures after which the build is canceled, or None if fail-fast mode is disabled
+        :rtype: int | None
+        """
+        return self._fail_fast_after
+
+
+def _parse_integer(value):
+    """
+    Parse an integer request parameter. Unlike int(), this rejects fractional numbers instead of truncating them.
+
+    :type value: int | float | str
+    :return: the integer, or None if the value is not an integer
+    :rtype: int | None
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
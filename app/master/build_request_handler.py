@@ -17,19 +17,23 @@ class BuildRequestHandler(object):
     The request_queue is the queue of non-prepared Build instances that the BuildRequestHandler has
     yet to prepare. This queue is populated by the ClusterMaster instance.
 
-    The builds_waiting_for_slaves queue is the queue of prepared Build instances that the
-    BuildRequestHandler has completed build preparation for, and is waiting for the SlaveAllocator (a separate
-    entity) to pull Builds from.
+    The builds_waiting_for_slaves collection holds the prepared Build instances that the
+    BuildRequestHandler has completed build preparation for, and that the SlaveAllocator (a separate
+    entity) shares idle slaves between.
 
     All of the input of builds come through self.handle_build_request() calls, and all of the output
-    of builds go through self._scheduler_pool.next_prepared_build_scheduler() calls.
+    of builds go through self._scheduler_pool.build_schedulers_waiting_for_slaves() calls.
     """
-    def __init__(self, scheduler_pool):
+    def __init__(self, scheduler_pool, project_fetched_callback=None):
         """
         :type scheduler_pool: app.master.build_scheduler_pool.BuildSchedulerPool
+        :param project_fetched_callback: called with each build once its project has been fetched on the master,
+            before the project is atomized
+        :type project_fetched_callback: (app.master.build.Build) -> None | None
         """
         self._logger = get_logger(__name__)
         self._scheduler_pool = scheduler_pool
+        self._project_fetched_callback = project_fetched_callback
         self._request_queue = Queue()
         self._request_queue_worker_thread = SafeThread(
             target=self._build_preparation_loop, name='RequestHandlerLoop', daemon=True)
@@ -61,11 +65,16 @@ class BuildRequestHandler(object):
             build = self._request_queue.get()
             project_id = build.project_type.project_id()
 
-            if project_id not in self._project_preparation_locks:
-                self._logger.info('Creating project lock [{}] for build {}', project_id, str(build.build_id()))
-                self._project_preparation_locks[project_id] = Lock()
+            if build.project_type.can_prepare_builds_concurrently():
+                # Each build gets its own copy of the project, so builds of the same project need not wait for each
+                # other.
+                project_lock = None
+            else:
+                if project_id not in self._project_preparation_locks:
+                    self._logger.info('Creating project lock [{}] for build {}', project_id, str(build.build_id()))
+                    self._project_preparation_locks[project_id] = Lock()
+                project_lock = self._project_preparation_locks[project_id]
 
-            project_lock = self._project_preparation_locks[project_id]
             SafeThread(
                 target=self._prepare_build_async,
                 name='Bld{}-PreparationThread'.format(build.build_id()),
@@ -75,30 +84,44 @@ class BuildRequestHandler(object):
     def _prepare_build_async(self, build, project_lock):
         """
         :type build: app.master.build.Build
-        :type project_lock: Lock
+        :param project_lock: the lock that serializes the preparation of builds of the same project, or None if the
+            build can be prepared concurrently with other builds of its project
+        :type project_lock: Lock | None
         """
-        self._logger.info('Build {} is waiting for the project lock', build.build_id())
+        if project_lock is None:
+            self._prepare_build(build)
+            return
 
+        self._logger.info('Build {} is waiting for the project lock', build.build_id())
         with project_lock:
             self._logger.info('Build {} has acquired project lock', build.build_id())
-            analytics.record_event(analytics.BUILD_PREPARE_START, build_id=build.build_id(),
-                                   log_msg='Build preparation loop is handling request for build {build_id}.')
-            try:
-                build.prepare()
-                if not build.is_stopped:
-                    analytics.record_event(analytics.BUILD_PREPARE_FINISH, build_id=build.build_id(), is_success=True,
-                                           log_msg='Build {build_id} successfully prepared.')
-                    # If the atomizer found no work to do, perform build cleanup and skip the slave allocation.
-                    if len(build.get_subjobs()) == 0:
-                        self._logger.info('Build {} has no work to perform and is exiting.', build.build_id())
-                        build.finish()
-                    # If there is work to be done, this build must queue to be allocated slaves.
-                    else:
-                        self._logger.info('Build {} is waiting for slaves.', build.build_id())
-                        self._scheduler_pool.add_build_waiting_for_slaves(build)
-
-            except Exception as ex:  # pylint: disable=broad-except
-                if not build.is_canceled:
-                    build.mark_failed(str(ex))  # WIP(joey): Build should do this internally.
-                    self._logger.exception('Could not handle build request for build {}.'.format(build.build_id()))
-                analytics.record_event(analytics.BUILD_PREPARE_FINISH, build_id=build.build_id(), is_success=False)
+            self._prepare_build(build)
+
+    def _prepare_build(self, build):
+        """
+        :type build: app.master.build.Build
+        """
+        analytics.record_event(analytics.BUILD_PREPARE_START, build_id=build.build_id(),
+                               log_msg='Build preparation loop is handling request for build {build_id}.')
+        try:
+            build.prepare(self._project_fetched_callback)
+            if not build.is_stopped:
+                analytics.record_event(analytics.BUILD_PREPARE_FINISH, build_id=build.build_id(), is_success=True,
+                                       log_msg='Build {build_id} successfully prepared.')
+                # If the atomizer found no work to do, perform build cleanup and skip the slave allocation.
+                if len(build.get_subjobs()) == 0:
+                    self._logger.info('Build {} has no work to perform and is exiting.', build.build_id())
+                    build.finish()
+                # If there is work to be done, this build must queue to be allocated slaves.
+                else:
+                    self._logger.info('Build {} is waiting for slaves.', build.build_id())
+                    self._scheduler_pool.add_build_waiting_for_slaves(build)
+
+        except Exception as ex:  # pylint: disable=broad-except
+            if not build.is_canceled:
+                build.mark_failed(str(ex))  # WIP(joey): Build should do this internally.
+                self._logger.exception('Could not handle build request for build {}.'.format(build.build_id()))
+            analytics.record_event(analytics.BUILD_PREPARE_FINISH, build_id=build.build_id(), is_success=False)
+
+        finally:
+            build.project_type.finish_preparation()
@@ -1,9 +1,11 @@
+from collections import deque
 from queue import Empty
 from threading import Lock
 
 from app.common.metrics import ErrorType, internal_errors
 from app.master.slave import Slave, SlaveError
 from app.util import analytics
+from app.util.conf.configuration import Configuration
 from app.util.log import get_logger
 
 # pylint: disable=protected-access
@@ -40,6 +42,10 @@ class BuildScheduler(object):
         self._build_started = False
         self._num_executors_allocated = 0
         self._num_executors_in_use = 0
+        # Subjobs sent to each slave beyond the ones its executors are working on, waiting for an executor to finish.
+        # A slave takes queued subjobs in the order they were sent.
+        self._subjobs_queued_by_slave = {}  # type: Dict[Slave, Deque[Subjob]]
+        self._are_queued_subjobs_killed = False
         self._subjob_assignment_lock = Lock()  # prevents subjobs from being skipped
 
     @property
@@ -47,17 +53,112 @@ class BuildScheduler(object):
         """ :rtype: int """
         return self._build.build_id()
 
-    def needs_more_slaves(self):
+    @property
+    def priority(self):
+        """ :rtype: int """
+        return self._build.priority
+
+    @property
+    def project_id(self):
+        """ :rtype: str """
+        return self._build.project_type.project_id()
+
+    @property
+    def project_version(self):
+        """ :rtype: str | None """
+        return self._build.project_type.project_version()
+
+    @property
+    def num_executors_allocated(self):
+        """ :rtype: int """
+        return self._num_executors_allocated
+
+    def estimated_remaining_work(self):
+        """
+        Estimate how much work is left in this build's unstarted subjobs. Atoms without historic timing data are
+        counted as taking the average expected time of the build's atoms that have timing data, or one second if none
+        of them have any.
+
+        :return: the estimated serial runtime of the unstarted subjobs, in seconds
+        :rtype: float
+        """
+        unstarted_subjobs = self._build._unstarted_subjobs
+        if unstarted_subjobs is None:
+            return 0.0
+        with unstarted_subjobs.mutex:
+            subjobs = list(unstarted_subjobs.queue)
+        average_atom_time = self._average_expected_atom_time()
+        return self._expected_time_of_subjobs(subjobs, 1.0 if average_atom_time is None else average_atom_time)
+
+    def estimated_time_remaining(self):
+        """
+        Estimate how long this build will take to finish on the executors allocated to it, from the expected times of
+        the atoms in its unfinished subjobs. Subjobs that are executing are counted as if they had just started, so the
+        build tends to finish earlier than estimated. Atoms without historic timing data are counted as taking the
+        average expected time of the build's atoms that have timing data.
+
+        :return: the estimated time until the build finishes, in seconds, or None if no executors are allocated to it
+            or none of its atoms have timing data
+        :rtype: float | None
+        """
+        finished_subjobs = self._build._finished_subjobs
+        if finished_subjobs is None or self._num_executors_allocated == 0:
+            return None
+        average_atom_time = self._average_expected_atom_time()
+        if average_atom_time is None:
+            return None
+        with finished_subjobs.mutex:
+            finished_subjob_ids = {subjob.subjob_id() for subjob in finished_subjobs.queue}
+        unfinished_subjobs = [subjob for subjob in self._build.get_subjobs()
+                              if subjob.subjob_id() not in finished_subjob_ids]
+        return self._expected_time_of_subjobs(unfinished_subjobs, average_atom_time) / self._num_executors_allocated
+
+    def _average_expected_atom_time(self):
+        """
+        :return: the average expected time of the build's atoms that have historic timing data, or None if none of
+            them have any
+        :rtype: float | None
+        """
+        expected_times = [atom.expected_time for subjob in self._build.get_subjobs() for atom in subjob.atoms
+                          if atom.expected_time is not None]
+        if not expected_times:
+            return None
+        return sum(expected_times) / len(expected_times)
+
+    @staticmethod
+    def _expected_time_of_subjobs(subjobs, atom_time_without_timing_data):
+        """
+        :type subjobs: list[Subjob]
+        :param atom_time_without_timing_data: the time to count for atoms without historic timing data
+        :type atom_time_without_timing_data: float
+        :return: the expected serial runtime of the subjobs, in seconds
+        :rtype: float
+        """
+        return sum(atom_time_without_timing_data if atom.expected_time is None else atom.expected_time
+                   for subjob in subjobs for atom in subjob.atoms)
+
+    def allocated_slaves(self):
+        """
+        :return: the slaves that are allocated to this build
+        :rtype: list[Slave]
+        """
+        return list(self._slaves_allocated)
+
+    def needs_more_slaves(self, num_executors_reserved=0):
         """
         Determine whether or not this build should have more slaves allocated to it.
 
+        :param num_executors_reserved: the number of executors on slaves that are reserved for this build but not yet
+            allocated to it; they are counted as allocated
+        :type num_executors_reserved: int
         :rtype: bool
         """
-        if self._num_executors_allocated >= self._max_executors:
+        num_executors = self._num_executors_allocated + num_executors_reserved
+        if num_executors >= self._max_executors:
             return False
         if self._build._unstarted_subjobs.empty():
             return False
-        if self._num_executors_allocated >= len(self._build.get_subjobs()):
+        if num_executors >= len(self._build.get_subjobs()):
             return False
         if self._build.is_canceled:
             return False
@@ -65,10 +166,19 @@ class BuildScheduler(object):
 
     def allocate_slave(self, slave: Slave) -> bool:
         """
-        Allocate a slave to this build. This tells the slave to execute setup commands for this build.
+        Allocate a slave to this build. This leases as many of the slave's idle executors as this build can use to the
+        build and tells the slave to execute setup commands for this build. The slave's remaining idle executors can
+        be allocated to other builds.
         :param slave: The slave to allocate
-        :return: Whether slave allocation was successful; this can fail if the slave is unresponsive
+        :return: Whether slave allocation was successful; this can fail if the slave is unresponsive. Nothing is
+            allocated (which is not a failure) if the build cannot use any of the slave's idle executors.
         """
+        num_executors = min(slave.num_idle_executors(), self._max_executors_per_slave,
+                            self._max_executors - self._num_executors_allocated)
+        if num_executors <= 0:
+            self._logger.info('Build {} cannot use any idle executors of {}.', self._build.build_id(), slave)
+            return True
+
         if not self._build_started:
             self._build_started = True
             self._build.mark_started()
@@ -76,11 +186,11 @@ class BuildScheduler(object):
         # Increment executors before triggering setup. This helps make sure the build won't take down
         # every slave in the cluster if setup calls fail because of a problem with the build.
         next_executor_index = self._num_executors_allocated
-        self._num_executors_allocated += min(slave.num_executors, self._max_executors_per_slave)
+        self._num_executors_allocated += num_executors
         analytics.record_event(analytics.BUILD_SETUP_START, build_id=self._build.build_id(), slave_id=slave.id)
         self._slaves_allocated.append(slave)
 
-        return slave.setup(self._build, executor_start_index=next_executor_index)
+        return slave.setup(self._build, executor_start_index=next_executor_index, num_executors=num_executors)
 
     def begin_subjob_executions_on_slave(self, slave):
         """
@@ -90,12 +200,17 @@ class BuildScheduler(object):
         :type slave: Slave
         """
         analytics.record_event(analytics.BUILD_SETUP_FINISH, build_id=self._build.build_id(), slave_id=slave.id)
-        for slave_executor_count in range(slave.num_executors):
-            if (self._num_executors_in_use >= self._max_executors
-                    or slave_executor_count >= self._max_executors_per_slave):
+        num_executors_claimed = 0
+        for _ in range(slave.num_executors_leased(self._build.build_id())):
+            if self._num_executors_in_use >= self._max_executors:
                 break
-            slave.claim_executor()
+            slave.claim_executor(self._build.build_id())
             self._num_executors_in_use += 1
+            num_executors_claimed += 1
+
+        num_subjobs_started = self._start_subjob_batch_on_slave(slave, num_executors_claimed)
+        # The executors that did not get a subjob from the batch execute a straggling subjob or are freed.
+        for _ in range(max(0, num_executors_claimed - num_subjobs_started)):
             self.execute_next_subjob_or_free_executor(slave)
 
     def execute_next_subjob_or_free_executor(self, slave):
@@ -106,7 +221,10 @@ class BuildScheduler(object):
         :type slave: Slave
         """
         if self._build.is_canceled:
-            self._free_slave_executor(slave)
+            self.kill_queued_subjobs()
+            with self._subjob_assignment_lock:
+                if not self._record_queued_subjob_started(slave):
+                    self._free_slave_executor(slave)
             return
 
         # This lock prevents the scenario where a subjob is pulled from the queue but cannot be assigned to this
@@ -114,34 +232,247 @@ class BuildScheduler(object):
         # this method, finds the subjob queue empty, and is torn down.  If that was the last 'living' slave, the
         # build would be stuck.
         with self._subjob_assignment_lock:
+            executor_started_queued_subjob = self._record_queued_subjob_started(slave)
             try:
                 subjob = self._build._unstarted_subjobs.get(block=False)
             except Empty:
-                self._free_slave_executor(slave)
+                if executor_started_queued_subjob:
+                    return
+                straggling_subjob = self._find_straggling_subjob(slave)
+                if straggling_subjob is None:
+                    self._free_slave_executor(slave)
+                else:
+                    self._start_speculative_execution(straggling_subjob, slave)
                 return
+            if self._should_split_subjob(subjob):
+                self._build.split_subjob(subjob)
             self._logger.debug('Sending {} to {}.', subjob, slave)
             try:
-                slave.start_subjob(subjob)
-                subjob.mark_in_progress(slave)
+                is_queued = slave.start_subjob(subjob)
+                subjob.mark_in_progress(slave, is_queued=is_queued)
+                if is_queued:
+                    self._subjobs_queued_by_slave.setdefault(slave, deque()).append(subjob)
 
             except SlaveError as ex:
                 internal_errors.labels(ErrorType.SubjobWriteFailure).inc()  # pylint: disable=no-member
-                self._logger.warning('Failed to start {} on {}: {}. Requeuing subjob and freeing slave executor...',
-                                     subjob, slave, repr(ex))
-                # An executor is currently allocated for this subjob in begin_subjob_executions_on_slave.
-                # Since the slave has been marked for shutdown, we need to free the executor.
+                self._logger.warning('Failed to start {} on {}: {}. Requeuing subjob...', subjob, slave, repr(ex))
                 self._build._unstarted_subjobs.put(subjob)
-                self._free_slave_executor(slave)
+                # An executor is currently allocated for this subjob in begin_subjob_executions_on_slave. Unless it is
+                # busy with a subjob that was queued on the slave, we need to free the executor, since the slave has
+                # been marked for shutdown.
+                if not executor_started_queued_subjob:
+                    self._free_slave_executor(slave)
+
+    def _start_subjob_batch_on_slave(self, slave, num_executors):
+        """
+        Grab unstarted subjobs off the queue for the specified number of newly claimed executors and send them to the
+        slave in a single request. More subjobs than executors are sent if the subjob dispatch depth is greater than
+        one; those are queued on the slave so that its executors can start their next subjob as soon as they finish
+        one, without waiting for the master to process the previous result.
+
+        :type slave: Slave
+        :type num_executors: int
+        :return: the number of subjobs that were started on the slave
+        :rtype: int
+        """
+        if self._build.is_canceled:
+            return 0
+
+        with self._subjob_assignment_lock:
+            subjobs = []
+            while len(subjobs) < num_executors * Configuration['subjob_dispatch_depth']:
+                try:
+                    subjob = self._build._unstarted_subjobs.get(block=False)
+                except Empty:
+                    break
+                if self._should_split_subjob(subjob):
+                    self._build.split_subjob(subjob)
+                subjobs.append(subjob)
+            if len(subjobs) == 0:
+                return 0
+
+            self._logger.debug('Sending {} subjobs to {}.', len(subjobs), slave)
+            try:
+                are_subjobs_queued = slave.start_subjobs(subjobs)
+
+            except SlaveError as ex:
+                internal_errors.labels(ErrorType.SubjobWriteFailure).inc()  # pylint: disable=no-member
+                self._logger.warning('Failed to start {} subjobs on {}: {}. Requeuing subjobs...',
+                                     len(subjobs), slave, repr(ex))
+                for subjob in subjobs:
+                    self._build._unstarted_subjobs.put(subjob)
+                return 0
+
+            queued_subjobs = self._subjobs_queued_by_slave.setdefault(slave, deque())
+            for subjob, is_queued in zip(subjobs, are_subjobs_queued):
+                subjob.mark_in_progress(slave, is_queued=is_queued)
+                if is_queued:
+                    queued_subjobs.append(subjob)
+            return len(subjobs)
+
+    def _record_queued_subjob_started(self, slave):
+        """
+        Handle an executor on the slave finishing a subjob. If subjobs are queued on the slave, the executor has
+        already started the first of them, so that subjob's execution time starts counting now. The caller must hold
+        the subjob assignment lock.
+
+        :type slave: Slave
+        :return: whether the executor started a subjob that was queued on the slave (if not, it is now idle)
+        :rtype: bool
+        """
+        queued_subjobs = self._subjobs_queued_by_slave.get(slave)
+        if not queued_subjobs:
+            return False
+        queued_subjobs.popleft().mark_execution_started()
+        return True
+
+    def kill_queued_subjobs(self):
+        """
+        Tell the slaves to drop the subjobs of this canceled build that are queued on them, instead of executing them
+        before their executors can be freed. A dropped subjob still reports its (empty) results as soon as an executor
+        takes it off the slave's queue, so the executors are freed as usual. Only the first call has an effect.
+        """
+        with self._subjob_assignment_lock:
+            if self._are_queued_subjobs_killed:
+                return
+            self._are_queued_subjobs_killed = True
+            queued_subjobs = [(slave, subjob) for slave, subjobs in self._subjobs_queued_by_slave.items()
+                              for subjob in subjobs]
+
+        for slave, subjob in queued_subjobs:
+            self._logger.info('Killing {} queued on {} since the build was canceled.', subjob, slave)
+            slave.kill_subjob(subjob)
+
+    def handle_slave_disconnected(self, slave):
+        """
+        Requeue the subjobs that were queued on a slave that has disconnected. The slave had not started executing
+        them, so they are put back on the build's unstarted subjob queue to be sent to another slave.
+
+        :type slave: Slave
+        """
+        with self._subjob_assignment_lock:
+            queued_subjobs = self._subjobs_queued_by_slave.pop(slave, None)
+            if not queued_subjobs:
+                return
+            for subjob in queued_subjobs:
+                self._logger.info('Requeuing {} since {} disconnected before executing it.', subjob, slave)
+                subjob.mark_not_started()
+                self._build._unstarted_subjobs.put(subjob)
+
+        # The build's other slaves may have already freed their executors, so make sure it gets slaves again.
+        if self.needs_more_slaves():
+            self._scheduler_pool.add_build_waiting_for_slaves(self._build)
+
+    def _should_split_subjob(self, subjob):
+        """
+        Determine whether a subjob that is about to be started should first be split in two. Once the build has
+        started finishing subjobs and there are fewer unstarted subjobs left than executors working on this build,
+        some executors would sit idle while the last few large subjobs finish. Splitting the subjobs that are handed
+        out during this tail spreads the remaining work over those executors, down to a single atom per subjob.
+
+        :type subjob: app.master.subjob.Subjob
+        :rtype: bool
+        """
+        if not Configuration['tail_subjob_splitting']:
+            return False
+        if len(subjob.atoms) < 2:
+            return False
+        if self._build._num_subjobs_finished == 0:
+            return False  # Executors are still receiving their first subjobs; this is not the tail of the build.
+        return self._build._unstarted_subjobs.qsize() < self._num_executors_in_use
+
+    def cancel_duplicate_subjob_execution(self, subjob_id, finished_slave):
+        """
+        Kill the other copy of a speculatively executed subjob once one of its copies has reported results. The killed
+        copy still reports its (partial) results, which the build ignores, and its executor is then reused or freed as
+        usual.
+
+        :type subjob_id: int
+        :param finished_slave: the slave whose results were received first
+        :type finished_slave: Slave
+        """
+        subjob = self._build.subjob(subjob_id)
+        if subjob.speculative_slave is None:
+            return
+
+        losing_slave = subjob.slave if finished_slave is subjob.speculative_slave else subjob.speculative_slave
+        subjob.slave = finished_slave
+        subjob.speculative_slave = None
+        self._logger.info('{} finished {} first. Killing the duplicate execution on {}.',
+                          finished_slave, subjob, losing_slave)
+        losing_slave.kill_subjob(subjob)
+
+    def _find_straggling_subjob(self, slave):
+        """
+        Find the in-progress subjob that is running the furthest behind its expected time, if it has exceeded the
+        configured slowdown factor and is not already being speculatively executed.
+
+        :param slave: the slave with an executor that would otherwise be freed
+        :type slave: Slave
+        :rtype: app.master.subjob.Subjob | None
+        """
+        slowdown_factor = Configuration['speculative_execution_slowdown_factor']
+        if not slowdown_factor:
+            return None
+
+        straggling_subjob = None
+        max_slowdown = slowdown_factor
+        for subjob in self._build.get_subjobs():
+            # A duplicate running on the same slave as the original would likely be just as slow.
+            if subjob.speculative_slave is not None or subjob.slave is slave:
+                continue
+            slowdown = subjob.slowdown()
+            if slowdown is not None and slowdown > max_slowdown:
+                straggling_subjob = subjob
+                max_slowdown = slowdown
+
+        return straggling_subjob
+
+    def _start_speculative_execution(self, subjob, slave):
+        """
+        Start a duplicate of an in-progress subjob on the idle executor of the specified slave, or free the executor if
+        the duplicate cannot be started. A duplicate is only worth running on an executor that is actually idle, so if
+        the slave queues it behind the subjobs its executors are still working on (e.g., because the executor has not
+        finished reporting its previous subjob yet), the duplicate is killed right away. The killed duplicate still
+        reports its empty results once an executor takes it off the slave's queue; the build ignores them since the
+        slave is no longer executing the subjob, and the executor is then reused or freed as usual.
+
+        :type subjob: app.master.subjob.Subjob
+        :type slave: Slave
+        :return: whether the duplicate was started
+        :rtype: bool
+        """
+        self._logger.info('Speculatively sending straggling {} to {}.', subjob, slave)
+        # Mark before sending so that a result from the duplicate always knows which copy it is racing against.
+        subjob.mark_speculatively_in_progress(slave)
+        try:
+            is_queued = slave.start_subjob(subjob)
+        except SlaveError as ex:
+            self._logger.warning('Failed to speculatively start {} on {}: {}.', subjob, slave, repr(ex))
+            subjob.speculative_slave = None
+            self._free_slave_executor(slave)
+            return False
+
+        if is_queued:
+            self._logger.info('{} queued the duplicate of straggling {} since its executors are busy. Killing it.',
+                              slave, subjob)
+            subjob.speculative_slave = None
+            slave.kill_subjob(subjob)
+            return False
+
+        analytics.record_event(analytics.SUBJOB_SPECULATIVE_EXECUTION_START, build_id=self._build.build_id(),
+                               subjob_id=subjob.subjob_id(), slave_id=slave.id)
+        return True
 
     def _free_slave_executor(self, slave):
-        num_executors_in_use = slave.free_executor()
+        num_executors_in_use = slave.free_executor(self._build.build_id())
         if num_executors_in_use == 0:
             try:
                 self._slaves_allocated.remove(slave)
             except ValueError:
                 pass  # We have already deallocated this slave, no need to teardown
             else:
-                slave.teardown()
+                slave.teardown(self._build.build_id())
                 # If all slaves are removed from a build that isn't done, but had already started, then we must
                 # make sure that when slave resources are available again, that this build them allocated.
                 # https://github.com/box/ClusterRunner/issues/313
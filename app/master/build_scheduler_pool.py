@@ -1,7 +1,9 @@
-from queue import Queue
-from threading import Lock
+from collections import OrderedDict
+from threading import Condition, Lock
+import time
 
 from app.master.build_scheduler import BuildScheduler
+from app.util.conf.configuration import Configuration
 
 
 class BuildSchedulerPool(object):
@@ -13,7 +15,10 @@ class BuildSchedulerPool(object):
     def __init__(self):
         self._schedulers_by_build_id = {}
         self._scheduler_creation_lock = Lock()
-        self._builds_waiting_for_slaves = Queue()
+        self._schedulers_waiting_for_slaves = OrderedDict()  # build id -> scheduler, in the order they started waiting
+        self._waiting_start_times = {}  # build id -> time the build started waiting for slaves
+        self._waiting_for_slaves_condition = Condition()
+        self._build_waiting_callbacks = []  # called whenever a build starts waiting for slaves
 
     def get(self, build):
         """
@@ -29,20 +34,68 @@ class BuildSchedulerPool(object):
 
         return scheduler
 
-    def next_prepared_build_scheduler(self):
+    def add_build_waiting_callback(self, callback):
         """
-        Get the scheduler for the next build that has successfully completed build preparation.
+        Register a function to call whenever a build starts waiting for slaves.
 
-        This is a blocking call--if there are no more builds that have completed build preparation and this
-        method gets invoked, the execution will hang until the next build has completed build preparation.
+        :type callback: () -> None
+        """
+        self._build_waiting_callbacks.append(callback)
 
-        :rtype: BuildScheduler
+    def wait_for_builds_waiting_for_slaves(self):
+        """
+        Block until there is at least one build that has completed build preparation and is waiting for slaves.
+        """
+        with self._waiting_for_slaves_condition:
+            while not self._schedulers_waiting_for_slaves:
+                self._waiting_for_slaves_condition.wait()
+
+    def build_schedulers_waiting_for_slaves(self):
+        """
+        Get the schedulers for all builds that are waiting for slaves, highest effective priority first. Builds with
+        the same effective priority are in the order they started waiting.
+
+        :rtype: list[BuildScheduler]
         """
-        build = self._builds_waiting_for_slaves.get()
-        return self.get(build)
+        with self._waiting_for_slaves_condition:
+            schedulers = list(self._schedulers_waiting_for_slaves.values())
+        return sorted(schedulers, key=self.effective_priority, reverse=True)
+
+    def effective_priority(self, scheduler):
+        """
+        Get the priority of a waiting build, including aging: the priority increases by one for every
+        'build_priority_aging_interval' seconds that the build has been waiting for slaves, so that builds with a low
+        priority still make progress while builds with a higher priority keep arriving. Only builds that have not been
+        allocated any executors age; a build that is already running competes for more slaves at its own priority, so
+        that it does not outrank (and starve) the builds of the same priority that started waiting after it.
+
+        :type scheduler: BuildScheduler
+        :rtype: int
+        """
+        aging_interval = Configuration['build_priority_aging_interval']
+        waiting_start_time = self._waiting_start_times.get(scheduler.build_id)
+        if not aging_interval or waiting_start_time is None or scheduler.num_executors_allocated > 0:
+            return scheduler.priority
+        return scheduler.priority + int((time.time() - waiting_start_time) // aging_interval)
 
     def add_build_waiting_for_slaves(self, build):
         """
         :type build: app.master.build.Build
         """
-        self._builds_waiting_for_slaves.put(build)
+        scheduler = self.get(build)
+        with self._waiting_for_slaves_condition:
+            self._schedulers_waiting_for_slaves[build.build_id()] = scheduler
+            self._waiting_start_times.setdefault(build.build_id(), time.time())
+            self._waiting_for_slaves_condition.notify_all()
+        for callback in self._build_waiting_callbacks:
+            callback()
+
+    def remove_build_waiting_for_slaves(self, scheduler):
+        """
+        Stop considering a build for slave allocation, e.g., because it does not need any more slaves.
+
+        :type scheduler: BuildScheduler
+        """
+        with self._waiting_for_slaves_condition:
+            self._schedulers_waiting_for_slaves.pop(scheduler.build_id, None)
+            self._waiting_start_times.pop(scheduler.build_id, None)
@@ -1,18 +1,22 @@
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
+import math
 import os
 import sched
 from threading import Thread
+import time
 from typing import List
 
 from app.common.cluster_service import ClusterService
-from app.common.metrics import SlavesCollector
+from app.common.metrics import ClusterDemandCollector, SlavesCollector
+from app.master.autoscaler import create_autoscaler
 from app.master.build import Build, MAX_SETUP_FAILURES
 from app.master.build_request import BuildRequest
 from app.master.build_request_handler import BuildRequestHandler
 from app.master.build_scheduler_pool import BuildSchedulerPool
 from app.master.build_store import BuildStore
-from app.master.slave import Slave, SlaveRegistry
+from app.master.slave import Slave, SlaveRegistry, SlaveWarmth
 from app.master.slave_allocator import SlaveAllocator
 from app.slave.cluster_slave import SlaveState
 from app.slave.cluster_slave import ClusterSlave
@@ -35,7 +39,8 @@ class ClusterMaster(ClusterService):
         self._master_results_path = Configuration['results_directory']
         self._slave_registry = SlaveRegistry.singleton()
         self._scheduler_pool = BuildSchedulerPool()
-        self._build_request_handler = BuildRequestHandler(self._scheduler_pool)
+        self._build_request_handler = BuildRequestHandler(
+            self._scheduler_pool, project_fetched_callback=self._prefetch_project_on_idle_slaves)
         self._build_request_handler.start()
         self._slave_allocator = SlaveAllocator(self._scheduler_pool)
         self._slave_allocator.start()
@@ -51,6 +56,9 @@ class ClusterMaster(ClusterService):
         # of executors, not the time it takes to lock/unlock the executor counts or the number of
         # teardown requests. Tweak the number to find the sweet spot if you feel this is the case.
         self._thread_pool_executor = ThreadPoolExecutor(max_workers=32)
+        # Processing the result of an atom extracts its artifacts and writes to the timing database and the atom result
+        # cache, which must not block the thread that serves the API.
+        self._atom_result_executor = ThreadPoolExecutor(max_workers=8)
 
         # Asynchronously delete (but immediately rename) all old builds when master starts.
         # Remove this if/when build numbers are unique across master starts/stops
@@ -63,6 +71,9 @@ class ClusterMaster(ClusterService):
         self._hb_scheduler = sched.scheduler()
 
         SlavesCollector.register_slaves_metrics_collector(lambda: self._slave_registry.get_all_slaves_by_id().values())
+        ClusterDemandCollector.register_cluster_demand_metrics_collector(self.cluster_demand)
+
+        self._autoscaler = create_autoscaler(self)
 
     def start_heartbeat_tracker_thread(self):
         self._logger.info('Heartbeat tracker will run every {} seconds'.format(
@@ -85,6 +96,24 @@ class ClusterMaster(ClusterService):
         self._hb_scheduler.enter(self._unresponsive_slaves_cleanup_interval, 0,
                                  self._disconnect_non_heartbeating_slaves)
 
+    def start_autoscaler_thread(self):
+        """
+        Start scaling the cluster's slaves periodically with the autoscaler selected by the 'autoscaler' setting.
+        """
+        if self._autoscaler is None:
+            return
+        self._logger.info('Autoscaler will run every {} seconds'.format(Configuration['autoscaler_interval']))
+        Thread(target=self._run_autoscaler, name='AutoscalerThread', daemon=True).start()
+
+    def _run_autoscaler(self):
+        while True:
+            try:
+                self._autoscaler.scale(self.cluster_demand())
+            except Exception:  # pylint: disable=broad-except
+                # A failing autoscaler should not take down the master; it will be retried on the next interval.
+                self._logger.exception('Autoscaler failed to scale the cluster.')
+            time.sleep(Configuration['autoscaler_interval'])
+
     def _is_slave_responsive(self, slave: ClusterSlave) -> bool:
         time_since_last_heartbeat = (datetime.now() - slave.get_last_heartbeat_time()).seconds
         return time_since_last_heartbeat < self._unresponsive_slaves_cleanup_interval
@@ -126,6 +155,33 @@ class ClusterMaster(ClusterService):
         """
         return [build for build in self.get_builds() if not build.is_finished]
 
+    def cluster_demand(self):
+        """
+        Summarize the demand for executors on this master, for autoscalers:
+        - queued_builds: the number of builds that have not started building on any slave yet
+        - queued_work_seconds: the estimated serial runtime of the unstarted subjobs of the builds that are waiting for
+          slaves, from historic timing data
+        - executors_needed: the number of executors that the builds waiting for slaves need, on top of the executors
+          already allocated to them, to finish their unstarted subjobs within the 'demand_target_latency' setting
+        - idle_executors: the number of executors on connected slaves that are not leased to any build
+
+        :rtype: dict[str, int | float]
+        """
+        waiting_schedulers = [scheduler for scheduler in self._scheduler_pool.build_schedulers_waiting_for_slaves()
+                              if scheduler.needs_more_slaves()]
+        queued_work_seconds = sum(scheduler.estimated_remaining_work() for scheduler in waiting_schedulers)
+        num_executors_allocated = sum(scheduler.num_executors_allocated for scheduler in waiting_schedulers)
+        executors_needed = math.ceil(queued_work_seconds / Configuration['demand_target_latency'])
+        idle_executors = sum(slave.num_idle_executors()
+                             for slave in self._slave_registry.get_all_slaves_by_id().values()
+                             if slave.is_alive() and not slave.is_shutdown())
+        return {
+            'queued_builds': sum(1 for build in self.active_builds() if build.is_queued),
+            'queued_work_seconds': queued_work_seconds,
+            'executors_needed': max(0, executors_needed - num_executors_allocated),
+            'idle_executors': idle_executors,
+        }
+
     def connect_slave(self, slave_url, num_executors, slave_session_id=None):
         """
         Connect a slave to this master.
@@ -148,17 +204,14 @@ class ClusterMaster(ClusterService):
                                  'Removing existing slave instance from the master\'s bookkeeping.', old_slave)
             # If a slave has requested to reconnect, we have to assume that whatever build the dead slave was
             # working on no longer has valid results.
-            if old_slave.current_build_id is not None:
-                self._logger.info('{} has build [{}] running on it. Attempting to cancel build.', old_slave,
-                                  old_slave.current_build_id)
+            for build_id in old_slave.current_build_ids:
+                self._logger.info('{} has build [{}] running on it. Attempting to cancel build.', old_slave, build_id)
                 try:
-                    build = self.get_build(old_slave.current_build_id)
+                    build = self.get_build(build_id)
                     build.cancel()
-                    self._logger.info('Cancelled build {} due to dead slave {}', old_slave.current_build_id,
-                                      old_slave)
+                    self._logger.info('Cancelled build {} due to dead slave {}', build_id, old_slave)
                 except ItemNotFoundError:
-                    self._logger.info('Failed to find build {} that was running on {}', old_slave.current_build_id,
-                                      old_slave)
+                    self._logger.info('Failed to find build {} that was running on {}', build_id, old_slave)
 
         slave = Slave(slave_url, num_executors, slave_session_id)
         self._slave_registry.add_slave(slave)
@@ -167,19 +220,22 @@ class ClusterMaster(ClusterService):
                           slave_url, num_executors, slave.id)
         return {'slave_id': str(slave.id)}
 
-    def handle_slave_state_update(self, slave, new_slave_state):
+    def handle_slave_state_update(self, slave, new_slave_state, build_id=None):
         """
         Execute logic to transition the specified slave to the given state.
 
         :type slave: Slave
         :type new_slave_state: SlaveState
+        :param build_id: the build that the state change is for, if the state change is for one of the builds that
+            the slave is working on
+        :type build_id: int | None
         """
         slave_transition_functions = {
             SlaveState.DISCONNECTED: self._disconnect_slave,
             SlaveState.SHUTDOWN: self._graceful_shutdown_slave,
-            SlaveState.IDLE: self._slave_allocator.add_idle_slave,
-            SlaveState.SETUP_COMPLETED: self._handle_setup_success_on_slave,
-            SlaveState.SETUP_FAILED: self._handle_setup_failure_on_slave,
+            SlaveState.IDLE: partial(self._slave_allocator.add_idle_slave, build_id=build_id),
+            SlaveState.SETUP_COMPLETED: partial(self._handle_setup_success_on_slave, build_id=build_id),
+            SlaveState.SETUP_FAILED: partial(self._handle_setup_failure_on_slave, build_id=build_id),
         }
 
         if new_slave_state not in slave_transition_functions:
@@ -216,34 +272,87 @@ class ClusterMaster(ClusterService):
 
         :type slave: Slave
         """
+        # The builds the slave was working on stop waiting for the subjobs that were queued on it.
+        for build_id in slave.current_build_ids:
+            try:
+                build = self.get_build(build_id)
+            except ItemNotFoundError:
+                continue
+            self._scheduler_pool.get(build).handle_slave_disconnected(slave)
+        self._slave_allocator.cancel_reservation(slave)
+
         # Mark slave dead. We do not remove it from the list of all slaves. We also do not remove it from idle_slaves;
         # that will happen during slave allocation.
         slave.mark_dead()
         # todo: Fail/resend any currently executing subjobs still executing on this slave.
         self._logger.info('Slave on {} was disconnected. (id: {})', slave.url, slave.id)
 
-    def _handle_setup_success_on_slave(self, slave: Slave):
+    def _handle_setup_success_on_slave(self, slave: Slave, build_id: int=None):
         """
-        Respond to successful build setup on a slave. This starts subjob executions on the slave. This should be called
-        once after the specified slave has already run build_setup commands for the specified build.
+        Respond to successful build setup on a slave. This records the project version that the slave has set up and
+        starts subjob executions on the slave. This should be called once after the specified slave has already run
+        build_setup commands for the specified build.
+
+        :param build_id: the build that was set up; defaults to the build that was allocated to the slave first
         """
-        build = self.get_build(slave.current_build_id)
+        build = self.get_build(build_id if build_id is not None else slave.current_build_id)
+        slave.mark_project_prepared(build.project_type.project_id(), build.project_type.project_version())
         scheduler = self._scheduler_pool.get(build)
         self._thread_pool_executor.submit(scheduler.begin_subjob_executions_on_slave, slave=slave)
 
-    def _handle_setup_failure_on_slave(self, slave):
+    def _prefetch_project_on_idle_slaves(self, build: Build):
+        """
+        Tell the idle slaves to fetch the project of a build once it has been fetched on the master. Fetching the
+        project on the slaves then overlaps with the atomization of the build instead of adding to the setup time of
+        the build. Slaves that have already set up the fetched version of the project are skipped.
+        """
+        if not Configuration['prefetch_project_on_idle_slaves']:
+            return
+
+        project_id = build.project_type.project_id()
+        project_version = build.project_type.project_version()
+        if project_version is None:
+            return  # Project types that do not report their fetched version have nothing to fetch ahead of setup.
+
+        for slave in self._slave_allocator.idle_slaves():
+            if slave.is_shutdown() or not slave.is_available_for(project_id):
+                continue
+            if slave.warmth_for(project_id, project_version) != SlaveWarmth.WARM_VERSION:
+                self._thread_pool_executor.submit(slave.prefetch_project, build)
+
+    def _reserve_slaves_of_finishing_build(self, scheduler):
+        """
+        Reserve the slaves of a build that is about to finish for the builds that are waiting for slaves (see
+        SlaveAllocator.reserve_slaves_of_finishing_build()). The reserved slaves are told to fetch the project of the
+        build they are reserved for while they finish their current build, so that setting up that build right after
+        the current build is torn down is faster.
+
+        :param scheduler: the scheduler of a build that a subjob has just finished for
+        :type scheduler: app.master.build_scheduler.BuildScheduler
+        """
+        for slave, reserved_scheduler in self._slave_allocator.reserve_slaves_of_finishing_build(scheduler):
+            # Fetching a project that the slave's current build uses would change files out from under that build.
+            if reserved_scheduler.project_version is None or reserved_scheduler.project_id == scheduler.project_id:
+                continue
+            if slave.warmth_for(reserved_scheduler.project_id,
+                                reserved_scheduler.project_version) != SlaveWarmth.WARM_VERSION:
+                slave.prefetch_project(BuildStore.get(reserved_scheduler.build_id))
+
+    def _handle_setup_failure_on_slave(self, slave, build_id=None):
         """
         Respond to failed build setup on a slave. This should put the slave back into a usable state.
 
         :type slave: Slave
+        :param build_id: the build that failed to set up; defaults to the build that was allocated to the slave first
+        :type build_id: int | None
         """
-        build = self.get_build(slave.current_build_id)
+        build = self.get_build(build_id if build_id is not None else slave.current_build_id)
         build.setup_failures += 1
         if build.setup_failures >= MAX_SETUP_FAILURES:
             build.cancel()
             build.mark_failed('Setup failed on this build more than {} times. Failing the build.'
                               .format(MAX_SETUP_FAILURES))
-        slave.teardown()
+        slave.teardown(build.build_id())
 
     def handle_request_for_new_build(self, build_params):
         """
@@ -265,6 +374,10 @@ class ClusterMaster(ClusterService):
             success = True
         elif not build_request.is_valid_type():
             response = {'error': 'Invalid build request type.'}
+        elif not build_request.is_valid_priority():
+            response = {'error': 'Invalid build priority. The priority must be an integer.'}
+        elif not build_request.is_valid_fail_fast_after():
+            response = {'error': 'Invalid fail_fast_after. It must be a positive integer.'}
         else:
             required_params = build_request.required_parameters()
             response = {'error': 'Missing required parameter. Required parameters: {}'.format(required_params)}
@@ -288,7 +401,10 @@ class ClusterMaster(ClusterService):
         success, response = build.validate_update_params(update_params)
         if not success:
             return success, response
-        return build.update_state(update_params), {}
+        success = build.update_state(update_params)
+        if build.is_canceled:
+            self._thread_pool_executor.submit(self._scheduler_pool.get(build).kill_queued_subjobs)
+        return success, {}
 
     def handle_result_reported_from_slave(self, slave_url, build_id, subjob_id, payload=None):
         """
@@ -303,11 +419,47 @@ class ClusterMaster(ClusterService):
         build = BuildStore.get(int(build_id))
         slave = self._slave_registry.get_slave(slave_url=slave_url)
         try:
-            build.complete_subjob(subjob_id, payload)
+            if build.complete_subjob(subjob_id, payload, slave=slave):
+                self._atom_result_executor.submit(build.record_atom_results, subjob_id)
         finally:
             scheduler = self._scheduler_pool.get(build)
+            self._thread_pool_executor.submit(scheduler.cancel_duplicate_subjob_execution,
+                                              subjob_id=subjob_id, finished_slave=slave)
             self._thread_pool_executor.submit(scheduler.execute_next_subjob_or_free_executor,
                                               slave=slave)
+            self._thread_pool_executor.submit(self._reserve_slaves_of_finishing_build, scheduler)
+
+    def handle_atom_result_reported_from_slave(self, slave_url, build_id, subjob_id, atom_id, payload):
+        """
+        Process the result of a single atom that a slave reported as soon as the atom finished. The subjob of the atom
+        is still running; its completion is reported separately through handle_result_reported_from_slave(). The result
+        is processed on a worker thread; the slave must not report the completion of the subjob before the returned
+        future is done, so that the results of all atoms of a subjob are processed by the time it is completed.
+        :type slave_url: str
+        :type build_id: int
+        :type subjob_id: int
+        :type atom_id: int
+        :type payload: dict
+        :return: a future that is done once the result has been processed
+        :rtype: concurrent.futures.Future
+        """
+        self._logger.info('Result received from {} for atom. (Build {}, Subjob {}, Atom {})',
+                          slave_url, build_id, subjob_id, atom_id)
+        slave = self._slave_registry.get_slave(slave_url=slave_url)
+        return self._atom_result_executor.submit(self._complete_atom, build_id, subjob_id, atom_id, payload, slave)
+
+    def _complete_atom(self, build_id, subjob_id, atom_id, payload, slave):
+        """
+        :type build_id: int
+        :type subjob_id: int
+        :type atom_id: int
+        :type payload: dict
+        :type slave: Slave
+        """
+        build = self.get_build(build_id)
+        build.complete_atom(subjob_id, atom_id, payload, slave=slave)
+        if build.is_canceled:  # e.g., the atom's failure has stopped a fail-fast build
+            self._thread_pool_executor.submit(self._scheduler_pool.get(build).kill_queued_subjobs)
 
     def get_build(self, build_id):
         """
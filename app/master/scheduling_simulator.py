@@ -0,0 +1,537 @@
+import heapq
+import itertools
+import json
+from collections import defaultdict, deque
+from queue import Queue
+
+from app.master.atom import Atom
+from app.master.build_scheduler_pool import BuildSchedulerPool
+from app.master.job_config import JobConfig
+from app.master.slave import Slave
+from app.master.slave_allocator import SlaveAllocator
+from app.master.subjob import Subjob
+from app.master.subjob_calculator import group_atoms
+from app.util import analytics
+from app.util.conf.configuration import Configuration
+
+
+class BuildWorkload(object):
+    """
+    The work that one build did, as recorded in the event logs of a cluster: when the build was requested, how long it
+    took to prepare on the master and to set up on a slave, and how long each of its atoms ran.
+    """
+
+    def __init__(self, build_id, arrival_time, atom_times, prepare_time=0.0, setup_time=0.0, priority=0):
+        """
+        :type build_id: int
+        :param arrival_time: when the build was requested, in seconds since the start of the workload
+        :type arrival_time: float
+        :param atom_times: how long each atom of the build ran, in seconds
+        :type atom_times: list[float]
+        :param prepare_time: how long the master took to prepare the build, in seconds
+        :type prepare_time: float
+        :param setup_time: how long a slave took to set up the build, in seconds
+        :type setup_time: float
+        :type priority: int
+        """
+        self.build_id = build_id
+        self.arrival_time = arrival_time
+        self.atom_times = atom_times
+        self.prepare_time = prepare_time
+        self.setup_time = setup_time
+        self.priority = priority
+
+
+class SimulationResult(object):
+    """
+    The outcome of replaying a workload with one scheduling policy.
+    """
+
+    def __init__(self, makespan, mean_queue_time, mean_build_time, utilization):
+        """
+        :param makespan: the time from the first build request until the last build finished, in seconds
+        :type makespan: float
+        :param mean_queue_time: the mean time from a build request until a slave was allocated to it, in seconds
+        :type mean_queue_time: float
+        :param mean_build_time: the mean time from a build request until the build finished, in seconds
+        :type mean_build_time: float
+        :param utilization: the fraction of the cluster's executor time that was spent running atoms
+        :type utilization: float
+        """
+        self.makespan = makespan
+        self.mean_queue_time = mean_queue_time
+        self.mean_build_time = mean_build_time
+        self.utilization = utilization
+
+    def api_representation(self):
+        return {
+            'makespan': self.makespan,
+            'mean_queue_time': self.mean_queue_time,
+            'mean_build_time': self.mean_build_time,
+            'utilization': self.utilization,
+        }
+
+
+def read_events(eventlog_file):
+    """
+    Read the events recorded in an event log file (see app.util.event_log.EventLog).
+
+    :param eventlog_file: the path to the event log file
+    :type eventlog_file: str
+    :rtype: list[dict]
+    """
+    with open(eventlog_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_workloads(events):
+    """
+    Reconstruct the workload of each build from the events of a master's and its slaves' event logs. The atom times
+    come from the ATOM_START and ATOM_FINISH events, which are recorded by the slaves, so only builds that ran atoms
+    are included. The other times come from the master's events; they are 0 if the master's events are missing.
+
+    :param events: the events of all event logs of the cluster, in any order
+    :type events: list[dict]
+    :return: the workloads, in the order the builds were requested
+    :rtype: list[BuildWorkload]
+    """
+    arrival_times = {}
+    prepare_start_times, prepare_times = {}, {}
+    setup_start_times, setup_times = {}, defaultdict(list)
+    atom_start_times, atom_times = {}, defaultdict(dict)
+    first_atom_start_times = {}
+
+    for event in sorted(events, key=lambda event: event['__timestamp__']):
+        tag = event['__tag__']
+        timestamp = event['__timestamp__']
+        build_id = event.get('build_id')
+        if tag == analytics.BUILD_REQUEST_QUEUED:
+            arrival_times.setdefault(build_id, timestamp)
+        elif tag == analytics.BUILD_PREPARE_START:
+            prepare_start_times[build_id] = timestamp
+        elif tag == analytics.BUILD_PREPARE_FINISH and build_id in prepare_start_times:
+            prepare_times[build_id] = timestamp - prepare_start_times.pop(build_id)
+        elif tag == analytics.BUILD_SETUP_START:
+            setup_start_times[build_id, event['slave_id']] = timestamp
+        elif tag == analytics.BUILD_SETUP_FINISH and (build_id, event['slave_id']) in setup_start_times:
+            setup_times[build_id].append(timestamp - setup_start_times.pop((build_id, event['slave_id'])))
+        elif tag == analytics.ATOM_START:
+            atom_start_times[build_id, event['subjob_id'], event['atom_id']] = timestamp
+            first_atom_start_times.setdefault(build_id, timestamp)
+        elif tag == analytics.ATOM_FINISH and (build_id, event['subjob_id'], event['atom_id']) in atom_start_times:
+            # A speculatively executed atom runs twice; the copy that finished last overwrites the other one.
+            atom_key = (event['subjob_id'], event['atom_id'])
+            atom_times[build_id][atom_key] = timestamp - atom_start_times.pop((build_id,) + atom_key)
+
+    # Builds without a BUILD_REQUEST_QUEUED event arrive when their first atom started.
+    for build_id, timestamp in first_atom_start_times.items():
+        arrival_times.setdefault(build_id, timestamp)
+    start_of_workload = min((arrival_times.get(build_id, 0.0) for build_id in atom_times), default=0.0)
+
+    workloads = []
+    for build_id, times_by_atom_key in atom_times.items():
+        build_setup_times = setup_times.get(build_id)
+        workloads.append(BuildWorkload(
+            build_id=build_id,
+            arrival_time=arrival_times.get(build_id, start_of_workload) - start_of_workload,
+            atom_times=[times_by_atom_key[atom_key] for atom_key in sorted(times_by_atom_key)],
+            prepare_time=prepare_times.get(build_id, 0.0),
+            setup_time=sum(build_setup_times) / len(build_setup_times) if build_setup_times else 0.0,
+        ))
+    return sorted(workloads, key=lambda workload: (workload.arrival_time, workload.build_id))
+
+
+def parse_policy(policy_string):
+    """
+    Parse a scheduling policy from a comma separated list of setting=value pairs, e.g.,
+    "atom_grouping_strategy=bin_packing,subjob_dispatch_depth=2". Values are converted to the type of the setting's
+    current value.
+
+    :type policy_string: str
+    :return: the values of the settings that make up the policy
+    :rtype: dict[str, object]
+    """
+    policy = {}
+    for setting in filter(None, (setting.strip() for setting in policy_string.split(','))):
+        key, separator, value = setting.partition('=')
+        key, value = key.strip(), value.strip()
+        if not separator or key not in Configuration:
+            raise ValueError('Invalid policy setting "{}". Settings must be given as <name>=<value>, where <name> '
+                             'is one of the master\'s settings.'.format(setting))
+        current_value = Configuration[key]
+        if isinstance(current_value, bool):  # bool is a subclass of int so should be checked first
+            if value.lower() not in ('true', 'false'):
+                raise ValueError('The value for {} should be True or False, but it is "{}".'.format(key, value))
+            policy[key] = value.lower() == 'true'
+        elif isinstance(current_value, (int, float)):
+            policy[key] = type(current_value)(value)
+        else:
+            policy[key] = value
+    return policy
+
+
+class SchedulingSimulator(object):
+    """
+    Replays build workloads on a simulated cluster to compare scheduling policies offline. The simulation runs the real
+    atom groupers, BuildScheduler and SlaveAllocator on a discrete-event clock: the simulated slaves do not run
+    anything, they schedule the completion of their setup, subjobs and teardown at the times recorded in the workload.
+    A policy is a set of master settings (e.g., atom_grouping_strategy, tail_subjob_splitting, subjob_dispatch_depth or
+    slave_reservation_lead_time) that are applied for the duration of a run.
+
+    Each build gets the atoms' recorded times as historic timing data, so the groupers know the atom times exactly.
+    Every build is treated as a project of its own, so builds never wait for each other to be prepared or set up.
+    Priority aging and speculative execution measure wall-clock time and therefore have no effect in a simulation.
+    """
+
+    def __init__(self, workloads, num_slaves, num_executors_per_slave, max_executors=None, teardown_time=0.0):
+        """
+        :type workloads: list[BuildWorkload]
+        :param num_slaves: the number of slaves in the simulated cluster
+        :type num_slaves: int
+        :param num_executors_per_slave: the number of executors of each simulated slave
+        :type num_executors_per_slave: int
+        :param max_executors: the max_executors of each build's job; defaults to the number of executors in the cluster
+        :type max_executors: int | None
+        :param teardown_time: how long a slave takes to tear down a build, in seconds
+        :type teardown_time: float
+        """
+        self._workloads = workloads
+        self._num_slaves = num_slaves
+        self._num_executors_per_slave = num_executors_per_slave
+        self._max_executors = max_executors or num_slaves * num_executors_per_slave
+        self._teardown_time = teardown_time
+
+    def run(self, policy=None):
+        """
+        Replay the workloads with the specified scheduling policy.
+
+        :param policy: the values of the master settings to simulate, e.g., {'atom_grouping_strategy': 'bin_packing'}
+        :type policy: dict[str, object] | None
+        :rtype: SimulationResult
+        """
+        policy = policy or {}
+        original_values = {key: Configuration[key] for key in policy}
+        for key, value in policy.items():
+            Configuration[key] = value
+        try:
+            return _Simulation(self._workloads, self._num_slaves, self._num_executors_per_slave, self._max_executors,
+                               self._teardown_time).run()
+        finally:
+            for key, value in original_values.items():
+                Configuration[key] = value
+
+
+class _Simulation(object):
+    """
+    The state of a single run of the scheduling simulator: the simulated clock, the pending events and the master's
+    scheduling components.
+    """
+
+    def __init__(self, workloads, num_slaves, num_executors_per_slave, max_executors, teardown_time):
+        """
+        :type workloads: list[BuildWorkload]
+        :type num_slaves: int
+        :type num_executors_per_slave: int
+        :type max_executors: int
+        :type teardown_time: float
+        """
+        self.now = 0.0
+        self.teardown_time = teardown_time
+        self._events = []  # a heap of (time, sequence number, callback, args)
+        self._event_sequence = itertools.count()  # keeps events that happen at the same time in scheduling order
+        self._scheduler_pool = BuildSchedulerPool()
+        self._slave_allocator = SlaveAllocator(self._scheduler_pool)
+        self._builds = [_SimulatedBuild(self, workload, max_executors) for workload in workloads]
+        self._slaves = [_SimulatedSlave(self, 'simulated_slave_{}'.format(slave_index), num_executors_per_slave)
+                        for slave_index in range(num_slaves)]
+        self._num_executors = num_slaves * num_executors_per_slave
+        self.busy_executor_time = 0.0
+
+    def run(self):
+        """
+        :rtype: SimulationResult
+        """
+        for slave in self._slaves:
+            self._slave_allocator.add_idle_slave(slave)
+        for build in self._builds:
+            self.schedule(build.workload.arrival_time, self._prepare_build, build)
+
+        while self._events:
+            self.now, _, callback, args = heapq.heappop(self._events)
+            callback(*args)
+
+        finished_builds = [build for build in self._builds if build.finish_time is not None]
+        if len(finished_builds) < len(self._builds):
+            raise RuntimeError('The simulation stopped before builds {} finished.'.format(
+                [build.build_id() for build in self._builds if build.finish_time is None]))
+        if not finished_builds:
+            return SimulationResult(makespan=0.0, mean_queue_time=0.0, mean_build_time=0.0, utilization=0.0)
+
+        first_arrival_time = min(build.workload.arrival_time for build in finished_builds)
+        makespan = max(build.finish_time for build in finished_builds) - first_arrival_time
+        return SimulationResult(
+            makespan=makespan,
+            mean_queue_time=_mean(build.start_time - build.workload.arrival_time for build in finished_builds),
+            mean_build_time=_mean(build.finish_time - build.workload.arrival_time for build in finished_builds),
+            utilization=self.busy_executor_time / (self._num_executors * makespan) if makespan > 0 else 0.0,
+        )
+
+    def schedule(self, time, callback, *args):
+        """
+        Call a function at the specified simulated time.
+
+        :type time: float
+        :type callback: callable
+        """
+        heapq.heappush(self._events, (time, next(self._event_sequence), callback, args))
+
+    def _prepare_build(self, build):
+        """
+        :type build: _SimulatedBuild
+        """
+        self.schedule(self.now + build.workload.prepare_time, self._finish_build_preparation, build)
+
+    def _finish_build_preparation(self, build):
+        """
+        :type build: _SimulatedBuild
+        """
+        build.prepare()
+        if build.finish_time is None:
+            self._scheduler_pool.add_build_waiting_for_slaves(build)
+            self._slave_allocator.allocate_idle_slaves_nowait()
+
+    def finish_setup(self, slave, build):
+        """
+        Handle a simulated slave finishing the setup of a build, like ClusterMaster does when a slave reports it.
+
+        :type slave: _SimulatedSlave
+        :type build: _SimulatedBuild
+        """
+        slave.mark_project_prepared(build.project_type.project_id(), build.project_type.project_version())
+        self._scheduler_pool.get(build).begin_subjob_executions_on_slave(slave)
+
+    def finish_subjob(self, slave, build, subjob):
+        """
+        Handle a simulated slave reporting the result of a subjob, like ClusterMaster does when it receives a result.
+
+        :type slave: _SimulatedSlave
+        :type build: _SimulatedBuild
+        :type subjob: Subjob
+        """
+        build.complete_subjob(subjob.subjob_id())
+        scheduler = self._scheduler_pool.get(build)
+        scheduler.execute_next_subjob_or_free_executor(slave)
+        self._slave_allocator.reserve_slaves_of_finishing_build(scheduler)
+        self._slave_allocator.allocate_idle_slaves_nowait()
+
+    def finish_teardown(self, slave, build_id):
+        """
+        Handle a simulated slave becoming idle after tearing down a build.
+
+        :type slave: _SimulatedSlave
+        :type build_id: int
+        """
+        self._slave_allocator.add_idle_slave(slave, build_id)
+        self._slave_allocator.allocate_idle_slaves_nowait()
+
+
+class _SimulatedProjectType(object):
+    """
+    The parts of a ProjectType that the master's scheduling components use.
+    """
+
+    def __init__(self, build_id, job_config):
+        """
+        :type build_id: int
+        :type job_config: JobConfig
+        """
+        self._project_id = 'simulated_project_{}'.format(build_id)
+        self._job_config = job_config
+
+    def job_config(self):
+        return self._job_config
+
+    def project_id(self):
+        return self._project_id
+
+    def project_version(self):
+        return None
+
+
+class _SimulatedBuild(object):
+    """
+    The parts of a Build that the master's scheduling components use, for a build whose atoms take the times recorded
+    in its workload.
+    """
+    # pylint: disable=protected-access
+
+    def __init__(self, simulation, workload, max_executors):
+        """
+        :type simulation: _Simulation
+        :type workload: BuildWorkload
+        :type max_executors: int
+        """
+        self._simulation = simulation
+        self.workload = workload
+        job_config = JobConfig(name='simulated_job', setup_build=None, teardown_build=None, command=None,
+                               atomizer=None, max_executors=max_executors,
+                               max_executors_per_slave=JobConfig.DEFAULT_MAX_EXECUTORS)
+        self.project_type = _SimulatedProjectType(workload.build_id, job_config)
+        self.priority = workload.priority
+        self.is_canceled = False
+        self.start_time = None
+        self.finish_time = None
+        self._atom_times = {}  # atom command string -> the time the atom takes to run
+        self._all_subjobs_by_id = {}
+        self._unstarted_subjobs = None
+        self._finished_subjobs = None
+
+    def build_id(self):
+        return self.workload.build_id
+
+    def prepare(self):
+        """
+        Group the build's atoms into subjobs, using the grouper selected by the current settings.
+        """
+        atoms = []
+        for atom_index, atom_time in enumerate(self.workload.atom_times):
+            atom = Atom('simulated atom {}'.format(atom_index))
+            self._atom_times[atom.command_string] = atom_time
+            atoms.append(atom)
+
+        job_config = self.project_type.job_config()
+        grouped_atoms = group_atoms(atoms, job_config.max_executors, dict(self._atom_times), project_directory='')
+        self._unstarted_subjobs = Queue()
+        self._finished_subjobs = Queue()
+        for subjob_id, subjob_atoms in enumerate(grouped_atoms):
+            for atom_id, atom in enumerate(subjob_atoms):
+                atom.id = atom_id
+            subjob = Subjob(self.build_id(), subjob_id, self.project_type, job_config, subjob_atoms)
+            self._all_subjobs_by_id[subjob_id] = subjob
+            self._unstarted_subjobs.put(subjob)
+        if not grouped_atoms:
+            self.start_time = self.finish_time = self._simulation.now
+
+    def mark_started(self):
+        self.start_time = self._simulation.now
+
+    def get_subjobs(self):
+        return list(self._all_subjobs_by_id.values())
+
+    def subjob(self, subjob_id):
+        return self._all_subjobs_by_id[subjob_id]
+
+    def split_subjob(self, subjob):
+        new_subjob = subjob.split(new_subjob_id=len(self._all_subjobs_by_id))
+        if new_subjob is not None:
+            self._all_subjobs_by_id[new_subjob.subjob_id()] = new_subjob
+            self._unstarted_subjobs.put(new_subjob)
+        return new_subjob
+
+    def complete_subjob(self, subjob_id):
+        """
+        :type subjob_id: int
+        """
+        subjob = self.subjob(subjob_id)
+        subjob.mark_completed()
+        self._finished_subjobs.put(subjob)
+        if self._finished_subjobs.qsize() == len(self._all_subjobs_by_id):
+            self.finish_time = self._simulation.now
+
+    def subjob_time(self, subjob):
+        """
+        :type subjob: Subjob
+        :return: how long the subjob takes to run, in seconds
+        :rtype: float
+        """
+        return sum(self._atom_times[atom.command_string] for atom in subjob.atoms)
+
+    @property
+    def _num_subjobs_finished(self):
+        return self._finished_subjobs.qsize()
+
+
+class _SimulatedSlave(Slave):
+    """
+    A slave that simulates executing the work it is sent instead of talking to a slave service. Subjobs that are sent
+    to the slave beyond the executors claimed for their build are queued, and an executor that finishes a subjob starts
+    the next queued subjob of its build, like a slave service does.
+    """
+    # pylint: disable=protected-access
+
+    def __init__(self, simulation, slave_url, num_executors):
+        """
+        :type simulation: _Simulation
+        :type slave_url: str
+        :type num_executors: int
+        """
+        super().__init__(slave_url, num_executors)
+        self._simulation = simulation
+        self._builds_by_id = {}
+        self._num_subjobs_running_by_build_id = defaultdict(int)
+        self._queued_subjobs_by_build_id = defaultdict(deque)
+
+    def setup(self, build, executor_start_index, num_executors=None):
+        self._lease_executors(build, num_executors)
+        self._builds_by_id[build.build_id()] = build
+        self._simulation.schedule(self._simulation.now + build.workload.setup_time,
+                                  self._simulation.finish_setup, self, build)
+        return True
+
+    def prefetch_project(self, build):
+        pass  # Every simulated build is a project of its own, so there is nothing to fetch ahead of setup.
+
+    def teardown(self, build_id):
+        self._simulation.schedule(self._simulation.now + self._simulation.teardown_time,
+                                  self._simulation.finish_teardown, self, build_id)
+
+    def start_subjob(self, subjob):
+        return self.start_subjobs([subjob])[0]
+
+    def start_subjobs(self, subjobs):
+        are_subjobs_queued = []
+        for subjob in subjobs:
+            build_id = subjob.build_id()
+            num_executors_claimed = self._executor_leases_by_build_id[build_id].num_executors_in_use
+            if self._num_subjobs_running_by_build_id[build_id] < num_executors_claimed:
+                self._run_subjob(subjob)
+                are_subjobs_queued.append(False)
+            else:
+                self._queued_subjobs_by_build_id[build_id].append(subjob)
+                are_subjobs_queued.append(True)
+        return are_subjobs_queued
+
+    def kill_subjob(self, subjob):
+        pass  # Subjobs are only killed by speculative execution and build cancellation, which are not simulated.
+
+    def is_alive(self, use_cached=True):
+        return True
+
+    def _run_subjob(self, subjob):
+        """
+        :type subjob: Subjob
+        """
+        build = self._builds_by_id[subjob.build_id()]
+        subjob_time = build.subjob_time(subjob)
+        self._num_subjobs_running_by_build_id[subjob.build_id()] += 1
+        self._simulation.busy_executor_time += subjob_time
+        self._simulation.schedule(self._simulation.now + subjob_time, self._finish_subjob, subjob)
+
+    def _finish_subjob(self, subjob):
+        """
+        :type subjob: Subjob
+        """
+        build_id = subjob.build_id()
+        self._num_subjobs_running_by_build_id[build_id] -= 1
+        if self._queued_subjobs_by_build_id[build_id]:
+            self._run_subjob(self._queued_subjobs_by_build_id[build_id].popleft())
+        self._simulation.finish_subjob(self, self._builds_by_id[build_id], subjob)
+
+
+def _mean(values):
+    """
+    :type values: collections.Iterable[float]
+    :rtype: float
+    """
+    values = list(values)
+    return sum(values) / len(values) if values else 0.0
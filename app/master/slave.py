@@ -1,10 +1,15 @@
+from collections import OrderedDict
 from datetime import datetime
+from enum import IntEnum
 from threading import Lock
+from typing import List
 import requests
 
 from app.master.build import Build
 from app.master.subjob import Subjob
+from app.slave.cluster_slave import SubjobStartStatus
 from app.util import analytics, log
+from app.util.conf.configuration import Configuration
 from app.util.counter import Counter
 from app.util.exceptions import ItemNotFoundError
 from app.util.network import Network, RequestFailedError
@@ -27,9 +32,10 @@ class Slave:
         self.url = slave_url
         self.num_executors = num_executors
         self.id = self._slave_id_counter.increment()
-        self._num_executors_in_use = Counter()
         self._network = Network(min_connection_poolsize=num_executors)
-        self.current_build_id = None
+        self._executor_lease_lock = Lock()
+        self._executor_leases_by_build_id = OrderedDict()  # type: Dict[int, _ExecutorLease]
+        self._prepared_project_versions = {}  # type: Dict[str, Optional[str]]
         self._last_heartbeat_time = datetime.now()
         self._is_alive = True
         self._is_in_shutdown_mode = False
@@ -47,46 +53,140 @@ class Slave:
             'session_id': self._session_id,
             'num_executors': self.num_executors,
             'num_executors_in_use': self.num_executors_in_use(),
+            'num_executors_idle': self.num_idle_executors(),
             'current_build_id': self.current_build_id,
+            'current_build_ids': self.current_build_ids,
             'is_alive': self.is_alive(),
             'is_in_shutdown_mode': self._is_in_shutdown_mode,
         }
 
-    def mark_as_idle(self):
+    @property
+    def current_build_id(self):
         """
-        Do bookkeeping when this slave becomes idle.  Error if the slave cannot be idle.
-        If the slave is in shutdown mode, clear the build_id, kill the slave, and raise an error.
+        The id of the build that was allocated to this slave first, out of the builds it is currently working on.
+
+        :rtype: int | None
+        """
+        build_ids = self.current_build_ids
+        return build_ids[0] if build_ids else None
+
+    @property
+    def current_build_ids(self):
+        """
+        The ids of all builds that executors on this slave are currently leased to, in the order they were allocated.
+
+        :rtype: list[int]
+        """
+        with self._executor_lease_lock:
+            return list(self._executor_leases_by_build_id)
+
+    def mark_as_idle(self, build_id=None):
         """
-        if self._num_executors_in_use.value() != 0:
-            raise Exception('Trying to mark slave idle while {} executors still in use.',
-                            self._num_executors_in_use.value())
+        Do bookkeeping when this slave has finished tearing down a build and the executors leased to that build
+        become idle. Error if the executors cannot be idle.
+        If the slave is in shutdown mode, kill the slave and raise an error; the slave is only killed and removed from
+        the registry once it is not working on any builds.
 
-        self.current_build_id = None
+        :param build_id: the build whose executors became idle, or None if all executors on the slave are idle
+        :type build_id: int | None
+        """
+        with self._executor_lease_lock:
+            build_ids = list(self._executor_leases_by_build_id) if build_id is None else [build_id]
+            for released_build_id in build_ids:
+                lease = self._executor_leases_by_build_id.get(released_build_id)
+                if lease is not None and lease.num_executors_in_use != 0:
+                    raise Exception('Trying to mark slave idle while {} executors still in use.'.format(
+                        lease.num_executors_in_use))
+            for released_build_id in build_ids:
+                self._executor_leases_by_build_id.pop(released_build_id, None)
+            has_leases = len(self._executor_leases_by_build_id) > 0
 
         if self._is_in_shutdown_mode:
-            self.kill()
-            self._remove_slave_from_registry()
+            if not has_leases:
+                self.kill()
+                self._remove_slave_from_registry()
             raise SlaveMarkedForShutdownError
 
-    def setup(self, build: Build, executor_start_index: int) -> bool:
+    def num_idle_executors(self):
+        """
+        :return: the number of executors on this slave that are not leased to any build
+        :rtype: int
+        """
+        with self._executor_lease_lock:
+            return self._num_unleased_executors()
+
+    def num_executors_leased(self, build_id):
+        """
+        :return: the number of executors on this slave that are leased to the specified build
+        :rtype: int
+        """
+        with self._executor_lease_lock:
+            lease = self._executor_leases_by_build_id.get(build_id)
+            return lease.num_executors if lease else 0
+
+    def is_available_for(self, project_id):
+        """
+        Whether some of this slave's executors can be leased to a build of the specified project. Builds of the same
+        project are never set up on the same slave at once since they would share (and clobber) the project's
+        directory on the slave.
+
+        :param project_id: the project id of the build (see ProjectType.project_id())
+        :type project_id: str
+        :rtype: bool
+        """
+        with self._executor_lease_lock:
+            return (self._num_unleased_executors() > 0
+                    and all(lease.project_id != project_id for lease in self._executor_leases_by_build_id.values()))
+
+    def mark_project_prepared(self, project_id, project_version):
+        """
+        Record that this slave has finished setting up a build of the specified project version.
+
+        :param project_id: the project id of the build (see ProjectType.project_id())
+        :type project_id: str
+        :param project_version: the version of the project that was set up (see ProjectType.project_version())
+        :type project_version: str | None
+        """
+        self._prepared_project_versions[project_id] = project_version
+
+    def warmth_for(self, project_id, project_version):
+        """
+        How much of the setup work for a build of the specified project version this slave has already done for
+        earlier builds.
+
+        :param project_id: the project id of the build (see ProjectType.project_id())
+        :type project_id: str
+        :param project_version: the version of the project the build is for (see ProjectType.project_version())
+        :type project_version: str | None
+        :rtype: SlaveWarmth
+        """
+        if project_id not in self._prepared_project_versions:
+            return SlaveWarmth.COLD
+        if project_version is not None and self._prepared_project_versions[project_id] == project_version:
+            return SlaveWarmth.WARM_VERSION
+        return SlaveWarmth.WARM_PROJECT
+
+    def setup(self, build: Build, executor_start_index: int, num_executors: int=None) -> bool:
         """
         Execute a setup command on the slave for the specified build. The setup process executes asynchronously on the
         slave and the slave will alert the master when setup is complete and it is ready to start working on subjobs.
 
         :param build: The build to set up this slave to work on
         :param executor_start_index: The index the slave should number its executors from for this build
+        :param num_executors: The number of this slave's idle executors to lease to the build; defaults to all of them
         :return: Whether or not the call to start setup on the slave was successful
         """
-        slave_project_type_params = build.build_request.build_parameters().copy()
-        slave_project_type_params.update(build.project_type.slave_param_overrides())
+        num_executors = self._lease_executors(build, num_executors)
 
         setup_url = self._slave_api.url('build', build.build_id(), 'setup')
         post_data = {
-            'project_type_params': slave_project_type_params,
+            'project_type_params': self._slave_project_type_params(build),
             'build_executor_start_index': executor_start_index,
+            'num_executors': num_executors,
         }
+        if Configuration['reuse_build_setup']:
+            post_data['setup_cache_key'] = build.project_type.setup_cache_key()
 
-        self.current_build_id = build.build_id()
         try:
             self._network.post_with_digest(setup_url, post_data, Secret.get())
         except (requests.ConnectionError, requests.Timeout) as ex:
@@ -95,25 +195,65 @@ class Slave:
             return False
         return True
 
-    def teardown(self):
+    def _lease_executors(self, build: Build, num_executors: int=None) -> int:
         """
-        Tell the slave to run the build teardown
+        Lease idle executors of this slave to a build.
+
+        :param build: The build to lease the executors to
+        :param num_executors: The number of idle executors to lease; defaults to all of them
+        :return: The number of executors that were leased
+        """
+        with self._executor_lease_lock:
+            num_idle_executors = self._num_unleased_executors()
+            if num_executors is None:
+                num_executors = num_idle_executors
+            if not 0 < num_executors <= num_idle_executors:
+                raise Exception('Cannot lease {} executors on slave {}. {} executors are idle.'.format(
+                    num_executors, self.url, num_idle_executors))
+            self._executor_leases_by_build_id[build.build_id()] = _ExecutorLease(
+                num_executors, build.project_type.project_id())
+        return num_executors
+
+    def prefetch_project(self, build: Build):
+        """
+        Tell the slave to fetch the project of a build ahead of setup. This lets the slave download the project while
+        the build is still being prepared on the master, so that a later setup of the build on this slave is faster.
+        The slave does not report back when the prefetch is done.
+
+        :param build: The build whose project should be fetched; its project must already be fetched on the master
+        """
+        if not self.is_alive():
+            return
+
+        prefetch_url = self._slave_api.url('prefetch')
+        post_data = {'project_type_params': self._slave_project_type_params(build)}
+        try:
+            self._network.post_with_digest(prefetch_url, post_data, Secret.get())
+        except (requests.ConnectionError, requests.Timeout) as ex:
+            self._logger.warning('Prefetch call to {} failed with {}: {}.', self, ex.__class__.__name__, str(ex))
+
+    def teardown(self, build_id):
+        """
+        Tell the slave to run the build teardown for the specified build
+
+        :type build_id: int
         """
         if not self.is_alive():
             self._logger.notice('Teardown request to slave {} was not sent since slave is disconnected.', self.url)
             return
 
-        teardown_url = self._slave_api.url('build', self.current_build_id, 'teardown')
+        teardown_url = self._slave_api.url('build', build_id, 'teardown')
         try:
             self._network.post(teardown_url)
         except (requests.ConnectionError, requests.Timeout):
             self._logger.warning('Teardown request to slave failed because slave is unresponsive.')
             self.mark_dead()
 
-    def start_subjob(self, subjob: Subjob):
+    def start_subjob(self, subjob: Subjob) -> bool:
         """
         Send a subjob of a build to this slave. The slave must have already run setup for the corresponding build.
         :param subjob: The subjob to send to this slave
+        :return: Whether the slave queued the subjob because all executors leased to the build are busy
         """
         if not self.is_alive():
             raise DeadSlaveError('Tried to start a subjob on a dead slave.')
@@ -127,24 +267,96 @@ class Slave:
         except (requests.ConnectionError, requests.Timeout, RequestFailedError) as ex:
             raise SlaveCommunicationError('Call to slave service failed: {}.'.format(repr(ex))) from ex
 
-        subjob_executor_id = response.json().get('executor_id')
+        response_data = response.json()
+        subjob_executor_id = response_data.get('executor_id')
         analytics.record_event(analytics.MASTER_TRIGGERED_SUBJOB, executor_id=subjob_executor_id,
                                build_id=subjob.build_id(), subjob_id=subjob.subjob_id(), slave_id=self.id)
+        return response_data.get('status') == SubjobStartStatus.QUEUED
+
+    def start_subjobs(self, subjobs: List[Subjob]) -> List[bool]:
+        """
+        Send several subjobs of a build to this slave in a single request. The slave must have already run setup for
+        the corresponding build. Subjobs beyond the number of executors leased to the build are queued on the slave.
+        :param subjobs: The subjobs to send to this slave; they must all belong to the same build
+        :return: Whether the slave queued each subjob because all executors leased to the build are busy
+        """
+        if not self.is_alive():
+            raise DeadSlaveError('Tried to start subjobs on a dead slave.')
+        if self._is_in_shutdown_mode:
+            raise SlaveMarkedForShutdownError('Tried to start subjobs on a slave in shutdown mode.')
+
+        build_id = subjobs[0].build_id()
+        execution_url = self._slave_api.url('build', build_id, 'subjob')
+        post_data = {
+            'subjobs': [{'subjob_id': subjob.subjob_id(), 'atomic_commands': subjob.atomic_commands()}
+                        for subjob in subjobs],
+        }
+        try:
+            response = self._network.post_with_digest(execution_url, post_data, Secret.get(), error_on_failure=True)
+        except (requests.ConnectionError, requests.Timeout, RequestFailedError) as ex:
+            raise SlaveCommunicationError('Call to slave service failed: {}.'.format(repr(ex))) from ex
+
+        response_data = response.json()
+        subjob_executor_ids = response_data.get('executor_ids', [])
+        for subjob, subjob_executor_id in zip(subjobs, subjob_executor_ids):
+            analytics.record_event(analytics.MASTER_TRIGGERED_SUBJOB, executor_id=subjob_executor_id,
+                                   build_id=build_id, subjob_id=subjob.subjob_id(), slave_id=self.id)
+        statuses = response_data.get('statuses', [])
+        return [index < len(statuses) and statuses[index] == SubjobStartStatus.QUEUED
+                for index in range(len(subjobs))]
+
+    def kill_subjob(self, subjob: Subjob):
+        """
+        Tell the slave to stop executing a subjob, e.g., because a duplicate of it has already finished elsewhere.
+        The slave still reports results for the killed subjob.
+        :param subjob: The subjob to kill on this slave
+        """
+        if not self.is_alive():
+            return
+
+        kill_url = self._slave_api.url('build', subjob.build_id(), 'subjob', subjob.subjob_id(), 'kill')
+        try:
+            self._network.post_with_digest(kill_url, {}, Secret.get())
+        except (requests.ConnectionError, requests.Timeout):
+            self._logger.warning('Request to kill {} on {} failed because slave is unresponsive.', subjob, self)
 
     def num_executors_in_use(self):
-        return self._num_executors_in_use.value()
+        with self._executor_lease_lock:
+            return sum(lease.num_executors_in_use for lease in self._executor_leases_by_build_id.values())
+
+    def claim_executor(self, build_id):
+        """
+        Claim one of the executors leased to the specified build.
 
-    def claim_executor(self):
-        new_count = self._num_executors_in_use.increment()
-        if new_count > self.num_executors:
-            raise Exception('Cannot claim executor on slave {}. No executors left.'.format(self.url))
-        return new_count
+        :type build_id: int
+        :return: the number of executors leased to the build that are now in use
+        :rtype: int
+        """
+        with self._executor_lease_lock:
+            lease = self._executor_leases_by_build_id.get(build_id)
+            if lease is None or lease.num_executors_in_use >= lease.num_executors:
+                raise Exception('Cannot claim executor on slave {} for build {}. No executors left.'.format(
+                    self.url, build_id))
+            lease.num_executors_in_use += 1
+            return lease.num_executors_in_use
 
-    def free_executor(self):
-        new_count = self._num_executors_in_use.decrement()
-        if new_count < 0:
-            raise Exception('Cannot free executor on slave {}. All are free.'.format(self.url))
-        return new_count
+    def free_executor(self, build_id):
+        """
+        Free one of the executors leased to the specified build.
+
+        :type build_id: int
+        :return: the number of executors leased to the build that are still in use
+        :rtype: int
+        """
+        with self._executor_lease_lock:
+            lease = self._executor_leases_by_build_id.get(build_id)
+            if lease is None:
+                return 0  # The lease was already dropped because the slave was marked dead.
+            if lease.num_executors_in_use <= 0:
+                raise Exception('Cannot free executor on slave {} for build {}. All are free.'.format(
+                    self.url, build_id))
+            lease.num_executors_in_use -= 1
+            return lease.num_executors_in_use
 
     def is_alive(self, use_cached: bool=True) -> bool:
         """
@@ -222,11 +434,29 @@ class Slave:
         """
         Mark the slave dead.
         """
-        self._logger.warning('{} has gone offline. Last build: {}', self, self.current_build_id)
+        self._logger.warning('{} has gone offline. Last builds: {}', self, self.current_build_ids)
         self._is_alive = False
-        self.current_build_id = None
+        with self._executor_lease_lock:
+            self._executor_leases_by_build_id.clear()
         self._network.reset_session()  # Close any pooled connections for this slave.
 
+    def _num_unleased_executors(self):
+        """
+        The caller must hold the executor lease lock.
+
+        :rtype: int
+        """
+        return self.num_executors - sum(lease.num_executors for lease in self._executor_leases_by_build_id.values())
+
+    def _slave_project_type_params(self, build):
+        """
+        :return: the parameters that define the project_type of the specified build on this slave
+        :rtype: dict
+        """
+        slave_project_type_params = build.build_request.build_parameters().copy()
+        slave_project_type_params.update(build.project_type.slave_param_overrides())
+        return slave_project_type_params
+
     def _expected_session_header(self):
         """
         Return headers that should be sent with slave requests to verify that the master is still talking to
@@ -322,6 +552,29 @@ class SlaveRegistry(Singleton):
         return self._all_slaves_by_url
 
 
+class _ExecutorLease(object):
+    """
+    The executors of a slave that are leased to a single build.
+    """
+    def __init__(self, num_executors, project_id):
+        """
+        :type num_executors: int
+        :type project_id: str
+        """
+        self.num_executors = num_executors
+        self.project_id = project_id
+        self.num_executors_in_use = 0
+
+
+class SlaveWarmth(IntEnum):
+    """
+    How much of the setup work for a build a slave has already done for earlier builds. Warmer slaves compare greater.
+    """
+    COLD = 0  # The slave has not set up the build's project.
+    WARM_PROJECT = 1  # The slave has set up a different version of the build's project.
+    WARM_VERSION = 2  # The slave has set up the same version of the build's project.
+
+
 class SlaveError(Exception):
     """A generic slave error occurred."""
 
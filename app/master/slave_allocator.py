@@ -1,8 +1,13 @@
+from queue import Empty
+from threading import Lock
+
+from app.common.metrics import slave_allocations
+from app.util.conf.configuration import Configuration
 from app.util.log import get_logger
 from app.util.ordered_set_queue import OrderedSetQueue
 from app.util.safe_thread import SafeThread
 
-from app.master.slave import SlaveMarkedForShutdownError
+from app.master.slave import SlaveMarkedForShutdownError, SlaveWarmth
 
 
 class SlaveAllocator(object):
@@ -17,6 +22,13 @@ class SlaveAllocator(object):
         self._logger = get_logger(__name__)
         self._scheduler_pool = scheduler_pool
         self._idle_slaves = OrderedSetQueue()
+        # Slaves of builds that are about to finish, reserved for the builds waiting for slaves
+        self._reserved_build_schedulers_by_slave = {}  # type: Dict[Slave, BuildScheduler]
+        self._reservation_lock = Lock()
+        # Slaves working on other builds whose idle executors no waiting build could use when they were last offered
+        self._slaves_with_unused_executors = set()
+        self._unused_executors_lock = Lock()
+        scheduler_pool.add_build_waiting_callback(self._offer_slaves_with_unused_executors)
         self._allocation_thread = SafeThread(
             target=self._slave_allocation_loop, name='SlaveAllocationLoop', daemon=True)
 
@@ -31,39 +43,297 @@ class SlaveAllocator(object):
 
     def _slave_allocation_loop(self):
         """
-        Builds wait in line for more slaves. This method executes in the background on another thread and
-        watches for idle slaves, then gives them out to the waiting builds.
+        Builds wait for more slaves. This method executes in the background on another thread and watches for slaves
+        with idle executors, then shares them out between all of the waiting builds so that a large build cannot
+        starve the builds that are waiting behind it. A slave's executors are leased to builds individually, so a
+        slave whose idle executors are not all used by one build is offered to the other waiting builds as well.
         """
         while True:
             # This is a blocking call that will block until there is a prepared build.
-            build_scheduler = self._scheduler_pool.next_prepared_build_scheduler()
+            self._scheduler_pool.wait_for_builds_waiting_for_slaves()
+            claimed_slave = self._idle_slaves.get()
+            self._allocate_claimed_slave(claimed_slave)
+
+    def allocate_idle_slaves_nowait(self):
+        """
+        Share out the slaves that are currently in the idle queue between the builds waiting for slaves, without
+        blocking. This does the same as the allocation loop, but on the calling thread, for callers that drive slave
+        allocation themselves instead of starting the allocation loop (e.g., the scheduling simulator). It returns once
+        no waiting build can be allocated any of the idle slaves.
+        """
+        offered_slaves = set()
+        while len(self._scheduler_pool.build_schedulers_waiting_for_slaves()) > 0:
+            try:
+                # Take the slaves that have not been offered since the last allocation first.
+                claimed_slave = self._idle_slaves.get_max_nowait(key=lambda slave: slave not in offered_slaves)
+            except Empty:
+                return
+            if claimed_slave in offered_slaves:
+                self._idle_slaves.put(claimed_slave)
+                return
+            offered_slaves.add(claimed_slave)
+            if self._allocate_claimed_slave(claimed_slave):
+                offered_slaves.clear()
+
+    def _allocate_claimed_slave(self, claimed_slave):
+        """
+        Allocate a slave that was taken off the idle queue to the waiting build that should get it next. If the slave
+        still has idle executors afterwards, it goes back to the idle queue to be offered to the other waiting builds.
+
+        :param claimed_slave: the slave that was taken off the idle queue
+        :type claimed_slave: app.master.slave.Slave
+        :return: whether the slave (or a warmer idle slave in its place) was allocated to a build
+        :rtype: bool
+        """
+        reserved_build_scheduler = self._pop_reservation(claimed_slave)
+
+        # Remove dead and shutdown slaves from the idle queue
+        if claimed_slave.is_shutdown() or not claimed_slave.is_alive(use_cached=False):
+            return False
+
+        # Builds may have been added or completed while we were waiting for an idle slave, so choose the build now.
+        build_scheduler = self._next_build_scheduler_to_allocate(claimed_slave, reserved_build_scheduler)
+        if build_scheduler is None:
+            if claimed_slave.current_build_id is None:
+                self.add_idle_slave(claimed_slave)
+            elif claimed_slave.num_idle_executors() > 0:
+                # Offer the slave's idle executors again once another build starts waiting for slaves. Keeping the
+                # slave in the idle queue instead would make the allocation loop spin while no build can use it.
+                with self._unused_executors_lock:
+                    self._slaves_with_unused_executors.add(claimed_slave)
+            return False
+
+        # Another idle slave may have already set up the build's project, which makes setting it up faster.
+        claimed_slave = self._warmest_idle_slave_for(build_scheduler, claimed_slave)
+        warmth = claimed_slave.warmth_for(build_scheduler.project_id, build_scheduler.project_version)
+        slave_allocations.labels(warmth.name.lower()).inc()  # pylint: disable=no-member
+
+        # Potential race condition here!  If the build completes after needs_more_slaves() is checked,
+        # a slave will be allocated needlessly (and run slave.setup(), which can be significant work).
+        self._logger.info('Allocating {} to build {} ({}).', claimed_slave, build_scheduler.build_id, warmth.name)
+        if build_scheduler.allocate_slave(claimed_slave) and claimed_slave.num_idle_executors() > 0:
+            self._idle_slaves.put(claimed_slave)
+        return True
+
+    def _next_build_scheduler_to_allocate(self, slave, reserved_build_scheduler=None):
+        """
+        Choose which of the waiting builds gets the idle executors of the next slave. Only the builds with the highest
+        effective priority that the slave is available for are considered. If the slave was reserved for one of those
+        builds, that build is chosen. Otherwise slaves are shared using weighted fair sharing: each build's fair share
+        of executors is proportional to its estimated remaining work, and the build that has the fewest executors
+        allocated relative to its share goes first. Builds that have not been allocated any slaves yet therefore go
+        before all others, in the order they started waiting. Builds that do not need any more slaves stop waiting.
+
+        :type slave: app.master.slave.Slave
+        :param reserved_build_scheduler: the scheduler of the build the slave was reserved for, if any
+        :type reserved_build_scheduler: app.master.build_scheduler.BuildScheduler | None
+        :return: the scheduler of the build to allocate the slave to, or None if no build needs more slaves
+        :rtype: app.master.build_scheduler.BuildScheduler | None
+        """
+        schedulers_needing_slaves = []
+        for build_scheduler in self._scheduler_pool.build_schedulers_waiting_for_slaves():
+            if not build_scheduler.needs_more_slaves():
+                self._scheduler_pool.remove_build_waiting_for_slaves(build_scheduler)
+                self._cancel_reservations_for_build(build_scheduler)
+                self._logger.info('Done allocating slaves for build {}.', build_scheduler.build_id)
+            elif slave.is_available_for(build_scheduler.project_id):
+                schedulers_needing_slaves.append(build_scheduler)
+
+        if len(schedulers_needing_slaves) == 0:
+            return None
+
+        highest_priority_schedulers = self._highest_priority_build_schedulers(schedulers_needing_slaves)
+        if reserved_build_scheduler in highest_priority_schedulers:
+            return reserved_build_scheduler
+        return min(highest_priority_schedulers, key=_executors_allocated_per_remaining_work)
+
+    def _highest_priority_build_schedulers(self, build_schedulers):
+        """
+        :type build_schedulers: list[app.master.build_scheduler.BuildScheduler]
+        :return: the schedulers of the builds with the highest effective priority, in their original order
+        :rtype: list[app.master.build_scheduler.BuildScheduler]
+        """
+        effective_priorities = [self._scheduler_pool.effective_priority(build_scheduler)
+                                for build_scheduler in build_schedulers]
+        highest_priority = max(effective_priorities)
+        return [build_scheduler for build_scheduler, priority in zip(build_schedulers, effective_priorities)
+                if priority == highest_priority]
 
-            while build_scheduler.needs_more_slaves():
-                claimed_slave = self._idle_slaves.get()
+    def reserve_slaves_of_finishing_build(self, finishing_build_scheduler):
+        """
+        Reserve the slaves of a build that is expected to finish within the 'slave_reservation_lead_time' setting for
+        the builds that are waiting for slaves. A reserved slave is allocated to the build it is reserved for as soon
+        as it becomes idle, unless a build with a higher effective priority has started waiting in the meantime. Only
+        slaves that are working on nothing but the finishing build are reserved, since only those become completely
+        idle when it finishes. The waiting builds are chosen the same way idle slaves are shared between them.
 
-                # Remove dead and shutdown slaves from the idle queue
-                if claimed_slave.is_shutdown() or not claimed_slave.is_alive(use_cached=False):
+        :param finishing_build_scheduler: the scheduler of a build that is running on slaves
+        :type finishing_build_scheduler: app.master.build_scheduler.BuildScheduler
+        :return: the slaves that were newly reserved, with the schedulers of the builds they are reserved for
+        :rtype: list[(app.master.slave.Slave, app.master.build_scheduler.BuildScheduler)]
+        """
+        lead_time = Configuration['slave_reservation_lead_time']
+        if lead_time <= 0:
+            return []
+        time_remaining = finishing_build_scheduler.estimated_time_remaining()
+        if time_remaining is None or time_remaining > lead_time:
+            return []
+
+        new_reservations = []
+        with self._reservation_lock:
+            self._remove_stale_reservations()
+            for slave in finishing_build_scheduler.allocated_slaves():
+                if (slave in self._reserved_build_schedulers_by_slave or slave.is_shutdown()
+                        or slave.current_build_ids != [finishing_build_scheduler.build_id]):
                     continue
+                build_scheduler = self._next_build_scheduler_to_reserve(finishing_build_scheduler)
+                if build_scheduler is None:
+                    break
+                self._logger.info('Reserving {} for build {}; build {} is expected to finish in {:.0f} seconds.',
+                                  slave, build_scheduler.build_id, finishing_build_scheduler.build_id, time_remaining)
+                self._reserved_build_schedulers_by_slave[slave] = build_scheduler
+                new_reservations.append((slave, build_scheduler))
+        return new_reservations
+
+    def _next_build_scheduler_to_reserve(self, finishing_build_scheduler):
+        """
+        Choose which of the waiting builds the next slave of a finishing build is reserved for. Builds that would not
+        need more slaves if the slaves already reserved for them were allocated are skipped. Must be called while
+        holding the reservation lock.
 
-                # The build may have completed while we were waiting for an idle slave, so check one more time.
-                if build_scheduler.needs_more_slaves():
-                    # Potential race condition here!  If the build completes after the if statement is checked,
-                    # a slave will be allocated needlessly (and run slave.setup(), which can be significant work).
-                    self._logger.info('Allocating {} to build {}.', claimed_slave, build_scheduler.build_id)
-                    build_scheduler.allocate_slave(claimed_slave)
-                else:
-                    self.add_idle_slave(claimed_slave)
+        :type finishing_build_scheduler: app.master.build_scheduler.BuildScheduler
+        :return: the scheduler of the build to reserve the slave for, or None if no waiting build needs more slaves
+        :rtype: app.master.build_scheduler.BuildScheduler | None
+        """
+        num_executors_reserved_by_build_id = {}
+        for slave, build_scheduler in self._reserved_build_schedulers_by_slave.items():
+            num_executors_reserved_by_build_id[build_scheduler.build_id] = (
+                num_executors_reserved_by_build_id.get(build_scheduler.build_id, 0) + slave.num_executors)
 
-            self._logger.info('Done allocating slaves for build {}.', build_scheduler.build_id)
+        schedulers_needing_slaves = [
+            build_scheduler for build_scheduler in self._scheduler_pool.build_schedulers_waiting_for_slaves()
+            if build_scheduler is not finishing_build_scheduler
+            and build_scheduler.needs_more_slaves(num_executors_reserved_by_build_id.get(build_scheduler.build_id, 0))
+        ]
+        if len(schedulers_needing_slaves) == 0:
+            return None
+        return min(self._highest_priority_build_schedulers(schedulers_needing_slaves),
+                   key=_executors_allocated_per_remaining_work)
+
+    def _remove_stale_reservations(self):
+        """
+        Remove the reservations of slaves that have gone offline or been put in shutdown mode, and of builds that are
+        no longer waiting for slaves or do not need any more slaves (e.g., because they were canceled). Must be called
+        while holding the reservation lock.
+        """
+        waiting_build_schedulers = self._scheduler_pool.build_schedulers_waiting_for_slaves()
+        for slave, build_scheduler in list(self._reserved_build_schedulers_by_slave.items()):
+            if (slave.is_shutdown() or not slave.is_alive() or build_scheduler not in waiting_build_schedulers
+                    or not build_scheduler.needs_more_slaves()):
+                del self._reserved_build_schedulers_by_slave[slave]
 
-    def add_idle_slave(self, slave):
+    def _cancel_reservations_for_build(self, build_scheduler):
+        """
+        :param build_scheduler: the scheduler of a build that has stopped waiting for slaves
+        :type build_scheduler: app.master.build_scheduler.BuildScheduler
+        """
+        with self._reservation_lock:
+            for slave, reserved_build_scheduler in list(self._reserved_build_schedulers_by_slave.items()):
+                if reserved_build_scheduler is build_scheduler:
+                    del self._reserved_build_schedulers_by_slave[slave]
+
+    def cancel_reservation(self, slave):
+        """
+        Remove the reservation of a slave, if it is reserved for a build, e.g., because the slave has disconnected.
+
+        :type slave: app.master.slave.Slave
+        """
+        self._pop_reservation(slave)
+
+    def _pop_reservation(self, slave):
+        """
+        :type slave: app.master.slave.Slave
+        :return: the scheduler of the build the slave was reserved for, or None if it was not reserved
+        :rtype: app.master.build_scheduler.BuildScheduler | None
+        """
+        with self._reservation_lock:
+            return self._reserved_build_schedulers_by_slave.pop(slave, None)
+
+    def _warmest_idle_slave_for(self, build_scheduler, claimed_slave):
+        """
+        Choose the idle slave that has already done the most setup work for the build, preferring a slave that has set
+        up the same version of the build's project over one that has only set up the project. If no other idle slave is
+        warmer than the claimed slave, the claimed slave is chosen. The slave that is not chosen goes back to the idle
+        queue.
+
+        :type build_scheduler: app.master.build_scheduler.BuildScheduler
+        :param claimed_slave: the idle slave that was taken off the idle queue for the build
+        :type claimed_slave: app.master.slave.Slave
+        :rtype: app.master.slave.Slave
+        """
+        def warmth(slave):
+            if not slave.is_available_for(build_scheduler.project_id):
+                return -1
+            return slave.warmth_for(build_scheduler.project_id, build_scheduler.project_version)
+
+        claimed_slave_warmth = warmth(claimed_slave)
+        if claimed_slave_warmth == SlaveWarmth.WARM_VERSION:
+            return claimed_slave
+        try:
+            warmest_slave = self._idle_slaves.get_max_nowait(key=warmth)
+        except Empty:
+            return claimed_slave
+
+        if warmth(warmest_slave) <= claimed_slave_warmth:
+            self._idle_slaves.put(warmest_slave)
+            return claimed_slave
+        if warmest_slave.is_shutdown() or not warmest_slave.is_alive(use_cached=False):
+            return claimed_slave  # Dead and shutdown slaves are removed from the idle queue.
+
+        self._idle_slaves.put(claimed_slave)
+        return warmest_slave
+
+    def _offer_slaves_with_unused_executors(self):
+        """
+        Put the slaves that are working on other builds but have idle executors that no waiting build could use back
+        on the idle queue, since the build that just started waiting for slaves may be able to use them.
+        """
+        with self._unused_executors_lock:
+            slaves = list(self._slaves_with_unused_executors)
+            self._slaves_with_unused_executors.clear()
+        for slave in slaves:
+            self._idle_slaves.put(slave)
+
+    def idle_slaves(self):
+        """
+        :return: the slaves that are currently waiting in the idle queue to be allocated to a build
+        :rtype: list[app.master.slave.Slave]
+        """
+        with self._idle_slaves.mutex:
+            return list(self._idle_slaves.queue)
+
+    def add_idle_slave(self, slave, build_id=None):
         """
         Add a slave to the idle queue.
 
         :type slave: Slave
+        :param build_id: the build whose executors on the slave became idle, or None if all of its executors are idle
+        :type build_id: int | None
         """
+        with self._unused_executors_lock:
+            self._slaves_with_unused_executors.discard(slave)
         try:
-            slave.mark_as_idle()
+            slave.mark_as_idle(build_id)
             self._idle_slaves.put(slave)
         except SlaveMarkedForShutdownError:
             pass
+
+
+def _executors_allocated_per_remaining_work(build_scheduler):
+    """
+    :type build_scheduler: app.master.build_scheduler.BuildScheduler
+    :rtype: float
+    """
+    if build_scheduler.num_executors_allocated == 0:
+        return 0.0
+    return build_scheduler.num_executors_allocated / max(build_scheduler.estimated_remaining_work(), 1.0)
@@ -1,4 +1,5 @@
 import os
+import time
 from typing import List
 
 from app.common.build_artifact import BuildArtifact
@@ -33,6 +34,8 @@ class Subjob(object):
         self._set_atom_state(AtomState.NOT_STARTED)
         self.timings = {}  # a dict, atom_ids are the keys and seconds are the values
         self.slave = None  # The slave that had been assigned this subjob. Is None if not started.
+        self.speculative_slave = None  # The slave running a duplicate of this subjob, if speculatively executed.
+        self._start_time = None  # When the slave started executing this subjob. Is None while it is queued.
 
     def __str__(self):
         return '<subjob {} of build {}>'.format(self._subjob_id, self._build_id)
@@ -58,15 +61,79 @@ class Subjob(object):
         for atom in self._atoms:
             atom.state = state
 
-    def mark_in_progress(self, slave):
+    def mark_in_progress(self, slave, is_queued=False):
         """
         Mark the subjob IN_PROGRESS, which marks the state of all the atoms of the subjob IN_PROGRESS.
 
         :param slave: the slave node that has been assigned this subjob.
         :type slave: Slave
+        :param is_queued: whether the slave queued the subjob behind the subjobs its executors are working on; if so,
+            the subjob only starts executing when mark_execution_started() is called
+        :type is_queued: bool
         """
         self._set_atom_state(AtomState.IN_PROGRESS)
         self.slave = slave
+        self._start_time = None if is_queued else time.time()
+
+    def mark_execution_started(self):
+        """
+        Record that the slave has started executing this subjob after it was queued on the slave.
+        """
+        self._start_time = time.time()
+
+    def mark_not_started(self):
+        """
+        Mark the subjob NOT_STARTED again, e.g., because the slave it was queued on disconnected before executing it.
+        """
+        self._set_atom_state(AtomState.NOT_STARTED)
+        self.slave = None
+        self._start_time = None
+
+    def mark_speculatively_in_progress(self, slave):
+        """
+        Record that a duplicate of this in-progress subjob has been started on another slave. The first of the two
+        copies to report results completes the subjob.
+
+        :param slave: the slave node that is executing the duplicate of this subjob.
+        :type slave: Slave
+        """
+        self.speculative_slave = slave
+
+    def is_executed_by(self, slave):
+        """
+        :param slave: the slave node that reported results for this subjob
+        :type slave: Slave
+        :return: whether the slave was assigned this subjob or is executing a speculative duplicate of it
+        :rtype: bool
+        """
+        return slave is not None and (slave is self.slave or slave is self.speculative_slave)
+
+    def is_in_progress(self):
+        """
+        :rtype: bool
+        """
+        return all(atom.state is AtomState.IN_PROGRESS for atom in self._atoms)
+
+    def is_completed(self):
+        """
+        :rtype: bool
+        """
+        return all(atom.state is AtomState.COMPLETED for atom in self._atoms)
+
+    def slowdown(self):
+        """
+        How many times longer than its expected time this subjob has been running so far.
+
+        :return: the ratio of elapsed time to expected time, or None if the subjob is not in progress, is still queued
+            on its slave or some of its atoms have no expected time
+        :rtype: float | None
+        """
+        if not self.is_in_progress() or self._start_time is None:
+            return None
+        expected_times = [atom.expected_time for atom in self._atoms]
+        if None in expected_times or sum(expected_times) <= 0:
+            return None
+        return (time.time() - self._start_time) / sum(expected_times)
 
     def mark_completed(self):
         """
@@ -74,6 +141,56 @@ class Subjob(object):
         """
         self._set_atom_state(AtomState.COMPLETED)
 
+    def split(self, new_subjob_id):
+        """
+        Split this subjob into two subjobs of roughly equal expected time. This subjob keeps the first part of its
+        atoms and a new subjob with the given id is created for the remaining atoms. Since each atom's artifact
+        directory is derived from its subjob id and atom id, this must only be called before the subjob has started.
+
+        :param new_subjob_id: the id for the subjob that takes over the remaining atoms
+        :type new_subjob_id: int
+        :return: the new subjob, or None if this subjob has too few atoms to be split
+        :rtype: Subjob | None
+        """
+        if len(self._atoms) < 2:
+            return None
+
+        # Atoms without timing data are all given the same weight, which splits them evenly by count. A recorded time
+        # of 0.0 is real timing data, so it is kept.
+        atom_times = [1.0 if atom.expected_time is None else atom.expected_time for atom in self._atoms]
+        half_of_total_time = sum(atom_times) / 2
+        split_index = 1
+        time_so_far = atom_times[0]
+        while split_index < len(self._atoms) - 1 and time_so_far + atom_times[split_index] <= half_of_total_time:
+            time_so_far += atom_times[split_index]
+            split_index += 1
+
+        remaining_atoms = self._atoms[split_index:]
+        self._atoms = self._atoms[:split_index]
+        # The atoms that stay in this subjob keep their ids; the ids of the moved atoms must start from 0 again.
+        for atom_id, atom in enumerate(remaining_atoms):
+            atom.id = atom_id
+
+        return Subjob(self._build_id, new_subjob_id, self._project_type, self.job_config, remaining_atoms)
+
+    def split_off_atoms(self, atoms, new_subjob_id):
+        """
+        Move the given atoms of this subjob into a new subjob with the given id. Like split(), this must only be called
+        before the subjob has started, since the ids of the atoms in both subjobs are renumbered from 0.
+
+        :param atoms: the atoms to move; they must be a subset of this subjob's atoms
+        :type atoms: list[app.master.atom.Atom]
+        :type new_subjob_id: int
+        :rtype: Subjob
+        """
+        self._atoms = [atom for atom in self._atoms if atom not in atoms]
+        for atom_id, atom in enumerate(self._atoms):
+            atom.id = atom_id
+        for atom_id, atom in enumerate(atoms):
+            atom.id = atom_id
+
+        return Subjob(self._build_id, new_subjob_id, self._project_type, self.job_config, atoms)
+
     def api_representation(self):
         """
         :rtype: dict [str, str]
@@ -137,7 +254,8 @@ class Subjob(object):
     def read_timings(self):
         """
         The timing data for each atom should be stored in the atom directory.  Parse them, associate
-        them with their atoms, and return them.
+        them with their atoms, and return them. The timings of atoms whose results were restored from the atom result
+        cache are not returned, since they are not new measurements.
         :rtype: dict [str, float]
         """
         timings = {}
@@ -152,7 +270,8 @@ class Subjob(object):
             if os.path.exists(timings_file_path):
                 with open(timings_file_path, 'r') as f:
                     atom.actual_time = float(f.readline())
-                    timings[atom.command_string] = atom.actual_time
+                    if not atom.is_result_cached:
+                        timings[atom.command_string] = atom.actual_time
             else:
                 self._logger.warning('No timing data for subjob {} atom {}.',
                                      self._subjob_id, atom_id)
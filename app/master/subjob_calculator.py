@@ -1,16 +1,29 @@
 import json
 import os
 
+from app.common.build_artifact import BuildArtifact
+from app.common.timing_data_store import TimingDataStore
 from app.master.atom import Atom
 from app.master.atom_grouper import AtomGrouper
+from app.master.atom_result_cache import AtomResultCache
+from app.master.bin_packing_atom_grouper import BinPackingAtomGrouper
 from app.master.subjob import Subjob
 from app.master.time_based_atom_grouper import TimeBasedAtomGrouper
 from app.util import log
+from app.util.conf.configuration import Configuration
+
+
+# The groupers that can be selected via the 'atom_grouping_strategy' setting when historic timing data is available.
+_TIMING_DATA_GROUPERS_BY_STRATEGY = {
+    'time_based': TimeBasedAtomGrouper,
+    'bin_packing': BinPackingAtomGrouper,
+}
 
 
 def compute_subjobs_for_build(build_id, job_config, project_type):
     """
-    Calculate subjobs for a build.
+    Calculate subjobs for a build. If atom result caching is enabled, the atoms with a cached result are put into one
+    additional subjob that is already completed, and their cached results are copied into the build's results.
     :type build_id: int
     :type job_config: JobConfig
     :param project_type: the project_type that the build is running in
@@ -25,14 +38,20 @@ def compute_subjobs_for_build(build_id, job_config, project_type):
     else:
         atoms_list = job_config.atomizer.atomize_in_project(project_type)
 
+    cached_atoms = []
+    if Configuration['cache_atom_results']:
+        atoms_list, cached_atoms = _partition_atoms_by_cached_result(atoms_list, job_config, project_type)
+
     # Group the atoms together using some grouping strategy
     timing_file_path = project_type.timing_file_path(job_config.name)
-    grouped_atoms = _grouped_atoms(
-        atoms_list,
-        job_config.max_executors,
-        timing_file_path,
-        project_type.project_directory
-    )
+    grouped_atoms = []
+    if atoms_list:
+        grouped_atoms = _grouped_atoms(
+            atoms_list,
+            job_config.max_executors,
+            timing_file_path,
+            project_type.project_directory
+        )
 
     # Generate subjobs for each group of atoms
     subjobs = []
@@ -41,39 +60,133 @@ def compute_subjobs_for_build(build_id, job_config, project_type):
         for atom_id, atom in enumerate(subjob_atoms):
             atom.id = atom_id
         subjobs.append(Subjob(build_id, subjob_id, project_type, job_config, subjob_atoms))
+
+    if cached_atoms:
+        subjobs.append(_cached_subjob(build_id, len(subjobs), project_type, job_config, cached_atoms))
     return subjobs
 
 
+def _partition_atoms_by_cached_result(atoms, job_config, project_type):
+    """
+    Set the result cache key of each atom and split the atoms into those that still need to run and those that have a
+    cached result. Nothing is cached if the source tree of the project is not known.
+
+    :type atoms: list[app.master.atom.Atom]
+    :type job_config: JobConfig
+    :type project_type: project_type.project_type.ProjectType
+    :return: the atoms without a cached result and the atoms with a cached result
+    :rtype: (list[app.master.atom.Atom], list[app.master.atom.Atom])
+    """
+    source_tree_hash = project_type.source_tree_hash()
+    if source_tree_hash is None:
+        return atoms, []
+
+    atom_result_cache = AtomResultCache()
+    uncached_atoms, cached_atoms = [], []
+    for atom in atoms:
+        atom.result_cache_key = atom_result_cache.cache_key(source_tree_hash, job_config, atom.command_string)
+        if atom_result_cache.has_result(atom.result_cache_key):
+            cached_atoms.append(atom)
+        else:
+            uncached_atoms.append(atom)
+
+    if cached_atoms:
+        log.get_logger(__name__).info('Using cached results for {} of {} atoms.', len(cached_atoms), len(atoms))
+    return uncached_atoms, cached_atoms
+
+
+def _cached_subjob(build_id, subjob_id, project_type, job_config, cached_atoms):
+    """
+    Create a completed subjob for the atoms that have a cached result and copy their cached results into the build's
+    results directory, where they are picked up by the build artifact like the results of any other subjob.
+
+    :type build_id: int
+    :type subjob_id: int
+    :type project_type: project_type.project_type.ProjectType
+    :type job_config: JobConfig
+    :type cached_atoms: list[app.master.atom.Atom]
+    :rtype: Subjob
+    """
+    atom_result_cache = AtomResultCache()
+    for atom_id, atom in enumerate(cached_atoms):
+        atom.id = atom_id
+        atom.exit_code = 0  # only the results of passed atoms are cached
+        atom_artifact_directory = BuildArtifact.atom_artifact_directory(
+            build_id,
+            subjob_id,
+            atom_id,
+            result_root=Configuration['results_directory']
+        )
+        atom_result_cache.restore_result(atom.result_cache_key, atom_artifact_directory)
+        atom.is_result_cached = True
+        # The cached result includes the resource usage of the original run of the atom, if the slave measured it.
+        resource_usage_file_path = os.path.join(atom_artifact_directory, BuildArtifact.RESOURCE_USAGE_FILE)
+        if os.path.isfile(resource_usage_file_path):
+            with open(resource_usage_file_path, 'r') as resource_usage_file:
+                atom.resource_usage = json.load(resource_usage_file)
+
+    subjob = Subjob(build_id, subjob_id, project_type, job_config, cached_atoms)
+    subjob.mark_completed()
+    return subjob
+
+
 def _grouped_atoms(atoms, max_executors, timing_file_path, project_directory):
     """
     Return atoms that are grouped for optimal CI performance.
 
-    If a timing file exists, then use the TimeBasedAtomGrouper.
-    If not, use the default AtomGrouper (groups each atom into its own subjob).
+    If timing data exists for any of the atoms, then use the grouper selected by the 'atom_grouping_strategy' setting
+    (the TimeBasedAtomGrouper by default). If not, use the default AtomGrouper (groups each atom into its own subjob).
 
     :param atoms: all of the atoms to be run this time
     :type atoms: list[app.master.atom.Atom]
     :param max_executors: the maximum number of executors for this build
     :type max_executors: int
-    :param timing_file_path: path to where the timing data file would be stored (if it exists) for this job
+    :param timing_file_path: the job's timing file path, which identifies the job in the timing data store
     :type timing_file_path: str
     :type project_directory: str
     :return: the grouped atoms (in the form of list of lists of strings)
     :rtype: list[list[app.master.atom.Atom]]
     """
-    atom_time_map = None
-
-    if os.path.isfile(timing_file_path):
-        with open(timing_file_path, 'r') as json_file:
-            try:
-                atom_time_map = json.load(json_file)
-            except ValueError:
-                logger = log.get_logger(__name__)
-                logger.warning('Failed to load timing data from file that exists {}', timing_file_path)
-
-    if atom_time_map is not None and len(atom_time_map) > 0:
-        atom_grouper = TimeBasedAtomGrouper(atoms, max_executors, atom_time_map, project_directory)
+    atom_time_map = TimingDataStore().get_expected_times(timing_file_path, [atom.command_string for atom in atoms])
+    return group_atoms(atoms, max_executors, atom_time_map, project_directory)
+
+
+def group_atoms(atoms, max_executors, atom_time_map, project_directory):
+    """
+    Group atoms into subjobs using the specified historic timing data. This is the grouping step of computing the
+    subjobs for a build, without looking up the timing data of the build's job.
+
+    :param atoms: all of the atoms to be run this time
+    :type atoms: list[app.master.atom.Atom]
+    :param max_executors: the maximum number of executors for this build
+    :type max_executors: int
+    :param atom_time_map: the historic times of the atoms, keyed by atom command string; may be empty
+    :type atom_time_map: dict[str, float]
+    :type project_directory: str
+    :return: the grouped atoms
+    :rtype: list[list[app.master.atom.Atom]]
+    """
+    if len(atom_time_map) > 0:
+        grouper_class = _timing_data_grouper_class()
+        atom_grouper = grouper_class(atoms, max_executors, atom_time_map, project_directory)
     else:
         atom_grouper = AtomGrouper(atoms, max_executors)
 
     return atom_grouper.groupings()
+
+
+def _timing_data_grouper_class():
+    """
+    Return the atom grouper class for the configured 'atom_grouping_strategy'. An unrecognized strategy falls back to
+    the TimeBasedAtomGrouper.
+
+    :rtype: type
+    """
+    strategy = Configuration['atom_grouping_strategy']
+    grouper_class = _TIMING_DATA_GROUPERS_BY_STRATEGY.get(strategy)
+    if grouper_class is None:
+        logger = log.get_logger(__name__)
+        logger.warning('Unknown atom grouping strategy "{}". Valid strategies are: {}.',
+                       strategy, ', '.join(sorted(_TIMING_DATA_GROUPERS_BY_STRATEGY)))
+        grouper_class = TimeBasedAtomGrouper
+    return grouper_class
@@ -173,7 +173,8 @@ class TimeBasedAtomGrouper(object):
         subjob_atoms = []
 
         while (max_groups_to_create is None or len(subjobs) < max_groups_to_create) and len(sorted_atom_time_dict) > 0:
-            for atom, time in sorted_atom_time_dict.items():
+            # Iterate over a snapshot since atoms are popped from sorted_atom_time_dict while it is being traversed.
+            for atom, time in list(sorted_atom_time_dict.items()):
                 if len(subjob_atoms) == 0 or (time + subjob_time_so_far) <= target_group_time:
                     subjob_time_so_far += time
                     subjob_atoms.append(atom)
@@ -186,7 +187,7 @@ class TimeBasedAtomGrouper(object):
                     if max_groups_to_create is not None and (len(subjobs) + len(sorted_atom_time_dict) + 1) <= max_groups_to_create:
                         subjobs.append(subjob_atoms)
 
-                        for atom, _ in sorted_atom_time_dict.items():
+                        for atom, _ in list(sorted_atom_time_dict.items()):
                             sorted_atom_time_dict.pop(atom)
                             subjobs.append([atom])
 
@@ -1,5 +1,7 @@
+from collections import defaultdict
 import os
 import shutil
+from threading import Lock
 from urllib.parse import urlparse
 
 from app.project_type.project_type import ProjectType
@@ -18,6 +20,12 @@ class Git(ProjectType):
     CLONE_DEPTH = 50
     DIRECTORY_PERMISSIONS = 0o700
 
+    # When builds are prepared in git worktrees, these guard the repo-wide operations (cloning and adding worktrees)
+    # and record which worktrees of each repo are being used by a build that is being prepared.
+    _repo_locks = defaultdict(Lock)
+    _repo_locks_lock = Lock()
+    _leased_worktree_indices_by_repo = defaultdict(set)
+
     @staticmethod
     def _generate_path_from_repo_url(base_sys_path, url):
         """
@@ -107,6 +115,10 @@ class Git(ProjectType):
         self._repo_directory = self.get_full_repo_directory(self._url)
         self._timing_file_directory = self.get_timing_file_directory(self._url)
         self._local_ref = None
+        self._fetch_head_hash = None
+        self._source_tree_hash = None
+        self._worktree_index = None
+        self._work_tree_directory = self._repo_directory  # the checkout that the build's project is fetched into
         self._logger = log.get_logger(__name__)
 
         # We explicitly set the repo directory to 700 so we don't inadvertently expose the repo to access by other users
@@ -114,17 +126,23 @@ class Git(ProjectType):
         fs.create_dir(self._timing_file_directory, self.DIRECTORY_PERMISSIONS)
         fs.create_dir(os.path.dirname(build_project_directory))
 
-        # Create a symlink from the generated build project directory to the actual project directory.
-        # This is done in order to switch between the master's and the slave's copies of the repo while not
-        # having to do something hacky in order to user the master's generated atoms on the slaves.
-        actual_project_directory = os.path.join(self._repo_directory, project_directory)
+        self.project_directory = build_project_directory
+        self._project_directory_in_repo = project_directory
+        self._link_build_project_directory()
+
+    def _link_build_project_directory(self):
+        """
+        Create a symlink from the generated build project directory to the actual project directory.
+        This is done in order to switch between the master's and the slave's copies of the repo while not
+        having to do something hacky in order to user the master's generated atoms on the slaves.
+        """
+        actual_project_directory = os.path.join(self._work_tree_directory, self._project_directory_in_repo)
         try:
-            os.unlink(build_project_directory)
+            os.unlink(self.project_directory)
         except FileNotFoundError:
             pass
 
-        os.symlink(actual_project_directory, build_project_directory)
-        self.project_directory = build_project_directory
+        os.symlink(actual_project_directory, self.project_directory)
 
     def slave_param_overrides(self):
         """
@@ -147,66 +165,166 @@ class Git(ProjectType):
 
         return param_overrides
 
-    def _fetch_project(self):
+    def prefetch_project(self):
         """
-        Clones the project if necessary, fetches from the remote repo and resets to the requested commit
+        Clones the project if necessary and fetches the requested branch from the remote repo. Unlike _fetch_project(),
+        this does not reset or clean the working tree.
         """
-        # If shallow_clones is set to True, then we need to specify the --depth=1 argument to all git fetch
-        # and clone invocations.
-        git_clone_fetch_depth_arg = ''
-        if Configuration['shallow_clones']:
-            git_clone_fetch_depth_arg = '--depth=1'
-
-        existing_repo_is_shallow = os.path.isfile(os.path.join(self._repo_directory, '.git', 'shallow'))
+        self._fetch_remote_branch()
 
-        # If we disable shallow clones, but the existing repo is shallow, we must re-clone non-shallowly.
-        if not Configuration['shallow_clones'] and existing_repo_is_shallow and os.path.exists(self._repo_directory):
-            shutil.rmtree(self._repo_directory)
-            fs.create_dir(self._repo_directory, self.DIRECTORY_PERMISSIONS)
+    def can_prepare_builds_concurrently(self):
+        """
+        Builds of the same repo can be prepared concurrently when each of them is fetched into its own git worktree.
+        """
+        return self._uses_worktrees()
 
-        # Clone the repo if it doesn't exist
-        try:
-            self._execute_git_command_in_repo_and_raise_on_failure('rev-parse')  # rev-parse succeeds if repo exists
-        except RuntimeError:
-            self._logger.notice('No valid repo in "{}". Cloning fresh from "{}".', self._repo_directory, self._url)
-            self._execute_git_command_in_repo_and_raise_on_failure(
-                git_command='clone {} {} {}'. format(git_clone_fetch_depth_arg, self._url, self._repo_directory),
-                error_msg='Could not clone repo.'
-            )
+    def finish_preparation(self):
+        """
+        Return the git worktree that this build was prepared in so that the next build of this repo can reuse it.
+        """
+        if self._worktree_index is None:
+            return
+        with self._repo_lock():
+            self._leased_worktree_indices_by_repo[self._repo_directory].discard(self._worktree_index)
+        self._worktree_index = None
 
-        # Must add the --update-head-ok in the scenario that the current branch of the working directory
-        # is equal to self._branch, otherwise the git fetch will exit with a non-zero exit code.
-        self._execute_git_command_in_repo_and_raise_on_failure(
-            git_command='fetch {} --update-head-ok {} {}'.format(git_clone_fetch_depth_arg, self._remote, self._branch),
-            error_msg='Could not fetch specified branch "{}" from remote "{}".'.format(self._branch, self._remote)
-        )
+    def _fetch_project(self):
+        """
+        Clones the project if necessary, fetches from the remote repo and resets to the requested commit
+        """
+        if self._uses_worktrees():
+            self._fetch_remote_branch_into_worktree()
+        else:
+            self._fetch_remote_branch()
 
         # Validate and convert the user-specified hash/refspec to a full git hash
         fetch_head_hash = self._execute_git_command_in_repo_and_raise_on_failure(
             git_command='rev-parse FETCH_HEAD',
-            error_msg='Could not rev-parse FETCH_HEAD of {} to a commit hash.'.format(self._branch)
+            error_msg='Could not rev-parse FETCH_HEAD of {} to a commit hash.'.format(self._branch),
+            cwd=self._work_tree_directory
         ).strip()
+        self._fetch_head_hash = fetch_head_hash
+        self._source_tree_hash = None
 
         # Save this hash as a local ref. Named local refs are necessary for slaves to fetch correctly from the master.
         # The local ref will be passed on to slaves instead of the user-specified branch.
         self._local_ref = 'refs/clusterrunner/{}'.format(fetch_head_hash)
         self._execute_git_command_in_repo_and_raise_on_failure(
             git_command='update-ref {} {}'.format(self._local_ref, fetch_head_hash),
-            error_msg='Could not update local ref.'
+            error_msg='Could not update local ref.',
+            cwd=self._work_tree_directory
         )
 
         # The '--' argument acts as a delimiter to differentiate values that can be "tree-ish" or a "path"
         self._execute_git_command_in_repo_and_raise_on_failure(
             git_command='reset --hard {} --'.format(fetch_head_hash),
-            error_msg='Could not reset Git repo.'
+            error_msg='Could not reset Git repo.',
+            cwd=self._work_tree_directory
         )
 
         self._execute_git_command_in_repo_and_raise_on_failure(
             git_command='clean -dfx',
-            error_msg='Could not clean Git repo.'
+            error_msg='Could not clean Git repo.',
+            cwd=self._work_tree_directory
         )
 
-    def _execute_git_command_in_repo_and_raise_on_failure(self, git_command, error_msg='Error executing git command.'):
+    def _fetch_remote_branch(self):
+        """
+        Clones the project if necessary and fetches the requested branch from the remote repo into FETCH_HEAD
+        """
+        self._clone_repo_if_needed()
+
+        # Must add the --update-head-ok in the scenario that the current branch of the working directory
+        # is equal to self._branch, otherwise the git fetch will exit with a non-zero exit code.
+        self._execute_git_command_in_repo_and_raise_on_failure(
+            git_command='fetch {} --update-head-ok {} {}'.format(self._fetch_depth_arg(), self._remote, self._branch),
+            error_msg='Could not fetch specified branch "{}" from remote "{}".'.format(self._branch, self._remote)
+        )
+
+    def _fetch_remote_branch_into_worktree(self):
+        """
+        Clones the project if necessary, leases a git worktree of the repo for this build and fetches the requested
+        branch from the remote repo into the FETCH_HEAD of the worktree. Worktrees share the repo's object store and
+        refs, but each has its own working tree, HEAD and FETCH_HEAD, so builds of the same repo can be prepared at the
+        same time.
+        """
+        with self._repo_lock():
+            self._clone_repo_if_needed()
+            leased_worktree_indices = self._leased_worktree_indices_by_repo[self._repo_directory]
+            self._worktree_index = next(index for index in range(len(leased_worktree_indices) + 1)
+                                        if index not in leased_worktree_indices)
+            leased_worktree_indices.add(self._worktree_index)
+            self._work_tree_directory = os.path.join(
+                '{}_worktrees'.format(self._repo_directory), str(self._worktree_index))
+
+            # Worktrees are kept around after their build has been prepared, so they can usually be reused.
+            if not os.path.exists(os.path.join(self._work_tree_directory, '.git')):
+                self._execute_git_command_in_repo_and_raise_on_failure(
+                    git_command='worktree prune',
+                    error_msg='Could not prune worktrees of Git repo.'
+                )
+                self._execute_git_command_in_repo_and_raise_on_failure(
+                    git_command='worktree add --detach --no-checkout {}'.format(self._work_tree_directory),
+                    error_msg='Could not add worktree to Git repo.'
+                )
+
+        self._link_build_project_directory()
+
+        # Fetch from the url rather than the named remote so that no remote-tracking refs (which are shared by all
+        # worktrees) are updated by concurrent fetches. The fetched commit only ends up in this worktree's FETCH_HEAD.
+        self._execute_git_command_in_repo_and_raise_on_failure(
+            git_command='fetch {} {} {}'.format(self._fetch_depth_arg(), self._url, self._branch),
+            error_msg='Could not fetch specified branch "{}" from "{}".'.format(self._branch, self._url),
+            cwd=self._work_tree_directory
+        )
+
+    def _clone_repo_if_needed(self):
+        """
+        Clones the project from the remote repo if there is no valid repo in the repo directory yet
+        """
+        existing_repo_is_shallow = os.path.isfile(os.path.join(self._repo_directory, '.git', 'shallow'))
+
+        # If we disable shallow clones, but the existing repo is shallow, we must re-clone non-shallowly.
+        if not Configuration['shallow_clones'] and existing_repo_is_shallow and os.path.exists(self._repo_directory):
+            shutil.rmtree(self._repo_directory)
+            fs.create_dir(self._repo_directory, self.DIRECTORY_PERMISSIONS)
+
+        # Clone the repo if it doesn't exist
+        try:
+            self._execute_git_command_in_repo_and_raise_on_failure('rev-parse')  # rev-parse succeeds if repo exists
+        except RuntimeError:
+            self._logger.notice('No valid repo in "{}". Cloning fresh from "{}".', self._repo_directory, self._url)
+            self._execute_git_command_in_repo_and_raise_on_failure(
+                git_command='clone {} {} {}'. format(self._fetch_depth_arg(), self._url, self._repo_directory),
+                error_msg='Could not clone repo.'
+            )
+
+    def _fetch_depth_arg(self):
+        """
+        If shallow_clones is set to True, then we need to specify the --depth=1 argument to all git fetch and clone
+        invocations.
+
+        :rtype: str
+        """
+        return '--depth=1' if Configuration['shallow_clones'] else ''
+
+    def _uses_worktrees(self):
+        """
+        :return: whether builds are prepared in git worktrees; this is a master setting, so slaves never use them
+        :rtype: bool
+        """
+        return 'prepare_builds_in_git_worktrees' in Configuration and Configuration['prepare_builds_in_git_worktrees']
+
+    def _repo_lock(self):
+        """
+        :return: the lock that guards the repo-wide operations on this build's repo
+        :rtype: Lock
+        """
+        with self._repo_locks_lock:
+            return self._repo_locks[self._repo_directory]
+
+    def _execute_git_command_in_repo_and_raise_on_failure(self, git_command, error_msg='Error executing git command.',
+                                                          cwd=None):
         """
         Execute the given git command. If it exits with a failing exit code then raise an exception.
 
@@ -217,6 +335,8 @@ class Git(ProjectType):
         :type git_command: string
         :param error_msg: The human readable error message to log if the command fails
         :type error_msg: string
+        :param cwd: The directory to execute the command in; defaults to the repo directory
+        :type cwd: string | None
         :return: The output of the process (stdout and stderr)
         :rtype: string
         """
@@ -230,7 +350,8 @@ class Git(ProjectType):
             'GIT_SSH_ARGS': git_ssh_args,  # GIT_SSH_ARGS is not used by git; it is used by our git_ssh.sh wrapper.
         }
         command = 'git ' + git_command
-        return self._execute_and_raise_on_failure(command, error_msg, cwd=self._repo_directory, env_vars=env_vars)
+        return self._execute_and_raise_on_failure(command, error_msg, cwd=cwd or self._repo_directory,
+                                                  env_vars=env_vars)
 
     def execute_command_in_project(self, *args, **kwargs):
         """
@@ -257,3 +378,16 @@ class Git(ProjectType):
 
     def project_id(self):
         return self._repo_directory
+
+    def project_version(self):
+        return self._fetch_head_hash
+
+    def source_tree_hash(self):
+        if self._fetch_head_hash is None:
+            return None
+        if self._source_tree_hash is None:
+            self._source_tree_hash = self._execute_git_command_in_repo_and_raise_on_failure(
+                git_command='rev-parse {}^{{tree}}'.format(self._fetch_head_hash),
+                error_msg='Could not rev-parse the tree of commit {}.'.format(self._fetch_head_hash)
+            ).strip()
+        return self._source_tree_hash
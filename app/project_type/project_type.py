@@ -1,18 +1,21 @@
 from collections import OrderedDict, namedtuple
+import hashlib
 import inspect
 import os
 import re
 import signal
-from subprocess import TimeoutExpired, STDOUT
+from subprocess import Popen, TimeoutExpired, STDOUT
 from tempfile import TemporaryFile
-from threading import Event
+from threading import Event, Lock
 import time
 
 from app.master.cluster_runner_config import ClusterRunnerConfig
 from app.master.job_config import JobConfig
 from app.util import log
 from app.util.conf.configuration import Configuration
-from app.util.process_utils import Popen_with_delayed_expansion, get_environment_variable_setter_command
+from app.util.process_utils import Popen_with_delayed_expansion, get_environment_variable_setter_command, \
+    wait_and_get_resource_usage, wait_without_reaping
+from app.util.warm_command_runner import WarmCommand, WarmCommandRunner
 
 
 class ProjectType(object):
@@ -36,6 +39,9 @@ class ProjectType(object):
         self._remote_files = remote_files if remote_files else {}
         self._logger = log.get_logger(__name__)
         self._kill_event = Event()
+        self._running_commands_by_pipe = {}  # the commands that kill_subprocesses() should terminate
+        self._running_commands_lock = Lock()
+        self._warm_command_runner = None
         self._job_config = None
 
     @property
@@ -111,6 +117,29 @@ class ProjectType(object):
     def _fetch_project(self):
         raise NotImplementedError
 
+    def prefetch_project(self):
+        """
+        Fetch the project onto the local machine ahead of a build's setup, without changing the files of the project,
+        so that the fetch_project() call during setup has less work to do. Project types that do not need to download
+        anything do nothing here.
+        """
+        pass
+
+    def can_prepare_builds_concurrently(self):
+        """
+        Whether builds of the same project can be fetched and atomized on the master at the same time. This is only
+        possible for project types that give every build being prepared its own copy of the project.
+        :rtype: bool
+        """
+        return False
+
+    def finish_preparation(self):
+        """
+        Called on the master once the build has been prepared (fetched and atomized), whether or not that succeeded.
+        Project types can release anything they only need while preparing a build here.
+        """
+        pass
+
     def _execute_and_raise_on_failure(self, command, message, cwd=None, env_vars=None):
         """
         :rtype: string
@@ -167,16 +196,23 @@ class ProjectType(object):
     def setup_executor(self):
         """
         Do setup for each executor. This should be called by client code for each executor before
-        executing repeated commands in the project_type. Default implementation is to do nothing.
+        executing repeated commands in the project_type. Default implementation is to start a warm command runner for
+        the executor's commands if the warm_command_runner setting is enabled.
         """
-        pass
+        if Configuration['warm_command_runner'] and WarmCommandRunner.is_supported():
+            environment = dict(os.environ)
+            environment.update({key: str(value) for key, value in self._get_environment_vars().items()})
+            self._warm_command_runner = WarmCommandRunner(env=environment)
+            self._warm_command_runner.start()
 
     def teardown_executor(self):
         """
         Do cleanup for each executor. This should be called by client code if project_type.fetch_project()
-        was called. Default implementation is to do nothing.
+        was called. Default implementation is to stop the warm command runner, if one was started.
         """
-        pass
+        if self._warm_command_runner is not None:
+            self._warm_command_runner.stop()
+            self._warm_command_runner = None
 
     def command_in_project(self, command):
         """
@@ -194,7 +230,7 @@ class ProjectType(object):
         return command
 
     def execute_command_in_project(self, command, extra_environment_vars=None, timeout=None, output_file=None,
-                                   **popen_kwargs):
+                                   resource_usage_callback=None, **popen_kwargs):
         """
         Execute a command in the context of the project
 
@@ -207,6 +243,10 @@ class ProjectType(object):
         :param output_file: The file to write console output to (both stdout and stderr). If not specified,
                             will generate a TemporaryFile. This method will close the file.
         :type output_file: BufferedRandom | None
+        :param resource_usage_callback: If specified, this is called with the resources used by the command (CPU time,
+            max RSS, block I/O and context switches) after it exits. It is not called if the resource usage could not
+            be measured, e.g., when the command timed out or ran in the warm command runner.
+        :type resource_usage_callback: callable | None
         :param popen_kwargs: additional keyword arguments to pass through to subprocess.Popen
         :type popen_kwargs: dict[str, mixed]
         :return: a tuple of (the string output from the command, the exit code of the command)
@@ -218,18 +258,13 @@ class ProjectType(object):
 
         # Redirect output to files instead of using pipes to avoid: https://github.com/box/ClusterRunner/issues/57
         output_file = output_file if output_file is not None else TemporaryFile()
-        pipe = Popen_with_delayed_expansion(
-            command,
-            shell=True,
-            stdout=output_file,
-            stderr=STDOUT,  # Redirect stderr to stdout, as we do not care to distinguish the two.
-            start_new_session=True,  # Starts a new process group (so we can kill it without killing clusterrunner).
-            **popen_kwargs
-        )
+        pipe = self._start_command(command, output_file, popen_kwargs)
 
-        clusterrunner_error_msgs = self._wait_for_pipe_to_close(pipe, command, timeout)
+        clusterrunner_error_msgs, resource_usage = self._wait_for_pipe_to_close(pipe, command, timeout)
         console_output = self._read_file_contents_and_close(output_file)
         exit_code = pipe.returncode
+        if resource_usage_callback is not None and resource_usage is not None:
+            resource_usage_callback(resource_usage)
 
         if exit_code != 0:
             max_log_length = 300
@@ -250,63 +285,148 @@ class ProjectType(object):
         combined_command_output = '\n'.join([console_output] + clusterrunner_error_msgs)
         return combined_command_output, exit_code
 
+    def _start_command(self, command, output_file, popen_kwargs):
+        """
+        Start a shell command, in the warm command runner if there is one that can run it and in a new shell otherwise.
+
+        :type command: str
+        :type output_file: BufferedRandom
+        :type popen_kwargs: dict[str, mixed]
+        :return: the started process, or an object with the same interface for waiting for it
+        :rtype: Popen | WarmCommand
+        """
+        # The warm command runner writes the output to a file by path, so it cannot write to an anonymous temporary
+        # file. It also cannot apply extra Popen arguments.
+        output_file_path = getattr(output_file, 'name', None)
+        if (self._warm_command_runner is not None and self._warm_command_runner.is_running and not popen_kwargs
+                and isinstance(output_file_path, str)):
+            try:
+                # Commands run by Popen_with_delayed_expansion also set pipefail when they are run by bash.
+                return self._warm_command_runner.run('set -o pipefail; ' + command, output_file_path)
+            except Exception:  # pylint: disable=broad-except
+                self._logger.exception('Could not run command in warm command runner. Starting it in a new shell.')
+
+        return Popen_with_delayed_expansion(
+            command,
+            shell=True,
+            stdout=output_file,
+            stderr=STDOUT,  # Redirect stderr to stdout, as we do not care to distinguish the two.
+            start_new_session=True,  # Starts a new process group (so we can kill it without killing clusterrunner).
+            **popen_kwargs
+        )
+
     def _wait_for_pipe_to_close(self, pipe, command, timeout):
         """
         Wait for the pipe to close (after command completes) or until timeout. If timeout is reached, then
         kill the pipe as well as any child processes spawned.
 
+        The wait blocks until the process exits instead of waking up periodically to check whether the command should
+        be killed: kill_subprocesses() terminates the processes of running commands itself, which ends the wait.
+
         :type pipe: Popen
         :type command: str
         :type timeout: int | None
-        :return: the list of error encountered while waiting for the pipe to close.
-        :rtype: list[str]
+        :return: the list of error encountered while waiting for the pipe to close, and the resource usage of the
+            command if it completed and the resource usage could be measured
+        :rtype: (list[str], dict[str, int | float] | None)
         """
         clusterrunner_error_msgs = []
+        resource_usage = None
         command_completed = False
         timeout_time = time.time() + (timeout or float('inf'))
 
-        # Wait for the command to complete, but also periodically check the kill event flag to see if we should
-        # terminate the process prematurely.
-        while not command_completed and not self._kill_event.is_set() and time.time() < timeout_time:
-            try:
-                pipe.wait(timeout=1)
-                command_completed = True  # wait() didn't raise TimeoutExpired, so process has finished executing.
-            except TimeoutExpired:
-                continue
-            except Exception as ex:  # pylint: disable=broad-except
-                error_message = 'Exception while waiting for process to finish.'
-                self._logger.exception(error_message)
-                clusterrunner_error_msgs.append(
-                    'ClusterRunner: {} ({}: "{}")'.format(error_message, type(ex).__name__, ex))
-                break
-
-        if not command_completed:
-            # We've been signaled to terminate subprocesses, so terminate them. But we still collect stdout and stderr.
-            # We must kill the entire process group since shell=True launches 'sh -c "cmd"' and just killing the pid
-            # will kill only "sh" and not its child processes.
-            # Note: We may lose buffered output from the subprocess that hasn't been flushed before termination.
-            self._logger.warning('Terminating PID: {}, Command: "{}"', pipe.pid, command)
-            try:
-                # todo: os.killpg sends a SIGTERM to all processes in the process group. If the immediate child process
-                # ("sh") dies but its child processes do not, we will leave them running orphaned.
+        # If kill_subprocesses() was called before this command was registered, it is up to us to terminate it.
+        with self._running_commands_lock:
+            self._running_commands_by_pipe[pipe] = command
+            is_killed = self._kill_event.is_set()
+
+        try:
+            while not command_completed and not is_killed:
+                remaining_time = timeout_time - time.time()
+                if remaining_time <= 0:
+                    break
                 try:
-                    os.killpg(pipe.pid, signal.SIGTERM)
-                except AttributeError:
-                    self._logger.warning('os.killpg is not available. This is expected if ClusterRunner is running'
-                                         'on Windows. Using os.kill instead.')
-                    os.kill(pipe.pid, signal.SIGTERM)
-            except (PermissionError, ProcessLookupError) as ex:  # os.killpg will raise if process has already ended
-                self._logger.warning('Attempted to kill process group (pgid: {}) but raised {}: "{}".',
-                                     pipe.pid, type(ex).__name__, ex)
-            try:
-                pipe.wait()
-            except Exception as ex:  # pylint: disable=broad-except
-                error_message = 'Exception while waiting for terminated process to finish.'
-                self._logger.exception(error_message)
-                clusterrunner_error_msgs.append(
-                    'ClusterRunner: {} ({}: "{}")'.format(error_message, type(ex).__name__, ex))
+                    resource_usage = self._wait_for_process(pipe, timeout=remaining_time if timeout else None)
+                    command_completed = True  # wait() didn't raise TimeoutExpired, so process has finished executing.
+                except TimeoutExpired:
+                    continue
+                except Exception as ex:  # pylint: disable=broad-except
+                    error_message = 'Exception while waiting for process to finish.'
+                    self._logger.exception(error_message)
+                    clusterrunner_error_msgs.append(
+                        'ClusterRunner: {} ({}: "{}")'.format(error_message, type(ex).__name__, ex))
+                    break
+
+            if not command_completed:
+                # We've been signaled to terminate subprocesses, so terminate them. But we still collect stdout and
+                # stderr. Note: We may lose buffered output from the subprocess that hasn't been flushed before
+                # termination.
+                self._terminate_process_group(pipe, command)
+                try:
+                    self._wait_for_process(pipe)
+                except Exception as ex:  # pylint: disable=broad-except
+                    error_message = 'Exception while waiting for terminated process to finish.'
+                    self._logger.exception(error_message)
+                    clusterrunner_error_msgs.append(
+                        'ClusterRunner: {} ({}: "{}")'.format(error_message, type(ex).__name__, ex))
+        finally:
+            with self._running_commands_lock:
+                del self._running_commands_by_pipe[pipe]
+
+        return clusterrunner_error_msgs, resource_usage
 
-        return clusterrunner_error_msgs
+    def _wait_for_process(self, pipe, timeout=None):
+        """
+        Wait for the process of a running command to exit.
+
+        :type pipe: Popen
+        :param timeout: the maximum number of seconds to wait, or None to wait until the process exits
+        :type timeout: float | None
+        :return: the resource usage of the process, if it could be measured
+        :rtype: dict[str, int | float] | None
+        :raises TimeoutExpired: if the process has not exited within the timeout
+        """
+        if isinstance(pipe, Popen) and hasattr(os, 'waitid'):
+            # kill_subprocesses() only signals commands without a returncode while holding the lock, so reaping the
+            # process (which sets its returncode) under the lock keeps it from signalling a process group whose id has
+            # been reused.
+            wait_without_reaping(pipe, timeout=timeout)
+            with self._running_commands_lock:
+                return wait_and_get_resource_usage(pipe)
+
+        # Otherwise the resource usage of a process can only be measured when waiting for it without a timeout.
+        if timeout is None and isinstance(pipe, Popen):
+            return wait_and_get_resource_usage(pipe)
+        pipe.wait(timeout=timeout)
+        return None
+
+    def _terminate_process_group(self, pipe, command):
+        """
+        Send a SIGTERM to the process group of a running command.
+
+        :type pipe: Popen | WarmCommand
+        :type command: str
+        """
+        # We must kill the entire process group since shell=True launches 'sh -c "cmd"' and just killing the pid
+        # will kill only "sh" and not its child processes.
+        self._logger.warning('Terminating PID: {}, Command: "{}"', pipe.pid, command)
+        try:
+            # The process of a warm command is reaped by the warm command runner rather than by us, so the runner has
+            # to make sure that its process group still exists.
+            if isinstance(pipe, WarmCommand):
+                pipe.signal_process_group(signal.SIGTERM)
+                return
+            # todo: os.killpg sends a SIGTERM to all processes in the process group. If the immediate child process
+            # ("sh") dies but its child processes do not, we will leave them running orphaned.
+            try:
+                os.killpg(pipe.pid, signal.SIGTERM)
+            except AttributeError:
+                self._logger.warning('os.killpg is not available. This is expected if ClusterRunner is running'
+                                     'on Windows. Using os.kill instead.')
+                os.kill(pipe.pid, signal.SIGTERM)
+        except (PermissionError, ProcessLookupError) as ex:  # os.killpg will raise if process has already ended
+            self._logger.warning('Attempted to kill process group (pgid: {}) but raised {}: "{}".',
+                                 pipe.pid, type(ex).__name__, ex)
 
     def _read_file_contents_and_close(self, file):
         """
@@ -356,9 +476,21 @@ class ProjectType(object):
 
     def kill_subprocesses(self):
         """
-        Signal the environment that any currently running subprocesses should be terminated.
+        Terminate any currently running subprocesses, and signal the environment that subprocesses started from now on
+        should be terminated as well (until reset_kill_signal() is called).
+        """
+        with self._running_commands_lock:
+            self._kill_event.set()
+            for pipe, command in self._running_commands_by_pipe.items():
+                # The process of a command with a returncode has been reaped, so its pid may have been reused.
+                if pipe.returncode is None:
+                    self._terminate_process_group(pipe, command)
+
+    def reset_kill_signal(self):
+        """
+        Clear a previous kill_subprocesses() signal so that subsequently executed commands are allowed to run.
         """
-        self._kill_event.set()
+        self._kill_event.clear()
 
     @classmethod
     def required_constructor_argument_names(cls):
@@ -433,6 +565,39 @@ class ProjectType(object):
         """
         raise NotImplementedError
 
+    def project_version(self):
+        """
+        Get a string that identifies the version of the project that was fetched (e.g., a commit hash). Slaves that
+        have already set up the same version of a project can set it up again quickly.
+        :return: the version of the fetched project, or None if it is not known
+        :rtype: str | None
+        """
+        return None
+
+    def source_tree_hash(self):
+        """
+        Get a string that identifies the contents of the fetched project's source tree (e.g., a git tree hash). Atoms
+        that ran against the same source tree with the same commands can reuse each other's results.
+        :return: the hash of the fetched source tree, or None if it is not known
+        :rtype: str | None
+        """
+        return None
+
+    def setup_cache_key(self):
+        """
+        Get a string that identifies the result of setting up a build of this project on a slave. Builds with the same
+        key are for the same project version and have the same setup_build commands, so they can reuse each other's
+        setup.
+        :return: the setup cache key, or None if the project version is not known
+        :rtype: str | None
+        """
+        project_version = self.project_version()
+        if project_version is None:
+            return None
+        setup_commands = self.job_config().setup_build or ''
+        setup_commands_hash = hashlib.sha1(setup_commands.encode('utf-8')).hexdigest()
+        return '{}:{}:{}'.format(self.project_id(), project_version, setup_commands_hash)
+
     def _run_remote_file_setup(self):
         """
         Fetches remote files
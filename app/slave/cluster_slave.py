@@ -1,8 +1,10 @@
+from collections import deque
 from enum import Enum
-from queue import Queue
+from functools import partial
+from queue import Empty, Queue
 import sys
 import sched
-import time
+from threading import Lock
 
 import requests
 
@@ -19,6 +21,7 @@ from app.util.session_id import SessionId
 from app.util.single_use_coin import SingleUseCoin
 from app.util.unhandled_exception_handler import UnhandledExceptionHandler
 from app.util.url_builder import UrlBuilder
+from app.util.worker_pool import WorkerPool
 
 
 class ClusterSlave(ClusterService):
@@ -49,14 +52,21 @@ class ClusterSlave(ClusterService):
             self._idle_executors.put(executor)
             self.executors_by_id[executor_id] = executor
 
+        # Each executor runs its subjobs (and the release of its build after teardown) on a long-lived worker thread,
+        # and uploads the results of its subjobs on another one so that it can start its next subjob right away.
+        self._executor_workers = WorkerPool(name='Executor')
+        self._result_upload_workers = WorkerPool(name='ResultUpload')
+
         self._master_url = None
         self._network = Network(min_connection_poolsize=num_executors)
         self._master_api = None  # wait until we connect to a master first
 
-        self._project_type = None  # this will be instantiated during build setup
-        self._current_build_id = None
-        self._build_teardown_coin = None
-        self._base_executor_index = None
+        self._builds_by_id = {}  # type: Dict[int, _SlaveBuild]
+        # Finished builds whose teardown was deferred so that the next build of the same project can reuse their setup
+        self._reusable_builds_by_project_id = {}  # type: Dict[str, _SlaveBuild]
+        self._builds_lock = Lock()
+        # Held while a project is fetched so that prefetching a project does not collide with fetching it for setup
+        self._project_fetch_locks = {}  # type: Dict[str, Lock]
 
         # Configure heartbeat
         self._heartbeat_failure_count = 0
@@ -102,7 +112,7 @@ class ClusterSlave(ClusterService):
         return {
             'is_alive': self.is_alive,
             'master_url': self._master_url,
-            'current_build_id': self._current_build_id,
+            'current_build_ids': sorted(self._builds_by_id),
             'slave_id': self._slave_id,
             'executors': executors_representation,
             'session_id': SessionId.get(),
@@ -114,12 +124,16 @@ class ClusterSlave(ClusterService):
         """
         return 'Slave service is up. <Port: {}>'.format(self.port)
 
-    def setup_build(self, build_id, project_type_params, build_executor_start_index):
+    def setup_build(self, build_id, project_type_params, build_executor_start_index, num_executors=None,
+                    setup_cache_key=None):
         """
         Usually called once per build to do build-specific setup. Will block any subjobs from executing until setup
         completes. The actual setup is performed on another thread and will unblock subjobs (via an Event) once it
         finishes.
 
+        Executors are leased to builds individually, so this slave can work on several builds at once as long as it
+        has enough idle executors.
+
         :param build_id: The id of the build to run setup on
         :type build_id: int
         :param project_type_params: The parameters that define the project_type this build will execute in
@@ -127,86 +141,199 @@ class ClusterSlave(ClusterService):
         :param build_executor_start_index: How many executors have alreayd been allocated on other slaves for
         this build
         :type build_executor_start_index: int
+        :param num_executors: The number of idle executors to lease to this build; defaults to all idle executors
+        :type num_executors: int | None
+        :param setup_cache_key: Identifies the result of this build's setup (see ProjectType.setup_cache_key()); if
+            set, the setup of the previous build of the same project is reused when that build had the same key, and
+            this build's teardown is deferred until a build with a different key replaces it.
+        :type setup_cache_key: str | None
         """
         self._logger.info('Executing setup for build {} (type: {}).', build_id, project_type_params.get('type'))
-        self._current_build_id = build_id
-        self._build_teardown_coin = SingleUseCoin()  # protects against build_teardown being executed multiple times
-
         # create an project_type instance for build-level operations
-        self._project_type = util.create_project_type(project_type_params)
-
-        # verify all executors are idle
-        if not self._idle_executors.full():
-            raise RuntimeError('Slave tried to setup build but not all executors are idle. ({}/{} executors idle.)'
-                               .format(self._idle_executors.qsize(), self._num_executors))
-
-        # Collect all the executors to pass to project_type.fetch_project(). This will create a new project_type for
+        project_type = util.create_project_type(project_type_params)
+
+        with self._builds_lock:
+            if build_id in self._builds_by_id:
+                raise BadRequestError('Tried to setup build {}, but it is already set up on this slave.'.format(
+                    build_id))
+
+            # lease the idle executors to this build
+            if num_executors is None:
+                num_executors = self._idle_executors.qsize()
+            executors = []
+            try:
+                while len(executors) < num_executors:
+                    executors.append(self._idle_executors.get(block=False))
+            except Empty:
+                for executor in executors:
+                    self._idle_executors.put(executor)
+                raise RuntimeError('Slave tried to setup build but not enough executors are idle. ({}/{} executors '
+                                   'idle.)'.format(len(executors), num_executors))
+
+            build = _SlaveBuild(build_id, project_type, executors, build_executor_start_index, setup_cache_key)
+            self._builds_by_id[build_id] = build
+
+        # Pass all the leased executors to project_type.fetch_project(). This will create a new project_type for
         # each executor (for subjob-level operations).
-        executors = list(self._idle_executors.queue)
         SafeThread(
             target=self._async_setup_build,
             name='Bld{}-Setup'.format(build_id),
-            args=(executors, project_type_params, build_executor_start_index)
+            args=(build, project_type_params)
         ).start()
 
-    def _async_setup_build(self, executors, project_type_params, build_executor_start_index):
+    def _async_setup_build(self, build, project_type_params):
         """
         Called from setup_build(). Do asynchronous setup for the build so that we can make the call to setup_build()
         non-blocking.
 
-        :type executors: list[SubjobExecutor]
+        :type build: _SlaveBuild
         :type project_type_params: dict
-        :type build_executor_start_index: int
         """
-        self._base_executor_index = build_executor_start_index
+        with self._builds_lock:
+            reusable_build = self._reusable_builds_by_project_id.pop(build.project_type.project_id(), None)
         try:
-            self._project_type.fetch_project()
-            for executor in executors:
-                executor.configure_project_type(project_type_params)
-            self._project_type.run_job_config_setup()
+            if reusable_build is not None and build.setup_cache_key == reusable_build.setup_cache_key:
+                self._logger.info('Reusing setup of build {} for build {}.', reusable_build.build_id, build.build_id)
+                for executor in build.executors:
+                    executor.configure_project_type(project_type_params)
+            else:
+                if reusable_build is not None:
+                    self._run_build_teardown_commands(reusable_build)
+                with self._project_fetch_lock(build.project_type.project_id()):
+                    build.project_type.fetch_project()
+                for executor in build.executors:
+                    executor.configure_project_type(project_type_params)
+                build.project_type.run_job_config_setup()
 
         except SetupFailureError as ex:
             self._logger.error(ex)
-            self._logger.info('Notifying master that build setup has failed for build {}.', self._current_build_id)
-            self._notify_master_of_state_change(SlaveState.SETUP_FAILED)
+            self._logger.info('Notifying master that build setup has failed for build {}.', build.build_id)
+            self._notify_master_of_state_change(SlaveState.SETUP_FAILED, build.build_id)
 
         else:
-            self._logger.info('Notifying master that build setup is complete for build {}.', self._current_build_id)
-            self._notify_master_of_state_change(SlaveState.SETUP_COMPLETED)
+            build.is_setup_complete = True
+            self._logger.info('Notifying master that build setup is complete for build {}.', build.build_id)
+            self._notify_master_of_state_change(SlaveState.SETUP_COMPLETED, build.build_id)
+
+    def prefetch_project(self, project_type_params):
+        """
+        Fetch the project of a build that is still being prepared on the master, so that setting up the build on this
+        slave later has less to fetch. The fetch is performed on another thread, and it is skipped if the project is
+        already being fetched.
+
+        :param project_type_params: The parameters that define the project_type of the build
+        :type project_type_params: dict
+        """
+        SafeThread(
+            target=self._async_prefetch_project,
+            name='ProjectPrefetch',
+            args=(project_type_params,)
+        ).start()
+
+    def _async_prefetch_project(self, project_type_params):
+        """
+        Called from prefetch_project(). Prefetching is only an optimization, so errors are logged and ignored; they
+        must not take down the slave, since this runs on a SafeThread.
+
+        :type project_type_params: dict
+        """
+        try:
+            project_type = util.create_project_type(project_type_params)
+            project_id = project_type.project_id()
+        except Exception:  # pylint: disable=broad-except
+            self._logger.exception('Could not create project type to prefetch project.')
+            return
+
+        fetch_lock = self._project_fetch_lock(project_id)
+        if not fetch_lock.acquire(blocking=False):
+            self._logger.info('Skipping prefetch of project {} since it is already being fetched.', project_id)
+            return
+        try:
+            self._logger.info('Prefetching project {}.', project_id)
+            project_type.prefetch_project()
+        except Exception:  # pylint: disable=broad-except
+            self._logger.exception('Prefetching project {} failed.', project_id)
+        finally:
+            fetch_lock.release()
+
+    def _project_fetch_lock(self, project_id):
+        """
+        :param project_id: the project id of the project to fetch (see ProjectType.project_id())
+        :type project_id: str
+        :rtype: Lock
+        """
+        with self._builds_lock:
+            if project_id not in self._project_fetch_locks:
+                self._project_fetch_locks[project_id] = Lock()
+            return self._project_fetch_locks[project_id]
 
     def teardown_build(self, build_id=None):
         """
-        Called at the end of each build on each slave before it reports back to the master that it is idle again.
+        Called at the end of each build on each slave before it reports back to the master that the executors leased
+        to the build are idle again. This kills the build's running subjobs and queues the release of each executor on
+        the executor's worker, behind the subjob the executor is working on. Once all executors are released, the
+        build's teardown_build commands are run and the master is notified that the executors are idle.
 
-        :param build_id: The build id to teardown -- this parameter is used solely for correctness checking of the
-            master, to make sure that the master is not erroneously sending teardown commands for other builds.
+        :param build_id: The build id to teardown -- this parameter may only be omitted if a single build is set up on
+            this slave.
         :type build_id: int | None
         """
-        if self._current_build_id is None:
-            raise BadRequestError('Tried to teardown a build but no build is active on this slave.')
+        with self._builds_lock:
+            if len(self._builds_by_id) == 0:
+                raise BadRequestError('Tried to teardown a build but no build is active on this slave.')
+
+            if build_id is None and len(self._builds_by_id) == 1:
+                build_id = next(iter(self._builds_by_id))
+            build = self._builds_by_id.get(build_id)
+            if build is None:
+                raise BadRequestError('Tried to teardown build {}, but slave is running builds {}!'.format(
+                    build_id, sorted(self._builds_by_id)))
+            if build.is_tearing_down:
+                self._logger.info('Teardown of build {} is already in progress.', build_id)
+                return
+            build.is_tearing_down = True
+
+        if len(build.executors) == 0:
+            self._async_teardown_build(build)
+            return
+        # This only has an effect if we are tearing down before the build completes.
+        for executor in build.executors:
+            executor.kill()
+        for executor in build.executors:
+            self._executor_workers.submit(executor.id, self._release_executor_after_teardown, build, executor)
 
-        if build_id is not None and build_id != self._current_build_id:
-            raise BadRequestError('Tried to teardown build {}, '
-                                  'but slave is running build {}!'.format(build_id, self._current_build_id))
-        SafeThread(
-            target=self._async_teardown_build,
-            name='Bld{}-Teardwn'.format(build_id)
-        ).start()
+    def _release_executor_after_teardown(self, build, executor):
+        """
+        Runs on the worker of an executor once the executor has finished its work for a build that is being torn down.
+        The worker of the last executor to be released finishes the teardown.
 
-    def _async_teardown_build(self):
+        :type build: _SlaveBuild
+        :type executor: SubjobExecutor
         """
-        Called from teardown_build(). Do asynchronous teardown for the build so that we can make the call to
-        teardown_build() non-blocking. Also take care of posting back to the master when teardown is complete.
+        if build.release_executor_after_teardown(executor):
+            self._async_teardown_build(build)
+
+    def _async_teardown_build(self, build):
+        """
+        Called once all executors of a build have been released after teardown_build(). Run the teardown_build commands
+        of the build (unless they are deferred), return the executors leased to the build to this slave, and post back
+        to the master that they are idle.
+
+        :type build: _SlaveBuild
         """
-        self._do_build_teardown_and_reset()
-        while not self._idle_executors.full():
-            time.sleep(1)
-        self._send_master_idle_notification()
+        self._teardown_build(build, allow_deferral=True)
+
+        # return the leased executors to this slave
+        with self._builds_lock:
+            self._builds_by_id.pop(build.build_id, None)
+            for executor in build.executors:
+                self._idle_executors.put(executor)
+        self._send_master_idle_notification(build.build_id)
 
     def _do_build_teardown_and_reset(self, timeout=None):
         """
-        Kill any currently running subjobs. Run the teardown_build commands for the current build (with an optional
-        timeout). Clear attributes related to the currently running build.
+        Kill any currently running subjobs. Run the teardown_build commands for all builds that are set up on this
+        slave and for all builds whose teardown was deferred (with an optional timeout).
 
         :param timeout: A maximum time in seconds to allow the teardown process to run before killing
         :type timeout: int | None
@@ -215,26 +342,67 @@ class ClusterSlave(ClusterService):
         for executor in self.executors_by_id.values():
             executor.kill()
 
-        # Order matters! Spend the coin if it has been initialized.
-        if not self._build_teardown_coin or not self._build_teardown_coin.spend() or not self._project_type:
-            return  # There is no build to tear down or teardown is already in progress.
+        with self._builds_lock:
+            builds = list(self._builds_by_id.values())
+            reusable_builds = list(self._reusable_builds_by_project_id.values())
+            self._reusable_builds_by_project_id.clear()
+        for build in builds:
+            self._teardown_build(build, timeout=timeout)
+        for reusable_build in reusable_builds:
+            self._run_build_teardown_commands(reusable_build, timeout=timeout)
+
+    def _teardown_build(self, build, timeout=None, allow_deferral=False):
+        """
+        Kill any currently running subjobs of the build and run its teardown_build commands (with an optional timeout).
+
+        :type build: _SlaveBuild
+        :param timeout: A maximum time in seconds to allow the teardown process to run before killing
+        :type timeout: int | None
+        :param allow_deferral: Whether the teardown_build commands should be deferred so that the next build of the
+            same project can reuse this build's setup. This only has an effect if the build has a setup cache key and
+            its setup completed.
+        :type allow_deferral: bool
+        """
+        # This only has an effect if we are tearing down before the build completes.
+        for executor in build.executors:
+            executor.kill()
+
+        if not build.teardown_coin.spend() or not build.project_type:
+            return  # Teardown is already in progress.
 
-        self._logger.info('Executing teardown for build {}.', self._current_build_id)
+        if allow_deferral and build.setup_cache_key is not None and build.is_setup_complete:
+            self._logger.info('Deferring teardown for build {} so that its setup can be reused.', build.build_id)
+            with self._builds_lock:
+                self._reusable_builds_by_project_id[build.project_type.project_id()] = build
+            return
+
+        self._run_build_teardown_commands(build, timeout=timeout)
+
+    def _run_build_teardown_commands(self, build, timeout=None):
+        """
+        Run the teardown_build commands for the build (with an optional timeout).
+
+        :type build: _SlaveBuild
+        :param timeout: A maximum time in seconds to allow the teardown process to run before killing
+        :type timeout: int | None
+        """
+        self._logger.info('Executing teardown for build {}.', build.build_id)
         # todo: Catch exceptions raised during teardown_build so we don't skip notifying master of idle/disconnect.
-        self._project_type.teardown_build(timeout=timeout)
-        self._logger.info('Build teardown complete for build {}.', self._current_build_id)
-        self._current_build_id = None
-        self._project_type = None
-        self._base_executor_index = None
+        build.project_type.teardown_build(timeout=timeout)
+        self._logger.info('Build teardown complete for build {}.', build.build_id)
 
-    def _send_master_idle_notification(self):
+    def _send_master_idle_notification(self, build_id):
+        """
+        :param build_id: the build whose executors are idle again
+        :type build_id: int
+        """
         if not self._is_master_responsive():
             self._logger.notice('Could not post idle notification to master because master is unresponsive.')
             return
 
-        # Notify master that this slave is finished with teardown and ready for a new build.
-        self._logger.info('Notifying master that this slave is ready for new builds.')
-        self._notify_master_of_state_change(SlaveState.IDLE)
+        # Notify master that this slave is finished with teardown and its executors are ready for a new build.
+        self._logger.info('Notifying master that the executors of build {} are ready for new builds.', build_id)
+        self._notify_master_of_state_change(SlaveState.IDLE, build_id)
 
     def _disconnect_from_master(self):
         """
@@ -296,58 +464,156 @@ class ClusterSlave(ClusterService):
 
     def start_working_on_subjob(self, build_id, subjob_id, atomic_commands):
         """
-        Begin working on a subjob with the given build id and subjob id. This just starts the subjob execution
-        asynchronously on a separate thread.
+        Begin working on a subjob with the given build id and subjob id. This returns immediately: the subjob is either
+        assigned to an idle executor leased to the build, which executes it on its worker thread, or queued until one of
+        the build's executors finishes its current subjob.
 
         :type build_id: int
         :type subjob_id: int
         :type atomic_commands: list[str]
         :return: The text to return in the API response.
-        :rtype: dict[str, int]
+        :rtype: dict[str, int | SubjobStartStatus | None]
         """
-        if build_id != self._current_build_id:
-            raise BadRequestError('Attempted to start subjob {} for build {}, '
-                                  'but current build id is {}.'.format(subjob_id, build_id, self._current_build_id))
+        build = self._builds_by_id.get(build_id)
+        if build is None:
+            raise BadRequestError('Attempted to start subjob {} for build {}, but current build ids are {}.'.format(
+                subjob_id, build_id, sorted(self._builds_by_id)))
+        if build.is_tearing_down:
+            raise BadRequestError('Attempted to start subjob {} for build {}, but the build is being torn down.'.format(
+                subjob_id, build_id))
+
+        # get an idle executor leased to the build to claim it as in-use (or queue the subjob until one is available)
+        executor = build.claim_executor_or_queue_subjob(subjob_id, atomic_commands)
+        if executor is None:
+            self._logger.info('Slave ({}:{}) has queued subjob. (Build {}, Subjob {})', self.host, self.port, build_id,
+                              subjob_id)
+            return {'executor_id': None, 'status': SubjobStartStatus.QUEUED}
+
+        self._executor_workers.submit(executor.id, self._execute_subjob, build, subjob_id, executor, atomic_commands)
+        self._logger.info('Slave ({}:{}) has received subjob. (Build {}, Subjob {})', self.host, self.port, build_id,
+                          subjob_id)
+        return {'executor_id': executor.id, 'status': SubjobStartStatus.ASSIGNED}
 
-        # get idle executor from queue to claim it as in-use (or block until one is available)
-        executor = self._idle_executors.get()
+    def start_working_on_subjobs(self, build_id, subjobs):
+        """
+        Begin working on several subjobs of the given build. Each subjob is assigned to an idle executor leased to the
+        build, or queued until one becomes available.
 
-        # Start a thread to execute the job (after waiting for setup to complete)
-        SafeThread(
-            target=self._execute_subjob,
-            args=(build_id, subjob_id, executor, atomic_commands),
-            name='Bld{}-Sub{}'.format(build_id, subjob_id),
-        ).start()
+        :type build_id: int
+        :param subjobs: the subjobs to start, each a dict with the 'subjob_id' and 'atomic_commands' of the subjob
+        :type subjobs: list[dict]
+        :return: The text to return in the API response.
+        :rtype: dict[str, list[int | SubjobStartStatus | None]]
+        """
+        executor_ids, statuses = [], []
+        for subjob in subjobs:
+            response = self.start_working_on_subjob(build_id, int(subjob['subjob_id']), subjob['atomic_commands'])
+            executor_ids.append(response['executor_id'])
+            statuses.append(response['status'])
+        return {'executor_ids': executor_ids, 'statuses': statuses}
+
+    def kill_subjob(self, build_id, subjob_id):
+        """
+        Kill the specified subjob if one of this slave's executors is currently executing it. The executor still
+        posts the (partial) results of the killed subjob back to the master.
 
-        self._logger.info('Slave ({}:{}) has received subjob. (Build {}, Subjob {})', self.host, self.port, build_id,
+        :type build_id: int
+        :type subjob_id: int
+        """
+        for executor in self.executors_by_id.values():
+            if executor.kill_subjob(build_id, subjob_id):
+                self._logger.info('Killed subjob on executor {}. (Build {}, Subjob {})', executor.id, build_id,
+                                  subjob_id)
+                return
+
+        build = self._builds_by_id.get(build_id)
+        if build is not None and build.remove_atoms_of_queued_subjob(subjob_id):
+            self._logger.info('Removed atoms of queued subjob. (Build {}, Subjob {})', build_id, subjob_id)
+            return
+
+        self._logger.info('Received request to kill subjob that is not executing. (Build {}, Subjob {})', build_id,
                           subjob_id)
-        return {'executor_id': executor.id}
 
-    def _execute_subjob(self, build_id, subjob_id, executor, atomic_commands):
+    def _execute_subjob(self, build, subjob_id, executor, atomic_commands):
         """
-        This is the method for executing a subjob asynchronously. This performs the work required by executing the
-        specified command, then does a post back to the master results endpoint to signal that the work is done.
+        This is the method for executing a subjob on the worker thread of its executor. This performs the work required
+        by executing the specified command and queues the upload of the results of each atom to the master as soon as
+        the atom finishes, followed by the notification that the subjob is complete. The executor then executes the
+        subjobs that were queued for the build while its executors were busy, one after another, before it becomes
+        idle.
 
-        :type build_id: int
+        :type build: _SlaveBuild
         :type subjob_id: int
         :type executor: SubjobExecutor
         :type atomic_commands: list[str]
         """
-        subjob_event_data = {'build_id': build_id, 'subjob_id': subjob_id, 'executor_id': executor.id}
+        next_subjob = (subjob_id, atomic_commands)
+        while next_subjob is not None:
+            subjob_id, atomic_commands = next_subjob
+            subjob_event_data = {'build_id': build.build_id, 'subjob_id': subjob_id, 'executor_id': executor.id}
+
+            analytics.record_event(analytics.SUBJOB_EXECUTION_START, **subjob_event_data)
+            executor.execute_subjob(build.build_id, subjob_id, atomic_commands, build.build_executor_index(executor),
+                                    partial(self._queue_atom_results_upload, build.build_id, subjob_id, executor.id))
+            analytics.record_event(analytics.SUBJOB_EXECUTION_FINISH, **subjob_event_data)
+
+            # work is done; take the next queued subjob for this executor, or mark the executor as idle
+            next_subjob = build.next_queued_subjob_or_release_executor(executor)
+            # The uploads of an executor run in order, so master receives the results of all atoms of the subjob first.
+            self._result_upload_workers.submit(executor.id, self._post_subjob_completion, build.build_id, subjob_id,
+                                               executor.id, block=True)
+
+    def _queue_atom_results_upload(self, build_id, subjob_id, executor_id, atom_id, results_file):
+        """
+        Called by an executor when an atom has finished. The upload waits for room in the upload queue, so an executor
+        cannot get far ahead of its uploads.
+
+        :type build_id: int
+        :type subjob_id: int
+        :type executor_id: int
+        :type atom_id: int
+        :param results_file: the path to the archive of the atom's results
+        :type results_file: str
+        """
+        self._result_upload_workers.submit(executor_id, self._post_atom_results, build_id, subjob_id, atom_id,
+                                           results_file, block=True)
 
-        analytics.record_event(analytics.SUBJOB_EXECUTION_START, **subjob_event_data)
-        results_file = executor.execute_subjob(build_id, subjob_id, atomic_commands, self._base_executor_index)
-        analytics.record_event(analytics.SUBJOB_EXECUTION_FINISH, **subjob_event_data)
+    def _post_atom_results(self, build_id, subjob_id, atom_id, results_file):
+        """
+        Post the results of an atom back to the master atom results endpoint.
 
+        :type build_id: int
+        :type subjob_id: int
+        :type atom_id: int
+        :param results_file: the path to the archive of the atom's results
+        :type results_file: str
+        """
+        results_url = self._master_api.url('build', build_id, 'subjob', subjob_id, 'atom', atom_id, 'result')
+        data = {'slave': '{}:{}'.format(self.host, self.port)}
+        with open(results_file, 'rb') as results:
+            files = {'file': ('payload', results, 'application/x-compressed')}
+            resp = self._network.post(results_url, data=data, files=files)
+        if not resp.ok:
+            self._logger.error(
+                ('Build {}, Subjob {}, Atom {} encountered an error when sending results to master.'
+                 '\n\tStatus Code {}\n\t{}').format(build_id, subjob_id, atom_id, resp.status_code, resp.text))
+
+    def _post_subjob_completion(self, build_id, subjob_id, executor_id):
+        """
+        Post to the master subjob results endpoint to signal that the work is done. The results of the subjob's atoms
+        have already been posted as each atom finished.
+
+        :type build_id: int
+        :type subjob_id: int
+        :type executor_id: int
+        """
         results_url = self._master_api.url('build', build_id, 'subjob', subjob_id, 'result')
         data = {
             'slave': '{}:{}'.format(self.host, self.port),
-            'metric_data': {'executor_id': executor.id},
+            'metric_data': {'executor_id': executor_id},
         }
-        files = {'file': ('payload', open(results_file, 'rb'), 'application/x-compressed')}
 
-        self._idle_executors.put(executor)  # work is done; mark executor as idle
-        resp = self._network.post(results_url, data=data, files=files)
+        resp = self._network.post(results_url, data=data)
         if resp.ok:
             self._logger.info('Build {}, Subjob {} completed and sent results to master.', build_id, subjob_id)
         else:
@@ -355,15 +621,20 @@ class ClusterSlave(ClusterService):
                 ('Build {}, Subjob {} encountered an error when sending results to master.'
                  '\n\tStatus Code {}\n\t{}').format(build_id, subjob_id, resp.status_code, resp.text))
 
-    def _notify_master_of_state_change(self, new_state):
+    def _notify_master_of_state_change(self, new_state, build_id=None):
         """
         Send a state notification to the master. This is used to notify the master of events occurring on the slave
         related to build execution progress.
 
         :type new_state: SlaveState
+        :param build_id: the build that the state change is for, if any
+        :type build_id: int | None
         """
         state_url = self._master_api.url('slave', self._slave_id)
-        self._network.put_with_digest(state_url, request_params={'slave': {'state': new_state}},
+        slave_state = {'state': new_state}
+        if build_id is not None:
+            slave_state['build_id'] = build_id
+        self._network.put_with_digest(state_url, request_params={'slave': slave_state},
                                       secret=Secret.get(), error_on_failure=True)
 
     def kill(self):
@@ -373,6 +644,116 @@ class ClusterSlave(ClusterService):
         sys.exit(0)
 
 
+class _SlaveBuild(object):
+    """
+    The state of a build that is set up on this slave, including the executors that are leased to the build.
+    """
+    def __init__(self, build_id, project_type, executors, base_executor_index, setup_cache_key=None):
+        """
+        :type build_id: int
+        :param project_type: the project_type instance for build-level operations
+        :type project_type: app.project_type.project_type.ProjectType
+        :param executors: the executors leased to this build
+        :type executors: list[SubjobExecutor]
+        :param base_executor_index: how many executors have already been allocated on other slaves for this build
+        :type base_executor_index: int
+        :param setup_cache_key: identifies the result of this build's setup, or None if its setup is not reusable
+        :type setup_cache_key: str | None
+        """
+        self.build_id = build_id
+        self.project_type = project_type
+        self.executors = executors
+        self.idle_executors = Queue()
+        for executor in executors:
+            self.idle_executors.put(executor)
+        # The subjobs sent by the master while all executors were busy, as (subjob id, atomic commands) pairs
+        self._queued_subjobs = deque()
+        self._subjob_queue_lock = Lock()
+        self.base_executor_index = base_executor_index
+        self.setup_cache_key = setup_cache_key
+        self.is_setup_complete = False
+        self.is_tearing_down = False
+        self._num_executors_released = 0
+        self.teardown_coin = SingleUseCoin()  # protects against build_teardown being executed multiple times
+
+    def claim_executor_or_queue_subjob(self, subjob_id, atomic_commands):
+        """
+        Claim an idle executor to run the specified subjob on. If all executors are busy, queue the subjob to run on
+        the next executor that finishes its subjob instead.
+
+        :type subjob_id: int
+        :type atomic_commands: list[str]
+        :return: the claimed executor, or None if the subjob was queued
+        :rtype: SubjobExecutor | None
+        """
+        with self._subjob_queue_lock:
+            try:
+                return self.idle_executors.get(block=False)
+            except Empty:
+                self._queued_subjobs.append((subjob_id, atomic_commands))
+                return None
+
+    def next_queued_subjob_or_release_executor(self, executor):
+        """
+        Take the next queued subjob for an executor that has finished its subjob. If no subjobs are queued, mark the
+        executor as idle.
+
+        :type executor: SubjobExecutor
+        :return: the subjob id and atomic commands of the next queued subjob, or None if no subjobs are queued
+        :rtype: (int, list[str]) | None
+        """
+        with self._subjob_queue_lock:
+            if self._queued_subjobs:
+                return self._queued_subjobs.popleft()
+            self.idle_executors.put(executor)
+            return None
+
+    def release_executor_after_teardown(self, executor):
+        """
+        Record that an executor has finished its work for this build after the build's teardown was requested.
+
+        :type executor: SubjobExecutor
+        :return: whether all executors leased to this build have now been released
+        :rtype: bool
+        """
+        with self._subjob_queue_lock:
+            self._num_executors_released += 1
+            return self._num_executors_released == len(self.executors)
+
+    def remove_atoms_of_queued_subjob(self, subjob_id):
+        """
+        Remove all atoms of a queued subjob, so that the subjob finishes (and reports its empty results to the master)
+        as soon as an executor starts it.
+
+        :type subjob_id: int
+        :return: whether the subjob was queued
+        :rtype: bool
+        """
+        with self._subjob_queue_lock:
+            for index, (queued_subjob_id, _) in enumerate(self._queued_subjobs):
+                if queued_subjob_id == subjob_id:
+                    self._queued_subjobs[index] = (subjob_id, [])
+                    return True
+        return False
+
+    def build_executor_index(self, executor):
+        """
+        :param executor: one of the executors leased to this build
+        :type executor: SubjobExecutor
+        :return: the index of the executor out of all executors working on this build across all slaves
+        :rtype: int
+        """
+        return self.base_executor_index + self.executors.index(executor)
+
+
+class SubjobStartStatus(str, Enum):
+    """
+    An enum of the outcomes of a request to start a subjob on this slave.
+    """
+    ASSIGNED = 'ASSIGNED'  # The subjob was assigned to an idle executor, which has started executing it.
+    QUEUED = 'QUEUED'  # All executors of the build are busy; the next one to finish its subjob will execute it.
+
+
 class SlaveState(str, Enum):
     """
     An enum of possible slave states. Also inherits from string to allow comparisons with other strings (which is
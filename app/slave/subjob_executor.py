@@ -1,5 +1,7 @@
+import json
 import os
 import shutil
+from threading import Lock
 import time
 
 from app.master.build import BuildArtifact
@@ -22,6 +24,10 @@ class SubjobExecutor(object):
         self._current_build_id = None
         self._current_subjob_id = None
         self._index_in_build = None
+        self._is_current_subjob_killed = False
+        # Guards the current subjob and its kill flag, since kill_subjob() is called from another thread. Without it, a
+        # kill could be requested just after the subjob finished and leave the kill signal set for the next subjob.
+        self._current_subjob_lock = Lock()
 
     def api_representation(self):
         """
@@ -50,28 +56,40 @@ class SubjobExecutor(object):
     def run_job_config_setup(self):
         self._project_type.run_job_config_setup()
 
-    def execute_subjob(self, build_id, subjob_id, atomic_commands, base_executor_index):
+    def execute_subjob(self, build_id, subjob_id, atomic_commands, build_executor_index, atom_finished_callback):
         """
-        This is the method for executing a subjob. This performs the work required by executing the specified command,
-        then archives the results into a single file and returns the filename.
+        This is the method for executing a subjob. This performs the work required by executing the specified command.
+        As soon as each atom finishes, its results are archived into a file of their own and the callback is called
+        with the filename, so that the results can be sent back to master while the remaining atoms are executing.
 
         :type build_id: int
         :type subjob_id: int
         :type atomic_commands: list[str]
-        :type base_executor_index: int
-        :rtype: str
+        :param build_executor_index: the index of this executor out of all executors working on the build
+        :type build_executor_index: int
+        :param atom_finished_callback: called with the atom id and the path to the archive of the atom's results after
+            each atom that was executed
+        :type atom_finished_callback: (int, str) -> None
         """
         self._logger.info('Executing subjob (Build {}, Subjob {})...', build_id, subjob_id)
 
         # Set the current task
-        self._current_build_id = build_id
-        self._current_subjob_id = subjob_id
+        with self._current_subjob_lock:
+            self._current_build_id = build_id
+            self._current_subjob_id = subjob_id
+            self._is_current_subjob_killed = False
 
-        # Maintain a list of atom artifact directories for compression and sending back to master
-        atom_artifact_dirs = []
+        # atom result archive names must be unique for a build, so they are named after the subjob and atom
+        subjob_artifact_dir = BuildArtifact.build_artifact_directory(build_id,
+                                                                     result_root=Configuration['artifact_directory'])
 
         # execute every atom and keep track of time elapsed for each
         for atom_id, atomic_command in enumerate(atomic_commands):
+            if self._is_current_subjob_killed:
+                self._logger.info('Skipping remaining atoms of killed subjob (Build {}, Subjob {}).',
+                                  build_id, subjob_id)
+                break
+
             atom_artifact_dir = BuildArtifact.atom_artifact_directory(
                 build_id,
                 subjob_id,
@@ -88,11 +106,9 @@ class SubjobExecutor(object):
                 'ATOM_ID': atom_id,
                 'EXECUTOR_INDEX': self.id,  # Deprecated, use MACHINE_EXECUTOR_INDEX
                 'MACHINE_EXECUTOR_INDEX': self.id,
-                'BUILD_EXECUTOR_INDEX': base_executor_index + self.id,
+                'BUILD_EXECUTOR_INDEX': build_executor_index,
             }
 
-            atom_artifact_dirs.append(atom_artifact_dir)
-
             job_name = self._project_type.job_name
             atom_event_data = {'build_id': build_id, 'atom_id': atom_id, 'job_name': job_name, 'subjob_id': subjob_id}
             analytics.record_event(analytics.ATOM_START, **atom_event_data)
@@ -102,21 +118,18 @@ class SubjobExecutor(object):
             atom_event_data['exit_code'] = exit_code
             analytics.record_event(analytics.ATOM_FINISH, **atom_event_data)
 
-        # Generate mapping of atom directories (for archiving) to paths in the archive file
-        targets_to_archive_paths = {atom_dir: os.path.basename(os.path.normpath(atom_dir))
-                                    for atom_dir in atom_artifact_dirs}
-
-        # zip file names must be unique for a build, so we append the subjob_id to the compressed file
-        subjob_artifact_dir = BuildArtifact.build_artifact_directory(build_id,
-                                                                     result_root=Configuration['artifact_directory'])
-        tarfile_path = os.path.join(subjob_artifact_dir, 'results_{}.tar.gz'.format(subjob_id))
-        fs_util.tar_directories(targets_to_archive_paths, tarfile_path)
+            tarfile_path = os.path.join(subjob_artifact_dir, 'results_{}_{}.tar.gz'.format(subjob_id, atom_id))
+            fs_util.tar_directories({atom_artifact_dir: os.path.basename(os.path.normpath(atom_artifact_dir))},
+                                    tarfile_path)
+            atom_finished_callback(atom_id, tarfile_path)
 
         # Reset the current task
-        self._current_build_id = None
-        self._current_subjob_id = None
-
-        return tarfile_path
+        with self._current_subjob_lock:
+            self._current_build_id = None
+            self._current_subjob_id = None
+            if self._is_current_subjob_killed:
+                self._project_type.reset_kill_signal()  # allow the next subjob on this executor to run
+                self._is_current_subjob_killed = False
 
     def kill(self):
         """
@@ -125,10 +138,28 @@ class SubjobExecutor(object):
         if self._project_type:
             self._project_type.kill_subprocesses()
 
+    def kill_subjob(self, build_id, subjob_id):
+        """
+        Kill the subprocesses of the specified subjob and skip its remaining atoms, if this executor is currently
+        executing that subjob. Unlike kill(), the executor can go on to execute other subjobs afterwards.
+
+        :type build_id: int
+        :type subjob_id: int
+        :return: whether this executor was executing the specified subjob
+        :rtype: bool
+        """
+        with self._current_subjob_lock:
+            if (build_id, subjob_id) != (self._current_build_id, self._current_subjob_id):
+                return False
+
+            self._is_current_subjob_killed = True
+            self._project_type.kill_subprocesses()
+            return True
+
     def _execute_atom_command(self, atomic_command, atom_environment_vars, atom_artifact_dir):
         """
-        Run the main command for this atom. Output the command, console output and exit code to
-        files in the atom artifact directory. Return the exit code.
+        Run the main command for this atom. Output the command, console output, exit code, elapsed time and resource
+        usage to files in the atom artifact directory. Return the exit code.
 
         :type atomic_command: str
         :type atom_environment_vars: dict[str, str]
@@ -139,9 +170,11 @@ class SubjobExecutor(object):
         # This console_output_file must be opened in 'w+b' mode in order to be interchangeable with the
         # TemporaryFile instance that gets instantiated in self._project_type.execute_command_in_project.
         with open(os.path.join(atom_artifact_dir, BuildArtifact.OUTPUT_FILE), mode='w+b') as console_output_file:
+            resource_usages = []
             start_time = time.time()
             _, exit_code = self._project_type.execute_command_in_project(atomic_command, atom_environment_vars,
-                                                                         output_file=console_output_file)
+                                                                         output_file=console_output_file,
+                                                                         resource_usage_callback=resource_usages.append)
             elapsed_time = time.time() - start_time
 
         exit_code_output_path = os.path.join(atom_artifact_dir, BuildArtifact.EXIT_CODE_FILE)
@@ -153,4 +186,9 @@ class SubjobExecutor(object):
         time_output_path = os.path.join(atom_artifact_dir, BuildArtifact.TIMING_FILE)
         fs_util.write_file('{:.2f}\n'.format(elapsed_time), time_output_path)
 
+        # The resource usage is not available if the command could not be measured (e.g., on Windows).
+        if resource_usages:
+            resource_usage_output_path = os.path.join(atom_artifact_dir, BuildArtifact.RESOURCE_USAGE_FILE)
+            fs_util.write_file(json.dumps(resource_usages[0]) + '\n', resource_usage_output_path)
+
         return exit_code
@@ -46,6 +46,10 @@ class MasterSubcommand(ServiceSubcommand):
         start_master_heartbeat_tracker = functools.partial(cluster_master.start_heartbeat_tracker_thread)
         ioloop.add_callback(start_master_heartbeat_tracker)
 
+        # start scaling the cluster's slaves once ioloop starts
+        start_master_autoscaler = functools.partial(cluster_master.start_autoscaler_thread)
+        ioloop.add_callback(start_master_autoscaler)
+
         ioloop.start()  # this call blocks until the server is stopped
         ioloop.close(all_fds=True)  # all_fds=True is necessary here to make sure connections don't hang
         self._logger.notice('Master server was stopped.')
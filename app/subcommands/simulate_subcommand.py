@@ -0,0 +1,55 @@
+import sys
+
+from app.master.scheduling_simulator import SchedulingSimulator, load_workloads, parse_policy, read_events
+from app.subcommands.subcommand import Subcommand
+from app.util import log
+
+
+class SimulateSubcommand(Subcommand):
+
+    def run(self, log_level, eventlog_files, num_slaves, num_executors, policies=None, max_executors=None,
+            teardown_time=0.0):
+        """
+        Replay the builds recorded in a cluster's event logs on a simulated cluster once for each scheduling policy, and
+        report the makespan, queue time and utilization of each policy.
+
+        :param log_level: the log level at which to do application logging (or None for default log level)
+        :type log_level: str | None
+        :param eventlog_files: the event log files of the master and its slaves
+        :type eventlog_files: list[str]
+        :param num_slaves: the number of slaves in the simulated cluster
+        :type num_slaves: int
+        :param num_executors: the number of executors of each simulated slave
+        :type num_executors: int
+        :param policies: the policies to compare, each a comma separated list of setting=value pairs; the current
+            settings are always simulated first
+        :type policies: list[str] | None
+        :param max_executors: the max_executors of each build's job; defaults to the number of executors in the cluster
+        :type max_executors: int | None
+        :param teardown_time: how long a slave takes to tear down a build, in seconds
+        :type teardown_time: float
+        """
+        # The scheduling components log every allocation at the info level, which would drown out the results.
+        log.configure_logging(log_level=log_level or 'NOTICE', simplified_console_logs=True)
+
+        try:
+            named_policies = [('current settings', {})] + [(policy, parse_policy(policy)) for policy in policies or []]
+        except ValueError as ex:
+            self._logger.error(str(ex))
+            sys.exit(1)
+
+        events = [event for eventlog_file in eventlog_files for event in read_events(eventlog_file)]
+        workloads = load_workloads(events)
+        if len(workloads) == 0:
+            self._logger.error('The event logs do not contain any atoms that ran. Event logs of the slaves are needed '
+                               'to simulate their builds.')
+            sys.exit(1)
+        self._logger.notice('Simulating {} builds on {} slaves with {} executors each.',
+                            len(workloads), num_slaves, num_executors)
+
+        simulator = SchedulingSimulator(workloads, num_slaves, num_executors, max_executors, teardown_time)
+        for policy_name, policy in named_policies:
+            result = simulator.run(policy)
+            self._logger.notice('{}: makespan {:.1f}s, mean queue time {:.1f}s, mean build time {:.1f}s, '
+                                'utilization {:.1%}', policy_name, result.makespan, result.mean_queue_time,
+                                result.mean_build_time, result.utilization)
@@ -11,6 +11,7 @@ MASTER_TRIGGERED_SUBJOB = 'MASTER_TRIGGERED_SUBJOB'
 SERVICE_STARTED = 'SERVICE_STARTED'
 SUBJOB_EXECUTION_FINISH = 'SUBJOB_EXECUTION_FINISH'
 SUBJOB_EXECUTION_START = 'SUBJOB_EXECUTION_START'
+SUBJOB_SPECULATIVE_EXECUTION_START = 'SUBJOB_SPECULATIVE_EXECUTION_START'
 ATOM_START = 'ATOM_START'
 ATOM_FINISH = 'ATOM_FINISH'
 
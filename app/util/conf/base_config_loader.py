@@ -162,6 +162,24 @@ class BaseConfigLoader(object):
             'heartbeat_interval',
             'heartbeat_failure_threshold',
             'unresponsive_slaves_cleanup_interval',
+            'atom_grouping_strategy',
+            'tail_subjob_splitting',
+            'speculative_execution_slowdown_factor',
+            'build_priority_aging_interval',
+            'reuse_build_setup',
+            'prefetch_project_on_idle_slaves',
+            'subjob_dispatch_depth',
+            'cache_atom_results',
+            'atom_result_cache_size',
+            'atomizer_output_cache_size',
+            'max_concurrent_atomizers',
+            'prepare_builds_in_git_worktrees',
+            'slave_reservation_lead_time',
+            'demand_target_latency',
+            'autoscaler',
+            'autoscaler_interval',
+            'local_autoscaler_max_slaves',
+            'warm_command_runner',
         ]
 
     def _load_section_from_config_file(self, config, config_filename, section):
@@ -210,6 +228,9 @@ class BaseConfigLoader(object):
         elif isinstance(default_value, int):
             config.set(key, int(value))
 
+        elif isinstance(default_value, float):
+            config.set(key, float(value))
+
         elif isinstance(default_value, list):
             # The ConfigObj library converts comma delimited strings to lists.  In the case on a single element, we
             # need to do the conversion ourselves.
@@ -1,6 +1,6 @@
 from os.path import join
 
-from app.util.conf.base_config_loader import BaseConfigLoader
+from app.util.conf.base_config_loader import BaseConfigLoader, InvalidConfigError
 
 
 class MasterConfigLoader(BaseConfigLoader):
@@ -22,13 +22,57 @@ class MasterConfigLoader(BaseConfigLoader):
         # Default values for heartbeat configuration
         conf.set('unresponsive_slaves_cleanup_interval', 600)
 
+        # How atoms are grouped into subjobs when historic timing data exists ('time_based' or 'bin_packing'). The
+        # 'bin_packing' grouper creates exactly min(max_executors, number of atoms) subjobs, without gap fillers.
+        conf.set('atom_grouping_strategy', 'time_based')
+        # Should unstarted subjobs be split into smaller subjobs near the end of a build to keep executors busy?
+        conf.set('tail_subjob_splitting', False)
+        # A duplicate of an in-progress subjob is started on an otherwise idle executor once the subjob has been
+        # running this many times longer than its expected time. 0 disables speculative execution.
+        conf.set('speculative_execution_slowdown_factor', 0.0)
+        # The priority of a build waiting for slaves increases by one every this many seconds. 0 disables aging.
+        conf.set('build_priority_aging_interval', 0)
+        # Should slaves skip build setup when their last build of a project used the same commit and setup commands?
+        conf.set('reuse_build_setup', False)
+        # Should idle slaves start fetching a build's project while the build is still being atomized on the master?
+        conf.set('prefetch_project_on_idle_slaves', False)
+        # How many subjobs to keep sent to each slave executor working on a build. 1 sends a subjob only once the executor
+        # has finished its previous one.
+        conf.set('subjob_dispatch_depth', 1)
+        # Should the results of passed atoms be cached, so that later builds of the same source tree can skip them?
+        conf.set('cache_atom_results', False)
+        # How many atom results the master keeps cached. The least recently used results are evicted once a build has
+        # finished and the cache holds more. 0 means there is no limit.
+        conf.set('atom_result_cache_size', 10000)
+        # How many atomizer command outputs (per commit) the master keeps cached in memory. 0 disables the cache.
+        conf.set('atomizer_output_cache_size', 0)
+        # The maximum number of atomizer commands of a job that the master runs at the same time.
+        conf.set('max_concurrent_atomizers', 1)
+        # Should builds of the same git repo be fetched and atomized concurrently, each in its own git worktree?
+        conf.set('prepare_builds_in_git_worktrees', False)
+        # How many seconds before a build is expected to finish its slaves are reserved for the next waiting build. 0
+        # disables slave reservations.
+        conf.set('slave_reservation_lead_time', 0.0)
+        # Within how many seconds should queued work finish? Used to compute the executors needed in the cluster demand.
+        conf.set('demand_target_latency', 600)
+        # Which autoscaler starts and stops slaves to meet the cluster demand ('none', 'local' or a dotted class path)
+        conf.set('autoscaler', 'none')
+        # How often (in seconds) the autoscaler is run
+        conf.set('autoscaler_interval', 30)
+        # The maximum number of slaves the 'local' autoscaler starts on the master's host
+        conf.set('local_autoscaler_max_slaves', 4)
+
     def configure_postload(self, conf):
         """
         After the clusterrunner.conf file has been loaded, generate the master-specific paths which descend from the
-        base_directory.
+        base_directory and validate the master-specific settings.
         :type conf: Configuration
         """
         super().configure_postload(conf)
+        if conf.get('demand_target_latency') <= 0:
+            raise InvalidConfigError('The value for demand_target_latency should be a positive number of seconds, but '
+                                     'it is {}'.format(conf.get('demand_target_latency')))
+
         base_directory = conf.get('base_directory')
         # where repos are cloned on the master
         conf.set('repo_directory', join(base_directory, 'repos', 'master'))
@@ -41,3 +85,7 @@ class MasterConfigLoader(BaseConfigLoader):
         # where to store results on the master
         conf.set('results_directory', join(base_directory, 'results', 'master'))
         conf.set('timings_directory', join(base_directory, 'timings', 'master'))  # timing data
+        # the database of historic atom times, which replaces the JSON timing files in timings_directory
+        conf.set('timing_database_file', join(base_directory, 'timings', 'timing_data.sqlite3'))
+        # where the results of passed atoms are cached when cache_atom_results is enabled
+        conf.set('atom_result_cache_directory', join(base_directory, 'atom_result_cache'))
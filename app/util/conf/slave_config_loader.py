@@ -20,6 +20,8 @@ class SlaveConfigLoader(BaseConfigLoader):
         conf.set('master_hostname', 'localhost')
         conf.set('master_port', 43000)
         conf.set('shallow_clones', True)
+        # Should each executor run atom commands in a long-lived shell instead of starting a new shell for each one?
+        conf.set('warm_command_runner', False)
         # Use a longer timeout for slaves since we don't yet have request metrics on the slave side and since
         # slaves are more likely to encounter long response times on the master due to the master being a
         # centralized hub with a single-threaded server.
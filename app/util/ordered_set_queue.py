@@ -1,5 +1,5 @@
 import collections
-from queue import Queue
+from queue import Empty, Queue
 
 
 class OrderedSetQueue(Queue):
@@ -16,6 +16,23 @@ class OrderedSetQueue(Queue):
     def _get(self):
         return self.queue.pop()
 
+    def get_max_nowait(self, key):
+        """
+        Remove and return the item in the queue for which key(item) is greatest, without blocking. Of items with equal
+        keys, the one that get() would return first is returned.
+
+        :param key: a function that returns the value to compare an item by
+        :type key: (object) -> object
+        :raises queue.Empty: if the queue is empty
+        """
+        with self.not_empty:
+            if not self._qsize():
+                raise Empty
+            item = max(reversed(self.queue), key=key)
+            self.queue.discard(item)
+            self.not_full.notify()
+            return item
+
 
 class OrderedSet(collections.MutableSet):
     """
@@ -1,6 +1,7 @@
 from contextlib import suppress
 import os
 import subprocess
+import sys
 import time
 
 SIGINFO = 29  # signal.SIGINFO is not present in all Python distributions
@@ -48,6 +49,75 @@ def kill_hard(process):
     return process.returncode, stdout, stderr
 
 
+def wait_without_reaping(process, timeout=None):
+    """
+    Wait for the process to exit without reaping it. Until the process is reaped by process.wait() or
+    wait_and_get_resource_usage(), its pid cannot be reused by another process, so it is still safe to signal it.
+    This requires os.waitid, which is not available on all platforms.
+
+    :param process: The process to wait for
+    :type process: subprocess.Popen
+    :param timeout: the maximum number of seconds to wait, or None to wait until the process exits
+    :type timeout: float | None
+    :raises subprocess.TimeoutExpired: if the process has not exited within the timeout
+    """
+    if process.returncode is not None:
+        return  # The process has already been reaped.
+
+    options = os.WEXITED | os.WNOWAIT
+    if timeout is None:
+        while True:
+            try:
+                os.waitid(os.P_PID, process.pid, options)
+                return
+            except InterruptedError:
+                continue  # Python 3.4 does not retry system calls that are interrupted by a signal (PEP 475).
+
+    # Poll the same way process.wait() does when it is given a timeout.
+    end_time = time.time() + timeout
+    delay = 0.0005
+    while os.waitid(os.P_PID, process.pid, options | os.WNOHANG) is None:
+        remaining_time = end_time - time.time()
+        if remaining_time <= 0:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        time.sleep(min(delay, remaining_time))
+        delay = min(delay * 2, 0.05)
+
+
+def wait_and_get_resource_usage(process):
+    """
+    Wait for the process to exit, like process.wait(), and measure the resources that the process and the descendants
+    it waited for have used.
+
+    :param process: The process to wait for
+    :type process: subprocess.Popen
+    :return: the resource usage, or None if it is not available on this platform or the process was already waited for
+    :rtype: dict[str, int | float] | None
+    """
+    if not hasattr(os, 'wait4') or process.returncode is not None:
+        process.wait()
+        return None
+
+    while True:
+        try:
+            _, exit_status, rusage = os.wait4(process.pid, 0)
+            break
+        except InterruptedError:
+            continue  # Python 3.4 does not retry system calls that are interrupted by a signal (PEP 475).
+    # Set the returncode just like process.wait() would have, since the process cannot be waited for twice.
+    process.returncode = -os.WTERMSIG(exit_status) if os.WIFSIGNALED(exit_status) else os.WEXITSTATUS(exit_status)
+    return {
+        'user_cpu_time': rusage.ru_utime,
+        'system_cpu_time': rusage.ru_stime,
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+        'max_rss_kb': rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss,
+        'block_input_operations': rusage.ru_inblock,
+        'block_output_operations': rusage.ru_oublock,
+        'voluntary_context_switches': rusage.ru_nvcsw,
+        'involuntary_context_switches': rusage.ru_nivcsw,
+    }
+
+
 def is_windows():
     """
     :return: Whether ClusterRunner is running on Windows or not>
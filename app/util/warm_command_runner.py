@@ -0,0 +1,227 @@
+import os
+import select
+import subprocess
+from subprocess import TimeoutExpired
+from threading import Lock
+
+from app.util import log
+from app.util.process_utils import is_windows
+
+
+class WarmCommandRunner(object):
+    """
+    A WarmCommandRunner is a long-lived shell process that runs shell commands on request (a fork server). Each command
+    runs in a subshell forked from the runner, so running a command does not start a new shell from scratch the way
+    Popen(shell=True) does. For short commands, such as a single test, that startup is a large share of the runtime.
+
+    Each command runs in its own process group (the runner has job control enabled), so it can be terminated through
+    its process group like a command started with Popen(start_new_session=True), using
+    WarmCommand.signal_process_group(). The runner runs one command at a time and requires bash, so it is not available
+    on Windows.
+    """
+    _SHELL = '/bin/bash'
+    # Requests are NUL-delimited since NUL is the only character a shell command cannot contain. For each request, the
+    # command's subshell replies with its pid and then with the exit status of the command, which is the negative signal
+    # number if the command was terminated by the SIGTERM sent to its process group (like Popen's returncode). The
+    # command runs in a nested subshell, so that the outer subshell (the process group leader) outlives it: after
+    # reporting the exit status, it keeps the process group alive (so that its id cannot be reused) until the exit has
+    # been acknowledged with an empty request. Only then does the runner reap the subshell and reply with the status
+    # that wait reports for it. Each reply is on a line of its own.
+    _SERVER_SCRIPT = '''
+set -m
+while IFS= read -r -d '' output_file && IFS= read -r -d '' command; do
+    (
+        terminated=
+        trap 'terminated=1' TERM
+        printf 'pid %s\\n' "$BASHPID"
+        ( exec > "$output_file" 2>&1 < /dev/null && eval "$command" )
+        status=$?
+        if [ -n "$terminated" ] && [ "$status" -eq $((128 + 15)) ]; then status=-15; fi
+        printf 'exit %s\\n' "$status"
+        while IFS= read -r -d '' _; [ "$?" -gt 128 ]; do :; done
+    ) &
+    wait "$!"
+    printf 'done %s\\n' "$?"
+done
+'''
+
+    def __init__(self, env=None):
+        """
+        :param env: the environment of the runner, inherited by every command it runs; defaults to the environment of
+            this process
+        :type env: dict[str, str] | None
+        """
+        self._logger = log.get_logger(__name__)
+        self._env = env
+        self._process = None
+        self._output_buffer = b''
+        self._command_lock = Lock()  # held while a command is running, since the runner runs one command at a time
+
+    @classmethod
+    def is_supported(cls):
+        """
+        :rtype: bool
+        """
+        return not is_windows() and os.path.exists(cls._SHELL)
+
+    def start(self):
+        """
+        Start the runner process.
+        """
+        self._process = subprocess.Popen(
+            [self._SHELL, '-c', self._SERVER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,  # job control status messages are not interesting
+            env=self._env,
+            start_new_session=True,
+        )
+        self._output_buffer = b''
+
+    def stop(self):
+        """
+        Stop the runner process. A command that is still running is not terminated.
+        """
+        if self._process is None:
+            return
+        self._process.stdin.close()  # the runner exits once its input is exhausted
+        try:
+            self._process.wait(timeout=5)
+        except TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process.stdout.close()
+        self._process = None
+
+    @property
+    def is_running(self):
+        """
+        :rtype: bool
+        """
+        return self._process is not None and self._process.poll() is None
+
+    def run(self, command, output_file_path):
+        """
+        Start running a command in a subshell of the runner. The returned object can be used like a Popen object to
+        wait for the command. The next command can only be run after this one has been waited for.
+
+        :param command: the shell command to run; it is evaluated by bash
+        :type command: str
+        :param output_file_path: the path of the file to write the command's console output (stdout and stderr) to
+        :type output_file_path: str
+        :rtype: WarmCommand
+        """
+        if not self._command_lock.acquire(blocking=False):
+            raise RuntimeError('The warm command runner is already running a command.')
+        try:
+            request = '{}\0{}\0'.format(output_file_path, command).encode()
+            self._process.stdin.write(request)
+            self._process.stdin.flush()
+            pid = int(self._read_reply('pid', timeout=None))
+        except:
+            self._command_lock.release()
+            raise
+        return WarmCommand(self, pid)
+
+    def _acknowledge_exit(self):
+        """
+        Let the subshell of the current command exit after it has reported the exit status of the command.
+        """
+        self._process.stdin.write(b'\0')
+        self._process.stdin.flush()
+
+    def _read_line(self, timeout):
+        """
+        Read the next line of the runner's replies.
+
+        :param timeout: the maximum number of seconds to wait for the line, or None to wait indefinitely
+        :type timeout: float | None
+        :rtype: str
+        """
+        stdout_fd = self._process.stdout.fileno()
+        while b'\n' not in self._output_buffer:
+            readable_fds, _, _ = select.select([stdout_fd], [], [], timeout)
+            if not readable_fds:
+                raise TimeoutExpired(self._SHELL, timeout)
+            output = os.read(stdout_fd, 4096)
+            if not output:
+                raise RuntimeError('The warm command runner exited unexpectedly.')
+            self._output_buffer += output
+        line, self._output_buffer = self._output_buffer.split(b'\n', 1)
+        return line.decode()
+
+    def _read_reply(self, *expected_reply_types, timeout):
+        """
+        Read the next reply of the runner, which must be of one of the expected types.
+
+        :param expected_reply_types: the types of reply that can come next ('pid', 'exit' or 'done')
+        :type expected_reply_types: str
+        :param timeout: the maximum number of seconds to wait for the reply, or None to wait indefinitely
+        :type timeout: float | None
+        :return: the value of the reply, or the type and value if several types of reply were expected
+        :rtype: str | (str, str)
+        """
+        reply_type, _, value = self._read_line(timeout).partition(' ')
+        if reply_type not in expected_reply_types:
+            raise RuntimeError('The warm command runner replied with "{}" instead of "{}".'.format(
+                reply_type, '" or "'.join(expected_reply_types)))
+        return value if len(expected_reply_types) == 1 else (reply_type, value)
+
+
+class WarmCommand(object):
+    """
+    A command that is running in a WarmCommandRunner. This supports the subset of the Popen interface that is needed to
+    wait for a command: pid, wait() and returncode. The command is terminated with signal_process_group().
+    """
+    def __init__(self, runner, pid):
+        """
+        :type runner: WarmCommandRunner
+        :param pid: the pid of the subshell running the command, which is also its process group id
+        :type pid: int
+        """
+        self._runner = runner
+        self.pid = pid
+        self.returncode = None
+        # Held while signalling the process group and while recording the exit of the command, so that the process
+        # group is only signalled while the runner keeps it alive.
+        self._signal_lock = Lock()
+
+    def signal_process_group(self, signal_number):
+        """
+        Send a signal to the process group of the command, unless the command has already exited. The runner keeps the
+        process group alive until wait() has recorded the exit, so unlike os.killpg(pid), this never signals a process
+        group whose id has been reused.
+
+        :type signal_number: int
+        """
+        with self._signal_lock:
+            if self.returncode is None:
+                os.killpg(self.pid, signal_number)
+
+    def wait(self, timeout=None):
+        """
+        Wait for the command to finish.
+
+        :param timeout: the maximum number of seconds to wait; raises TimeoutExpired if the command is still running
+        :type timeout: float | None
+        :return: the exit code of the command; like Popen, this is the negative signal number if it was terminated by
+            a signal
+        :rtype: int
+        """
+        if self.returncode is not None:
+            return self.returncode
+
+        runner = self._runner
+        reply_type, status = runner._read_reply('exit', 'done', timeout=timeout)  # pylint: disable=protected-access
+        if reply_type == 'exit':
+            with self._signal_lock:
+                self.returncode = int(status)
+                # The subshell exits (and its process group goes away) once the exit is acknowledged.
+                runner._acknowledge_exit()  # pylint: disable=protected-access
+            runner._read_reply('done', timeout=None)  # pylint: disable=protected-access
+        else:
+            # The subshell did not report an exit status, so it was killed by a signal other than SIGTERM.
+            wait_status = int(status)
+            self.returncode = 128 - wait_status if wait_status > 128 else wait_status
+        runner._command_lock.release()  # pylint: disable=protected-access
+        return self.returncode
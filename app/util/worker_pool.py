@@ -0,0 +1,84 @@
+from queue import Full, Queue
+from threading import Lock
+
+from app.util.safe_thread import SafeThread
+
+
+class WorkerPool(object):
+    """
+    A WorkerPool runs work on long-lived worker threads instead of starting a new thread for every piece of work. Work
+    is submitted under a key, and each key has its own worker thread and work queue: the work submitted under the same
+    key runs one item at a time, in the order it was submitted. This makes it easy to run work after the work that is
+    already queued for a key has finished (e.g., after an executor finishes its current subjob) without polling.
+
+    Worker threads are started when work is first submitted under their key. Each work queue is bounded; submitting to
+    a full queue either raises WorkQueueFullError or blocks until there is room, so that callers that must not block
+    (e.g., API request handlers) never do.
+    """
+    DEFAULT_MAX_QUEUED_WORK_ITEMS = 16
+
+    def __init__(self, name, max_queued_work_items=DEFAULT_MAX_QUEUED_WORK_ITEMS):
+        """
+        :param name: the prefix of the names of the worker threads
+        :type name: str
+        :param max_queued_work_items: the maximum number of work items that can wait in the work queue of each key
+        :type max_queued_work_items: int
+        """
+        self._name = name
+        self._max_queued_work_items = max_queued_work_items
+        self._work_queues_by_key = {}
+        self._worker_creation_lock = Lock()
+
+    def submit(self, key, work, *args, block=False):
+        """
+        Queue work to run on the worker thread of the specified key.
+
+        :param key: identifies the worker thread to run the work on, e.g., an executor id
+        :type key: collections.Hashable
+        :param work: the function to call
+        :type work: callable
+        :param args: the arguments to call the function with
+        :param block: whether to wait for room in a full work queue instead of raising an error
+        :type block: bool
+        """
+        try:
+            self._work_queue(key).put((work, args), block=block)
+        except Full:
+            raise WorkQueueFullError('Cannot queue more than {} work items for worker {} of {}.'.format(
+                self._max_queued_work_items, key, self._name))
+
+    def _work_queue(self, key):
+        """
+        Get the work queue of the specified key, starting its worker thread if it has not been started yet.
+
+        :type key: collections.Hashable
+        :rtype: Queue
+        """
+        with self._worker_creation_lock:
+            work_queue = self._work_queues_by_key.get(key)
+            if work_queue is None:
+                work_queue = self._work_queues_by_key[key] = Queue(maxsize=self._max_queued_work_items)
+                SafeThread(
+                    target=self._run_worker,
+                    name='{}-{}'.format(self._name, key),
+                    args=(work_queue,),
+                    daemon=True,
+                ).start()
+            return work_queue
+
+    def _run_worker(self, work_queue):
+        """
+        The loop of a worker thread. The worker thread lives as long as the application; an exception raised by a work
+        item is handled like any other exception raised on a SafeThread.
+
+        :type work_queue: Queue
+        """
+        while True:
+            work, args = work_queue.get()
+            work(*args)
+
+
+class WorkQueueFullError(Exception):
+    """
+    Raised when work is submitted to a WorkerPool without blocking while the work queue is full.
+    """
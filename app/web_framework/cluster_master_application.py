@@ -2,6 +2,7 @@ import http.client
 import os
 import urllib.parse
 
+import tornado.gen
 import tornado.web
 import prometheus_client
 
@@ -45,6 +46,7 @@ class ClusterMasterApplication(ClusterApplication):
                                 RouteNode(r'atom', _AtomsHandler, 'atoms').add_children([
                                     RouteNode(r'(\d+)', _AtomHandler, 'atom').add_children([
                                         RouteNode(r'console', _AtomConsoleHandler),
+                                        RouteNode(r'result', _AtomResultHandler),
                                     ]),
                                 ]),
                                 RouteNode(r'result', _SubjobResultHandler),
@@ -53,6 +55,7 @@ class ClusterMasterApplication(ClusterApplication):
                     ]),
                 ]),
                 RouteNode(r'queue', _QueueHandler),
+                RouteNode(r'demand', _DemandHandler),
                 RouteNode(r'slave', _SlavesHandler, 'slaves').add_children([
                     RouteNode(r'(\d+)', _SlaveHandler, 'slave').add_children([
                         RouteNode(r'shutdown', _SlaveShutdownHandler, 'shutdown'),
@@ -75,6 +78,7 @@ class ClusterMasterApplication(ClusterApplication):
                             RouteNode(r'atoms', _V2AtomsHandler).add_children([
                                 RouteNode(r'(\d+)', _AtomHandler, 'atom').add_children([
                                     RouteNode(r'console', _AtomConsoleHandler),
+                                    RouteNode(r'result', _AtomResultHandler),
                                 ]),
                             ]),
                             RouteNode(r'result', _SubjobResultHandler),
@@ -83,6 +87,7 @@ class ClusterMasterApplication(ClusterApplication):
                 ]),
             ]),
             RouteNode(r'queue', _QueueHandler),
+            RouteNode(r'demand', _DemandHandler),
             RouteNode(r'slaves', _SlavesHandler).add_children([
                 RouteNode(r'(\d+)', _SlaveHandler, 'slave').add_children([
                     RouteNode(r'shutdown', _SlaveShutdownHandler),
@@ -145,6 +150,14 @@ class _QueueHandler(_ClusterMasterBaseAPIHandler):
         self.write(response)
 
 
+class _DemandHandler(_ClusterMasterBaseAPIHandler):
+    def get(self):
+        response = {
+            'demand': self._cluster_master.cluster_demand()
+        }
+        self.write(response)
+
+
 class _SubjobsHandler(_ClusterMasterBaseAPIHandler):
     def get(self, build_id):
         build = self._cluster_master.get_build(int(build_id))
@@ -178,16 +191,15 @@ class _SubjobResultHandler(_ClusterMasterBaseAPIHandler):
     def post(self, build_id, subjob_id):
         slave_url = self.decoded_body.get('slave')
         slave = SlaveRegistry.singleton().get_slave(slave_url=slave_url)
+        # Slaves that report the result of each atom separately complete the subjob without a result file.
         file_payload = self.request.files.get('file')
-        if not file_payload:
-            raise RuntimeError('Result file not provided')
 
         slave_executor_id = self.decoded_body.get('metric_data', {}).get('executor_id')
         analytics.record_event(analytics.MASTER_RECEIVED_RESULT, executor_id=slave_executor_id, build_id=int(build_id),
                                subjob_id=int(subjob_id), slave_id=slave.id)
 
         self._cluster_master.handle_result_reported_from_slave(
-            slave_url, int(build_id), int(subjob_id), file_payload[0])
+            slave_url, int(build_id), int(subjob_id), file_payload[0] if file_payload else None)
         self._write_status()
 
     def get(self, build_id, subjob_id):
@@ -272,6 +284,21 @@ class _AtomConsoleHandler(_ClusterMasterBaseAPIHandler):
             self.redirect('{}?{}'.format(slave_console_url, query_string))
 
 
+class _AtomResultHandler(_ClusterMasterBaseAPIHandler):
+    @tornado.gen.coroutine
+    def post(self, build_id, subjob_id, atom_id):
+        slave_url = self.decoded_body.get('slave')
+        file_payload = self.request.files.get('file')
+        if not file_payload:
+            raise RuntimeError('Result file not provided')
+
+        # The slave only reports the completion of the subjob once this request has finished, so respond after the
+        # result has been processed.
+        yield self._cluster_master.handle_atom_result_reported_from_slave(
+            slave_url, int(build_id), int(subjob_id), int(atom_id), file_payload[0])
+        self._write_status()
+
+
 class _BuildsHandler(_ClusterMasterBaseAPIHandler):
     @authenticated
     def post(self):
@@ -388,8 +415,9 @@ class _SlaveHandler(_ClusterMasterBaseAPIHandler):
     @authenticated
     def put(self, slave_id):
         new_slave_state = self.decoded_body.get('slave', {}).get('state')
+        build_id = self.decoded_body.get('slave', {}).get('build_id')
         slave = SlaveRegistry.singleton().get_slave(slave_id=int(slave_id))
-        self._cluster_master.handle_slave_state_update(slave, new_slave_state)
+        self._cluster_master.handle_slave_state_update(slave, new_slave_state, build_id=build_id)
         self._cluster_master.update_slave_last_heartbeat_time(slave)
 
         self._write_status({
@@ -31,7 +31,8 @@ class ClusterSlaveApplication(ClusterApplication):
                                     RouteNode(r'(\d+)', _AtomHandler).add_children([
                                         RouteNode(r'console', _AtomConsoleHandler)
                                     ])
-                                ])
+                                ]),
+                                RouteNode(r'kill', _SubjobKillHandler)
                             ])
                         ])
                     ])
@@ -39,6 +40,7 @@ class ClusterSlaveApplication(ClusterApplication):
                 RouteNode(r'executor', _ExecutorsHandler, 'executors').add_children([
                     RouteNode(r'(\d+)', _ExecutorHandler, 'executor')
                 ]),
+                RouteNode(r'prefetch', _PrefetchHandler),
                 RouteNode(r'eventlog', _EventlogHandler),
                 RouteNode(r'kill', _KillHandler)
             ])]
@@ -55,7 +57,8 @@ class ClusterSlaveApplication(ClusterApplication):
                                 RouteNode(r'(\d+)', _AtomHandler).add_children([
                                     RouteNode(r'console', _AtomConsoleHandler)
                                 ])
-                            ])
+                            ]),
+                            RouteNode(r'kill', _SubjobKillHandler)
                         ])
                     ])
                 ])
@@ -63,6 +66,7 @@ class ClusterSlaveApplication(ClusterApplication):
             RouteNode(r'executor', _ExecutorsHandler, 'executors').add_children([
                 RouteNode(r'(\d+)', _ExecutorHandler, 'executor')
             ]),
+            RouteNode(r'prefetch', _PrefetchHandler),
             RouteNode(r'eventlog', _EventlogHandler),
             RouteNode(r'kill', _KillHandler)]
 
@@ -118,7 +122,19 @@ class _BuildSetupHandler(_ClusterSlaveBaseAPIHandler):
     def post(self, build_id):
         project_type_params = self.decoded_body.get('project_type_params')
         build_executor_start_index = self.decoded_body.get('build_executor_start_index')
-        self._cluster_slave.setup_build(int(build_id), project_type_params, int(build_executor_start_index))
+        num_executors = self.decoded_body.get('num_executors')
+        setup_cache_key = self.decoded_body.get('setup_cache_key')
+        self._cluster_slave.setup_build(int(build_id), project_type_params, int(build_executor_start_index),
+                                        num_executors=None if num_executors is None else int(num_executors),
+                                        setup_cache_key=setup_cache_key)
+        self._write_status()
+
+
+class _PrefetchHandler(_ClusterSlaveBaseAPIHandler):
+    @authenticated
+    def post(self):
+        project_type_params = self.decoded_body.get('project_type_params')
+        self._cluster_slave.prefetch_project(project_type_params)
         self._write_status()
 
 
@@ -129,7 +145,12 @@ class _TeardownHandler(_ClusterSlaveBaseAPIHandler):
 
 
 class _SubjobsHandler(_ClusterSlaveBaseAPIHandler):
-    pass
+    @authenticated
+    def post(self, build_id):
+        subjobs = self.decoded_body.get('subjobs')
+
+        response = self._cluster_slave.start_working_on_subjobs(int(build_id), subjobs)
+        self._write_status(response, status_code=201)
 
 
 class _SubjobHandler(_ClusterSlaveBaseAPIHandler):
@@ -149,6 +170,13 @@ class _SubjobHandler(_ClusterSlaveBaseAPIHandler):
         self.write(response)
 
 
+class _SubjobKillHandler(_ClusterSlaveBaseAPIHandler):
+    @authenticated
+    def post(self, build_id, subjob_id):
+        self._cluster_slave.kill_subjob(int(build_id), int(subjob_id))
+        self._write_status()
+
+
 class _AtomsHandler(_ClusterSlaveBaseAPIHandler):
     pass
 
@@ -0,0 +1,124 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from threading import Barrier, Thread
+
+from genty import genty, genty_dataset
+
+from app.common.timing_data_store import TimingDataStore
+from app.util import fs
+from test.framework.base_integration_test_case import BaseIntegrationTestCase
+
+
+@genty
+class TestTimingDataStore(BaseIntegrationTestCase):
+    def setUp(self):
+        super().setUp()
+        self._temp_dir = TemporaryDirectory()
+        self.addCleanup(self._temp_dir.cleanup)
+        self._timing_file_path = os.path.join(self._temp_dir.name, 'timings', 'job.timing.json')
+        self._store = TimingDataStore(os.path.join(self._temp_dir.name, 'timing_data.sqlite3'))
+
+    @genty_dataset(
+        mutually_exclusive=({'1': 1, '2': 2}, {'3': 3}, {'1': 1, '2': 2, '3': 3}),
+        entire_overlap=({'1': 1, '2': 2}, {'1': 3, '2': 4}, {'1': 1.6, '2': 2.6}),
+        some_overlap=({'1': 1, '2': 2}, {'2': 4, '3': 5}, {'1': 1, '2': 2.6, '3': 5}),
+    )
+    def test_record_atom_times_updates_moving_average_of_recorded_atoms(self, existing_timing_data, new_timing_data,
+                                                                         expected_final_timing_data):
+        self._store.record_atom_times(self._timing_file_path, existing_timing_data)
+        self._store.record_atom_times(self._timing_file_path, new_timing_data)
+
+        expected_times = self._store.get_expected_times(self._timing_file_path, ['1', '2', '3'])
+
+        self.assertEqual(expected_times.keys(), expected_final_timing_data.keys())
+        for atom, expected_time in expected_final_timing_data.items():
+            self.assertAlmostEqual(expected_times[atom], expected_time)
+
+    def test_get_expected_times_returns_only_requested_atoms_of_requested_job(self):
+        self._store.record_atom_times(self._timing_file_path, {'atom_{}'.format(i): float(i) for i in range(1200)})
+        self._store.record_atom_times('/some/other/job.timing.json', {'atom_1': 100.0, 'atom_2000': 100.0})
+
+        requested_atoms = ['atom_{}'.format(i) for i in range(0, 2400, 2)]
+        expected_times = self._store.get_expected_times(self._timing_file_path, requested_atoms)
+
+        self.assertEqual(expected_times, {'atom_{}'.format(i): float(i) for i in range(0, 1200, 2)})
+
+    def test_get_atom_statistics_returns_percentiles_of_recent_samples(self):
+        for atom_time in range(1, 101):
+            self._store.record_atom_times(self._timing_file_path, {'atom': float(atom_time)})
+
+        statistics = self._store.get_atom_statistics(self._timing_file_path, ['atom'])['atom']
+
+        self.assertEqual(statistics['sample_count'], 100)
+        self.assertEqual(statistics['p50'], 90.0)  # only the last 20 samples (81-100) are kept for percentiles
+        self.assertEqual(statistics['p95'], 99.0)
+
+    def test_existing_timing_file_is_migrated_on_first_access(self):
+        fs.write_file(json.dumps({'atom_1': 5.0, 'atom_2': 7.0}), self._timing_file_path)
+
+        self.assertTrue(self._store.has_timing_data(self._timing_file_path))
+        self._store.record_atom_times(self._timing_file_path, {'atom_1': 10.0})
+        fs.write_file(json.dumps({'atom_3': 1.0}), self._timing_file_path)  # should not be migrated a second time
+
+        expected_times = self._store.get_expected_times(self._timing_file_path, ['atom_1', 'atom_2', 'atom_3'])
+        self.assertEqual(expected_times, {'atom_1': 6.5, 'atom_2': 7.0})
+
+    def test_existing_timing_file_is_migrated_once_when_accessed_concurrently(self):
+        fs.write_file(json.dumps({'atom_{}'.format(i): float(i) for i in range(100)}), self._timing_file_path)
+        num_threads = 8
+        all_threads_started = Barrier(num_threads)
+        errors = []
+
+        def access_timing_data():
+            store = TimingDataStore(os.path.join(self._temp_dir.name, 'timing_data.sqlite3'))
+            all_threads_started.wait()
+            try:
+                store.get_expected_times(self._timing_file_path, ['atom_1'])
+            except Exception as ex:  # pylint: disable=broad-except
+                errors.append(ex)
+
+        threads = [Thread(target=access_timing_data) for _ in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        statistics = self._store.get_atom_statistics(self._timing_file_path, ['atom_1'])
+        self.assertEqual(statistics['atom_1']['sample_count'], 1)
+
+    def test_get_failing_atoms_returns_atoms_whose_most_recent_execution_failed(self):
+        self._store.record_atom_results(self._timing_file_path, ['atom_1', 'atom_2'], ['atom_3'])
+        self._store.record_atom_results(self._timing_file_path, ['atom_3'], ['atom_1'])
+        self._store.record_atom_results('/some/other/job.timing.json', ['atom_4'], [])
+
+        failing_atoms = self._store.get_failing_atoms(self._timing_file_path, ['atom_1', 'atom_2', 'atom_3', 'atom_4'])
+
+        self.assertEqual(failing_atoms, {'atom_2', 'atom_3'})
+
+    def test_all_threads_share_one_connection_to_the_database(self):
+        other_store = TimingDataStore(os.path.join(self._temp_dir.name, 'timing_data.sqlite3'))
+        other_thread_connections = []
+
+        def get_connection():
+            with other_store._transaction() as connection:
+                other_thread_connections.append(connection)
+
+        thread = Thread(target=get_connection)
+        thread.start()
+        thread.join()
+        self._store.record_atom_times(self._timing_file_path, {'atom_1': 1.0})
+
+        with self._store._transaction() as connection:
+            self.assertIs(connection, other_thread_connections[0])
+        self.assertEqual(other_store.get_expected_times(self._timing_file_path, ['atom_1']), {'atom_1': 1.0})
+
+    def test_database_is_recreated_after_its_file_is_deleted(self):
+        self._store.record_atom_times(self._timing_file_path, {'atom_1': 1.0})
+        os.remove(os.path.join(self._temp_dir.name, 'timing_data.sqlite3'))
+
+        self._store.record_atom_results(self._timing_file_path, ['atom_2'], [])
+
+        self.assertEqual(self._store.get_failing_atoms(self._timing_file_path, ['atom_1', 'atom_2']), {'atom_2'})
+        self.assertFalse(self._store.has_timing_data(self._timing_file_path))
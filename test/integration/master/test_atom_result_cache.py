@@ -0,0 +1,52 @@
+import os
+from tempfile import TemporaryDirectory
+
+from app.common.build_artifact import BuildArtifact
+from app.master.atom_result_cache import AtomResultCache
+from app.master.job_config import JobConfig
+from app.util import fs
+from test.framework.base_integration_test_case import BaseIntegrationTestCase
+
+
+class TestAtomResultCache(BaseIntegrationTestCase):
+    def setUp(self):
+        super().setUp()
+        self._temp_dir = TemporaryDirectory()
+        self.addCleanup(self._temp_dir.cleanup)
+        self._cache = AtomResultCache(os.path.join(self._temp_dir.name, 'cache'))
+
+    def test_stored_result_is_restored_into_new_artifact_directory(self):
+        atom_artifact_dir = os.path.join(self._temp_dir.name, 'results', '1', 'artifact_0_0')
+        fs.write_file('0', os.path.join(atom_artifact_dir, BuildArtifact.EXIT_CODE_FILE))
+        fs.write_file('All tests passed.', os.path.join(atom_artifact_dir, BuildArtifact.OUTPUT_FILE))
+
+        self.assertFalse(self._cache.has_result('fake_key'))
+        self._cache.store_result('fake_key', atom_artifact_dir)
+        self.assertTrue(self._cache.has_result('fake_key'))
+
+        restored_artifact_dir = os.path.join(self._temp_dir.name, 'results', '2', 'artifact_3_1')
+        self._cache.restore_result('fake_key', restored_artifact_dir)
+        with open(os.path.join(restored_artifact_dir, BuildArtifact.OUTPUT_FILE)) as output_file:
+            self.assertEqual(output_file.read(), 'All tests passed.')
+
+    def test_least_recently_used_results_are_evicted_when_cache_is_full(self):
+        atom_artifact_dir = os.path.join(self._temp_dir.name, 'results', '1', 'artifact_0_0')
+        fs.write_file('0', os.path.join(atom_artifact_dir, BuildArtifact.EXIT_CODE_FILE))
+        for last_used_time, cache_key in enumerate(['key_1', 'key_2', 'key_3']):
+            self._cache.store_result(cache_key, atom_artifact_dir)
+            os.utime(self._cache._result_directory(cache_key), (last_used_time, last_used_time))
+        self.assertTrue(self._cache.has_result('key_1'))  # marks the oldest result as used
+
+        self._cache.evict_least_recently_used_results(max_results=2)
+
+        self.assertEqual([self._cache.has_result(key) for key in ['key_1', 'key_2', 'key_3']], [True, False, True])
+
+    def test_cache_key_depends_on_source_tree_job_commands_and_atom(self):
+        job_config = JobConfig('job', 'make deps', 'make clean', 'make test', None, 1, 1)
+        other_setup_job_config = JobConfig('job', 'make other_deps', 'make clean', 'make test', None, 1, 1)
+        key = AtomResultCache.cache_key('tree1', job_config, 'export TEST=a;')
+
+        self.assertEqual(key, AtomResultCache.cache_key('tree1', job_config, 'export TEST=a;'))
+        self.assertNotEqual(key, AtomResultCache.cache_key('tree2', job_config, 'export TEST=a;'))
+        self.assertNotEqual(key, AtomResultCache.cache_key('tree1', other_setup_job_config, 'export TEST=a;'))
+        self.assertNotEqual(key, AtomResultCache.cache_key('tree1', job_config, 'export TEST=b;'))
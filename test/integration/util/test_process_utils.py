@@ -0,0 +1,34 @@
+import signal
+import subprocess
+import sys
+from unittest import skipUnless
+
+from app.util.process_utils import is_windows, wait_and_get_resource_usage
+from test.framework.base_integration_test_case import BaseIntegrationTestCase
+
+
+@skipUnless(not is_windows(), 'Resource usage is only measured on platforms that support os.wait4().')
+class TestProcessUtils(BaseIntegrationTestCase):
+
+    def test_wait_and_get_resource_usage_includes_resources_used_by_descendant_processes(self):
+        # The shell runs the memory hungry process as a child of its own, like the atom commands that the shell runs.
+        allocate_memory_command = '{} -c "data = bytearray(64 * 1024 * 1024); sum(range(1000000))"'.format(
+            sys.executable)
+        process = subprocess.Popen('{}; exit 3'.format(allocate_memory_command), shell=True)
+
+        resource_usage = wait_and_get_resource_usage(process)
+
+        self.assertEqual(process.returncode, 3)
+        self.assertEqual(process.wait(), 3, 'The process should not need to be waited for again.')
+        self.assertGreaterEqual(resource_usage['max_rss_kb'], 64 * 1024)
+        self.assertGreater(resource_usage['user_cpu_time'] + resource_usage['system_cpu_time'], 0)
+        self.assertGreater(resource_usage['voluntary_context_switches'] +
+                           resource_usage['involuntary_context_switches'], 0)
+
+    def test_wait_and_get_resource_usage_sets_negative_returncode_of_process_terminated_by_signal(self):
+        process = subprocess.Popen(['sleep', '60'])
+        process.terminate()
+
+        wait_and_get_resource_usage(process)
+
+        self.assertEqual(process.returncode, -signal.SIGTERM)
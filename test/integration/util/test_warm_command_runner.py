@@ -0,0 +1,71 @@
+import os
+import signal
+from subprocess import TimeoutExpired
+from tempfile import TemporaryDirectory
+import time
+from unittest import skipUnless
+
+from genty import genty, genty_dataset
+
+from app.util.warm_command_runner import WarmCommandRunner
+from test.framework.base_integration_test_case import BaseIntegrationTestCase
+
+
+@genty
+@skipUnless(WarmCommandRunner.is_supported(), 'The warm command runner requires bash.')
+class TestWarmCommandRunner(BaseIntegrationTestCase):
+    def setUp(self):
+        super().setUp()
+        self._temp_dir = TemporaryDirectory()
+        self.addCleanup(self._temp_dir.cleanup)
+        self._output_file_path = os.path.join(self._temp_dir.name, 'console_output')
+        self._runner = WarmCommandRunner(env=dict(os.environ, PROJECT_DIR='/the/project'))
+        self._runner.start()
+        self.addCleanup(self._runner.stop)
+
+    def test_commands_run_one_after_another_with_their_own_output_and_exit_code(self):
+        first_command = self._runner.run('echo "$PROJECT_DIR"; echo oops >&2; exit 3', self._output_file_path)
+        self.assertEqual(first_command.wait(), 3)
+        self.assertEqual(self._read_output(), '/the/project\noops\n')
+
+        second_command = self._runner.run('export FOO="foo bar"; echo "$FOO"', self._output_file_path)
+        self.assertEqual(second_command.wait(), 0)
+        self.assertEqual(self._read_output(), 'foo bar\n')
+
+        third_command = self._runner.run('echo "${FOO:-unset}"', self._output_file_path)
+        self.assertEqual(third_command.wait(), 0)
+        self.assertEqual(self._read_output(), 'unset\n', 'Commands should not affect the environment of later ones.')
+
+    @genty_dataset(
+        interrupt_exit_status=('exit 130', 130),
+        largest_exit_status=('exit 255', 255),
+        aborted_child_process=('bash -c \'kill -ABRT $$\'', 128 + signal.SIGABRT),
+    )
+    def test_exit_status_above_128_is_not_reported_as_signal(self, command, expected_exit_code):
+        self.assertEqual(self._runner.run(command, self._output_file_path).wait(timeout=10), expected_exit_code)
+
+    def test_running_command_can_be_terminated_through_its_process_group(self):
+        command = self._runner.run('sleep 30', self._output_file_path)
+        with self.assertRaises(TimeoutExpired):
+            command.wait(timeout=0.1)
+
+        command.signal_process_group(signal.SIGTERM)
+
+        self.assertEqual(command.wait(timeout=10), -signal.SIGTERM)
+        self.assertEqual(self._runner.run('true', self._output_file_path).wait(timeout=10), 0,
+                         'The runner should keep running commands after a command was terminated.')
+
+    def test_process_group_of_command_exists_until_command_has_been_waited_for(self):
+        command = self._runner.run('exit 3', self._output_file_path)
+        time.sleep(0.1)  # give the command time to exit
+
+        os.killpg(command.pid, 0)  # raises ProcessLookupError if the process group no longer exists
+        self.assertEqual(command.wait(timeout=10), 3)
+        command.signal_process_group(signal.SIGTERM)  # should not signal the process group once it may be gone
+
+        with self.assertRaises(ProcessLookupError):
+            os.killpg(command.pid, 0)
+
+    def _read_output(self):
+        with open(self._output_file_path) as output_file:
+            return output_file.read()
@@ -1,7 +1,10 @@
+from threading import Barrier
 from unittest.mock import Mock
 
 from app.master.atomizer import Atomizer, AtomizerError
+from app.master.atomizer_output_cache import AtomizerOutputCache
 from app.project_type.project_type import ProjectType
+from app.util.conf.configuration import Configuration
 from app.util.process_utils import get_environment_variable_setter_command
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
@@ -13,6 +16,10 @@ _FAILING_EXIT_CODE = 1
 
 
 class TestAtomizer(BaseUnitTestCase):
+    def setUp(self):
+        super().setUp()
+        AtomizerOutputCache.reset_singleton()
+
     def test_atomizer_returns_expected_atom_list(self):
         mock_project = Mock(spec=ProjectType)
         mock_project.execute_command_in_project.return_value = (_FAKE_ATOMIZER_COMMAND_OUTPUT, _SUCCESSFUL_EXIT_CODE)
@@ -40,3 +47,68 @@ class TestAtomizer(BaseUnitTestCase):
             atomizer.atomize_in_project(mock_project)
 
         mock_project.execute_command_in_project.assert_called_once_with(_FAKE_ATOMIZER_COMMAND)
+
+    def test_atomizer_reuses_cached_output_for_same_project_version(self):
+        Configuration['atomizer_output_cache_size'] = 10
+        mock_project = Mock(spec=ProjectType)
+        mock_project.execute_command_in_project.return_value = (_FAKE_ATOMIZER_COMMAND_OUTPUT, _SUCCESSFUL_EXIT_CODE)
+        mock_project.project_directory = '/tmp/test/directory'
+        mock_project.project_id.return_value = 'fake_project'
+        mock_project.project_version.return_value = 'abc123'
+        atomizer = Atomizer([{'TEST_FILE': _FAKE_ATOMIZER_COMMAND}])
+
+        first_atom_commands = [atom.command_string for atom in atomizer.atomize_in_project(mock_project)]
+        second_atom_commands = [atom.command_string for atom in atomizer.atomize_in_project(mock_project)]
+        mock_project.project_version.return_value = 'def456'
+        atomizer.atomize_in_project(mock_project)
+
+        self.assertListEqual(first_atom_commands, second_atom_commands)
+        self.assertEqual(mock_project.execute_command_in_project.call_count, 2,
+                         'The atomizer command should only run again for a different project version.')
+
+    def test_atomizer_does_not_cache_output_if_project_version_is_unknown(self):
+        Configuration['atomizer_output_cache_size'] = 10
+        mock_project = Mock(spec=ProjectType)
+        mock_project.execute_command_in_project.return_value = (_FAKE_ATOMIZER_COMMAND_OUTPUT, _SUCCESSFUL_EXIT_CODE)
+        mock_project.project_directory = '/tmp/test/directory'
+        mock_project.project_version.return_value = None
+        atomizer = Atomizer([{'TEST_FILE': _FAKE_ATOMIZER_COMMAND}])
+
+        atomizer.atomize_in_project(mock_project)
+        atomizer.atomize_in_project(mock_project)
+
+        self.assertEqual(mock_project.execute_command_in_project.call_count, 2)
+
+    def test_atomizer_runs_atomizer_commands_concurrently_and_keeps_atomizer_order(self):
+        Configuration['max_concurrent_atomizers'] = 2
+        both_atomizers_started = Barrier(2, timeout=5)  # fails if the atomizer commands run one after another
+
+        def fake_execute_command_in_project(command):
+            both_atomizers_started.wait()
+            return '{}_1\n{}_2\n'.format(command, command), _SUCCESSFUL_EXIT_CODE
+
+        mock_project = Mock(spec=ProjectType)
+        mock_project.execute_command_in_project.side_effect = fake_execute_command_in_project
+        mock_project.project_directory = '/tmp/test/directory'
+
+        atomizer = Atomizer([{'UNIT_TEST': 'find_unit_tests'}, {'UI_TEST': 'find_ui_tests'}])
+        actual_atom_commands = [atom.command_string for atom in atomizer.atomize_in_project(mock_project)]
+
+        expected_atom_commands = [
+            get_environment_variable_setter_command('UNIT_TEST', 'find_unit_tests_1'),
+            get_environment_variable_setter_command('UNIT_TEST', 'find_unit_tests_2'),
+            get_environment_variable_setter_command('UI_TEST', 'find_ui_tests_1'),
+            get_environment_variable_setter_command('UI_TEST', 'find_ui_tests_2'),
+        ]
+        self.assertListEqual(expected_atom_commands, actual_atom_commands)
+
+    def test_atomizer_raises_exception_when_one_of_concurrent_atomize_commands_fails(self):
+        Configuration['max_concurrent_atomizers'] = 2
+        mock_project = Mock(spec=ProjectType)
+        mock_project.execute_command_in_project.side_effect = lambda command: (
+            ('ERROR', _FAILING_EXIT_CODE) if command == 'failing_atomizer' else ('test_a.py', _SUCCESSFUL_EXIT_CODE))
+        mock_project.project_directory = '/tmp/test/directory'
+
+        atomizer = Atomizer([{'TEST_FILE': _FAKE_ATOMIZER_COMMAND}, {'OTHER_FILE': 'failing_atomizer'}])
+        with self.assertRaises(AtomizerError):
+            atomizer.atomize_in_project(mock_project)
@@ -0,0 +1,33 @@
+from app.master.atomizer_output_cache import AtomizerOutputCache
+from app.util.conf.configuration import Configuration
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestAtomizerOutputCache(BaseUnitTestCase):
+    def setUp(self):
+        super().setUp()
+        AtomizerOutputCache.reset_singleton()
+
+    def test_get_returns_output_for_same_project_version_and_command_only(self):
+        Configuration['atomizer_output_cache_size'] = 10
+        cache = AtomizerOutputCache.singleton()
+
+        cache.put('project', 'abc123', 'find . -name test_*.py', ['test_a.py', 'test_b.py'])
+
+        self.assertEqual(cache.get('project', 'abc123', 'find . -name test_*.py'), ['test_a.py', 'test_b.py'])
+        self.assertIsNone(cache.get('project', 'def456', 'find . -name test_*.py'))
+        self.assertIsNone(cache.get('project', 'abc123', 'find . -name *_test.py'))
+        self.assertIsNone(cache.get('other_project', 'abc123', 'find . -name test_*.py'))
+
+    def test_least_recently_used_output_is_evicted_when_cache_is_full(self):
+        Configuration['atomizer_output_cache_size'] = 2
+        cache = AtomizerOutputCache.singleton()
+
+        cache.put('project', 'commit_1', 'atomizer', ['1'])
+        cache.put('project', 'commit_2', 'atomizer', ['2'])
+        cache.get('project', 'commit_1', 'atomizer')
+        cache.put('project', 'commit_3', 'atomizer', ['3'])
+
+        self.assertEqual(cache.get('project', 'commit_1', 'atomizer'), ['1'])
+        self.assertIsNone(cache.get('project', 'commit_2', 'atomizer'))
+        self.assertEqual(cache.get('project', 'commit_3', 'atomizer'), ['3'])
@@ -0,0 +1,80 @@
+from unittest.mock import Mock
+
+from genty import genty, genty_dataset
+
+from app.master.autoscaler import Autoscaler, LocalSlaveAutoscaler, create_autoscaler
+from app.master.cluster_master import ClusterMaster
+from app.master.slave import Slave, SlaveRegistry
+from app.util.conf.configuration import Configuration
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class FakeAutoscaler(Autoscaler):
+    def scale(self, demand):
+        pass
+
+
+@genty
+class TestAutoscaler(BaseUnitTestCase):
+
+    def setUp(self):
+        super().setUp()
+        SlaveRegistry.reset_singleton()
+        self.mock_popen = self.patch('app.master.autoscaler.Popen')
+        self.mock_popen.return_value.poll.return_value = None
+        self.mock_cluster_master = Mock(spec=ClusterMaster)
+        Configuration['port'] = 43000
+        Configuration['hostname'] = 'localhost'
+        Configuration['main_executable_path'] = ['clusterrunner']
+        Configuration['local_autoscaler_max_slaves'] = 3
+
+    @genty_dataset(
+        disabled=('none', type(None)),
+        by_name=('local', LocalSlaveAutoscaler),
+        by_dotted_path=('test.unit.master.test_autoscaler.FakeAutoscaler', FakeAutoscaler),
+        unknown_name=('cloud', type(None)),
+        unknown_dotted_path=('test.unit.master.test_autoscaler.MissingAutoscaler', type(None)),
+    )
+    def test_create_autoscaler_creates_autoscaler_selected_by_setting(self, autoscaler_setting, expected_type):
+        Configuration['autoscaler'] = autoscaler_setting
+
+        autoscaler = create_autoscaler(self.mock_cluster_master)
+
+        self.assertIs(type(autoscaler), expected_type)
+
+    def test_local_autoscaler_starts_slaves_for_missing_executors_up_to_max_slaves(self):
+        autoscaler = LocalSlaveAutoscaler(self.mock_cluster_master)
+
+        autoscaler.scale(self._demand(executors_needed=2, idle_executors=1))
+        autoscaler.scale(self._demand(executors_needed=10, idle_executors=0))
+
+        started_slave_ports = [call[0][0][3] for call in self.mock_popen.call_args_list]
+        self.assertEqual(started_slave_ports, ['43001', '43002', '43003'],
+                         'The slave that has not connected yet should count as a missing executor that is starting.')
+
+    def test_local_autoscaler_stops_idle_slaves_it_started_once_no_builds_are_queued(self):
+        autoscaler = LocalSlaveAutoscaler(self.mock_cluster_master)
+        autoscaler.scale(self._demand(executors_needed=2))
+        idle_slave = Slave('localhost:43001', 1)
+        busy_slave = Slave('localhost:43002', 1)
+        SlaveRegistry.singleton().add_slave(idle_slave)
+        SlaveRegistry.singleton().add_slave(busy_slave)
+        busy_slave._executor_leases_by_build_id[1] = Mock()
+
+        autoscaler.scale(self._demand(queued_builds=1))
+        self.assertFalse(self.mock_cluster_master.set_shutdown_mode_on_slaves.called,
+                         'Slaves should not be stopped while builds are queued.')
+
+        autoscaler.scale(self._demand())
+        self.mock_cluster_master.set_shutdown_mode_on_slaves.assert_called_once_with([idle_slave.id])
+
+    def _demand(self, queued_builds=0, executors_needed=0, idle_executors=0):
+        """
+        :rtype: dict[str, int | float]
+        """
+        return {
+            'queued_builds': queued_builds,
+            'queued_work_seconds': 0.0,
+            'executors_needed': executors_needed,
+            'idle_executors': idle_executors,
+        }
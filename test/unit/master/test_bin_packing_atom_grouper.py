@@ -0,0 +1,89 @@
+import heapq
+from unittest.mock import Mock
+
+from genty import genty, genty_dataset
+
+from app.master.atom import Atom
+from app.master.bin_packing_atom_grouper import BinPackingAtomGrouper
+from app.master.time_based_atom_grouper import TimeBasedAtomGrouper
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+@genty
+class TestBinPackingAtomGrouper(BaseUnitTestCase):
+    def _mock_atoms(self, command_strings):
+        atom_spec = Atom('key', 'val')
+        return [Mock(spec_set=atom_spec, command_string=cmd) for cmd in command_strings]
+
+    def test_groupings_creates_one_subjob_per_executor(self):
+        atom_times = {'atom_{}'.format(i): float(i % 7 + 1) for i in range(100)}
+        new_atoms = self._mock_atoms(sorted(atom_times))
+
+        atom_grouper = BinPackingAtomGrouper(new_atoms, 8, atom_times, 'some_project_directory')
+        subjobs = atom_grouper.groupings()
+
+        self.assertEqual(len(subjobs), 8)
+        self.assertCountEqual([atom for subjob in subjobs for atom in subjob], new_atoms)
+
+    def test_groupings_creates_one_subjob_per_atom_when_there_are_more_executors_than_atoms(self):
+        atom_times = {'atom_1': 100.0, 'atom_2': 50.0, 'atom_3': 2.0}
+        new_atoms = self._mock_atoms(['atom_1', 'atom_2', 'atom_3'])
+
+        atom_grouper = BinPackingAtomGrouper(new_atoms, 5, atom_times, 'some_project_directory')
+        subjobs = atom_grouper.groupings()
+
+        actual_groups = [[atom.command_string for atom in subjob] for subjob in subjobs]
+        self.assertEqual(actual_groups, [['atom_1'], ['atom_2'], ['atom_3']])
+
+    def test_groupings_defaults_to_atom_grouper_when_no_timing_data_exists(self):
+        new_atoms = self._mock_atoms(['atom_{}'.format(i) for i in range(10)])
+
+        atom_grouper = BinPackingAtomGrouper(new_atoms, 2, {}, 'some_project_directory')
+        subjobs = atom_grouper.groupings()
+
+        self.assertEqual(len(subjobs), 10)
+
+    def test_groupings_finds_optimal_grouping_that_lpt_alone_misses(self):
+        # LPT groups these as [3, 2, 2] and [3, 2] (makespan 7) while the optimal grouping is [3, 3] and [2, 2, 2].
+        atom_times = {'atom_1': 3.0, 'atom_2': 3.0, 'atom_3': 2.0, 'atom_4': 2.0, 'atom_5': 2.0}
+        new_atoms = self._mock_atoms(sorted(atom_times))
+
+        atom_grouper = BinPackingAtomGrouper(new_atoms, 2, atom_times, 'some_project_directory')
+        subjobs = atom_grouper.groupings()
+
+        self.assertEqual(_estimated_makespan(subjobs, 2), 6.0)
+
+    @genty_dataset(
+        data_set_1=({'atom_1': 1.0, 'atom_2': 10.0, 'atom_3': 11.0, 'atom_4': 2.0, 'atom_5': 10.0, 'atom_6': 5.0,
+                     'atom_7': 2.0, 'atom_8': 8.0, 'atom_9': 10.0, 'atom_10': 3.0}, 2),
+        data_set_2=({'atom_1': 100.0, 'atom_2': 100.0, 'atom_3': 50.0, 'atom_4': 2.0, 'atom_5': 2.0}, 3),
+        data_set_3=({'atom_1': 100.0, 'atom_2': 100.0, 'atom_3': 50.0, 'atom_4': 2.0, 'atom_5': 2.0}, 2),
+        many_uneven_atoms=({'atom_{}'.format(i): float((i * 37) % 101 + 1) for i in range(500)}, 13),
+    )
+    def test_groupings_makespan_is_no_worse_than_time_based_grouper(self, atom_times, max_executors):
+        time_based_subjobs = TimeBasedAtomGrouper(
+            self._mock_atoms(sorted(atom_times)), max_executors, atom_times, 'some_project_directory').groupings()
+        bin_packing_subjobs = BinPackingAtomGrouper(
+            self._mock_atoms(sorted(atom_times)), max_executors, atom_times, 'some_project_directory').groupings()
+
+        self.assertLessEqual(_estimated_makespan(bin_packing_subjobs, max_executors),
+                             _estimated_makespan(time_based_subjobs, max_executors))
+
+
+def _estimated_makespan(grouped_atoms, num_executors):
+    """
+    Estimate how long a build will take if its subjobs are handed out in order to whichever executor frees up
+    first, which is how the BuildScheduler distributes subjobs.
+
+    :param grouped_atoms: the grouped atoms, each with its expected_time set
+    :type grouped_atoms: list[list[app.master.atom.Atom]]
+    :type num_executors: int
+    :return: the estimated time in seconds until the last subjob finishes
+    :rtype: float
+    """
+    executor_finish_times = [0.0] * max(1, min(num_executors, len(grouped_atoms)))
+    for group in grouped_atoms:
+        finish_time = heapq.heappop(executor_finish_times)
+        heapq.heappush(executor_finish_times, finish_time + sum(atom.expected_time for atom in group))
+
+    return max(executor_finish_times)
@@ -1,8 +1,10 @@
-from os.path import abspath, join
+from io import StringIO
+import json
+from os.path import abspath, basename, join
 import sys
 from threading import Event
 from unittest import skip
-from unittest.mock import MagicMock, Mock, mock_open, call
+from unittest.mock import MagicMock, Mock, mock_open
 
 from genty import genty, genty_dataset
 
@@ -41,6 +43,8 @@ class TestBuild(BaseUnitTestCase):
         self.mock_listdir = self.patch('os.listdir')
         self.patch('tempfile.mktemp')
         self.patch('shutil.move')
+        self.mock_timing_data_store = self.patch('app.master.build.TimingDataStore').return_value
+        self.mock_timing_data_store.get_failing_atoms.return_value = set()
         self.scheduler_pool = BuildSchedulerPool()
 
     def test_allocate_slave_calls_slave_setup(self):
@@ -50,7 +54,7 @@ class TestBuild(BaseUnitTestCase):
 
         scheduler.allocate_slave(mock_slave)
 
-        mock_slave.setup.assert_called_once_with(build, executor_start_index=0)
+        mock_slave.setup.assert_called_once_with(build, executor_start_index=0, num_executors=5)
 
     def test_build_doesnt_use_more_than_max_executors(self):
         mock_slaves = [self._create_mock_slave(num_executors=5) for _ in range(3)]  # 15 total available executors
@@ -64,7 +68,8 @@ class TestBuild(BaseUnitTestCase):
             scheduler.allocate_slave(mock_slave)
             scheduler.begin_subjob_executions_on_slave(mock_slave)
 
-        self.assertEqual(scheduler.execute_next_subjob_or_free_executor.call_count, expected_num_executors_used,
+        num_executors_used = sum(mock_slave.claim_executor.call_count for mock_slave in mock_slaves)
+        self.assertEqual(num_executors_used, expected_num_executors_used,
                          'Build should start executing as many subjobs as its max_executors setting.')
 
     def test_build_doesnt_use_more_than_max_executors_per_slave(self):
@@ -80,17 +85,9 @@ class TestBuild(BaseUnitTestCase):
             scheduler.begin_subjob_executions_on_slave(mock_slave)
 
         # Even though each slave has 5 executors, we should only start subjobs on 2 of those executors per slave.
-        expected_subjob_execution_calls = [
-            call(mock_slaves[0]),
-            call(mock_slaves[0]),
-            call(mock_slaves[1]),
-            call(mock_slaves[1]),
-            call(mock_slaves[2]),
-            call(mock_slaves[2]),
-        ]
         self.assertEqual(
-            scheduler.execute_next_subjob_or_free_executor.mock_calls,
-            expected_subjob_execution_calls,
+            [mock_slave.claim_executor.call_count for mock_slave in mock_slaves],
+            [max_executors_per_slave] * len(mock_slaves),
             'Build should start executing as many subjobs per slave as its max_executors_per_slave setting.')
 
     def test_build_status_returns_queued_after_build_creation(self):
@@ -138,6 +135,23 @@ class TestBuild(BaseUnitTestCase):
         self.assertTrue(build._all_subjobs_are_finished())
         self.assertEqual(build._status(), BuildStatus.FINISHED)
 
+    def test_build_with_tail_subjob_splitting_splits_subjobs_and_finishes(self):
+        Configuration['tail_subjob_splitting'] = True
+        mock_slave = self._create_mock_slave(num_executors=2)
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=3, num_atoms_per_subjob=4,
+                                        slaves=[mock_slave])
+        build._create_build_artifact = MagicMock()
+
+        self._finish_test_build(build)
+
+        self.assertEqual(build._status(), BuildStatus.FINISHED)
+        self.assertGreater(len(build.get_subjobs()), 3, 'Subjobs started near the end of the build should be split.')
+        self.assertEqual(sum(len(subjob.atoms) for subjob in build.get_subjobs()), 12)
+        for split_off_subjob in build.get_subjobs()[3:]:
+            self.assertEqual([(atom.subjob_id, atom.id) for atom in split_off_subjob.atoms],
+                             [(split_off_subjob.subjob_id(), atom_id)
+                              for atom_id in range(len(split_off_subjob.atoms))])
+
     def test_complete_subjob_parses_payload_and_stores_value_in_atom_objects(self):
         fake_atom_exit_code = 777
         mock_open(mock=self.mock_open, read_data=str(fake_atom_exit_code))
@@ -173,6 +187,203 @@ class TestBuild(BaseUnitTestCase):
         self.mock_util.fs.write_file.assert_called_once_with('Heroes in a half shell.', expected_payload_sys_path)
         self.mock_util.fs.extract_tar.assert_called_once_with(expected_payload_sys_path, delete=True)
 
+    def test_complete_subjob_ignores_duplicate_result_for_already_completed_subjob(self):
+        build = self._create_test_build(BuildStatus.BUILDING)
+        subjob = build.get_subjobs()[0]
+
+        payload = {'filename': 'turtles.txt', 'body': 'Heroes in a half shell.'}
+        self.assertTrue(build.complete_subjob(subjob.subjob_id(), payload=payload))
+        self.assertFalse(build.complete_subjob(subjob.subjob_id(), payload=payload))
+
+        self.assertEqual(self.mock_util.fs.write_file.call_count, 1)
+        self.assertEqual(build._finished_subjobs.qsize(), 1)
+
+    def test_complete_atom_extracts_payload_under_unique_name_and_records_exit_code_of_atom(self):
+        mock_open(mock=self.mock_open, read_data='1')
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=2)
+        subjob = build.get_subjobs()[0]
+
+        build.complete_atom(subjob.subjob_id(), 1, payload=self._FAKE_PAYLOAD)
+
+        expected_payload_sys_path = join(Configuration['results_directory'], '1', 'results_0_1.tar.gz')
+        self.mock_util.fs.write_file.assert_called_once_with(self._FAKE_PAYLOAD['body'], expected_payload_sys_path)
+        self.mock_util.fs.extract_tar.assert_called_once_with(expected_payload_sys_path, delete=True)
+        self.assertEqual([atom.exit_code for atom in subjob.atoms], [None, 1])
+        self.assertFalse(subjob.is_completed(), 'The subjob should only be completed by complete_subjob().')
+
+    def test_complete_atom_records_resource_usage_of_atom_if_slave_measured_it(self):
+        resource_usage = {'user_cpu_time': 1.5, 'system_cpu_time': 0.25, 'max_rss_kb': 2048}
+        file_contents_by_name = {
+            BuildArtifact.EXIT_CODE_FILE: '0',
+            BuildArtifact.RESOURCE_USAGE_FILE: json.dumps(resource_usage),
+        }
+        self.patch('app.master.build.os.path.isfile').return_value = True
+        self.mock_open.side_effect = lambda path, mode: StringIO(file_contents_by_name[basename(path)])
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=2)
+        subjob = build.get_subjobs()[0]
+
+        build.complete_atom(subjob.subjob_id(), 1, payload=self._FAKE_PAYLOAD)
+
+        self.assertEqual([atom.resource_usage for atom in subjob.atoms], [None, resource_usage])
+        self.assertEqual(subjob.atoms[1].api_representation()['resource_usage'], resource_usage)
+
+    def test_results_from_slave_that_is_not_executing_subjob_are_ignored(self):
+        mock_open(mock=self.mock_open, read_data='1')
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=1)
+        subjob = build.get_subjobs()[0]
+        executing_slave, other_slave = Mock(Slave), Mock(Slave)
+        subjob.mark_in_progress(executing_slave)
+
+        build.complete_atom(subjob.subjob_id(), 0, payload=self._FAKE_PAYLOAD, slave=other_slave)
+        self.assertFalse(build.complete_subjob(subjob.subjob_id(), payload=self._FAKE_PAYLOAD, slave=other_slave))
+
+        self.assertFalse(subjob.is_completed())
+        self.assertIsNone(subjob.atoms[0].exit_code)
+        self.assertTrue(build.complete_subjob(subjob.subjob_id(), payload=self._FAKE_PAYLOAD, slave=executing_slave))
+        self.assertTrue(subjob.is_completed())
+
+    def test_complete_atom_ignores_duplicate_result_for_atom(self):
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=1)
+        subjob = build.get_subjobs()[0]
+
+        build.complete_atom(subjob.subjob_id(), 0, payload=self._FAKE_PAYLOAD)
+        build.complete_atom(subjob.subjob_id(), 0, payload=self._FAKE_PAYLOAD)
+
+        self.assertEqual(self.mock_util.fs.write_file.call_count, 1)
+
+    @genty_dataset(
+        build_running=(BuildStatus.BUILDING, BuildStatus.ERROR),
+        build_canceled=(BuildStatus.CANCELED, BuildStatus.CANCELED),
+    )
+    def test_complete_subjob_without_payload_fails_build_if_atom_results_are_missing(self, build_status,
+                                                                                     expected_status):
+        mock_open(mock=self.mock_open, read_data='0')
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=2)
+        subjob = build.get_subjobs()[0]
+        build.complete_atom(subjob.subjob_id(), 0, payload=self._FAKE_PAYLOAD)
+        if build_status is BuildStatus.CANCELED:
+            build.cancel()
+
+        build.complete_subjob(subjob.subjob_id())
+
+        self.assertEqual(build._status(), expected_status)
+        if expected_status is BuildStatus.ERROR:
+            self.assertIn('atoms [1] of subjob 0', build.api_representation()['error_message'])
+
+    def test_complete_subjob_without_payload_after_all_atoms_reported_results_marks_subjob_complete(self):
+        mock_open(mock=self.mock_open, read_data='0')
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=2)
+        subjob = build.get_subjobs()[0]
+
+        build.complete_atom(subjob.subjob_id(), 0, payload=self._FAKE_PAYLOAD)
+        build.complete_atom(subjob.subjob_id(), 1, payload=self._FAKE_PAYLOAD)
+        build.complete_subjob(subjob.subjob_id())
+
+        self.assertTrue(subjob.is_completed())
+        self.assertEqual([atom.exit_code for atom in subjob.atoms], [0, 0])
+        self.assertEqual(self.mock_util.fs.write_file.call_count, 2, 'The completion should not carry a payload.')
+
+    def test_results_of_atoms_reported_before_their_subjob_completes_are_recorded_together(self):
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=3)
+        subjob = build.get_subjobs()[0]
+
+        for atom_id, exit_code in enumerate(['1', '0']):
+            mock_open(mock=self.mock_open, read_data=exit_code)
+            build.complete_atom(subjob.subjob_id(), atom_id, payload=self._FAKE_PAYLOAD)
+        build.cancel()
+        build.complete_subjob(subjob.subjob_id())
+        self.assertFalse(self.mock_timing_data_store.record_atom_results.called)
+        build.record_atom_results(subjob.subjob_id())
+
+        self.mock_timing_data_store.record_atom_results.assert_called_once_with(
+            build._timing_file_path, [subjob.atoms[0].command_string], [subjob.atoms[1].command_string])
+
+    def test_fail_fast_build_is_canceled_by_failed_atom_before_its_subjob_completes(self):
+        mock_open(mock=self.mock_open, read_data='1')
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=3,
+                                        build_parameters={'fail_fast_after': 1})
+        subjob = build.get_subjobs()[0]
+
+        build.complete_atom(subjob.subjob_id(), 0, payload=self._FAKE_PAYLOAD)
+
+        self.assertEqual(build._status(), BuildStatus.CANCELED)
+
+    def test_record_atom_results_records_failed_and_passed_atoms_of_completed_subjob(self):
+        mock_open(mock=self.mock_open, read_data='0')
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=1)
+        subjob = build.get_subjobs()[0]
+
+        self.assertTrue(build.complete_subjob(subjob.subjob_id(), payload=self._FAKE_PAYLOAD))
+        build.record_atom_results(subjob.subjob_id())
+
+        self.mock_timing_data_store.record_atom_results.assert_called_once_with(
+            build._timing_file_path, [], ['NAME=Leonardo'])
+
+    @genty_dataset(
+        threshold_reached=(3, BuildStatus.CANCELED),
+        threshold_not_reached=(4, BuildStatus.BUILDING),
+    )
+    def test_fail_fast_build_is_canceled_once_threshold_of_atom_failures_is_reached(self, fail_fast_after,
+                                                                                    expected_status):
+        mock_open(mock=self.mock_open, read_data='1')
+        # One subjob is left incomplete so that the build does not finish (asynchronously) when the other three do.
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=4, num_atoms_per_subjob=1,
+                                        build_parameters={'fail_fast_after': fail_fast_after})
+
+        for subjob in build.get_subjobs()[:3]:
+            build.complete_subjob(subjob.subjob_id(), payload=self._FAKE_PAYLOAD)
+
+        self.assertEqual(build._status(), expected_status)
+        if expected_status is BuildStatus.CANCELED:
+            self.assertIn('fail_fast_after=3', build.api_representation()['error_message'])
+
+    def test_fail_fast_build_runs_previously_failed_atoms_first_in_subjobs_of_their_own(self):
+        build = self._create_test_build(BuildStatus.QUEUED, build_parameters={'fail_fast_after': 1})
+        job_config = self._create_job_config()
+        subjobs = [
+            Subjob(build_id=1, subjob_id=subjob_id, project_type=None, job_config=job_config,
+                   atoms=[Atom(command) for command in commands])
+            for subjob_id, commands in enumerate([['A=1', 'A=2'], ['A=3', 'A=4'], ['A=5', 'A=6']])
+        ]
+        self._patch_compute_subjob_for_build(subjobs)
+        self.mock_timing_data_store.get_failing_atoms.return_value = {'A=3', 'A=5', 'A=6'}
+
+        build.prepare()
+
+        unstarted_subjobs = [build._unstarted_subjobs.get(block=False) for _ in range(4)]
+        self.assertEqual([subjob.subjob_id() for subjob in unstarted_subjobs], [2, 3, 0, 1])
+        self.assertEqual([[atom.command_string for atom in subjob.atoms] for subjob in unstarted_subjobs],
+                         [['A=5', 'A=6'], ['A=3'], ['A=1', 'A=2'], ['A=4']],
+                         'The previously failed atom of subjob 1 should be split off into a subjob of its own.')
+        self.assertEqual([atom.id for atom in build.subjob(1).atoms + build.subjob(3).atoms], [0, 0])
+
+    def test_complete_subjob_caches_results_of_passed_atoms_if_result_caching_is_enabled(self):
+        Configuration['cache_atom_results'] = True
+        mock_result_cache = self.patch('app.master.build.AtomResultCache').return_value
+        mock_open(mock=self.mock_open, read_data='0')
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=1, num_atoms_per_subjob=2)
+        subjob = build.get_subjobs()[0]
+        subjob.atoms[0].result_cache_key = 'fake_cache_key'
+
+        build.complete_subjob(subjob.subjob_id(), payload=self._FAKE_PAYLOAD)
+
+        mock_result_cache.store_result.assert_called_once_with(
+            'fake_cache_key', join(Configuration['results_directory'], '1', 'artifact_0_0'))
+
+    def test_build_with_only_cached_subjobs_finishes_without_slaves(self):
+        build = self._create_test_build(BuildStatus.QUEUED)
+        subjobs = self._create_subjobs(count=2, job_config=self._create_job_config())
+        for subjob in subjobs:
+            subjob.mark_completed()
+        self._patch_compute_subjob_for_build(subjobs)
+        postbuild_tasks_complete_event = Event()
+        self._on_async_postbuild_tasks_completed(build, postbuild_tasks_complete_event.set)
+
+        build.prepare()
+
+        self.assertTrue(postbuild_tasks_complete_event.wait(timeout=5), 'Postbuild tasks should be run.')
+        self.assertEqual(build._status(), BuildStatus.FINISHED)
+
     def test_exception_is_raised_if_problem_occurs_writing_subjob(self):
         build = self._create_test_build(BuildStatus.BUILDING)
         subjob = build.get_subjobs()[0]
@@ -214,11 +425,28 @@ class TestBuild(BaseUnitTestCase):
         with self.assertRaisesRegex(RuntimeError, r'prepare\(\) was called more than once'):
             build.prepare()
 
+    def test_prepare_calls_project_fetched_callback_after_fetch_and_before_atomization(self):
+        build = self._create_test_build(BuildStatus.QUEUED)
+        job_config = self._create_job_config()
+        subjobs = self._create_subjobs(count=3, job_config=job_config)
+        compute_subjobs_mock = self._patch_compute_subjob_for_build(subjobs)
+
+        def assert_project_is_fetched_but_not_atomized(callback_build):
+            self.assertIs(callback_build, build)
+            self.assertTrue(build.project_type.fetch_project.called, 'The project should be fetched before callback.')
+            self.assertFalse(compute_subjobs_mock.called, 'The project should be atomized after the callback.')
+
+        project_fetched_callback = Mock(side_effect=assert_project_is_fetched_but_not_atomized)
+        build.prepare(project_fetched_callback)
+
+        project_fetched_callback.assert_called_once_with(build)
+        self.assertEqual(build._status(), BuildStatus.PREPARED)
+
     def test_teardown_called_on_slave_when_no_subjobs_remain(self):
         mock_slave = self._create_mock_slave(num_executors=1)
-        self._create_test_build(BuildStatus.FINISHED, num_subjobs=1, slaves=[mock_slave])
+        build = self._create_test_build(BuildStatus.FINISHED, num_subjobs=1, slaves=[mock_slave])
 
-        mock_slave.teardown.assert_called_with()
+        mock_slave.teardown.assert_called_with(build.build_id())
 
     def test_teardown_called_on_all_slaves_when_no_subjobs_remain(self):
         mock_slaves = [
@@ -226,27 +454,29 @@ class TestBuild(BaseUnitTestCase):
             self._create_mock_slave(num_executors=4),
             self._create_mock_slave(num_executors=3),
         ]
-        self._create_test_build(BuildStatus.FINISHED, num_subjobs=20, slaves=mock_slaves)
+        build = self._create_test_build(BuildStatus.FINISHED, num_subjobs=20, slaves=mock_slaves)
 
         for mock_slave in mock_slaves:
-            mock_slave.teardown.assert_called_with()
+            mock_slave.teardown.assert_called_with(build.build_id())
 
     @genty_dataset(DeadSlaveError, SlaveCommunicationError, SlaveMarkedForShutdownError)
     def test_teardown_called_on_slave_when_start_subjob_raises(self, exception_cls):
         mock_slave = self._create_mock_slave(num_executors=5)
         mock_slave.start_subjob.side_effect = exception_cls
+        mock_slave.start_subjobs.side_effect = exception_cls
 
-        self._create_test_build(BuildStatus.BUILDING, num_subjobs=30, slaves=[mock_slave])
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=30, slaves=[mock_slave])
 
-        mock_slave.teardown.assert_called_with()
+        mock_slave.teardown.assert_called_with(build.build_id())
 
     def test_teardown_called_on_slave_when_slave_is_not_alive(self):
         mock_slave = self._create_mock_slave(num_executors=5)
         mock_slave.start_subjob.side_effect = SlaveMarkedForShutdownError
+        mock_slave.start_subjobs.side_effect = SlaveMarkedForShutdownError
 
-        self._create_test_build(BuildStatus.BUILDING, num_subjobs=30, slaves=[mock_slave])
+        build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=30, slaves=[mock_slave])
 
-        mock_slave.teardown.assert_called_with()
+        mock_slave.teardown.assert_called_with(build.build_id())
 
     @genty_dataset(BuildStatus.QUEUED, BuildStatus.PREPARED, BuildStatus.BUILDING)
     def test_canceling_build_calls_kill_subprocesses(self, build_state):
@@ -263,14 +493,14 @@ class TestBuild(BaseUnitTestCase):
         mock_slave = self._create_mock_slave(num_executors=5)
         build = self._create_test_build(BuildStatus.BUILDING, num_subjobs=30, slaves=[mock_slave])
 
-        self.assertEqual(mock_slave.start_subjob.call_count, 5, 'Slave should only have had as many subjobs started '
-                                                                'as its num_executors.')
+        self.assertEqual(len(self._get_started_subjobs_for_mock_slave(mock_slave)), 5,
+                         'Slave should only have had as many subjobs started as its num_executors.')
         build.cancel()
         self._finish_test_build(build, assert_postbuild_tasks_complete=False)
 
         self.assertEqual(build._status(), BuildStatus.CANCELED, 'Canceled build should have canceled state.')
-        self.assertEqual(mock_slave.start_subjob.call_count, 5, 'A canceled build should not have any more subjobs '
-                                                                'started after it has been canceled.')
+        self.assertEqual(len(self._get_started_subjobs_for_mock_slave(mock_slave)), 5,
+                         'A canceled build should not have any more subjobs started after it has been canceled.')
 
     def test_cancel_is_a_noop_if_build_is_already_finished(self):
         mock_slave = self._create_mock_slave()
@@ -480,6 +710,7 @@ class TestBuild(BaseUnitTestCase):
             num_subjobs=3,
             num_atoms_per_subjob=3,
             slaves=None,
+            build_parameters=None,
     ):
         """
         Create a Build instance for testing purposes. The instance will be created and brought to the specified
@@ -491,7 +722,7 @@ class TestBuild(BaseUnitTestCase):
         :type build_status: BuildStatus
         :rtype: Build
         """
-        build = Build(BuildRequest(build_parameters={}))
+        build = Build(BuildRequest(build_parameters=build_parameters or {}))
         if build_status is None:
             return build
 
@@ -568,21 +799,28 @@ class TestBuild(BaseUnitTestCase):
         slave_spec = Slave('', 0)  # constructor values don't matter since this is just a spec object
         mock_slave = MagicMock(spec_set=slave_spec, url=self._FAKE_SLAVE_URL, num_executors=num_executors)
 
+        mock_slave.num_idle_executors.return_value = num_executors
+        mock_slave.start_subjob.return_value = False
+        mock_slave.start_subjobs.side_effect = lambda subjobs: [False] * len(subjobs)
+        mock_slave.num_executors_leased.side_effect = lambda build_id: mock_slave.setup.call_args[1]['num_executors']
+
         counter = Counter()
-        mock_slave.claim_executor.side_effect = counter.increment
-        mock_slave.free_executor.side_effect = counter.decrement
+        mock_slave.claim_executor.side_effect = lambda build_id: counter.increment()
+        mock_slave.free_executor.side_effect = lambda build_id: counter.decrement()
 
         return mock_slave
 
     def _patch_compute_subjob_for_build(self, subjobs, compute_subjob_raises_exception=False):
         """
         :type subjobs: list[Subjob]
+        :rtype: MagicMock
         """
         mock_compute_subjobs_for_build = self.patch('app.master.build.compute_subjobs_for_build')
         if compute_subjob_raises_exception:
             mock_compute_subjobs_for_build.side_effect = AtomizerError('Atomizer command failed!')
         else:
             mock_compute_subjobs_for_build.return_value = subjobs
+        return mock_compute_subjobs_for_build
 
     def _finish_test_build(self, build, assert_postbuild_tasks_complete=True):
         """
@@ -598,7 +836,8 @@ class TestBuild(BaseUnitTestCase):
         postbuild_tasks_complete_event = Event()
         self._on_async_postbuild_tasks_completed(build, postbuild_tasks_complete_event.set)
 
-        # Complete all subjobs for this build.
+        # Complete all subjobs for this build. All atoms pass.
+        mock_open(mock=self.mock_open, read_data='0')
         build_has_running_subjobs = True
         while build_has_running_subjobs:
             build_has_running_subjobs = False
@@ -611,7 +850,7 @@ class TestBuild(BaseUnitTestCase):
 
                 for subjob in self._get_in_progress_subjobs_for_mock_slave(mock_slave):
                     build_has_running_subjobs = True
-                    build.complete_subjob(subjob.subjob_id())
+                    build.complete_subjob(subjob.subjob_id(), payload=self._FAKE_PAYLOAD)
                     build_scheduler.execute_next_subjob_or_free_executor(mock_slave)
 
         # Wait for the async postbuild thread to complete executing postbuild tasks.
@@ -621,11 +860,22 @@ class TestBuild(BaseUnitTestCase):
 
     def _get_in_progress_subjobs_for_mock_slave(self, mock_slave):
         return [
-            start_subjob_args[0]
-            for start_subjob_args, _ in mock_slave.start_subjob.call_args_list
-            if start_subjob_args[0].atoms[0].state is AtomState.IN_PROGRESS
+            subjob for subjob in self._get_started_subjobs_for_mock_slave(mock_slave)
+            if subjob.atoms[0].state is AtomState.IN_PROGRESS
         ]
 
+    def _get_started_subjobs_for_mock_slave(self, mock_slave):
+        """
+        :return: the subjobs sent to the mock slave, either one at a time or in batches
+        :rtype: list[Subjob]
+        """
+        started_subjobs = []
+        for start_subjobs_args, _ in mock_slave.start_subjobs.call_args_list:
+            started_subjobs.extend(start_subjobs_args[0])
+        for start_subjob_args, _ in mock_slave.start_subjob.call_args_list:
+            started_subjobs.append(start_subjob_args[0])
+        return started_subjobs
+
     def _on_async_postbuild_tasks_completed(self, build, callback):
         # Patch a build so it executes the specified callback after its PostBuild thread finishes.
         original_async_postbuild_method = build._perform_async_postbuild_tasks
@@ -56,3 +56,21 @@ class TestBuildRequestHandler(BaseUnitTestCase):
         build_request_handler._prepare_build_async(build_mock, mock_project_lock)
 
         self.assertFalse(build_mock.mark_failed.called, 'Build mark_failed should not be called for CANCELED build')
+
+    @genty_dataset(
+        prepare_succeeds=(None,),
+        prepare_fails=(AtomizerError,),
+    )
+    def test_prepare_build_async_without_project_lock_prepares_build_and_finishes_preparation(self, prepare_error):
+        build_scheduler_mock = self.patch('app.master.build_scheduler.BuildScheduler').return_value
+        build_request_handler = BuildRequestHandler(build_scheduler_mock)
+        build_mock = self.patch('app.master.build.Build').return_value
+        build_mock.is_stopped = False
+        build_mock.is_canceled = False
+        build_mock.get_subjobs.return_value = ['some subjob']
+        build_mock.prepare.side_effect = prepare_error
+
+        build_request_handler._prepare_build_async(build_mock, project_lock=None)
+
+        build_mock.prepare.assert_called_once_with(None)
+        build_mock.project_type.finish_preparation.assert_called_once_with()
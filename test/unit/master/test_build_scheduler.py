@@ -1,12 +1,13 @@
 from queue import Queue
-from unittest.mock import Mock
+from unittest.mock import ANY, Mock, call
 
 from app.master.build import Build
 from app.master.build_scheduler import BuildScheduler
 from app.master.build_scheduler_pool import BuildSchedulerPool
 from app.master.job_config import JobConfig
-from app.master.slave import Slave
+from app.master.slave import Slave, SlaveError
 from app.master.subjob import Subjob
+from app.util.conf.configuration import Configuration
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
 
@@ -26,7 +27,7 @@ class TestBuildScheduler(BaseUnitTestCase):
         # Arrange
         mock_build = self._get_mock_build()
         mock_build.is_canceled = True
-        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1})
+        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1, 'num_idle_executors.return_value': 10})
 
         # Act
         scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
@@ -34,13 +35,13 @@ class TestBuildScheduler(BaseUnitTestCase):
         scheduler.execute_next_subjob_or_free_executor(mock_slave)
 
         # Assert
-        mock_slave.free_executor.assert_called_once_with()
+        mock_slave.free_executor.assert_called_once_with(mock_build.build_id())
 
     def test_executor_or_free_with_canceled_build_tearsdown_and_unallocates_when_all_free(self):
         # Arrange
         mock_build = self._get_mock_build()
         mock_build.is_canceled = True
-        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1})
+        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1, 'num_idle_executors.return_value': 10})
         mock_slave.free_executor.return_value = 0
 
         # Act
@@ -49,15 +50,15 @@ class TestBuildScheduler(BaseUnitTestCase):
         scheduler.execute_next_subjob_or_free_executor(mock_slave)
 
         # Assert
-        mock_slave.free_executor.assert_called_once_with()
-        mock_slave.teardown.assert_called_once_with()
+        mock_slave.free_executor.assert_called_once_with(mock_build.build_id())
+        mock_slave.teardown.assert_called_once_with(mock_build.build_id())
 
     def test_execute_next_subjob_or_free_executor_with_no_unstarted_subjobs_frees_executors(self):
         # Arrange
         mock_build = self._get_mock_build()
         mock_build.is_canceled = False
         mock_build._unstarted_subjobs = Queue(maxsize=10)
-        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1})
+        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1, 'num_idle_executors.return_value': 10})
 
         # Act
         scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
@@ -65,7 +66,7 @@ class TestBuildScheduler(BaseUnitTestCase):
         scheduler.execute_next_subjob_or_free_executor(mock_slave)
 
         # Assert
-        mock_slave.free_executor.assert_called_once_with()
+        mock_slave.free_executor.assert_called_once_with(mock_build.build_id())
 
     def test_executor_or_free_starts_subjob_and_marks_build_in_progress(self):
         # Arrange
@@ -74,7 +75,8 @@ class TestBuildScheduler(BaseUnitTestCase):
         mock_build._unstarted_subjobs = Queue(maxsize=10)
         mock_subjob = Mock(Subjob)
         mock_build._unstarted_subjobs.put(mock_subjob)
-        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1})
+        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1, 'num_idle_executors.return_value': 10,
+                                    'start_subjob.return_value': False})
 
         # Act
         scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
@@ -83,4 +85,365 @@ class TestBuildScheduler(BaseUnitTestCase):
 
         # Assert
         mock_slave.start_subjob.assert_called_once_with(mock_subjob)
-        mock_subjob.mark_in_progress.assert_called_once_with(mock_slave)
+        mock_subjob.mark_in_progress.assert_called_once_with(mock_slave, is_queued=False)
+
+    def test_executor_or_free_splits_subjob_when_fewer_unstarted_subjobs_than_executors_near_build_end(self):
+        Configuration['tail_subjob_splitting'] = True
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_build._num_subjobs_finished = 1
+        mock_subjob = Mock(Subjob, atoms=[Mock(), Mock()])
+        mock_build._unstarted_subjobs.put(mock_subjob)
+        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1, 'num_idle_executors.return_value': 10})
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.allocate_slave(mock_slave)
+        scheduler._num_executors_in_use = 2
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        mock_build.split_subjob.assert_called_once_with(mock_subjob)
+        mock_slave.start_subjob.assert_called_once_with(mock_subjob)
+
+    def test_executor_or_free_does_not_split_subjob_before_any_subjob_has_finished(self):
+        Configuration['tail_subjob_splitting'] = True
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_build._num_subjobs_finished = 0
+        mock_build._unstarted_subjobs.put(Mock(Subjob, atoms=[Mock(), Mock()]))
+        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1, 'num_idle_executors.return_value': 10})
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.allocate_slave(mock_slave)
+        scheduler._num_executors_in_use = 2
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        self.assertFalse(mock_build.split_subjob.called)
+
+    def test_executor_or_free_speculatively_executes_straggling_subjob_when_no_unstarted_subjobs(self):
+        Configuration['speculative_execution_slowdown_factor'] = 2.0
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        original_slave = Mock(Slave)
+        on_time_subjob = Mock(Subjob, slave=original_slave, speculative_slave=None, **{'slowdown.return_value': 1.5})
+        straggling_subjob = Mock(Subjob, slave=original_slave, speculative_slave=None, **{'slowdown.return_value': 3.0})
+        mock_build.get_subjobs.return_value = [on_time_subjob, straggling_subjob]
+        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1, 'num_idle_executors.return_value': 10,
+                                    'start_subjob.return_value': False})
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.allocate_slave(mock_slave)
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        mock_slave.start_subjob.assert_called_once_with(straggling_subjob)
+        straggling_subjob.mark_speculatively_in_progress.assert_called_once_with(mock_slave)
+        self.assertFalse(mock_slave.kill_subjob.called)
+        self.assertFalse(mock_slave.free_executor.called)
+
+    def test_executor_or_free_kills_speculative_duplicate_that_slave_queued_without_freeing_executor(self):
+        Configuration['speculative_execution_slowdown_factor'] = 2.0
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        straggling_subjob = Mock(Subjob, slave=Mock(Slave), speculative_slave=None,
+                                 **{'slowdown.return_value': 3.0})
+        mock_build.get_subjobs.return_value = [straggling_subjob]
+        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1, 'num_idle_executors.return_value': 10,
+                                    'start_subjob.return_value': True})
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.allocate_slave(mock_slave)
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        mock_slave.kill_subjob.assert_called_once_with(straggling_subjob)
+        self.assertIsNone(straggling_subjob.speculative_slave)
+        self.assertFalse(mock_slave.free_executor.called,
+                         'The executor should stay claimed until the killed duplicate reports its results.')
+
+    def test_executor_or_free_frees_executor_when_speculative_duplicate_fails_to_start(self):
+        Configuration['speculative_execution_slowdown_factor'] = 2.0
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        straggling_subjob = Mock(Subjob, slave=Mock(Slave), speculative_slave=None,
+                                 **{'slowdown.return_value': 3.0})
+        mock_build.get_subjobs.return_value = [straggling_subjob]
+        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1, 'num_idle_executors.return_value': 10,
+                                    'start_subjob.side_effect': SlaveError})
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.allocate_slave(mock_slave)
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        self.assertIsNone(straggling_subjob.speculative_slave)
+        mock_slave.free_executor.assert_called_once_with(mock_build.build_id())
+
+    def test_executor_or_free_frees_executor_when_straggling_subjob_runs_on_same_slave(self):
+        Configuration['speculative_execution_slowdown_factor'] = 2.0
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_slave = Mock(Slave, **{'num_executors': 10, 'id': 1, 'num_idle_executors.return_value': 10})
+        straggling_subjob = Mock(Subjob, slave=mock_slave, speculative_slave=None, **{'slowdown.return_value': 3.0})
+        mock_build.get_subjobs.return_value = [straggling_subjob]
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.allocate_slave(mock_slave)
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        self.assertFalse(mock_slave.start_subjob.called)
+        mock_slave.free_executor.assert_called_once_with(mock_build.build_id())
+
+    def test_allocate_slave_leases_only_executors_the_build_can_use(self):
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_slave = Mock(Slave, **{'num_executors': 16, 'id': 1, 'num_idle_executors.return_value': 16})
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.allocate_slave(mock_slave)
+
+        mock_slave.setup.assert_called_once_with(mock_build, executor_start_index=0, num_executors=10)
+        self.assertEqual(scheduler.num_executors_allocated, 10)
+
+    def test_allocate_slave_does_not_lease_executors_beyond_max_executors(self):
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_slave = Mock(Slave, **{'num_executors': 16, 'id': 1, 'num_idle_executors.return_value': 16})
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        for slave_id in (2, 3):
+            scheduler.allocate_slave(
+                Mock(Slave, **{'num_executors': 16, 'id': slave_id, 'num_idle_executors.return_value': 16}))
+
+        self.assertTrue(scheduler.allocate_slave(mock_slave))
+
+        self.assertFalse(mock_slave.setup.called)
+        self.assertEqual(scheduler.num_executors_allocated, 20)
+
+    def test_begin_subjob_executions_queues_subjobs_on_slave_up_to_dispatch_depth(self):
+        Configuration['subjob_dispatch_depth'] = 3
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_build._unstarted_subjobs = Queue()
+        for _ in range(10):
+            mock_build._unstarted_subjobs.put(Mock(Subjob, atoms=[Mock()]))
+        mock_slave = Mock(Slave, **{'id': 1, 'num_executors_leased.return_value': 2,
+                                    'start_subjobs.return_value': [False] * 2 + [True] * 4})
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.begin_subjob_executions_on_slave(mock_slave)
+
+        self.assertEqual(mock_slave.claim_executor.call_count, 2)
+        (started_subjobs,), _ = mock_slave.start_subjobs.call_args
+        self.assertEqual(len(started_subjobs), 6, 'Each executor should be sent 3 subjobs.')
+        self.assertEqual(mock_build._unstarted_subjobs.qsize(), 4)
+
+    def test_executor_is_freed_only_once_no_subjobs_are_queued_on_slave(self):
+        Configuration['subjob_dispatch_depth'] = 2
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_build._unstarted_subjobs = Queue()
+        for _ in range(2):
+            mock_build._unstarted_subjobs.put(Mock(Subjob, atoms=[Mock()]))
+        mock_slave = Mock(Slave, **{'id': 1, 'num_executors_leased.return_value': 1,
+                                    'start_subjobs.return_value': [False, True]})
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.begin_subjob_executions_on_slave(mock_slave)
+
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)  # The executor starts the queued subjob.
+        self.assertFalse(mock_slave.free_executor.called, 'The executor should not be freed while it has queued work.')
+
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+        mock_slave.free_executor.assert_called_once_with(mock_build.build_id())
+
+    def test_execution_of_subjob_queued_on_slave_starts_when_executor_finishes_previous_subjob(self):
+        Configuration['subjob_dispatch_depth'] = 2
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_build._unstarted_subjobs = Queue()
+        running_subjob, queued_subjob, unstarted_subjob = [Mock(Subjob, atoms=[Mock()]) for _ in range(3)]
+        for subjob in (running_subjob, queued_subjob, unstarted_subjob):
+            mock_build._unstarted_subjobs.put(subjob)
+        mock_slave = Mock(Slave, **{'id': 1, 'num_executors_leased.return_value': 1,
+                                    'start_subjobs.return_value': [False, True], 'start_subjob.return_value': True})
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+
+        scheduler.begin_subjob_executions_on_slave(mock_slave)
+
+        running_subjob.mark_in_progress.assert_called_once_with(mock_slave, is_queued=False)
+        queued_subjob.mark_in_progress.assert_called_once_with(mock_slave, is_queued=True)
+        self.assertFalse(queued_subjob.mark_execution_started.called,
+                         'A queued subjob should not be considered running before the executor is done.')
+
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)  # The executor finished the running subjob.
+
+        queued_subjob.mark_execution_started.assert_called_once_with()
+        unstarted_subjob.mark_in_progress.assert_called_once_with(mock_slave, is_queued=True)
+        self.assertFalse(unstarted_subjob.mark_execution_started.called)
+
+    def test_kill_queued_subjobs_kills_subjobs_queued_on_slaves_once(self):
+        Configuration['subjob_dispatch_depth'] = 3
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_build._unstarted_subjobs = Queue()
+        subjobs = [Mock(Subjob, atoms=[Mock()]) for _ in range(3)]
+        for subjob in subjobs:
+            mock_build._unstarted_subjobs.put(subjob)
+        mock_slave = Mock(Slave, **{'id': 1, 'num_executors_leased.return_value': 1,
+                                    'start_subjobs.return_value': [False, True, True]})
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.begin_subjob_executions_on_slave(mock_slave)
+
+        scheduler.kill_queued_subjobs()
+        scheduler.kill_queued_subjobs()
+
+        self.assertEqual(mock_slave.kill_subjob.call_args_list, [call(subjobs[1]), call(subjobs[2])])
+
+    def test_executor_of_canceled_build_is_freed_once_subjobs_queued_on_slave_have_reported(self):
+        Configuration['subjob_dispatch_depth'] = 2
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_build._unstarted_subjobs = Queue()
+        for _ in range(2):
+            mock_build._unstarted_subjobs.put(Mock(Subjob, atoms=[Mock()]))
+        mock_slave = Mock(Slave, **{'id': 1, 'num_executors_leased.return_value': 1,
+                                    'start_subjobs.return_value': [False, True]})
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.begin_subjob_executions_on_slave(mock_slave)
+        mock_build.is_canceled = True
+
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+
+        mock_slave.kill_subjob.assert_called_once_with(ANY)
+        self.assertFalse(mock_slave.free_executor.called, 'The killed queued subjob should still report its results.')
+        scheduler.execute_next_subjob_or_free_executor(mock_slave)
+        mock_slave.free_executor.assert_called_once_with(mock_build.build_id())
+
+    def test_subjobs_queued_on_disconnected_slave_are_requeued_and_run_on_another_slave(self):
+        Configuration['subjob_dispatch_depth'] = 3
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_build._unstarted_subjobs = Queue()
+        subjobs = [Mock(Subjob, atoms=[Mock()]) for _ in range(3)]
+        for subjob in subjobs:
+            mock_build._unstarted_subjobs.put(subjob)
+        mock_build.get_subjobs.return_value = subjobs
+        mock_pool = Mock(BuildSchedulerPool)
+        dead_slave = Mock(Slave, **{'id': 1, 'num_executors_leased.return_value': 1,
+                                    'start_subjobs.return_value': [False, True, True]})
+        other_slave = Mock(Slave, **{'id': 2, 'num_executors_leased.return_value': 1,
+                                     'start_subjob.return_value': False})
+        scheduler = BuildScheduler(mock_build, mock_pool)
+        scheduler.begin_subjob_executions_on_slave(dead_slave)
+
+        scheduler.handle_slave_disconnected(dead_slave)
+
+        for subjob in subjobs[1:]:
+            subjob.mark_not_started.assert_called_once_with()
+        mock_pool.add_build_waiting_for_slaves.assert_called_once_with(mock_build)
+        scheduler.execute_next_subjob_or_free_executor(other_slave)
+        scheduler.execute_next_subjob_or_free_executor(other_slave)
+        self.assertEqual(other_slave.start_subjob.call_args_list, [call(subjobs[1]), call(subjobs[2])])
+        scheduler.kill_queued_subjobs()
+        self.assertFalse(dead_slave.kill_subjob.called)
+
+    def test_begin_subjob_executions_sends_subjobs_for_all_executors_in_one_request(self):
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_build._unstarted_subjobs = Queue()
+        subjobs = [Mock(Subjob, atoms=[Mock()]) for _ in range(5)]
+        for subjob in subjobs:
+            mock_build._unstarted_subjobs.put(subjob)
+        mock_slave = Mock(Slave, **{'id': 1, 'num_executors_leased.return_value': 3,
+                                    'start_subjobs.return_value': [False] * 3})
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.begin_subjob_executions_on_slave(mock_slave)
+
+        mock_slave.start_subjobs.assert_called_once_with(subjobs[:3])
+        self.assertFalse(mock_slave.start_subjob.called)
+        for subjob in subjobs[:3]:
+            subjob.mark_in_progress.assert_called_once_with(mock_slave, is_queued=False)
+        self.assertFalse(mock_slave.free_executor.called)
+
+    def test_subjobs_are_requeued_and_executors_freed_if_slave_fails_to_receive_batch(self):
+        Configuration['subjob_dispatch_depth'] = 2
+        mock_build = self._get_mock_build()
+        mock_build.is_canceled = False
+        mock_build._unstarted_subjobs = Queue()
+        for _ in range(2):
+            mock_build._unstarted_subjobs.put(Mock(Subjob, atoms=[Mock()]))
+        mock_slave = Mock(Slave, **{'id': 1, 'num_executors_leased.return_value': 1})
+        mock_slave.start_subjobs.side_effect = SlaveError
+        mock_slave.start_subjob.side_effect = SlaveError
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.begin_subjob_executions_on_slave(mock_slave)
+
+        self.assertEqual(mock_build._unstarted_subjobs.qsize(), 2, 'The subjobs that failed to start should be requeued.')
+        mock_slave.free_executor.assert_called_once_with(mock_build.build_id())
+
+    def test_cancel_duplicate_subjob_execution_kills_subjob_on_losing_slave(self):
+        mock_build = self._get_mock_build()
+        original_slave, speculative_slave = Mock(Slave), Mock(Slave)
+        mock_subjob = Mock(Subjob, slave=original_slave, speculative_slave=speculative_slave)
+        mock_build.subjob.return_value = mock_subjob
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler.cancel_duplicate_subjob_execution(subjob_id=3, finished_slave=speculative_slave)
+        scheduler.cancel_duplicate_subjob_execution(subjob_id=3, finished_slave=original_slave)
+
+        original_slave.kill_subjob.assert_called_once_with(mock_subjob)
+        self.assertFalse(speculative_slave.kill_subjob.called)
+        self.assertIs(mock_subjob.slave, speculative_slave)
+
+    def test_estimated_remaining_work_counts_atoms_without_timing_data_as_average_atom_time(self):
+        subjobs = [
+            Mock(Subjob, atoms=[Mock(expected_time=3.0), Mock(expected_time=None)]),
+            Mock(Subjob, atoms=[Mock(expected_time=5.5)]),
+        ]
+        mock_build = self._get_mock_build()
+        mock_build.get_subjobs.return_value = subjobs
+        for subjob in subjobs:
+            mock_build._unstarted_subjobs.put(subjob)
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+
+        self.assertEqual(scheduler.estimated_remaining_work(), 3.0 + 4.25 + 5.5)
+
+    def test_estimated_remaining_work_counts_atoms_as_one_second_if_build_has_no_timing_data(self):
+        subjob = Mock(Subjob, atoms=[Mock(expected_time=None), Mock(expected_time=None)])
+        mock_build = self._get_mock_build()
+        mock_build.get_subjobs.return_value = [subjob]
+        mock_build._unstarted_subjobs.put(subjob)
+
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+
+        self.assertEqual(scheduler.estimated_remaining_work(), 2.0)
+
+    def test_estimated_time_remaining_divides_expected_times_of_unfinished_atoms_by_allocated_executors(self):
+        finished_subjob = Mock(Subjob, atoms=[Mock(expected_time=2.0)], **{'subjob_id.return_value': 0})
+        running_subjob = Mock(Subjob, atoms=[Mock(expected_time=3.0), Mock(expected_time=None)],
+                              **{'subjob_id.return_value': 1})
+        unstarted_subjob = Mock(Subjob, atoms=[Mock(expected_time=7.0)], **{'subjob_id.return_value': 2})
+        mock_build = self._get_mock_build()
+        mock_build.get_subjobs.return_value = [finished_subjob, running_subjob, unstarted_subjob]
+        mock_build._finished_subjobs = Queue()
+        mock_build._finished_subjobs.put(finished_subjob)
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler._num_executors_allocated = 2
+
+        # The atom without timing data is counted as the average expected atom time of the build, 4 seconds.
+        self.assertEqual(scheduler.estimated_time_remaining(), (3.0 + 4.0 + 7.0) / 2)
+
+    def test_estimated_time_remaining_is_none_if_build_has_no_timing_data(self):
+        subjob = Mock(Subjob, atoms=[Mock(expected_time=None)], **{'subjob_id.return_value': 0})
+        mock_build = self._get_mock_build()
+        mock_build.get_subjobs.return_value = [subjob]
+        mock_build._finished_subjobs = Queue()
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+        scheduler._num_executors_allocated = 2
+
+        self.assertIsNone(scheduler.estimated_time_remaining())
+
+    def test_estimated_time_remaining_is_none_before_executors_are_allocated(self):
+        mock_build = self._get_mock_build()
+        mock_build._finished_subjobs = Queue()
+        scheduler = BuildScheduler(mock_build, Mock(BuildSchedulerPool))
+
+        self.assertIsNone(scheduler.estimated_time_remaining())
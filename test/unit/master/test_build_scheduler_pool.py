@@ -0,0 +1,65 @@
+from unittest.mock import Mock
+
+from app.master.build import Build
+from app.master.build_scheduler_pool import BuildSchedulerPool
+from app.util.conf.configuration import Configuration
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestBuildSchedulerPool(BaseUnitTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.mock_time = self.patch('app.master.build_scheduler_pool.time')
+        self.mock_time.time.return_value = 1000.0
+        self.patch('app.master.build_scheduler_pool.BuildScheduler', new=self._create_mock_scheduler)
+
+    def test_build_schedulers_waiting_for_slaves_are_sorted_by_priority_then_waiting_order(self):
+        scheduler_pool = BuildSchedulerPool()
+        for build_id, priority in [(1, 0), (2, 5), (3, 0), (4, 5)]:
+            scheduler_pool.add_build_waiting_for_slaves(self._create_mock_build(build_id, priority))
+
+        waiting_build_ids = [scheduler.build_id for scheduler in scheduler_pool.build_schedulers_waiting_for_slaves()]
+
+        self.assertEqual(waiting_build_ids, [2, 4, 1, 3])
+
+    def test_effective_priority_of_waiting_build_increases_with_time_spent_waiting(self):
+        Configuration['build_priority_aging_interval'] = 60
+        scheduler_pool = BuildSchedulerPool()
+        scheduler_pool.add_build_waiting_for_slaves(self._create_mock_build(1, priority=0))
+        self.mock_time.time.return_value = 1000.0 + 3 * 60 + 1
+        scheduler_pool.add_build_waiting_for_slaves(self._create_mock_build(2, priority=2))
+
+        waiting_build_ids = [scheduler.build_id for scheduler in scheduler_pool.build_schedulers_waiting_for_slaves()]
+
+        self.assertEqual(waiting_build_ids, [1, 2], 'The older build should overtake the higher priority build.')
+
+    def test_build_that_has_been_allocated_executors_does_not_age(self):
+        Configuration['build_priority_aging_interval'] = 60
+        scheduler_pool = BuildSchedulerPool()
+        older_build = self._create_mock_build(1, priority=0)
+        scheduler_pool.add_build_waiting_for_slaves(older_build)
+        scheduler_pool.get(older_build).num_executors_allocated = 4
+        self.mock_time.time.return_value = 1000.0 + 10 * 60
+        newer_build = self._create_mock_build(2, priority=0)
+        scheduler_pool.add_build_waiting_for_slaves(newer_build)
+
+        self.assertEqual(scheduler_pool.effective_priority(scheduler_pool.get(older_build)), 0)
+        self.assertEqual(scheduler_pool.effective_priority(scheduler_pool.get(newer_build)), 0)
+
+    def test_removed_build_no_longer_waits_for_slaves(self):
+        scheduler_pool = BuildSchedulerPool()
+        mock_build = self._create_mock_build(1, priority=0)
+        scheduler_pool.add_build_waiting_for_slaves(mock_build)
+
+        scheduler_pool.remove_build_waiting_for_slaves(scheduler_pool.get(mock_build))
+
+        self.assertEqual(scheduler_pool.build_schedulers_waiting_for_slaves(), [])
+
+    def _create_mock_build(self, build_id, priority):
+        mock_build = Mock(spec=Build, priority=priority)
+        mock_build.build_id.return_value = build_id
+        return mock_build
+
+    def _create_mock_scheduler(self, build, scheduler_pool):
+        return Mock(build_id=build.build_id(), priority=build.priority, num_executors_allocated=0)
@@ -13,7 +13,7 @@ from app.master.build import Build
 from app.master.build_request import BuildRequest
 from app.master.build_store import BuildStore
 from app.master.cluster_master import ClusterMaster
-from app.master.slave import Slave, SlaveRegistry
+from app.master.slave import Slave, SlaveRegistry, SlaveWarmth, _ExecutorLease
 from app.master.subjob import Subjob
 from app.slave.cluster_slave import SlaveState
 from app.util.conf.configuration import Configuration
@@ -34,6 +34,7 @@ class TestClusterMaster(BaseUnitTestCase):
         self.patch('app.util.fs.async_delete')
         self.patch('os.makedirs')
         self.mock_slave_allocator = self.patch('app.master.cluster_master.SlaveAllocator').return_value
+        self.mock_slave_allocator.reserve_slaves_of_finishing_build.return_value = []
         self.mock_scheduler_pool = self.patch('app.master.cluster_master.BuildSchedulerPool').return_value
 
         # mock datetime class inside cluster master
@@ -96,12 +97,28 @@ class TestClusterMaster(BaseUnitTestCase):
         build_mock = MagicMock(spec_set=Build)
         BuildStore._all_builds_by_id[1] = build_mock
         existing_slave = slave_registry.get_slave(slave_id=None, slave_url='running-slave.turtles.gov')
-        existing_slave.current_build_id = 1
+        existing_slave._executor_leases_by_build_id[1] = _ExecutorLease(10, 'fake_project')
 
         master.connect_slave('running-slave.turtles.gov', 10)
 
         self.assertTrue(build_mock.cancel.called, 'The build was not cancelled.')
 
+    def test_connect_slave_with_existing_slave_running_multiple_builds_cancels_all_builds(self):
+        master = ClusterMaster()
+        slave_registry = SlaveRegistry.singleton()
+
+        master.connect_slave('running-slave.turtles.gov', 10)
+        build_mocks = {build_id: MagicMock(spec_set=Build) for build_id in (1, 2)}
+        BuildStore._all_builds_by_id.update(build_mocks)
+        existing_slave = slave_registry.get_slave(slave_id=None, slave_url='running-slave.turtles.gov')
+        existing_slave._executor_leases_by_build_id[1] = _ExecutorLease(4, 'project_a')
+        existing_slave._executor_leases_by_build_id[2] = _ExecutorLease(6, 'project_b')
+
+        master.connect_slave('running-slave.turtles.gov', 10)
+
+        for build_mock in build_mocks.values():
+            self.assertTrue(build_mock.cancel.called, 'The build was not cancelled.')
+
     def test_update_build_with_valid_params_succeeds(self):
         build_id = 1
         update_params = {'key': 'value'}
@@ -117,6 +134,22 @@ class TestClusterMaster(BaseUnitTestCase):
         self.assertTrue(success, "Update build should return success")
         self.assertEqual(response, {}, "Response should be empty")
 
+    def test_canceling_build_kills_subjobs_queued_on_slaves(self):
+        build_id = 1
+        update_params = {'status': 'canceled'}
+        master = ClusterMaster()
+        build = Mock(is_canceled=True)
+        BuildStore._all_builds_by_id[build_id] = build
+        build.validate_update_params = Mock(return_value=(True, update_params))
+        mock_scheduler = self.mock_scheduler_pool.get(build)
+        kill_event = Event()
+        mock_scheduler.kill_queued_subjobs.side_effect = kill_event.set
+
+        master.handle_request_to_update_build(build_id, update_params)
+
+        self.assertTrue(kill_event.wait(timeout=5), 'Subjobs queued on slaves should be killed when a build is '
+                                                    'canceled.')
+
     def test_update_build_with_bad_build_id_fails(self):
         build_id = 1
         invalid_build_id = 2
@@ -148,11 +181,38 @@ class TestClusterMaster(BaseUnitTestCase):
         slave_url = 'raphael.turtles.gov'
         master.connect_slave(slave_url, num_executors=10)
         slave = slave_registry.get_slave(slave_url=slave_url)
-        slave.current_build_id = 4
+        slave._executor_leases_by_build_id[4] = _ExecutorLease(10, 'fake_project')
 
         master.handle_slave_state_update(slave, SlaveState.DISCONNECTED)
 
         self.assertIsNone(slave.current_build_id)
+        self.assertEqual(slave.num_idle_executors(), 10)
+
+    def test_updating_slave_to_disconnected_state_should_forget_subjobs_queued_on_slave(self):
+        master = ClusterMaster()
+        slave_registry = SlaveRegistry.singleton()
+        slave_url = 'raphael.turtles.gov'
+        master.connect_slave(slave_url, num_executors=10)
+        slave = slave_registry.get_slave(slave_url=slave_url)
+        build = Mock()
+        BuildStore._all_builds_by_id[4] = build
+        slave._executor_leases_by_build_id[4] = _ExecutorLease(10, 'fake_project')
+
+        master.handle_slave_state_update(slave, SlaveState.DISCONNECTED)
+
+        self.mock_scheduler_pool.get.assert_called_once_with(build)
+        self.mock_scheduler_pool.get(build).handle_slave_disconnected.assert_called_once_with(slave)
+
+    def test_updating_slave_to_disconnected_state_should_cancel_slave_reservation(self):
+        master = ClusterMaster()
+        slave_registry = SlaveRegistry.singleton()
+        slave_url = 'raphael.turtles.gov'
+        master.connect_slave(slave_url, num_executors=10)
+        slave = slave_registry.get_slave(slave_url=slave_url)
+
+        master.handle_slave_state_update(slave, SlaveState.DISCONNECTED)
+
+        self.mock_slave_allocator.cancel_reservation.assert_called_once_with(slave)
 
     def test_updating_slave_to_setup_completed_state_should_tell_build_to_begin_subjob_execution(self):
         master = ClusterMaster()
@@ -174,6 +234,84 @@ class TestClusterMaster(BaseUnitTestCase):
         _, call_kwargs = mock_scheduler.begin_subjob_executions_on_slave.call_args
         self.assertEqual(call_kwargs.get('slave'), slave)
 
+    @genty_dataset(
+        prefetch_enabled=(True, ['cold_slave', 'warm_project_slave']),
+        prefetch_disabled=(False, []),
+    )
+    def test_project_is_prefetched_only_on_idle_slaves_that_have_not_set_up_fetched_version(
+            self, prefetch_enabled, expected_prefetching_slave_names):
+        Configuration['prefetch_project_on_idle_slaves'] = prefetch_enabled
+        master = ClusterMaster()
+        fake_build = MagicMock(spec_set=Build)
+        fake_build.project_type.project_id.return_value = 'fake_project'
+        fake_build.project_type.project_version.return_value = 'fake_version'
+        idle_slaves = {
+            'cold_slave': self._create_mock_idle_slave(SlaveWarmth.COLD),
+            'warm_project_slave': self._create_mock_idle_slave(SlaveWarmth.WARM_PROJECT),
+            'warm_version_slave': self._create_mock_idle_slave(SlaveWarmth.WARM_VERSION),
+            'unavailable_slave': self._create_mock_idle_slave(SlaveWarmth.COLD, is_available=False),
+            'shutdown_slave': self._create_mock_idle_slave(SlaveWarmth.COLD, is_shutdown=True),
+        }
+        self.mock_slave_allocator.idle_slaves.return_value = list(idle_slaves.values())
+
+        master._prefetch_project_on_idle_slaves(fake_build)
+        self.thread_pool_executor.shutdown()
+
+        prefetching_slave_names = [name for name, slave in idle_slaves.items() if slave.prefetch_project.called]
+        self.assertCountEqual(prefetching_slave_names, expected_prefetching_slave_names)
+        for name in expected_prefetching_slave_names:
+            idle_slaves[name].prefetch_project.assert_called_once_with(fake_build)
+
+    @genty_dataset(
+        cold_slave_of_other_project=(SlaveWarmth.COLD, 'other_project', True),
+        warm_version_slave=(SlaveWarmth.WARM_VERSION, 'other_project', False),
+        slave_of_same_project=(SlaveWarmth.COLD, 'finishing_project', False),
+    )
+    def test_reserved_slaves_prefetch_project_of_build_they_are_reserved_for(
+            self, warmth, reserved_project_id, expect_prefetch):
+        master = ClusterMaster()
+        reserved_build = MagicMock(spec_set=Build)
+        BuildStore._all_builds_by_id[1] = reserved_build
+        finishing_scheduler = Mock(build_id=2, project_id='finishing_project')
+        reserved_scheduler = Mock(build_id=1, project_id=reserved_project_id, project_version='fake_version')
+        reserved_slave = self._create_mock_idle_slave(warmth)
+        self.mock_slave_allocator.reserve_slaves_of_finishing_build.return_value = [
+            (reserved_slave, reserved_scheduler)]
+
+        master._reserve_slaves_of_finishing_build(finishing_scheduler)
+
+        self.mock_slave_allocator.reserve_slaves_of_finishing_build.assert_called_once_with(finishing_scheduler)
+        if expect_prefetch:
+            reserved_slave.prefetch_project.assert_called_once_with(reserved_build)
+        else:
+            self.assertFalse(reserved_slave.prefetch_project.called)
+
+    def test_cluster_demand_summarizes_builds_waiting_for_slaves_and_idle_executors(self):
+        Configuration['demand_target_latency'] = 100
+        master = ClusterMaster()
+        waiting_schedulers = [
+            Mock(num_executors_allocated=2, **{'needs_more_slaves.return_value': True,
+                                               'estimated_remaining_work.return_value': 900.0}),
+            Mock(num_executors_allocated=0, **{'needs_more_slaves.return_value': True,
+                                               'estimated_remaining_work.return_value': 150.0}),
+            Mock(num_executors_allocated=5, **{'needs_more_slaves.return_value': False,
+                                               'estimated_remaining_work.return_value': 1000.0}),
+        ]
+        self.mock_scheduler_pool.build_schedulers_waiting_for_slaves.return_value = waiting_schedulers
+        master.active_builds = Mock(return_value=[Mock(spec=Build, is_queued=True), Mock(spec=Build, is_queued=False)])
+        master.connect_slave('idle-slave.turtles.gov', 4)
+        master.connect_slave('shutdown-slave.turtles.gov', 4)
+        SlaveRegistry.singleton().get_slave(slave_url='shutdown-slave.turtles.gov')._is_in_shutdown_mode = True
+
+        demand = master.cluster_demand()
+
+        self.assertEqual(demand, {
+            'queued_builds': 1,
+            'queued_work_seconds': 1050.0,
+            'executors_needed': 9,  # 1050 seconds of work needs 11 executors to finish within 100 seconds
+            'idle_executors': 4,
+        })
+
     def test_updating_slave_to_shutdown_should_call_slave_set_shutdown_mode(self):
         master = ClusterMaster()
         slave_registry = SlaveRegistry.singleton()
@@ -214,7 +352,7 @@ class TestClusterMaster(BaseUnitTestCase):
         last_heartbeat_time = self._mock_current_datetime - timedelta(seconds=seconds_since_last_heartbeat)
         master = ClusterMaster()
 
-        mock_slave = Mock()
+        mock_slave = Mock(current_build_ids=[])
         self.patch('app.master.cluster_master.Slave', new=lambda *args: mock_slave)
         master.connect_slave('slave_url', 1)
 
@@ -237,6 +375,8 @@ class TestClusterMaster(BaseUnitTestCase):
         build.cancel()
 
         self.patch_object(build, '_handle_subjob_payload')
+        self.patch_object(build, 'record_atom_results')
+        self.patch_object(build, '_count_failed_atoms')
         self.patch_object(build, '_mark_subjob_complete')
 
         master = ClusterMaster()
@@ -246,11 +386,13 @@ class TestClusterMaster(BaseUnitTestCase):
         mock_scheduler = self.mock_scheduler_pool.get(build)
 
         master.handle_result_reported_from_slave(slave_url, build_id, 1)
+        self.thread_pool_executor.shutdown()  # wait for the scheduler calls submitted to the thread pool
 
         self.assertEqual(build._handle_subjob_payload.call_count, 1, "Canceled builds should "
                                                                      "handle payload")
         self.assertEqual(build._mark_subjob_complete.call_count, 1, "Canceled builds should mark "
                                                                     "their subjobs complete")
+        build.record_atom_results.assert_called_once_with(1)
         self.assertTrue(mock_scheduler.execute_next_subjob_or_free_executor.called)
 
     def test_exception_raised_during_complete_subjob_does_not_prevent_slave_teardown(self):
@@ -266,9 +408,45 @@ class TestClusterMaster(BaseUnitTestCase):
 
         with self.assertRaisesRegex(RuntimeError, 'Write failed'):
             master.handle_result_reported_from_slave(slave_url, mock_build.build_id(), subjob_id=888)
+        self.thread_pool_executor.shutdown()  # wait for the scheduler calls submitted to the thread pool
 
         self.assertEqual(mock_scheduler.execute_next_subjob_or_free_executor.call_count, 1)
 
+    def test_handle_atom_result_reported_from_slave_completes_atom_without_completing_subjob(self):
+        mock_build = Mock(spec_set=Build, build_id=lambda: 777)
+        mock_slave = Mock()
+        master = ClusterMaster()
+        BuildStore._all_builds_by_id[mock_build.build_id()] = mock_build
+        SlaveRegistry.singleton()._all_slaves_by_url['raphael.turtles.gov'] = mock_slave
+        payload = {'filename': 'payload', 'body': 'Cowabunga!'}
+
+        future = master.handle_atom_result_reported_from_slave('raphael.turtles.gov', mock_build.build_id(),
+                                                               subjob_id=888, atom_id=3, payload=payload)
+
+        future.result(timeout=5)
+        mock_build.complete_atom.assert_called_once_with(888, 3, payload, slave=mock_slave)
+        self.assertFalse(mock_build.complete_subjob.called)
+
+    @genty_dataset(not_a_number=('urgent',), fraction=(1.9,), fraction_string=('1.9',), boolean=(True,))
+    def test_handle_request_for_new_build_with_invalid_priority_fails(self, priority):
+        master = ClusterMaster()
+
+        success, response = master.handle_request_for_new_build(
+            {'type': 'directory', 'project_directory': '/tmp', 'priority': priority})
+
+        self.assertFalse(success)
+        self.assertIn('priority', response['error'])
+
+    @genty_dataset(not_an_integer=('soon',), fraction=(1.5,), zero=(0,), negative=(-2,))
+    def test_handle_request_for_new_build_with_invalid_fail_fast_after_fails(self, fail_fast_after):
+        master = ClusterMaster()
+
+        success, response = master.handle_request_for_new_build(
+            {'type': 'directory', 'project_directory': '/tmp', 'fail_fast_after': fail_fast_after})
+
+        self.assertFalse(success)
+        self.assertIn('fail_fast_after', response['error'])
+
     @given(dictionaries(text(), text()))
     def test_handle_request_for_new_build_does_not_raise_exception(self, build_params):
         master = ClusterMaster()
@@ -479,3 +657,16 @@ class TestClusterMaster(BaseUnitTestCase):
         self.assertEqual(id_of_last_atom, expected_last_atom_id, 'Received the wrong last atom from request')
         if offset is not None and limit is not None:
             self.assertLessEqual(num_atoms, self._PAGINATION_MAX_LIMIT, 'Received too many atoms from request')
+
+    def _create_mock_idle_slave(self, warmth, is_available=True, is_shutdown=False):
+        """
+        :type warmth: SlaveWarmth
+        :type is_available: bool
+        :type is_shutdown: bool
+        :rtype: Mock
+        """
+        mock_slave = Mock(spec=Slave)
+        mock_slave.warmth_for.return_value = warmth
+        mock_slave.is_available_for.return_value = is_available
+        mock_slave.is_shutdown.return_value = is_shutdown
+        return mock_slave
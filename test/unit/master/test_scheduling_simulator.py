@@ -0,0 +1,118 @@
+from genty import genty, genty_dataset
+
+from app.master.scheduling_simulator import BuildWorkload, SchedulingSimulator, load_workloads, parse_policy
+from app.util import analytics
+from app.util.conf.configuration import Configuration
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+@genty
+class TestSchedulingSimulator(BaseUnitTestCase):
+
+    def test_load_workloads_reconstructs_build_times_from_events(self):
+        events = [
+            self._event(analytics.BUILD_REQUEST_QUEUED, 100.0, build_id=1),
+            self._event(analytics.BUILD_PREPARE_START, 101.0, build_id=1),
+            self._event(analytics.BUILD_PREPARE_FINISH, 104.0, build_id=1, is_success=True),
+            self._event(analytics.BUILD_SETUP_START, 104.0, build_id=1, slave_id=1),
+            self._event(analytics.BUILD_SETUP_START, 104.0, build_id=1, slave_id=2),
+            self._event(analytics.BUILD_SETUP_FINISH, 106.0, build_id=1, slave_id=1),
+            self._event(analytics.BUILD_SETUP_FINISH, 108.0, build_id=1, slave_id=2),
+            self._event(analytics.ATOM_START, 108.0, build_id=1, subjob_id=1, atom_id=0),
+            self._event(analytics.ATOM_FINISH, 113.0, build_id=1, subjob_id=1, atom_id=0, exit_code=0),
+            self._event(analytics.ATOM_START, 106.0, build_id=1, subjob_id=0, atom_id=0),
+            self._event(analytics.ATOM_FINISH, 107.5, build_id=1, subjob_id=0, atom_id=0, exit_code=0),
+            self._event(analytics.BUILD_REQUEST_QUEUED, 130.0, build_id=2),
+            self._event(analytics.ATOM_START, 140.0, build_id=2, subjob_id=0, atom_id=0),
+            self._event(analytics.ATOM_FINISH, 142.0, build_id=2, subjob_id=0, atom_id=0, exit_code=1),
+        ]
+
+        workloads = load_workloads(events)
+
+        self.assertEqual([workload.build_id for workload in workloads], [1, 2])
+        self.assertEqual([workload.arrival_time for workload in workloads], [0.0, 30.0])
+        self.assertEqual(workloads[0].atom_times, [1.5, 5.0], 'Atom times should be ordered by subjob and atom id.')
+        self.assertEqual(workloads[0].prepare_time, 3.0)
+        self.assertEqual(workloads[0].setup_time, 3.0, 'The setup time should be averaged over the slaves.')
+        self.assertEqual((workloads[1].prepare_time, workloads[1].setup_time), (0.0, 0.0))
+
+    def test_load_workloads_uses_first_atom_start_as_arrival_time_if_build_request_was_not_recorded(self):
+        events = [
+            self._event(analytics.ATOM_START, 50.0, build_id=7, subjob_id=0, atom_id=0),
+            self._event(analytics.ATOM_START, 52.0, build_id=8, subjob_id=0, atom_id=0),
+            self._event(analytics.ATOM_FINISH, 53.0, build_id=7, subjob_id=0, atom_id=0, exit_code=0),
+            self._event(analytics.ATOM_FINISH, 54.0, build_id=8, subjob_id=0, atom_id=0, exit_code=0),
+        ]
+
+        workloads = load_workloads(events)
+
+        self.assertEqual([workload.arrival_time for workload in workloads], [0.0, 2.0])
+
+    def test_run_of_single_build_on_single_executor_runs_atoms_back_to_back(self):
+        workload = BuildWorkload(build_id=1, arrival_time=0.0, atom_times=[1.0, 2.0, 3.0], prepare_time=4.0,
+                                 setup_time=2.0)
+        simulator = SchedulingSimulator([workload], num_slaves=1, num_executors_per_slave=1)
+
+        result = simulator.run()
+
+        self.assertAlmostEqual(result.makespan, 12.0)
+        self.assertAlmostEqual(result.mean_queue_time, 4.0)
+        self.assertAlmostEqual(result.mean_build_time, 12.0)
+        self.assertAlmostEqual(result.utilization, 0.5)
+
+    def test_run_lets_build_wait_until_slave_is_torn_down_by_earlier_build(self):
+        workloads = [
+            BuildWorkload(build_id=1, arrival_time=0.0, atom_times=[10.0]),
+            BuildWorkload(build_id=2, arrival_time=1.0, atom_times=[10.0]),
+        ]
+        simulator = SchedulingSimulator(workloads, num_slaves=1, num_executors_per_slave=1, teardown_time=1.0)
+
+        result = simulator.run()
+
+        self.assertAlmostEqual(result.makespan, 21.0)
+        self.assertAlmostEqual(result.mean_queue_time, 5.0, msg='The second build should wait 10 seconds.')
+
+    def test_run_spreads_build_over_all_executors_of_cluster(self):
+        workload = BuildWorkload(build_id=1, arrival_time=0.0, atom_times=[5.0] * 8)
+        simulator = SchedulingSimulator([workload], num_slaves=2, num_executors_per_slave=2)
+
+        result = simulator.run({'atom_grouping_strategy': 'bin_packing'})
+
+        self.assertAlmostEqual(result.makespan, 10.0)
+        self.assertAlmostEqual(result.utilization, 1.0)
+
+    def test_run_restores_settings_after_simulating_policy(self):
+        Configuration['subjob_dispatch_depth'] = 1
+        workload = BuildWorkload(build_id=1, arrival_time=0.0, atom_times=[1.0, 1.0])
+        simulator = SchedulingSimulator([workload], num_slaves=1, num_executors_per_slave=1)
+
+        simulator.run({'subjob_dispatch_depth': 3})
+
+        self.assertEqual(Configuration['subjob_dispatch_depth'], 1)
+
+    def test_parse_policy_converts_values_to_type_of_setting(self):
+        policy = parse_policy('atom_grouping_strategy=bin_packing, tail_subjob_splitting=False,subjob_dispatch_depth=2')
+
+        self.assertEqual(policy, {
+            'atom_grouping_strategy': 'bin_packing',
+            'tail_subjob_splitting': False,
+            'subjob_dispatch_depth': 2,
+        })
+
+    @genty_dataset(
+        unknown_setting=('not_a_setting=1',),
+        missing_value=('subjob_dispatch_depth',),
+        invalid_bool=('tail_subjob_splitting=maybe',),
+    )
+    def test_parse_policy_raises_for_invalid_setting(self, policy_string):
+        with self.assertRaises(ValueError):
+            parse_policy(policy_string)
+
+    def _event(self, tag, timestamp, **event_data):
+        """
+        :type tag: str
+        :type timestamp: float
+        :rtype: dict
+        """
+        event_data.update({'__tag__': tag, '__timestamp__': timestamp})
+        return event_data
@@ -4,9 +4,11 @@ from unittest.mock import Mock, MagicMock, ANY
 
 from app.master.build import Build
 from app.master.build_request import BuildRequest
-from app.master.slave import DeadSlaveError, SlaveMarkedForShutdownError, Slave, SlaveError, SlaveRegistry
+from app.master.slave import (DeadSlaveError, SlaveMarkedForShutdownError, Slave, SlaveError, SlaveRegistry,
+                              SlaveWarmth, _ExecutorLease)
 from app.master.subjob import Subjob
 from app.util import network
+from app.util.conf.configuration import Configuration
 from app.util.exceptions import ItemNotFoundError
 from app.util.secret import Secret
 from app.util.session_id import SessionId
@@ -14,6 +16,7 @@ from test.framework.base_unit_test_case import BaseUnitTestCase
 from test.framework.comparators import AnyStringMatching, AnythingOfType
 
 
+@genty
 class TestSlave(BaseUnitTestCase):
 
     _FAKE_SLAVE_URL = 'splinter.sensei.net:43001'
@@ -30,20 +33,20 @@ class TestSlave(BaseUnitTestCase):
 
     def test_disconnect_command_is_sent_during_teardown_when_slave_is_still_connected(self):
         slave = self._create_slave()
-        slave.current_build_id = 3
+        self._lease_executors(slave, build_id=3)
         slave._is_alive = True
 
-        slave.teardown()
+        slave.teardown(3)
 
         expected_teardown_url = 'http://splinter.sensei.net:43001/v1/build/3/teardown'
         self.mock_network.post.assert_called_once_with(expected_teardown_url)
 
     def test_disconnect_command_is_not_sent_during_teardown_when_slave_has_disconnected(self):
         slave = self._create_slave()
-        slave.current_build_id = 3
+        self._lease_executors(slave, build_id=3)
         slave._is_alive = False
 
-        slave.teardown()
+        slave.teardown(3)
 
         self.assertEqual(self.mock_network.post.call_count, 0,
                          'Master should not send teardown command to slave when slave has disconnected.')
@@ -69,6 +72,7 @@ class TestSlave(BaseUnitTestCase):
             'http://{}/v1/build/888/setup'.format(self._FAKE_SLAVE_URL),
             {
                 'build_executor_start_index': 777,
+                'num_executors': self._FAKE_NUM_EXECUTORS,
                 'project_type_params': {
                     'type': 'git',
                     'url': 'ssh://new-url-for-clusterrunner-master',
@@ -77,6 +81,38 @@ class TestSlave(BaseUnitTestCase):
             Secret.get()
         )
 
+    def test_setup_sends_setup_cache_key_to_slave_if_build_setup_reuse_is_enabled(self):
+        Configuration['reuse_build_setup'] = True
+        slave = self._create_slave()
+        mock_build = self._create_mock_build(build_id=888)
+        mock_build.project_type.setup_cache_key.return_value = 'fake_setup_cache_key'
+
+        slave.setup(mock_build, executor_start_index=0)
+
+        (_, post_body, _), _ = self.mock_network.post_with_digest.call_args
+        self.assertEqual(post_body.get('setup_cache_key'), 'fake_setup_cache_key')
+
+    def test_prefetch_project_sends_slave_project_params_to_slave(self):
+        slave = self._create_slave()
+        mock_build = self._create_mock_build(build_id=888)
+        mock_build.project_type.slave_param_overrides.return_value = {'branch': 'refs/clusterrunner/abc'}
+
+        slave.prefetch_project(mock_build)
+
+        self.mock_network.post_with_digest.assert_called_once_with(
+            'http://{}/v1/prefetch'.format(self._FAKE_SLAVE_URL),
+            {'project_type_params': {'type': 'git', 'branch': 'refs/clusterrunner/abc'}},
+            Secret.get()
+        )
+
+    def test_prefetch_project_is_not_sent_to_dead_slave(self):
+        slave = self._create_slave()
+        slave.mark_dead()
+
+        slave.prefetch_project(self._create_mock_build(build_id=888))
+
+        self.assertFalse(self.mock_network.post_with_digest.called)
+
     def test_build_id_is_set_on_master_before_telling_slave_to_setup(self):
         # This test enforces an ordering that avoids a race where the slave finishes setup and posts back before the
         # master has actually set the slave's current_build_id.
@@ -142,10 +178,66 @@ class TestSlave(BaseUnitTestCase):
 
     def test_mark_as_idle_raises_when_executors_are_in_use(self):
         slave = self._create_slave()
-        slave._num_executors_in_use.increment()
+        self._lease_executors(slave, build_id=1)
+        slave.claim_executor(1)
 
         self.assertRaises(Exception, slave.mark_as_idle)
 
+    def test_setup_leases_requested_number_of_executors_to_build(self):
+        slave = self._create_slave(num_executors=10)
+
+        slave.setup(self._create_mock_build(build_id=1), executor_start_index=0, num_executors=4)
+
+        self.assertEqual(slave.num_executors_leased(1), 4)
+        self.assertEqual(slave.num_idle_executors(), 6)
+
+    def test_setup_raises_when_not_enough_executors_are_idle(self):
+        slave = self._create_slave(num_executors=10)
+        self._lease_executors(slave, build_id=1, num_executors=8)
+
+        self.assertRaises(Exception, slave.setup, self._create_mock_build(build_id=2), executor_start_index=0,
+                          num_executors=3)
+
+    def test_slave_can_work_on_multiple_builds_at_once(self):
+        slave = self._create_slave(num_executors=10)
+        self._lease_executors(slave, build_id=1, num_executors=4)
+        self._lease_executors(slave, build_id=2, num_executors=6)
+
+        slave.claim_executor(1)
+        slave.claim_executor(2)
+        slave.claim_executor(2)
+
+        self.assertEqual(slave.current_build_ids, [1, 2])
+        self.assertEqual(slave.num_executors_in_use(), 3)
+        self.assertEqual(slave.num_idle_executors(), 0)
+        self.assertRaises(Exception, slave.claim_executor, 3)
+
+    def test_mark_as_idle_releases_only_executors_of_specified_build(self):
+        slave = self._create_slave(num_executors=10)
+        self._lease_executors(slave, build_id=1, num_executors=4)
+        self._lease_executors(slave, build_id=2, num_executors=6)
+
+        slave.mark_as_idle(1)
+
+        self.assertEqual(slave.current_build_ids, [2])
+        self.assertEqual(slave.num_idle_executors(), 4)
+
+    @genty_dataset(
+        same_project=('project_a', False),
+        different_project=('project_b', True),
+    )
+    def test_is_available_for_only_allows_one_build_per_project(self, project_id, expected_is_available):
+        slave = self._create_slave(num_executors=10)
+        self._lease_executors(slave, build_id=1, num_executors=4, project_id='project_a')
+
+        self.assertEqual(slave.is_available_for(project_id), expected_is_available)
+
+    def test_is_available_for_returns_false_when_all_executors_are_leased(self):
+        slave = self._create_slave(num_executors=10)
+        self._lease_executors(slave, build_id=1, num_executors=10, project_id='project_a')
+
+        self.assertFalse(slave.is_available_for('project_b'))
+
     def test_mark_as_idle_raises_when_slave_is_in_shutdown_mode(self):
         slave = self._create_slave()
         slave._is_in_shutdown_mode = True
@@ -154,6 +246,18 @@ class TestSlave(BaseUnitTestCase):
         self.mock_network.post_with_digest.assert_called_once_with(
             AnyStringMatching('/v1/kill'), ANY, ANY)
 
+    @genty_dataset(
+        project_not_prepared=('project_b', 'abc123', SlaveWarmth.COLD),
+        different_version_prepared=('project_a', 'def456', SlaveWarmth.WARM_PROJECT),
+        unknown_version=('project_a', None, SlaveWarmth.WARM_PROJECT),
+        same_version_prepared=('project_a', 'abc123', SlaveWarmth.WARM_VERSION),
+    )
+    def test_warmth_for_depends_on_prepared_project_version(self, project_id, project_version, expected_warmth):
+        slave = self._create_slave()
+        slave.mark_project_prepared('project_a', 'abc123')
+
+        self.assertEqual(slave.warmth_for(project_id, project_version), expected_warmth)
+
     def test_start_subjob_raises_if_slave_is_dead(self):
         slave = self._create_slave()
         slave._is_alive = False
@@ -168,7 +272,7 @@ class TestSlave(BaseUnitTestCase):
 
     def test_set_shutdown_mode_should_set_is_shutdown_and_not_kill_slave_if_slave_has_a_build(self):
         slave = self._create_slave()
-        slave.current_build_id = 1
+        self._lease_executors(slave, build_id=1)
 
         slave.set_shutdown_mode()
 
@@ -218,6 +322,37 @@ class TestSlave(BaseUnitTestCase):
         self.assertEqual(post_body, {'atomic_commands': AnythingOfType(list)},
                          'Call to start subjob should contain list of atomic_commands for this subjob.')
 
+    def test_start_subjobs_sends_all_subjobs_to_slave_in_one_request(self):
+        slave = self._create_slave()
+        subjobs = [self._create_test_subjob(build_id=888, subjob_id=subjob_id) for subjob_id in (1, 2)]
+
+        slave.start_subjobs(subjobs)
+
+        self.mock_network.post_with_digest.assert_called_once_with(
+            'http://{}/v1/build/888/subjob'.format(self._FAKE_SLAVE_URL),
+            {'subjobs': [{'subjob_id': subjob.subjob_id(), 'atomic_commands': subjob.atomic_commands()}
+                         for subjob in subjobs]},
+            Secret.get(), error_on_failure=True)
+
+    def test_start_subjobs_returns_which_subjobs_were_queued_on_slave(self):
+        slave = self._create_slave()
+        subjobs = [self._create_test_subjob(subjob_id=subjob_id) for subjob_id in (1, 2)]
+        self.mock_network.post_with_digest.return_value.json.return_value = {
+            'executor_ids': [1, None],
+            'statuses': ['ASSIGNED', 'QUEUED'],
+        }
+
+        are_subjobs_queued = slave.start_subjobs(subjobs)
+
+        self.assertEqual(are_subjobs_queued, [False, True])
+
+    def test_start_subjobs_raises_slave_error_on_request_failure(self):
+        self.mock_network.post_with_digest.side_effect = network.RequestFailedError
+        slave = self._create_slave()
+
+        with self.assertRaises(SlaveError):
+            slave.start_subjobs([self._create_test_subjob()])
+
     def test_get_last_heartbeat_time_returns_last_heartbeat_time(self):
         slave = self._create_slave()
 
@@ -241,6 +376,18 @@ class TestSlave(BaseUnitTestCase):
         kwargs.setdefault('num_executors', self._FAKE_NUM_EXECUTORS)
         return Slave(**kwargs)
 
+    def _lease_executors(self, slave, build_id, num_executors=1, project_id='fake_project'):
+        """
+        Lease executors on the slave to a build without telling the slave to set up the build.
+        """
+        slave._executor_leases_by_build_id[build_id] = _ExecutorLease(num_executors, project_id)
+
+    def _create_mock_build(self, build_id):
+        mock_build = MagicMock(spec=Build, build_request=BuildRequest({'type': 'git'}),
+                               build_id=Mock(return_value=build_id))
+        mock_build.project_type.slave_param_overrides.return_value = {}
+        return mock_build
+
     def _create_test_subjob(
             self, build_id=1234, subjob_id=456, project_type=None, job_config=None, atoms=None,
     ) -> Subjob:
@@ -1,12 +1,17 @@
 from unittest.mock import Mock
 
+from genty import genty, genty_dataset
+
 from app.master.build import Build
+from app.master.build_scheduler import BuildScheduler
 from app.master.build_scheduler_pool import BuildSchedulerPool
-from app.master.slave import Slave
+from app.master.slave import Slave, SlaveWarmth
 from app.master.slave_allocator import SlaveAllocator
+from app.util.conf.configuration import Configuration
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
 
+@genty
 class TestSlaveAllocator(BaseUnitTestCase):
 
     def test_start_should_raise_if_allocation_thread_is_dead(self):
@@ -25,24 +30,287 @@ class TestSlaveAllocator(BaseUnitTestCase):
         assert slave_allocator._allocation_thread.start.called
 
     def test_slave_allocation_loop_should_allocate_a_slave(self):
-        mock_build = Mock(spec=Build, needs_more_slaves=Mock(return_value=True),
-                          allocate_slave=Mock(side_effect=AbortLoopForTesting))
-        mock_slave = Mock(spec=Slave, url='', is_alive=Mock(return_value=True), is_shutdown=Mock(return_value=False))
+        mock_scheduler = self._create_mock_scheduler(allocate_slave=Mock(side_effect=AbortLoopForTesting))
+        mock_slave = self._create_mock_slave()
         slave_allocator = self._create_slave_allocator()
-        slave_allocator._scheduler_pool.next_prepared_build_scheduler = Mock(return_value=mock_build)
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [mock_scheduler]
         slave_allocator._idle_slaves.get = Mock(return_value=mock_slave)
 
         self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+        mock_scheduler.allocate_slave.assert_called_once_with(mock_slave)
 
     def test_slave_allocation_loop_should_return_idle_slave_to_queue_if_not_needed(self):
-        mock_build = Mock(spec=Build, needs_more_slaves=Mock(side_effect=[True, False]))
-        mock_slave = Mock(spec=Slave, url='', is_alive=Mock(return_value=True), is_shutdown=Mock(return_value=False))
+        mock_scheduler = self._create_mock_scheduler(needs_more_slaves=Mock(return_value=False))
+        mock_slave = self._create_mock_slave()
         slave_allocator = self._create_slave_allocator()
-        slave_allocator._scheduler_pool.next_prepared_build_scheduler = Mock(return_value=mock_build)
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [mock_scheduler]
         slave_allocator._idle_slaves.get = Mock(return_value=mock_slave)
         slave_allocator.add_idle_slave = Mock(side_effect=AbortLoopForTesting)
 
         self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+        slave_allocator._scheduler_pool.remove_build_waiting_for_slaves.assert_called_once_with(mock_scheduler)
+        self.assertFalse(mock_scheduler.allocate_slave.called)
+
+    @genty_dataset(
+        build_without_slaves_goes_first=((10, 100.0), (0, 1.0), 1),
+        earliest_waiting_build_without_slaves_goes_first=((0, 1.0), (0, 100.0), 0),
+        build_with_more_remaining_work_per_executor_goes_first=((4, 100.0), (2, 10.0), 0),
+    )
+    def test_next_build_scheduler_to_allocate_uses_weighted_fair_share(self, first_build, second_build,
+                                                                       expected_scheduler_index):
+        mock_schedulers = [
+            self._create_mock_scheduler(num_executors_allocated=num_executors_allocated,
+                                        estimated_remaining_work=Mock(return_value=remaining_work))
+            for num_executors_allocated, remaining_work in (first_build, second_build)
+        ]
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = mock_schedulers
+
+        build_scheduler = slave_allocator._next_build_scheduler_to_allocate(self._create_mock_slave())
+
+        self.assertIs(build_scheduler, mock_schedulers[expected_scheduler_index])
+
+    def test_next_build_scheduler_to_allocate_prefers_build_with_highest_effective_priority(self):
+        low_priority_scheduler = self._create_mock_scheduler(priority=0)
+        high_priority_scheduler = self._create_mock_scheduler(priority=10, num_executors_allocated=50,
+                                                              estimated_remaining_work=Mock(return_value=1.0))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [
+            low_priority_scheduler, high_priority_scheduler]
+
+        build_scheduler = slave_allocator._next_build_scheduler_to_allocate(self._create_mock_slave())
+
+        self.assertIs(build_scheduler, high_priority_scheduler)
+
+    def test_slave_allocation_loop_should_return_slave_to_queue_if_it_has_idle_executors_left(self):
+        mock_scheduler = self._create_mock_scheduler(allocate_slave=Mock(return_value=True))
+        mock_slave = self._create_mock_slave(num_idle_executors=Mock(return_value=4))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [mock_scheduler]
+        slave_allocator._idle_slaves.get = Mock(side_effect=[mock_slave, AbortLoopForTesting])
+        slave_allocator._idle_slaves.put = Mock()
+
+        self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+        slave_allocator._idle_slaves.put.assert_called_once_with(mock_slave)
+
+    def test_next_build_scheduler_to_allocate_skips_builds_the_slave_is_not_available_for(self):
+        same_project_scheduler = self._create_mock_scheduler(project_id='project_a')
+        other_project_scheduler = self._create_mock_scheduler(project_id='project_b', num_executors_allocated=50,
+                                                              estimated_remaining_work=Mock(return_value=1.0))
+        mock_slave = self._create_mock_slave(
+            is_available_for=Mock(side_effect=lambda project_id: project_id != 'project_a'))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [
+            same_project_scheduler, other_project_scheduler]
+
+        build_scheduler = slave_allocator._next_build_scheduler_to_allocate(mock_slave)
+
+        self.assertIs(build_scheduler, other_project_scheduler)
+        self.assertFalse(slave_allocator._scheduler_pool.remove_build_waiting_for_slaves.called)
+
+    def test_slave_allocation_loop_should_prefer_warm_idle_slave(self):
+        mock_scheduler = self._create_mock_scheduler(allocate_slave=Mock(side_effect=AbortLoopForTesting))
+        cold_slave = self._create_mock_slave()
+        warm_slave = self._create_mock_slave(warmth_for=Mock(return_value=SlaveWarmth.WARM_VERSION))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [mock_scheduler]
+        slave_allocator._idle_slaves.put(cold_slave)
+        slave_allocator._idle_slaves.put(warm_slave)
+
+        self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+        mock_scheduler.allocate_slave.assert_called_once_with(warm_slave)
+        self.assertEqual(list(slave_allocator._idle_slaves.queue), [cold_slave])
+
+    def test_warmest_idle_slave_for_keeps_claimed_slave_if_no_idle_slave_is_warmer(self):
+        mock_scheduler = self._create_mock_scheduler()
+        claimed_slave = self._create_mock_slave(warmth_for=Mock(return_value=SlaveWarmth.WARM_PROJECT))
+        other_slave = self._create_mock_slave(warmth_for=Mock(return_value=SlaveWarmth.WARM_PROJECT))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._idle_slaves.put(other_slave)
+
+        chosen_slave = slave_allocator._warmest_idle_slave_for(mock_scheduler, claimed_slave)
+
+        self.assertIs(chosen_slave, claimed_slave)
+        self.assertEqual(list(slave_allocator._idle_slaves.queue), [other_slave])
+
+    @genty_dataset(
+        reservations_disabled=(0, 10.0),
+        build_not_finishing_within_lead_time=(60, 61.0),
+        build_without_estimate=(60, None),
+    )
+    def test_reserve_slaves_of_finishing_build_does_not_reserve(self, lead_time, time_remaining):
+        Configuration['slave_reservation_lead_time'] = lead_time
+        mock_slave = self._create_mock_slave(current_build_ids=[1])
+        finishing_scheduler = self._create_mock_scheduler(
+            build_id=1, estimated_time_remaining=Mock(return_value=time_remaining),
+            allocated_slaves=Mock(return_value=[mock_slave]))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [
+            self._create_mock_scheduler(build_id=2)]
+
+        self.assertEqual(slave_allocator.reserve_slaves_of_finishing_build(finishing_scheduler), [])
+
+    def test_reserve_slaves_of_finishing_build_reserves_only_slaves_working_on_nothing_but_that_build(self):
+        Configuration['slave_reservation_lead_time'] = 60
+        dedicated_slave = self._create_mock_slave(current_build_ids=[1])
+        shared_slave = self._create_mock_slave(current_build_ids=[1, 3])
+        finishing_scheduler = self._create_mock_scheduler(
+            build_id=1, estimated_time_remaining=Mock(return_value=30.0),
+            allocated_slaves=Mock(return_value=[dedicated_slave, shared_slave]))
+        waiting_scheduler = self._create_mock_scheduler(build_id=2)
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [
+            finishing_scheduler, waiting_scheduler]
+
+        reservations = slave_allocator.reserve_slaves_of_finishing_build(finishing_scheduler)
+
+        self.assertEqual(reservations, [(dedicated_slave, waiting_scheduler)])
+        self.assertEqual(slave_allocator.reserve_slaves_of_finishing_build(finishing_scheduler), [],
+                         'A slave should only be reserved once.')
+
+    def test_reserve_slaves_of_finishing_build_counts_reserved_executors_against_builds_needs(self):
+        Configuration['slave_reservation_lead_time'] = 60
+        slaves = [self._create_mock_slave(current_build_ids=[1]) for _ in range(2)]
+        finishing_scheduler = self._create_mock_scheduler(
+            build_id=1, estimated_time_remaining=Mock(return_value=30.0), allocated_slaves=Mock(return_value=slaves))
+        waiting_scheduler = self._create_mock_scheduler(
+            build_id=2, needs_more_slaves=Mock(side_effect=lambda num_executors_reserved=0: num_executors_reserved < 5))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [waiting_scheduler]
+
+        reservations = slave_allocator.reserve_slaves_of_finishing_build(finishing_scheduler)
+
+        self.assertEqual(reservations, [(slaves[0], waiting_scheduler)])
+
+    @genty_dataset(
+        reserved_slave_is_dead=(False, True),
+        reserved_build_is_no_longer_waiting=(True, False),
+    )
+    def test_reserve_slaves_of_finishing_build_does_not_count_stale_reservations(self, is_stale_slave_alive,
+                                                                                 is_reserved_build_waiting):
+        Configuration['slave_reservation_lead_time'] = 60
+        stale_slave = self._create_mock_slave(is_alive=Mock(return_value=is_stale_slave_alive))
+        finishing_slave = self._create_mock_slave(current_build_ids=[1])
+        finishing_scheduler = self._create_mock_scheduler(
+            build_id=1, estimated_time_remaining=Mock(return_value=30.0),
+            allocated_slaves=Mock(return_value=[finishing_slave]))
+        waiting_scheduler = self._create_mock_scheduler(
+            build_id=2, needs_more_slaves=Mock(side_effect=lambda num_executors_reserved=0: num_executors_reserved < 5))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [waiting_scheduler]
+        reserved_scheduler = waiting_scheduler if is_reserved_build_waiting else self._create_mock_scheduler(build_id=2)
+        slave_allocator._reserved_build_schedulers_by_slave[stale_slave] = reserved_scheduler
+
+        reservations = slave_allocator.reserve_slaves_of_finishing_build(finishing_scheduler)
+
+        self.assertEqual(reservations, [(finishing_slave, waiting_scheduler)])
+        self.assertNotIn(stale_slave, slave_allocator._reserved_build_schedulers_by_slave)
+
+    def test_reservations_are_canceled_when_build_stops_waiting_for_slaves(self):
+        done_scheduler = self._create_mock_scheduler(needs_more_slaves=Mock(return_value=False))
+        reserved_slave = self._create_mock_slave()
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [done_scheduler]
+        slave_allocator._reserved_build_schedulers_by_slave[reserved_slave] = done_scheduler
+
+        slave_allocator._next_build_scheduler_to_allocate(self._create_mock_slave())
+
+        slave_allocator._scheduler_pool.remove_build_waiting_for_slaves.assert_called_once_with(done_scheduler)
+        self.assertEqual(slave_allocator._reserved_build_schedulers_by_slave, {})
+
+    def test_slave_allocation_loop_should_allocate_reserved_slave_to_build_it_is_reserved_for(self):
+        Configuration['slave_reservation_lead_time'] = 60
+        reserved_slave = self._create_mock_slave(current_build_ids=[1])
+        finishing_scheduler = self._create_mock_scheduler(
+            build_id=1, estimated_time_remaining=Mock(return_value=30.0),
+            allocated_slaves=Mock(return_value=[reserved_slave]))
+        reserved_scheduler = self._create_mock_scheduler(build_id=2,
+                                                         allocate_slave=Mock(side_effect=AbortLoopForTesting))
+        # The build without slaves would get the slave if it were not reserved.
+        other_scheduler = self._create_mock_scheduler(build_id=3, allocate_slave=Mock(side_effect=AbortLoopForTesting))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [reserved_scheduler]
+        slave_allocator.reserve_slaves_of_finishing_build(finishing_scheduler)
+        reserved_scheduler.num_executors_allocated = 8
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [
+            reserved_scheduler, other_scheduler]
+        slave_allocator._idle_slaves.get = Mock(return_value=reserved_slave)
+
+        self.assertRaises(AbortLoopForTesting, slave_allocator._slave_allocation_loop)
+        reserved_scheduler.allocate_slave.assert_called_once_with(reserved_slave)
+        self.assertFalse(other_scheduler.allocate_slave.called)
+        self.assertEqual(slave_allocator._reserved_build_schedulers_by_slave, {})
+
+    def test_next_build_scheduler_to_allocate_ignores_reservation_for_build_with_lower_priority(self):
+        reserved_scheduler = self._create_mock_scheduler(priority=0)
+        high_priority_scheduler = self._create_mock_scheduler(priority=10)
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [
+            reserved_scheduler, high_priority_scheduler]
+
+        build_scheduler = slave_allocator._next_build_scheduler_to_allocate(self._create_mock_slave(),
+                                                                            reserved_scheduler)
+
+        self.assertIs(build_scheduler, high_priority_scheduler)
+
+    def test_allocate_idle_slaves_nowait_offers_each_idle_slave_until_none_can_be_allocated(self):
+        mock_scheduler = self._create_mock_scheduler(allocate_slave=Mock(return_value=True))
+        available_slave = self._create_mock_slave()
+        unavailable_slave = self._create_mock_slave(is_available_for=Mock(return_value=False))
+        slave_allocator = self._create_slave_allocator()
+        slave_allocator._scheduler_pool.build_schedulers_waiting_for_slaves.return_value = [mock_scheduler]
+        slave_allocator._idle_slaves.put(available_slave)
+        slave_allocator._idle_slaves.put(unavailable_slave)
+
+        slave_allocator.allocate_idle_slaves_nowait()
+
+        mock_scheduler.allocate_slave.assert_called_once_with(available_slave)
+        self.assertEqual(list(slave_allocator._idle_slaves.queue), [unavailable_slave])
+
+    def test_idle_executors_of_busy_slave_are_allocated_to_build_that_starts_waiting_later(self):
+        first_build, second_build = Mock(spec=Build), Mock(spec=Build)
+        first_build.build_id.return_value, second_build.build_id.return_value = 1, 2
+        first_scheduler, second_scheduler = [
+            self._create_mock_scheduler(build_id=build_id, allocate_slave=Mock(return_value=True),
+                                        needs_more_slaves=Mock(side_effect=[True, False]))
+            for build_id in (1, 2)
+        ]
+        schedulers_by_build = {first_build: first_scheduler, second_build: second_scheduler}
+        self.patch('app.master.build_scheduler_pool.BuildScheduler').side_effect = (
+            lambda build, scheduler_pool: schedulers_by_build[build])
+        scheduler_pool = BuildSchedulerPool()
+        slave_allocator = SlaveAllocator(scheduler_pool)
+        mock_slave = self._create_mock_slave(current_build_id=1, num_idle_executors=Mock(return_value=6))
+        slave_allocator._idle_slaves.put(mock_slave)
+        scheduler_pool.add_build_waiting_for_slaves(first_build)
+        slave_allocator.allocate_idle_slaves_nowait()
+
+        scheduler_pool.add_build_waiting_for_slaves(second_build)
+        slave_allocator.allocate_idle_slaves_nowait()
+
+        first_scheduler.allocate_slave.assert_called_once_with(mock_slave)
+        second_scheduler.allocate_slave.assert_called_once_with(mock_slave)
+
+    def test_partly_allocated_older_build_does_not_outrank_newer_build_of_same_priority(self):
+        Configuration['build_priority_aging_interval'] = 60
+        mock_time = self.patch('app.master.build_scheduler_pool.time')
+        mock_time.time.return_value = 1000.0
+        older_build, newer_build = Mock(spec=Build), Mock(spec=Build)
+        older_build.build_id.return_value, newer_build.build_id.return_value = 1, 2
+        older_scheduler = self._create_mock_scheduler(build_id=1, num_executors_allocated=4,
+                                                      estimated_remaining_work=Mock(return_value=1000.0))
+        newer_scheduler = self._create_mock_scheduler(build_id=2, estimated_remaining_work=Mock(return_value=10.0))
+        schedulers_by_build = {older_build: older_scheduler, newer_build: newer_scheduler}
+        self.patch('app.master.build_scheduler_pool.BuildScheduler').side_effect = (
+            lambda build, scheduler_pool: schedulers_by_build[build])
+        slave_allocator = SlaveAllocator(BuildSchedulerPool())
+        slave_allocator._scheduler_pool.add_build_waiting_for_slaves(older_build)
+        mock_time.time.return_value = 1000.0 + 10 * 60
+        slave_allocator._scheduler_pool.add_build_waiting_for_slaves(newer_build)
+
+        build_scheduler = slave_allocator._next_build_scheduler_to_allocate(self._create_mock_slave())
+
+        self.assertIs(build_scheduler, newer_scheduler)
 
     def test_add_idle_slave_should_mark_slave_idle_and_add_to_queue(self):
         mock_slave = Mock(spec=Slave, url='', mark_as_idle=Mock())
@@ -51,7 +319,7 @@ class TestSlaveAllocator(BaseUnitTestCase):
 
         slave_allocator.add_idle_slave(mock_slave)
 
-        self.assertTrue(mock_slave.mark_as_idle.called)
+        mock_slave.mark_as_idle.assert_called_once_with(None)
         slave_allocator._idle_slaves.put.assert_called_with(mock_slave)
 
     def test_add_idle_slave_should_not_add_slave_to_queue_if_slave_is_shutdown(self):
@@ -65,13 +333,36 @@ class TestSlaveAllocator(BaseUnitTestCase):
 
         self.assertFalse(slave_allocator._idle_slaves.put.called)
 
+    def _create_mock_scheduler(self, **kwargs):
+        """
+        :param kwargs: attributes to set on the mock scheduler
+        :rtype: BuildScheduler
+        """
+        attributes = {'build_id': 1, 'priority': 0, 'num_executors_allocated': 0, 'project_id': 'fake_project',
+                      'project_version': 'fake_version', 'needs_more_slaves': Mock(return_value=True)}
+        attributes.update(kwargs)
+        return Mock(spec=BuildScheduler, **attributes)
+
+    def _create_mock_slave(self, **kwargs):
+        """
+        :param kwargs: attributes to set on the mock slave
+        :rtype: Slave
+        """
+        attributes = {'url': '', 'num_executors': 10, 'current_build_id': None, 'is_alive': Mock(return_value=True),
+                      'is_shutdown': Mock(return_value=False), 'is_available_for': Mock(return_value=True),
+                      'num_idle_executors': Mock(return_value=0), 'warmth_for': Mock(return_value=SlaveWarmth.COLD)}
+        attributes.update(kwargs)
+        return Mock(spec=Slave, **attributes)
+
     def _create_slave_allocator(self, **kwargs):
         """
         Create a slave allocator for testing.
         :param kwargs: Any constructor parameters for the slave; if none are specified, test defaults will be used.
         :rtype: SlaveAllocator
         """
-        return SlaveAllocator(Mock(spec_set=BuildSchedulerPool))
+        mock_scheduler_pool = Mock(spec_set=BuildSchedulerPool)
+        mock_scheduler_pool.effective_priority.side_effect = lambda build_scheduler: build_scheduler.priority
+        return SlaveAllocator(mock_scheduler_pool)
 
 class AbortLoopForTesting(Exception):
     """
@@ -1,4 +1,4 @@
-from unittest.mock import Mock
+from unittest.mock import Mock, mock_open
 from app.master.atom import Atom, AtomState
 from app.master.job_config import JobConfig
 from app.master.subjob import Subjob
@@ -24,6 +24,7 @@ class TestSubjob(BaseUnitTestCase):
                     exit_code=1,
                     state=AtomState.NOT_STARTED,
                     atom_id=0,
+                    resource_usage={'user_cpu_time': 51.2, 'max_rss_kb': 10240},
                 ),
                 Atom(
                     'export BREAKFAST="cereal";',
@@ -57,7 +58,8 @@ class TestSubjob(BaseUnitTestCase):
                     'actual_time': 56.7,
                     'exit_code': 1,
                     'state': 'NOT_STARTED',
-                    'subjob_id': 34
+                    'subjob_id': 34,
+                    'resource_usage': {'user_cpu_time': 51.2, 'max_rss_kb': 10240},
                 },
                 {
                     'id': 1,
@@ -66,7 +68,8 @@ class TestSubjob(BaseUnitTestCase):
                     'actual_time': 24.6,
                     'exit_code': 0,
                     'state': 'NOT_STARTED',
-                    'subjob_id': 34
+                    'subjob_id': 34,
+                    'resource_usage': None,
                 },
             ]
         }
@@ -85,3 +88,60 @@ class TestSubjob(BaseUnitTestCase):
         self._subjob.mark_completed()
         actual_api_repr = self._subjob.api_representation()
         self._assert_atoms_are_in_state(actual_api_repr, 'COMPLETED')
+
+    def test_read_timings_does_not_return_timings_of_atoms_with_cached_results(self):
+        self.patch('app.master.subjob.os.path.exists').return_value = True
+        self.patch('app.master.subjob.open', new=mock_open(read_data='12.5'), create=True)
+        self._subjob.atoms[1].is_result_cached = True
+
+        timings = self._subjob.read_timings()
+
+        self.assertEqual(timings, {'export BREAKFAST="pancakes";': 12.5})
+        self.assertEqual([atom.actual_time for atom in self._subjob.atoms], [12.5, 12.5])
+
+    def test_split_moves_second_half_of_atoms_by_expected_time_into_new_subjob(self):
+        atoms = [Atom('atom_{}'.format(i), expected_time=time, atom_id=i) for i, time in enumerate([4.0, 3.0, 2.0, 1.0])]
+        subjob = Subjob(build_id=12, subjob_id=0, project_type=Mock(), job_config=Mock(), atoms=atoms)
+
+        new_subjob = subjob.split(new_subjob_id=7)
+
+        self.assertEqual([atom.command_string for atom in subjob.atoms], ['atom_0'])
+        self.assertEqual([atom.command_string for atom in new_subjob.atoms], ['atom_1', 'atom_2', 'atom_3'])
+        self.assertEqual(new_subjob.subjob_id(), 7)
+        self.assertEqual([(atom.subjob_id, atom.id) for atom in new_subjob.atoms], [(7, 0), (7, 1), (7, 2)])
+
+    def test_split_does_not_treat_recorded_expected_time_of_zero_as_missing_timing_data(self):
+        atoms = [Atom('atom_{}'.format(i), expected_time=time, atom_id=i) for i, time in enumerate([2.0, 0.0, 0.0, 2.0])]
+        subjob = Subjob(build_id=12, subjob_id=0, project_type=Mock(), job_config=Mock(), atoms=atoms)
+
+        new_subjob = subjob.split(new_subjob_id=7)
+
+        self.assertEqual([atom.command_string for atom in subjob.atoms], ['atom_0', 'atom_1', 'atom_2'])
+        self.assertEqual([atom.command_string for atom in new_subjob.atoms], ['atom_3'])
+
+    def test_split_returns_none_for_single_atom_subjob(self):
+        subjob = Subjob(build_id=12, subjob_id=0, project_type=Mock(), job_config=Mock(), atoms=[Atom('atom_0')])
+
+        self.assertIsNone(subjob.split(new_subjob_id=1))
+        self.assertEqual(len(subjob.atoms), 1)
+
+    def test_slowdown_is_ratio_of_elapsed_time_to_expected_time(self):
+        self.patch('app.master.subjob.time').time.side_effect = [1000.0, 1000.0 + 2 * 112.4]
+        self._subjob.mark_in_progress(None)
+
+        self.assertAlmostEqual(self._subjob.slowdown(), 2.0)
+
+    def test_slowdown_of_subjob_queued_on_slave_counts_from_start_of_execution(self):
+        self.patch('app.master.subjob.time').time.side_effect = [1000.0, 1000.0 + 2 * 112.4]
+        self._subjob.mark_in_progress(None, is_queued=True)
+        self.assertIsNone(self._subjob.slowdown(), 'A subjob waiting in a slave\'s queue should not be a straggler.')
+
+        self._subjob.mark_execution_started()
+
+        self.assertAlmostEqual(self._subjob.slowdown(), 2.0)
+
+    def test_slowdown_is_none_when_subjob_is_not_in_progress(self):
+        self.assertIsNone(self._subjob.slowdown())
+        self._subjob.mark_in_progress(None)
+        self._subjob.mark_completed()
+        self.assertIsNone(self._subjob.slowdown())
@@ -1,12 +1,16 @@
-from unittest.mock import Mock
+from os.path import join
+from unittest.mock import Mock, call
 
 from genty import genty, genty_dataset
 
-from app.master.atom import Atom
+from app.master.atom import Atom, AtomState
 from app.master.atomizer import Atomizer
+from app.master.bin_packing_atom_grouper import BinPackingAtomGrouper
 from app.master.job_config import JobConfig
-from app.master.subjob_calculator import compute_subjobs_for_build
+from app.master.subjob_calculator import compute_subjobs_for_build, _timing_data_grouper_class
+from app.master.time_based_atom_grouper import TimeBasedAtomGrouper
 from app.project_type.project_type import ProjectType
+from app.util.conf.configuration import Configuration
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
 
@@ -23,7 +27,7 @@ class TestSubjobCalculator(BaseUnitTestCase):
         :type atomizer_output: list[Atom] | None
         :type atomizer_called: bool
         """
-        self.patch('os.path.isfile').return_value = False
+        self.patch('app.master.subjob_calculator.TimingDataStore').return_value.get_expected_times.return_value = {}
         mock_project = Mock(spec_set=ProjectType())
         mock_project.atoms_override = atoms_override
         mock_project.timing_file_path.return_value = '/some/path/doesnt/matter'
@@ -38,3 +42,57 @@ class TestSubjobCalculator(BaseUnitTestCase):
         compute_subjobs_for_build(build_id=1, job_config=mock_job_config, project_type=mock_project)
 
         self.assertEquals(mock_atomizer.atomize_in_project.called, atomizer_called)
+
+    @genty_dataset(
+        time_based=('time_based', TimeBasedAtomGrouper),
+        bin_packing=('bin_packing', BinPackingAtomGrouper),
+        unknown_strategy=('not_a_real_strategy', TimeBasedAtomGrouper),
+    )
+    def test_timing_data_grouper_class_returns_grouper_for_configured_strategy(self, strategy,
+                                                                               expected_grouper_class):
+        Configuration['atom_grouping_strategy'] = strategy
+
+        self.assertIs(_timing_data_grouper_class(), expected_grouper_class)
+
+    def test_compute_subjobs_for_build_puts_atoms_with_cached_results_into_completed_subjob(self):
+        Configuration['cache_atom_results'] = True
+        Configuration['results_directory'] = '/results'
+        self.patch('app.master.subjob_calculator.TimingDataStore').return_value.get_expected_times.return_value = {}
+        mock_result_cache = self.patch('app.master.subjob_calculator.AtomResultCache').return_value
+        mock_result_cache.cache_key.side_effect = lambda tree_hash, job_config, command: tree_hash + command
+        mock_result_cache.has_result.side_effect = lambda cache_key: cache_key in {'tree_atom_1', 'tree_atom_3'}
+        mock_project = Mock(spec_set=ProjectType())
+        mock_project.atoms_override = ['atom_1', 'atom_2', 'atom_3']
+        mock_project.source_tree_hash.return_value = 'tree_'
+        mock_job_config = Mock(spec=JobConfig)
+        mock_job_config.name = 'some_config'
+        mock_job_config.max_executors = 1
+
+        subjobs = compute_subjobs_for_build(build_id=1, job_config=mock_job_config, project_type=mock_project)
+
+        self.assertEqual([[atom.command_string for atom in subjob.atoms] for subjob in subjobs],
+                         [['atom_2'], ['atom_1', 'atom_3']])
+        self.assertFalse(subjobs[0].is_completed())
+        self.assertTrue(subjobs[1].is_completed())
+        self.assertTrue(all(atom.exit_code == 0 and atom.state is AtomState.COMPLETED for atom in subjobs[1].atoms))
+        self.assertEqual([atom.is_result_cached for subjob in subjobs for atom in subjob.atoms], [False, True, True])
+        self.assertEqual(mock_result_cache.restore_result.call_args_list, [
+            call('tree_atom_1', join('/results', '1', 'artifact_1_0')),
+            call('tree_atom_3', join('/results', '1', 'artifact_1_1')),
+        ])
+
+    def test_compute_subjobs_for_build_does_not_use_result_cache_if_source_tree_is_unknown(self):
+        Configuration['cache_atom_results'] = True
+        self.patch('app.master.subjob_calculator.TimingDataStore').return_value.get_expected_times.return_value = {}
+        mock_result_cache_class = self.patch('app.master.subjob_calculator.AtomResultCache')
+        mock_project = Mock(spec_set=ProjectType())
+        mock_project.atoms_override = ['atom_1', 'atom_2']
+        mock_project.source_tree_hash.return_value = None
+        mock_job_config = Mock(spec=JobConfig)
+        mock_job_config.name = 'some_config'
+        mock_job_config.max_executors = 1
+
+        subjobs = compute_subjobs_for_build(build_id=1, job_config=mock_job_config, project_type=mock_project)
+
+        self.assertEqual(len(subjobs), 2)
+        self.assertFalse(mock_result_cache_class.called)
@@ -255,6 +255,73 @@ class TestGit(BaseUnitTestCase):
         self.assertEqual(expected_overrides, actual_overrides, 'Slave param overrides from Git object should match'
                                                                'expected.')
 
+    def test_project_version_is_fetched_commit_hash(self):
+        self._patch_popen({
+            'git rev-parse FETCH_HEAD': _FakePopenResult(stdout='deadbee123\n')
+        })
+
+        git = Git(url='http://original-user-specified-url.test/repo-path/repo-name')
+        self.assertIsNone(git.project_version(), 'Project version should not be known before the project is fetched.')
+        git.fetch_project()
+
+        self.assertEqual(git.project_version(), 'deadbee123')
+
+    def test_source_tree_hash_is_tree_of_fetched_commit(self):
+        self._patch_popen({
+            'git rev-parse FETCH_HEAD': _FakePopenResult(stdout='deadbee123\n'),
+            r'git rev-parse deadbee123\^\{tree\}': _FakePopenResult(stdout='7ree456\n'),
+        })
+
+        git = Git(url='http://original-user-specified-url.test/repo-path/repo-name')
+        self.assertIsNone(git.source_tree_hash(), 'Source tree should not be known before the project is fetched.')
+        git.fetch_project()
+
+        self.assertEqual(git.source_tree_hash(), '7ree456')
+
+    def test_fetch_project_with_worktrees_prepares_concurrent_builds_in_separate_reusable_worktrees(self):
+        Configuration['prepare_builds_in_git_worktrees'] = True
+        self.addCleanup(Git._leased_worktree_indices_by_repo.clear)
+        mock_popen = self._patch_popen()
+        url = 'http://original-user-specified-url.test/repo-path/repo-name'
+        worktrees_directory = Git.get_full_repo_directory(url) + '_worktrees'
+
+        first_git, second_git, third_git = (Git(url=url, branch='feature') for _ in range(3))
+        first_git.fetch_project()
+        second_git.fetch_project()
+        first_git.finish_preparation()
+        third_git.fetch_project()
+
+        worktree_add_commands = [call_args[0][0] for call_args in mock_popen.call_args_list
+                                 if 'git worktree add' in call_args[0][0]]
+        self.assertEqual(len(worktree_add_commands), 3)  # the existence of the worktrees is not faked
+        self.assertIn(join(worktrees_directory, '0'), worktree_add_commands[0])
+        self.assertIn(join(worktrees_directory, '1'), worktree_add_commands[1])
+        self.assertIn(join(worktrees_directory, '0'), worktree_add_commands[2], 'Released worktrees should be reused.')
+        self.assertTrue(first_git.can_prepare_builds_concurrently())
+
+        fetch_in_second_worktree_call = call(AnyStringMatching('git fetch +{} feature'.format(url)),
+                                             cwd=join(worktrees_directory, '1'), start_new_session=ANY, stdout=ANY,
+                                             stderr=ANY, shell=ANY)
+        self.assertIn(fetch_in_second_worktree_call, mock_popen.call_args_list,
+                      'The branch should be fetched by url into the worktree.')
+        reset_in_second_worktree_call = call(AnyStringMatching('git reset --hard'), cwd=join(worktrees_directory, '1'),
+                                             start_new_session=ANY, stdout=ANY, stderr=ANY, shell=ANY)
+        self.assertIn(reset_in_second_worktree_call, mock_popen.call_args_list)
+
+    def test_prefetch_project_fetches_branch_without_resetting_working_tree(self):
+        mock_popen = self._patch_popen()
+
+        git = Git(url='http://original-user-specified-url.test/repo-path/repo-name', branch='refs/clusterrunner/abc')
+        git.prefetch_project()
+
+        git_fetch_call = call(AnyStringMatching('git fetch .* origin refs/clusterrunner/abc'), start_new_session=ANY,
+                              stdout=ANY, stderr=ANY, cwd=ANY, shell=ANY)
+        self.assertIn(git_fetch_call, mock_popen.call_args_list, 'Prefetching should fetch the specified branch.')
+        for git_command in ('reset', 'clean'):
+            command_call = call(AnyStringMatching('git {}'.format(git_command)), start_new_session=ANY,
+                                stdout=ANY, stderr=ANY, cwd=ANY, shell=ANY)
+            self.assertNotIn(command_call, mock_popen.call_args_list, 'Prefetching must not change the working tree.')
+
     def test_slave_param_overrides_when_get_project_from_master_is_disabled(self):
         Configuration['get_project_from_master'] = False
 
@@ -1,9 +1,13 @@
 from genty import genty, genty_dataset
-from subprocess import TimeoutExpired
-from unittest.mock import ANY, MagicMock
+import os
+from subprocess import Popen, TimeoutExpired
+from threading import Event
+from unittest import skipUnless
+from unittest.mock import ANY, call, MagicMock
 
 from app.master.job_config import JobConfig
 from app.project_type.project_type import ProjectType
+from app.util.conf.configuration import Configuration
 from app.util.safe_thread import SafeThread
 from app.util.unhandled_exception_handler import UnhandledExceptionHandler
 from test.framework.base_unit_test_case import BaseUnitTestCase
@@ -125,6 +129,99 @@ class TestProjectType(BaseUnitTestCase):
 
         self.mock_kill.assert_called_once_with(55555, ANY)  # Note: os.killpg does not accept keyword args.
 
+    def test_kill_subprocesses_terminates_running_command_without_waiting_for_wait_loop(self):
+        self._mock_console_output(b'fake_output')
+        self.mock_popen.pid = 55555
+        self._simulate_hanging_popen_process()
+        project_type = ProjectType()
+        wait_started_event = Event()
+        hanging_wait = self.mock_popen.wait.side_effect
+        self.mock_popen.wait.side_effect = lambda timeout=None: wait_started_event.set() or hanging_wait(timeout)
+        command_thread = SafeThread(target=project_type.execute_command_in_project, args=('sleep 99',))
+        command_thread.start()
+        self.assertTrue(wait_started_event.wait(timeout=10), 'The command thread should wait for the process.')
+
+        project_type.kill_subprocesses()
+
+        self.mock_kill.assert_called_once_with(55555, ANY)
+        with UnhandledExceptionHandler.singleton():
+            command_thread.join(timeout=10)
+        self.assertFalse(command_thread.is_alive(), 'The command thread should stop waiting once the process is killed.')
+        self.assertEqual(self.mock_popen.wait.call_args_list[0], call(timeout=None),
+                         'The process should be waited for without polling when there is no timeout.')
+
+    def test_kill_subprocesses_does_not_signal_command_whose_process_was_reaped(self):
+        running_pipe = MagicMock(pid=55555, returncode=None)
+        reaped_pipe = MagicMock(pid=66666, returncode=0)
+        project_type = ProjectType()
+        project_type._running_commands_by_pipe = {running_pipe: 'sleep 99', reaped_pipe: 'true'}
+        self.mock_kill.side_effect = lambda pid, sig: self.assertTrue(
+            project_type._running_commands_lock.locked(), 'Processes should be signaled while holding the lock.')
+
+        project_type.kill_subprocesses()
+
+        self.mock_kill.assert_called_once_with(55555, ANY)
+
+    @skipUnless(hasattr(os, 'waitid'), 'os.waitid is not available on this platform.')
+    def test_process_is_reaped_while_holding_lock_after_waiting_for_it_to_exit(self):
+        mock_pipe = MagicMock(Popen, pid=55555, returncode=None)
+        mock_wait_without_reaping = self.patch('app.project_type.project_type.wait_without_reaping')
+        mock_wait_and_get_resource_usage = self.patch('app.project_type.project_type.wait_and_get_resource_usage')
+        project_type = ProjectType()
+        mock_wait_and_get_resource_usage.side_effect = lambda pipe: (
+            self.assertTrue(project_type._running_commands_lock.locked()) or {'user_cpu_time': 1.0})
+
+        resource_usage = project_type._wait_for_process(mock_pipe)
+
+        mock_wait_without_reaping.assert_called_once_with(mock_pipe, timeout=None)
+        self.assertEqual(resource_usage, {'user_cpu_time': 1.0})
+
+    @genty_dataset(
+        enabled=(True, True),
+        disabled=(False, False),
+    )
+    def test_setup_executor_starts_warm_command_runner_only_if_enabled(self, warm_command_runner_enabled,
+                                                                        expect_runner_started):
+        Configuration['warm_command_runner'] = warm_command_runner_enabled
+        mock_runner_cls = self.patch('app.project_type.project_type.WarmCommandRunner')
+        mock_runner_cls.is_supported.return_value = True
+        project_type = ProjectType()
+
+        project_type.setup_executor()
+        project_type.teardown_executor()
+
+        self.assertEqual(mock_runner_cls.return_value.start.called, expect_runner_started)
+        self.assertEqual(mock_runner_cls.return_value.stop.called, expect_runner_started)
+
+    def test_command_writing_output_to_named_file_runs_in_warm_command_runner(self):
+        mock_runner = self._set_up_warm_command_runner()
+        mock_runner.run.return_value.returncode = 0
+        output_file = MagicMock()
+        output_file.name = '/artifacts/artifact_0_0/clusterrunner_console_output'
+        output_file.read.return_value = b'fake output'
+        project_type = ProjectType()
+        project_type.setup_executor()
+
+        actual_output, actual_return_code = project_type.execute_command_in_project('run_test.sh',
+                                                                                    output_file=output_file)
+
+        mock_runner.run.assert_called_once_with(ANY, output_file.name)
+        self.assertTrue(mock_runner.run.call_args[0][0].endswith('run_test.sh'))
+        self.assertFalse(self.mock_popen.wait.called, 'The command should not be started in a new shell.')
+        self.assertEqual((actual_output, actual_return_code), ('fake output', 0))
+
+    def test_command_writing_output_to_temporary_file_does_not_run_in_warm_command_runner(self):
+        mock_runner = self._set_up_warm_command_runner()
+        self._mock_console_output(b'')
+        self.mock_popen.returncode = 0
+        project_type = ProjectType()
+        project_type.setup_executor()
+
+        project_type.execute_command_in_project('make deps')
+
+        self.assertFalse(mock_runner.run.called)
+        self.assertTrue(self.mock_popen.wait.called)
+
     def test_command_exiting_normally_will_break_out_of_command_execution_wait_loop(self):
         timeout_exc = TimeoutExpired(cmd=None, timeout=1)
         expected_return_code = 0
@@ -223,23 +320,64 @@ class TestProjectType(BaseUnitTestCase):
 
         mock_execute.assert_called_once_with(ANY, timeout=expected_timeout)
 
+    def test_setup_cache_key_is_none_if_project_version_is_unknown(self):
+        project_type = ProjectType()
+        project_type.project_version = MagicMock(return_value=None)
+
+        self.assertIsNone(project_type.setup_cache_key())
+
+    @genty_dataset(
+        same_version_and_setup=('abc123', 'make deps', True),
+        different_version=('def456', 'make deps', False),
+        different_setup=('abc123', 'make other_deps', False),
+    )
+    def test_setup_cache_key_depends_on_project_version_and_setup_commands(self, other_version, other_setup_build,
+                                                                          expect_same_key):
+        def create_project_type(project_version, setup_build):
+            project_type = ProjectType()
+            project_type.project_id = MagicMock(return_value='fake_project')
+            project_type.project_version = MagicMock(return_value=project_version)
+            project_type.job_config = MagicMock(return_value=MagicMock(setup_build=setup_build))
+            return project_type
+
+        key = create_project_type('abc123', 'make deps').setup_cache_key()
+        other_key = create_project_type(other_version, other_setup_build).setup_cache_key()
+
+        self.assertEqual(key == other_key, expect_same_key)
+
+    def _set_up_warm_command_runner(self):
+        """
+        Enable the warm command runner setting and replace the runner with a mock.
+        :rtype: MagicMock
+        """
+        Configuration['warm_command_runner'] = True
+        mock_runner_cls = self.patch('app.project_type.project_type.WarmCommandRunner')
+        mock_runner_cls.is_supported.return_value = True
+        mock_runner_cls.return_value.is_running = True
+        return mock_runner_cls.return_value
+
     def _simulate_hanging_popen_process(self, fake_returncode=0, wait_exception=None):
         """
         Replace the Popen.wait() call with a fake implementation that imitates a process that never finishes until it
         is terminated.
         """
+        process_killed_event = Event()
+        self.mock_kill.side_effect = lambda *args: process_killed_event.set()
+
         def fake_wait(timeout=None):
-            # The fake implementation is that wait() times out forever until os.killpg is called.
-            if self.mock_kill.call_count == 0 and timeout is not None:
+            # The fake implementation is that wait() times out (or blocks, if there is no timeout) until os.killpg is
+            # called. Blocking is limited so that a test that never kills the process fails instead of hanging.
+            if not process_killed_event.is_set() and timeout is not None:
                 raise TimeoutExpired(None, timeout)
-            elif self.mock_kill.call_count > 0:
-                if wait_exception:
-                    raise wait_exception
-                return fake_returncode
-            self.fail('Popen.wait() should not be called without a timeout before os.killpg has been called.')
+            if not process_killed_event.wait(timeout=10):
+                self.fail('Popen.wait() without a timeout should only return after os.killpg has been called.')
+            self.mock_popen.returncode = fake_returncode
+            if wait_exception:
+                raise wait_exception
+            return fake_returncode
 
         self.mock_popen.wait.side_effect = fake_wait
-        self.mock_popen.returncode = fake_returncode
+        self.mock_popen.returncode = None
 
     def test_job_config_uses_passed_in_config_instead_of_clusterrunner_yaml(self):
         config_dict = {
@@ -1,20 +1,19 @@
-import builtins
 import http.client
+from subprocess import CalledProcessError
 from threading import Event
 from unittest import skip
-from unittest.mock import ANY, call, MagicMock, Mock, mock_open, patch
+from unittest.mock import ANY, call, MagicMock, Mock, mock_open
 
 from genty import genty, genty_dataset
 import requests
 import requests.models
 
 from app.project_type.project_type import SetupFailureError
-from app.slave.cluster_slave import ClusterSlave, SlaveState
+from app.slave.cluster_slave import ClusterSlave, SlaveState, SubjobStartStatus, _SlaveBuild
 from app.util.conf.configuration import Configuration
 from app.util.conf.slave_config_loader import SlaveConfigLoader
 from app.util.exceptions import BadRequestError
 from app.util.safe_thread import SafeThread
-from app.util.single_use_coin import SingleUseCoin
 from app.util.unhandled_exception_handler import UnhandledExceptionHandler
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
@@ -42,7 +41,8 @@ class TestClusterSlave(BaseUnitTestCase):
     )
     def test_start_working_on_subjob_called_with_incorrect_build_id_will_raise(self, slave_current_build_id):
         slave = self._create_cluster_slave()
-        slave._current_build_id = slave_current_build_id
+        if slave_current_build_id is not None:
+            self._add_slave_build(slave, slave_current_build_id)
         incorrect_build_id = 300
 
         with self.assertRaises(BadRequestError, msg='Start subjob should raise error if incorrect build_id specified.'):
@@ -54,7 +54,8 @@ class TestClusterSlave(BaseUnitTestCase):
     )
     def test_teardown_called_with_incorrect_build_id_will_raise(self, slave_current_build_id):
         slave = self._create_cluster_slave()
-        slave._current_build_id = slave_current_build_id
+        if slave_current_build_id is not None:
+            self._add_slave_build(slave, slave_current_build_id)
         incorrect_build_id = 300
 
         with self.assertRaises(BadRequestError, msg='Teardown should raise error if incorrect build_id specified.'):
@@ -98,7 +99,6 @@ class TestClusterSlave(BaseUnitTestCase):
 
         slave = self._create_cluster_slave(num_executors=3)
         slave.connect_to_master(self._FAKE_MASTER_URL)
-        slave._build_teardown_coin = SingleUseCoin()
         self.trigger_graceful_app_shutdown()
 
         expected_disconnect_call = call.mock_network.put_with_digest(disconnect_api_url, request_params=ANY,
@@ -208,42 +208,273 @@ class TestClusterSlave(BaseUnitTestCase):
         expected_slave_data_url = 'http://{}/v1/slave/1'.format(self._FAKE_MASTER_URL)
         slave = self._create_cluster_slave()
         slave.connect_to_master(self._FAKE_MASTER_URL)
-        slave._project_type = MagicMock()
+        build = _SlaveBuild(build_id=123, project_type=MagicMock(), executors=[], base_executor_index=0)
         if not is_setup_successful:
-            slave._project_type.fetch_project.side_effect = SetupFailureError
+            build.project_type.fetch_project.side_effect = SetupFailureError
 
-        slave._async_setup_build(executors=[], project_type_params={}, build_executor_start_index=0)
+        slave._async_setup_build(build=build, project_type_params={})
 
         self.mock_network.put_with_digest.assert_called_once_with(
-            expected_slave_data_url, request_params={'slave': {'state': expected_slave_state}},
+            expected_slave_data_url, request_params={'slave': {'state': expected_slave_state, 'build_id': 123}},
             secret=ANY, error_on_failure=True)
 
     def test_async_setup_happy_path_invokes_correct_methods(self):
         slave = self._create_cluster_slave()
         slave.connect_to_master(self._FAKE_MASTER_URL)
         project_type_mock = self.patch('app.slave.cluster_slave.util.create_project_type').return_value
-        slave._project_type = project_type_mock
-        slave._async_setup_build([], {}, 0)
+        slave._async_setup_build(_SlaveBuild(123, project_type_mock, [], 0), {})
 
         project_type_mock.fetch_project.assert_called_once_with()
         self.assertTrue(project_type_mock.run_job_config_setup.called)
 
+    def test_async_setup_reuses_setup_of_previous_build_with_same_setup_cache_key(self):
+        slave = self._create_cluster_slave()
+        slave.connect_to_master(self._FAKE_MASTER_URL)
+        previous_build = self._create_reusable_build(slave, build_id=1, setup_cache_key='same_key')
+        build = _SlaveBuild(2, MagicMock(), [], 0, setup_cache_key='same_key')
+        build.project_type.project_id.return_value = 'fake_project'
+
+        slave._async_setup_build(build, {})
+
+        self.assertFalse(build.project_type.fetch_project.called)
+        self.assertFalse(build.project_type.run_job_config_setup.called)
+        self.assertFalse(previous_build.project_type.teardown_build.called)
+        self.mock_network.put_with_digest.assert_called_once_with(
+            ANY, request_params={'slave': {'state': SlaveState.SETUP_COMPLETED, 'build_id': 2}},
+            secret=ANY, error_on_failure=True)
+
+    def test_async_setup_tears_down_previous_build_with_different_setup_cache_key(self):
+        slave = self._create_cluster_slave()
+        slave.connect_to_master(self._FAKE_MASTER_URL)
+        previous_build = self._create_reusable_build(slave, build_id=1, setup_cache_key='old_key')
+        build = _SlaveBuild(2, MagicMock(), [], 0, setup_cache_key='new_key')
+        build.project_type.project_id.return_value = 'fake_project'
+
+        slave._async_setup_build(build, {})
+
+        previous_build.project_type.teardown_build.assert_called_once_with(timeout=None)
+        build.project_type.fetch_project.assert_called_once_with()
+        self.assertEqual(slave._reusable_builds_by_project_id, {})
+
+    @genty_dataset(
+        with_setup_cache_key=('fake_key', False),
+        without_setup_cache_key=(None, True),
+    )
+    def test_teardown_is_deferred_only_for_builds_with_setup_cache_key(self, setup_cache_key, expect_teardown):
+        slave = self._create_cluster_slave()
+        build = _SlaveBuild(1, MagicMock(), [], 0, setup_cache_key=setup_cache_key)
+        build.is_setup_complete = True
+
+        slave._teardown_build(build, allow_deferral=True)
+
+        self.assertEqual(build.project_type.teardown_build.called, expect_teardown)
+        self.assertEqual(build in slave._reusable_builds_by_project_id.values(), not expect_teardown)
+
+    def test_deferred_teardown_runs_when_slave_shuts_down(self):
+        slave = self._create_cluster_slave()
+        previous_build = self._create_reusable_build(slave, build_id=1, setup_cache_key='fake_key')
+
+        slave._do_build_teardown_and_reset()
+
+        previous_build.project_type.teardown_build.assert_called_once_with(timeout=None)
+
+    @genty_dataset(
+        project_not_being_fetched=(False, True),
+        project_being_fetched=(True, False),
+    )
+    def test_prefetch_is_skipped_if_and_only_if_project_is_being_fetched(self, is_project_being_fetched,
+                                                                          expect_prefetch):
+        slave = self._create_cluster_slave()
+        project_type_mock = self.patch('app.slave.cluster_slave.util.create_project_type').return_value
+        project_type_mock.project_id.return_value = 'fake_project'
+        if is_project_being_fetched:
+            slave._project_fetch_lock('fake_project').acquire()
+
+        slave._async_prefetch_project({'type': 'Fake'})
+
+        self.assertEqual(project_type_mock.prefetch_project.called, expect_prefetch)
+
+    @genty_dataset(
+        runtime_error=(RuntimeError,),
+        os_error=(OSError,),
+        called_process_error=(CalledProcessError(128, 'git fetch'),),
+    )
+    def test_failed_prefetch_does_not_raise_and_releases_project_fetch_lock(self, prefetch_error):
+        slave = self._create_cluster_slave()
+        project_type_mock = self.patch('app.slave.cluster_slave.util.create_project_type').return_value
+        project_type_mock.project_id.return_value = 'fake_project'
+        project_type_mock.prefetch_project.side_effect = prefetch_error
+
+        slave._async_prefetch_project({'type': 'Fake'})
+
+        self.assertTrue(slave._project_fetch_lock('fake_project').acquire(blocking=False),
+                        'The project fetch lock should be released after a failed prefetch.')
+
     def test_setup_build_sets_base_executor_index(self):
         slave = self._create_cluster_slave()
         slave.setup_build(build_id=123, project_type_params={'type': 'Fake'}, build_executor_start_index=8)
-        self.assertEqual(8, slave._base_executor_index, 'Build setup should set _base_executor_index')
+        self.assertEqual(8, slave._builds_by_id[123].base_executor_index,
+                         'Build setup should set the base executor index of the build')
+
+    def test_setup_build_leases_only_requested_number_of_executors(self):
+        self.patch('app.slave.cluster_slave.util.create_project_type')
+        slave = self._create_cluster_slave(num_executors=3)
+        slave.connect_to_master(self._FAKE_MASTER_URL)
+
+        slave.setup_build(build_id=1, project_type_params={'type': 'Fake'}, build_executor_start_index=0,
+                          num_executors=2)
+        slave.setup_build(build_id=2, project_type_params={'type': 'Fake'}, build_executor_start_index=0,
+                          num_executors=1)
 
-    def test_execute_subjob_passes_base_executor_index_to_executor(self):
+        self.assertEqual(len(slave._builds_by_id[1].executors), 2)
+        self.assertEqual(len(slave._builds_by_id[2].executors), 1)
+        self.assertEqual(slave._idle_executors.qsize(), 0)
+        with self.assertRaises(RuntimeError, msg='Setup should raise error if not enough executors are idle.'):
+            slave.setup_build(build_id=3, project_type_params={'type': 'Fake'}, build_executor_start_index=0,
+                              num_executors=1)
+
+    def test_execute_subjob_passes_build_executor_index_to_executor(self):
         slave = self._create_cluster_slave()
-        slave._base_executor_index = 12
         slave._master_api = Mock()
-        executor = Mock()
-        slave._idle_executors = Mock()
+        executors = [Mock(), Mock()]
+        slave._result_upload_workers = Mock()
+        build = _SlaveBuild(build_id=1, project_type=Mock(), executors=executors, base_executor_index=12)
+
+        slave._execute_subjob(build=build, subjob_id=2, executor=executors[1], atomic_commands=[])
+
+        executors[1].execute_subjob.assert_called_with(1, 2, [], 13, ANY)
+
+    def test_subjob_is_queued_while_all_executors_of_build_are_busy(self):
+        slave = self._create_cluster_slave()
+        slave._executor_workers = Mock()
+        executor = Mock(id=3)
+        slave._builds_by_id[1] = _SlaveBuild(build_id=1, project_type=Mock(), executors=[executor],
+                                             base_executor_index=0)
+
+        first_response = slave.start_working_on_subjob(build_id=1, subjob_id=2, atomic_commands=['cmd'])
+        second_response = slave.start_working_on_subjob(build_id=1, subjob_id=5, atomic_commands=['cmd'])
+
+        self.assertEqual(first_response, {'executor_id': 3, 'status': SubjobStartStatus.ASSIGNED})
+        self.assertEqual(second_response, {'executor_id': None, 'status': SubjobStartStatus.QUEUED})
+        self.assertEqual(slave._executor_workers.submit.call_count, 1, 'Only the first subjob should start executing.')
+
+    def test_finished_executor_starts_next_queued_subjob_without_waiting_for_results_upload(self):
+        slave = self._create_cluster_slave()
+        slave._master_api = Mock()
+        slave._result_upload_workers = Mock()
+        executor = Mock(id=0)
+        build = _SlaveBuild(build_id=1, project_type=Mock(), executors=[executor], base_executor_index=0)
+        build.idle_executors.get()  # The executor is busy with subjob 2.
+        build.claim_executor_or_queue_subjob(subjob_id=5, atomic_commands=['cmd'])
+
+        slave._execute_subjob(build=build, subjob_id=2, executor=executor, atomic_commands=[])
+
+        executor.execute_subjob.assert_has_calls([call(1, 2, [], 0, ANY), call(1, 5, ['cmd'], 0, ANY)])
+        self.assertFalse(self.mock_network.post.called, 'Results should be posted by the upload worker.')
+        self.assertEqual(slave._result_upload_workers.submit.call_count, 2)
+        self.assertFalse(build.idle_executors.empty(), 'The executor should be idle after running the queued subjob.')
+
+    def test_results_of_each_atom_are_uploaded_as_atom_finishes_and_before_subjob_completion(self):
+        slave = self._create_cluster_slave()
+        slave._result_upload_workers = Mock()
+        executor = Mock(id=0)
+        build = _SlaveBuild(build_id=1, project_type=Mock(), executors=[executor], base_executor_index=0)
+        build.idle_executors.get()  # The executor is busy with subjob 2.
+
+        def execute_subjob(build_id, subjob_id, atomic_commands, build_executor_index, atom_finished_callback):
+            for atom_id in range(len(atomic_commands)):
+                atom_finished_callback(atom_id, 'results_{}_{}.tar.gz'.format(subjob_id, atom_id))
+        executor.execute_subjob.side_effect = execute_subjob
+
+        slave._execute_subjob(build=build, subjob_id=2, executor=executor, atomic_commands=['cmd0', 'cmd1'])
+
+        self.assertEqual(slave._result_upload_workers.submit.call_args_list, [
+            call(0, slave._post_atom_results, 1, 2, 0, 'results_2_0.tar.gz', block=True),
+            call(0, slave._post_atom_results, 1, 2, 1, 'results_2_1.tar.gz', block=True),
+            call(0, slave._post_subjob_completion, 1, 2, 0, block=True),
+        ])
+
+    def test_post_atom_results_posts_results_file_to_atom_result_endpoint(self):
+        slave = self._create_cluster_slave()
+        slave.connect_to_master(self._FAKE_MASTER_URL)
+        self.patch('app.slave.cluster_slave.open', new=mock_open(read_data=b''), create=True)
+
+        slave._post_atom_results(build_id=1, subjob_id=2, atom_id=3, results_file='results_2_3.tar.gz')
 
-        with patch.object(builtins, 'open', mock_open(read_data='asdf')):
-            slave._execute_subjob(build_id=1, subjob_id=2, executor=executor, atomic_commands=[])
+        self.mock_network.post.assert_called_with(
+            'http://{}/v1/build/1/subjob/2/atom/3/result'.format(self._FAKE_MASTER_URL),
+            data={'slave': '{}:{}'.format(self._FAKE_SLAVE_HOST, self._FAKE_SLAVE_PORT)}, files=ANY)
 
-        executor.execute_subjob.assert_called_with(1, 2, [], 12)
+    def test_teardown_releases_executors_on_their_workers_and_notifies_master_once_all_are_released(self):
+        slave = self._create_cluster_slave()
+        slave.connect_to_master(self._FAKE_MASTER_URL)
+        slave._executor_workers = Mock()
+        executors = [slave._idle_executors.get(), slave._idle_executors.get()]
+        build = _SlaveBuild(build_id=1, project_type=Mock(), executors=executors, base_executor_index=0)
+        slave._builds_by_id[1] = build
+
+        slave.teardown_build(1)
+
+        self.assertEqual(slave._executor_workers.submit.call_args_list, [
+            call(executors[0].id, slave._release_executor_after_teardown, build, executors[0]),
+            call(executors[1].id, slave._release_executor_after_teardown, build, executors[1]),
+        ])
+        slave._release_executor_after_teardown(build, executors[0])
+        self.assertIn(1, slave._builds_by_id, 'The build should stay set up until all executors are released.')
+        slave._release_executor_after_teardown(build, executors[1])
+        self.assertNotIn(1, slave._builds_by_id)
+        self.mock_network.put_with_digest.assert_called_once_with(
+            'http://{}/v1/slave/1'.format(self._FAKE_MASTER_URL),
+            request_params={'slave': {'state': SlaveState.IDLE, 'build_id': 1}}, secret=ANY, error_on_failure=True)
+
+    def test_teardown_requested_twice_releases_executors_once(self):
+        slave = self._create_cluster_slave()
+        slave._executor_workers = Mock()
+        slave._builds_by_id[1] = _SlaveBuild(build_id=1, project_type=Mock(), executors=[Mock(id=0)],
+                                             base_executor_index=0)
+
+        slave.teardown_build(1)
+        slave.teardown_build(1)
+
+        self.assertEqual(slave._executor_workers.submit.call_count, 1)
+
+    def test_start_working_on_subjob_raises_while_build_is_being_torn_down(self):
+        slave = self._create_cluster_slave()
+        slave._executor_workers = Mock()
+        slave._builds_by_id[1] = _SlaveBuild(build_id=1, project_type=Mock(), executors=[Mock(id=0)],
+                                             base_executor_index=0)
+        slave.teardown_build(1)
+
+        with self.assertRaises(BadRequestError):
+            slave.start_working_on_subjob(build_id=1, subjob_id=2, atomic_commands=['cmd'])
+
+    def test_start_working_on_subjobs_starts_each_subjob_and_returns_executor_ids(self):
+        slave = self._create_cluster_slave()
+        slave._executor_workers = Mock()
+        executors = [Mock(id=3), Mock(id=4)]
+        slave._builds_by_id[1] = _SlaveBuild(build_id=1, project_type=Mock(), executors=executors,
+                                             base_executor_index=0)
+
+        response = slave.start_working_on_subjobs(build_id=1, subjobs=[
+            {'subjob_id': 2, 'atomic_commands': ['cmd']},
+            {'subjob_id': 5, 'atomic_commands': ['cmd']},
+            {'subjob_id': 7, 'atomic_commands': ['cmd']},
+        ])
+
+        self.assertEqual(response, {
+            'executor_ids': [3, 4, None],
+            'statuses': [SubjobStartStatus.ASSIGNED, SubjobStartStatus.ASSIGNED, SubjobStartStatus.QUEUED],
+        })
+
+    def test_kill_subjob_removes_atoms_of_queued_subjob(self):
+        slave = self._create_cluster_slave()
+        build = _SlaveBuild(build_id=1, project_type=Mock(), executors=[], base_executor_index=0)
+        slave._builds_by_id[1] = build
+        build.claim_executor_or_queue_subjob(subjob_id=5, atomic_commands=['cmd'])
+
+        slave.kill_subjob(build_id=1, subjob_id=5)
+
+        self.assertEqual(build.next_queued_subjob_or_release_executor(Mock()), (5, []))
 
     @genty_dataset(
         responsive_master=(True, 1),
@@ -281,3 +512,24 @@ class TestClusterSlave(BaseUnitTestCase):
         kwargs.setdefault('host', self._FAKE_SLAVE_HOST)
         kwargs.setdefault('port', self._FAKE_SLAVE_PORT)
         return ClusterSlave(**kwargs)
+
+    def _create_reusable_build(self, slave, build_id, setup_cache_key):
+        """
+        Add a finished build whose teardown was deferred to the slave.
+        :type slave: ClusterSlave
+        :type build_id: int
+        :type setup_cache_key: str
+        :rtype: _SlaveBuild
+        """
+        build = _SlaveBuild(build_id, MagicMock(), [], 0, setup_cache_key=setup_cache_key)
+        build.is_setup_complete = True
+        slave._reusable_builds_by_project_id['fake_project'] = build
+        return build
+
+    def _add_slave_build(self, slave, build_id):
+        """
+        Add a build to the builds that are set up on the slave, without running build setup.
+        :type slave: ClusterSlave
+        :type build_id: int
+        """
+        slave._builds_by_id[build_id] = _SlaveBuild(build_id, project_type=Mock(), executors=[], base_executor_index=0)
@@ -1,4 +1,5 @@
-from unittest.mock import Mock, mock_open
+from unittest.mock import ANY, call, Mock, mock_open
+import json
 from os.path import expanduser, join
 
 from app.slave.subjob_executor import SubjobExecutor
@@ -58,7 +59,86 @@ class TestSubjobExecutor(BaseUnitTestCase):
         }
 
         executor.execute_subjob(build_id=1, subjob_id=2, atomic_commands=atomic_commands,
-                                base_executor_index=6)
+                                build_executor_index=8, atom_finished_callback=Mock())
 
         executor._project_type.execute_command_in_project.assert_called_with('command', expected_env_vars,
-                                                                             output_file=output_file_mock)
+                                                                             output_file=output_file_mock,
+                                                                             resource_usage_callback=ANY)
+
+    def test_execute_subjob_archives_results_of_each_atom_and_calls_callback_as_atom_finishes(self):
+        Configuration['artifact_directory'] = expanduser('~')
+        executor = SubjobExecutor(1)
+        executor._project_type = Mock()
+        executor._project_type.execute_command_in_project = Mock(return_value=(1, 0))
+        fs_util = self.patch('app.slave.subjob_executor.fs_util')
+        self.patch('app.slave.subjob_executor.shutil')
+        self.patch('app.slave.subjob_executor.open', new=mock_open(read_data=''), create=True)
+        atom_finished_callback = Mock()
+        fs_util.tar_directories.side_effect = lambda *args: self.assertEqual(
+            atom_finished_callback.call_count, fs_util.tar_directories.call_count - 1,
+            'Each atom should be archived before the callback for it is called.')
+
+        executor.execute_subjob(build_id=1, subjob_id=2, atomic_commands=['command0', 'command1'],
+                                build_executor_index=0, atom_finished_callback=atom_finished_callback)
+
+        build_artifact_dir = join(expanduser('~'), '1')
+        self.assertEqual(atom_finished_callback.call_args_list, [
+            call(0, join(build_artifact_dir, 'results_2_0.tar.gz')),
+            call(1, join(build_artifact_dir, 'results_2_1.tar.gz')),
+        ])
+        fs_util.tar_directories.assert_called_with({join(build_artifact_dir, 'artifact_2_1'): 'artifact_2_1'},
+                                                   join(build_artifact_dir, 'results_2_1.tar.gz'))
+
+    def test_execute_subjob_writes_resource_usage_of_atom_command_next_to_timing_file(self):
+        Configuration['artifact_directory'] = expanduser('~')
+        resource_usage = {'user_cpu_time': 1.5, 'system_cpu_time': 0.25, 'max_rss_kb': 2048}
+
+        def fake_execute_command_in_project(*args, resource_usage_callback, **kwargs):
+            resource_usage_callback(resource_usage)
+            return 'output', 0
+
+        executor = SubjobExecutor(1)
+        executor._project_type = Mock()
+        executor._project_type.execute_command_in_project = Mock(side_effect=fake_execute_command_in_project)
+        fs_util = self.patch('app.slave.subjob_executor.fs_util')
+        self.patch('app.slave.subjob_executor.shutil')
+        self.patch('app.slave.subjob_executor.open', new=mock_open(read_data=''), create=True)
+
+        executor.execute_subjob(build_id=1, subjob_id=2, atomic_commands=['command'],
+                                build_executor_index=0, atom_finished_callback=Mock())
+
+        atom_artifact_dir = join(expanduser('~'), '1', 'artifact_2_0')
+        fs_util.write_file.assert_any_call(json.dumps(resource_usage) + '\n',
+                                           join(atom_artifact_dir, 'clusterrunner_resource_usage'))
+
+    def test_kill_subjob_kills_subprocesses_only_if_executing_specified_subjob(self):
+        executor = SubjobExecutor(1)
+        executor._project_type = Mock()
+        executor._current_build_id = 1
+        executor._current_subjob_id = 2
+
+        self.assertFalse(executor.kill_subjob(build_id=1, subjob_id=3))
+        self.assertFalse(executor._project_type.kill_subprocesses.called)
+        self.assertTrue(executor.kill_subjob(build_id=1, subjob_id=2))
+        executor._project_type.kill_subprocesses.assert_called_once_with()
+
+    def test_kill_subjob_while_executing_last_atom_resets_kill_signal_for_next_subjob(self):
+        Configuration['artifact_directory'] = expanduser('~')
+        executor = SubjobExecutor(1)
+        executor._project_type = Mock()
+        executor._project_type.execute_command_in_project = Mock(return_value=('output', 0))
+        self.patch('app.slave.subjob_executor.fs_util')
+        self.patch('app.slave.subjob_executor.shutil')
+        self.patch('app.slave.subjob_executor.open', new=mock_open(read_data=''), create=True)
+        kill_subjob_results = []
+        atom_finished_callback = Mock(side_effect=lambda *args: kill_subjob_results.append(
+            executor.kill_subjob(build_id=1, subjob_id=2)))
+
+        executor.execute_subjob(build_id=1, subjob_id=2, atomic_commands=['command'],
+                                build_executor_index=0, atom_finished_callback=atom_finished_callback)
+
+        self.assertEqual(kill_subjob_results, [True])
+        executor._project_type.reset_kill_signal.assert_called_once_with()
+        self.assertFalse(executor.kill_subjob(build_id=1, subjob_id=2),
+                         'A subjob that has finished should not be killed.')
+        self.assertEqual(executor._project_type.kill_subprocesses.call_count, 1)
@@ -7,12 +7,13 @@ from test.framework.base_unit_test_case import BaseUnitTestCase
 
 class _FakeConfigLoader(BaseConfigLoader):
     def _get_config_file_whitelisted_keys(self):
-        return ['some_bool', 'some_int', 'some_list', 'some_str']
+        return ['some_bool', 'some_int', 'some_float', 'some_list', 'some_str']
 
     def configure_defaults(self, conf):
         super().configure_defaults(conf)
         conf.set('some_bool', True)
         conf.set('some_int', 1776)
+        conf.set('some_float', 17.76)
         conf.set('some_list', ['red', 'white', 'blue'])
         conf.set('some_str', 'America!')
         conf.set('some_nonwhitelisted_key', 1492)
@@ -24,6 +25,7 @@ class TestBaseConfigLoader(BaseUnitTestCase):
     @genty_dataset(
         bool_type=('some_bool', 'False', False),
         int_type=('some_int', '1999', 1999),
+        float_type=('some_float', '2.5', 2.5),
         list_type=('some_list', ['a', 'b', 'c'], ['a', 'b', 'c']),
         str_type=('some_str', 'OneTwoThree', 'OneTwoThree'),
     )
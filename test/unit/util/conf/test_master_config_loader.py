@@ -1,8 +1,12 @@
+from genty import genty, genty_dataset
+
+from app.util.conf.base_config_loader import InvalidConfigError
 from app.util.conf.master_config_loader import MasterConfigLoader
 from app.util.conf.configuration import Configuration
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
 
+@genty
 class TestMasterConfigLoader(BaseUnitTestCase):
 
     def test_configure_default_sets_protocol_scheme_to_http(self):
@@ -46,3 +50,19 @@ class TestMasterConfigLoader(BaseUnitTestCase):
                          'The configuration value for the key "{}" was expected to be {}:{}, but was {}:{}.'.format(
                              key, type(expected_stored_protocol_scheme_value), expected_stored_protocol_scheme_value,
                              type(actual_stored_protocol_scheme_value), actual_stored_protocol_scheme_value))
+
+    @genty_dataset(zero=('0',), negative=('-60',))
+    def test_configure_postload_raises_for_non_positive_demand_target_latency(self, demand_target_latency):
+        mock_config_file = self.patch('app.util.conf.base_config_loader.ConfigFile').return_value
+        mock_config_file.read_config_from_disk.return_value = {'general': {},
+                                                               'master': {'demand_target_latency': demand_target_latency}
+                                                              }
+        self.unpatch('app.util.conf.master_config_loader.MasterConfigLoader.load_from_config_file')
+
+        config = Configuration.singleton()
+        config_loader = MasterConfigLoader()
+        config_loader.configure_defaults(config)
+        config_loader.load_from_config_file(config, config_filename='fake_filename')
+
+        with self.assertRaises(InvalidConfigError):
+            config_loader.configure_postload(config)
@@ -1,6 +1,12 @@
+import os
+from subprocess import Popen, TimeoutExpired
+from unittest import skipUnless
+from unittest.mock import Mock
+
 from genty import genty, genty_dataset, genty_args
 
-from app.util.process_utils import Popen_with_delayed_expansion, get_environment_variable_setter_command
+from app.util.process_utils import Popen_with_delayed_expansion, get_environment_variable_setter_command, \
+    wait_and_get_resource_usage, wait_without_reaping
 
 from test.framework.base_unit_test_case import BaseUnitTestCase
 
@@ -68,3 +74,26 @@ class TestProcessUtils(BaseUnitTestCase):
 
         # Assert
         self.assertEqual(command, expected_command)
+
+    @skipUnless(hasattr(os, 'wait4'), 'os.wait4 is not available on this platform.')
+    def test_wait_and_get_resource_usage_retries_wait_interrupted_by_signal(self):
+        mock_process = Mock(Popen, pid=123, returncode=None)
+        mock_wait4 = self.patch('app.util.process_utils.os.wait4')
+        mock_wait4.side_effect = [InterruptedError, (123, 3 << 8, Mock(ru_maxrss=0))]
+
+        resource_usage = wait_and_get_resource_usage(mock_process)
+
+        self.assertEqual(mock_wait4.call_count, 2)
+        self.assertEqual(mock_process.returncode, 3)
+        self.assertIsNotNone(resource_usage)
+
+    @skipUnless(hasattr(os, 'waitid'), 'os.waitid is not available on this platform.')
+    def test_wait_without_reaping_raises_if_process_does_not_exit_within_timeout(self):
+        mock_process = Mock(Popen, pid=123, returncode=None, args='sleep 99')
+        mock_waitid = self.patch('app.util.process_utils.os.waitid')
+        mock_waitid.return_value = None
+
+        with self.assertRaises(TimeoutExpired):
+            wait_without_reaping(mock_process, timeout=0.01)
+
+        mock_waitid.assert_called_with(os.P_PID, 123, os.WEXITED | os.WNOWAIT | os.WNOHANG)
@@ -0,0 +1,46 @@
+from threading import Event, current_thread
+
+from app.util.worker_pool import WorkerPool, WorkQueueFullError
+from test.framework.base_unit_test_case import BaseUnitTestCase
+
+
+class TestWorkerPool(BaseUnitTestCase):
+
+    def test_work_submitted_under_same_key_runs_in_order_on_one_worker_thread(self):
+        worker_pool = WorkerPool(name='Test')
+        work_done_event = Event()
+        thread_names = []
+        values = []
+
+        def work(value):
+            thread_names.append(current_thread().name)
+            values.append(value)
+            if len(values) == 3:
+                work_done_event.set()
+
+        for value in range(3):
+            worker_pool.submit('key', work, value)
+
+        self.assertTrue(work_done_event.wait(timeout=5), 'All submitted work should run.')
+        self.assertEqual(values, [0, 1, 2])
+        self.assertEqual(thread_names, ['Test-key'] * 3)
+
+    def test_submitting_to_full_work_queue_without_blocking_raises(self):
+        worker_pool = WorkerPool(name='Test', max_queued_work_items=1)
+        work_started_event = Event()
+        unblock_worker_event = Event()
+
+        def blocking_work():
+            work_started_event.set()
+            unblock_worker_event.wait(timeout=5)
+
+        worker_pool.submit('key', blocking_work)
+        self.assertTrue(work_started_event.wait(timeout=5), 'The first work item should start.')
+        worker_pool.submit('key', lambda: None)
+
+        try:
+            with self.assertRaises(WorkQueueFullError):
+                worker_pool.submit('key', lambda: None)
+            worker_pool.submit('other key', lambda: None)  # Work queues of other keys are not affected.
+        finally:
+            unblock_worker_event.set()